@@ -0,0 +1,293 @@
+"""
+Synthesis answer cache for CENTEF RAG system.
+
+Standard questions (e.g. on the CTF readings) are asked by many users and
+retrieval returns the same evidence each time, yet every one paid for a full
+Gemini generation. Answers are cached under a key built from everything that
+shapes the prompt:
+
+    - the normalized query (case, whitespace and trailing punctuation ignored)
+    - the ordered summary and chunk IDs given to the model
+    - the detected output format, temperature and output token limit
+    - a hash of the conversation history window included in the prompt
+
+Entries expire after ANSWER_CACHE_TTL_S. Each entry remembers the manifest
+updated_at of every source in its evidence; a source that is re-indexed
+(updated_at changes) or deleted invalidates the entry. Deletions and manifest
+updates made through this API invalidate immediately (invalidate_source);
+changes made elsewhere are caught when an entry is revalidated against the
+manifest, at most every ANSWER_CACHE_REVALIDATE_S.
+
+Hits are logged to the LLM tracker with the tokens they saved.
+"""
+import copy
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from shared.llm_tracker import get_tracker
+
+logger = logging.getLogger(__name__)
+
+# Environment variables
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_TTL_S = float(os.getenv("ANSWER_CACHE_TTL_S", "3600"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "512"))
+ANSWER_CACHE_REVALIDATE_S = float(os.getenv("ANSWER_CACHE_REVALIDATE_S", "60"))  # Skip manifest checks within this window
+
+# Result fields that describe one request rather than the answer
+_PER_REQUEST_FIELDS = ("time_to_first_token_ms", "generation_ms")
+
+
+def normalize_query(query: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation."""
+    return re.sub(r"\s+", " ", query).strip().lower().rstrip("?!.؟ ")
+
+
+def _history_fingerprint(conversation_history: Optional[List[Any]]) -> Optional[str]:
+    if not conversation_history:
+        return None
+    digest = hashlib.sha256()
+    for message in conversation_history:
+        role = getattr(message, "role", "")
+        digest.update(f"{getattr(role, 'value', role)}\x00{getattr(message, 'content', '')}\x00".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def answer_cache_key(
+    query: str,
+    summary_results: Iterable[Any],
+    chunk_results: Iterable[Any],
+    format_type: str,
+    temperature: float,
+    max_output_tokens: int,
+    conversation_history: Optional[List[Any]] = None
+) -> str:
+    """
+    Build the cache key for a synthesis request.
+
+    Args:
+        query: User's question
+        summary_results: Summaries given to the model (after truncation), in order
+        chunk_results: Chunks given to the model (after truncation), in order
+        format_type: Detected output format
+        temperature: Generation temperature
+        max_output_tokens: Output token limit
+        conversation_history: History window included in the prompt
+
+    Returns:
+        Hex digest
+    """
+    material = {
+        "query": normalize_query(query),
+        "summaries": [r.get("id") or r.get("source_id") for r in summary_results],
+        "chunks": [r.get("id") for r in chunk_results],
+        "format": format_type,
+        "temperature": temperature,
+        "max_output_tokens": max_output_tokens,
+        "history": _history_fingerprint(conversation_history),
+    }
+    return hashlib.sha256(json.dumps(material, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def manifest_versions(source_ids: Iterable[str]) -> Dict[str, Optional[str]]:
+    """Current manifest updated_at for each source (None if it no longer exists)."""
+    from shared.manifest import get_manifest_entries_by_ids
+    return {
+        source_id: entry.updated_at if entry else None
+        for source_id, entry in get_manifest_entries_by_ids(source_ids).items()
+    }
+
+
+class CachedAnswer:
+    """A cached result and the source versions it was built from."""
+
+    __slots__ = ("result", "source_versions", "created_at", "checked_at", "hits")
+
+    def __init__(self, result: Dict[str, Any], source_versions: Dict[str, Optional[str]], now: float):
+        self.result = result
+        self.source_versions = source_versions
+        self.created_at = now
+        self.checked_at = now
+        self.hits = 0
+
+
+class AnswerCache:
+    """In-process LRU cache of synthesis results with TTL and source invalidation."""
+
+    def __init__(
+        self,
+        ttl_s: float = ANSWER_CACHE_TTL_S,
+        max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+        revalidate_s: float = ANSWER_CACHE_REVALIDATE_S,
+        version_lookup: Callable[[Iterable[str]], Dict[str, Optional[str]]] = manifest_versions,
+        clock=time.monotonic
+    ):
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.revalidate_s = revalidate_s
+        self._version_lookup = version_lookup
+        self._clock = clock
+        self._entries: "OrderedDict[str, CachedAnswer]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.saved_input_tokens = 0
+        self.saved_output_tokens = 0
+
+    def _drop(self, key: str, reason: str) -> None:
+        if self._entries.pop(key, None) is not None:
+            self.invalidations += 1
+            logger.info(f"Answer cache entry {key[:12]} dropped: {reason}")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up a cached result.
+
+        Returns:
+            A copy of the cached result, or None on a miss or if the entry expired
+            or one of its sources changed
+        """
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry.created_at > self.ttl_s:
+                self._drop(key, "expired")
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            revalidate = now - entry.checked_at > self.revalidate_s
+
+        if revalidate:
+            try:
+                current = self._version_lookup(entry.source_versions.keys())
+            except Exception as e:
+                logger.warning(f"Answer cache revalidation failed, treating as miss: {e}")
+                current = None
+            with self._lock:
+                if current != entry.source_versions:
+                    self._drop(key, "source re-indexed or deleted")
+                    self.misses += 1
+                    return None
+                entry.checked_at = now
+
+        with self._lock:
+            if self._entries.get(key) is not entry:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            entry.hits += 1
+            self.hits += 1
+            self.saved_input_tokens += entry.result.get("input_tokens", 0)
+            self.saved_output_tokens += entry.result.get("output_tokens", 0)
+            result = copy.deepcopy(entry.result)
+        result["cache_age_s"] = round(now - entry.created_at, 1)
+        return result
+
+    def put(self, key: str, result: Dict[str, Any], source_ids: Iterable[str]) -> bool:
+        """
+        Cache a result built from the given sources.
+
+        Returns:
+            Whether the result was cached (not if the source versions can't be read)
+        """
+        source_ids = sorted({s for s in source_ids if s})
+        try:
+            versions = self._version_lookup(source_ids)
+        except Exception as e:
+            logger.warning(f"Not caching answer, could not read source versions: {e}")
+            return False
+        if any(versions.get(s) is None for s in source_ids):
+            # A source vanished between retrieval and now
+            return False
+        cached = copy.deepcopy({k: v for k, v in result.items() if k not in _PER_REQUEST_FIELDS})
+        with self._lock:
+            self._entries[key] = CachedAnswer(cached, versions, self._clock())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return True
+
+    def invalidate_source(self, source_id: str) -> int:
+        """Drop every entry whose evidence includes source_id. Returns the number dropped."""
+        with self._lock:
+            keys = [k for k, e in self._entries.items() if source_id in e.source_versions]
+            for key in keys:
+                self._drop(key, f"source {source_id} changed")
+        return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": ANSWER_CACHE_ENABLED,
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "invalidations": self.invalidations,
+                "saved_input_tokens": self.saved_input_tokens,
+                "saved_output_tokens": self.saved_output_tokens,
+            }
+
+
+_answer_cache = AnswerCache()
+
+
+def get_answer_cache() -> AnswerCache:
+    """Get the shared answer cache."""
+    return _answer_cache
+
+
+def reset_answer_cache(**kwargs: Any) -> AnswerCache:
+    """Replace the shared cache (kwargs as for AnswerCache)."""
+    global _answer_cache
+    _answer_cache = AnswerCache(**kwargs)
+    return _answer_cache
+
+
+def invalidate_source(source_id: str) -> int:
+    """Drop cached answers built from a source that was re-indexed or deleted."""
+    dropped = _answer_cache.invalidate_source(source_id)
+    if dropped:
+        logger.info(f"Invalidated {dropped} cached answers for source {source_id}")
+    return dropped
+
+
+def record_cache_hit(
+    result: Dict[str, Any],
+    source_function: str,
+    latency_ms: float,
+    user_id: Optional[str] = None,
+    session_id: Optional[str] = None
+) -> None:
+    """Log a cache hit to the LLM tracker with the tokens it saved."""
+    get_tracker().log_call(
+        source_function=source_function,
+        api_provider="gemini",
+        api_type="generative",
+        model="answer-cache",
+        operation="chat_answer",
+        latency_ms=latency_ms,
+        user_id=user_id,
+        session_id=session_id,
+        temperature=result.get("temperature"),
+        additional_params={
+            "answer_cache": "hit",
+            "answer_model": result.get("model_used"),
+            "saved_input_tokens": result.get("input_tokens", 0),
+            "saved_output_tokens": result.get("output_tokens", 0),
+        }
+    )
@@ -0,0 +1,186 @@
+"""
+Single-pass citation processing for CENTEF RAG system.
+
+Turning the model's answer into the final one used to take several passes:
+replace [Document N] / [Chunk N] placeholders inside brackets, extract the
+bracketed citations, match each to a source, then str.replace every citation
+with its number (longest first). Each pass rescanned or rebuilt the whole
+answer.
+
+CitationProcessor scans the answer once with a precompiled bracket scanner.
+For each [...] span it resolves placeholder labels through the label maps,
+matches the citation to a source (by title or source_id, as before), numbers
+sources in order of first citation and writes [N] in place. Because numbering
+only depends on what came before, the same processor works incrementally:
+feed() takes streamed text and returns what can be emitted, holding back an
+unclosed "[" until it closes or grows past MAX_CITATION_CHARS (quoted text,
+not a citation).
+"""
+import logging
+import re
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Bracketed spans at least this long are left as written (matches extract_inline_citations)
+MAX_CITATION_CHARS = 200
+
+# Innermost [...] span: a stray "[" no longer swallows the text up to the next citation
+CITATION_SCANNER = re.compile(r"\[([^\[\]]*)\]")
+PLACEHOLDER_LABEL_PATTERN = re.compile(r"(?i)(Document|Chunk)\s+(\d+)")
+
+
+class CitationProcessor:
+    """Resolves and numbers inline citations in one pass, for whole answers or streamed text."""
+
+    def __init__(
+        self,
+        all_sources: List[Dict[str, Any]],
+        document_label_map: Optional[Dict[str, str]] = None,
+        chunk_label_map: Optional[Dict[str, str]] = None
+    ):
+        self.all_sources = all_sources
+        self._labels = {
+            "document": document_label_map or {},
+            "chunk": chunk_label_map or {},
+        }
+        # Lowercased once instead of per citation
+        self._match_keys = [
+            (source, (source.get("title") or "").lower(), (source.get("source_id") or "").lower())
+            for source in all_sources
+        ]
+        self._numbers: Dict[str, Optional[int]] = {}  # citation -> number (None if unmatched)
+        self._source_numbers: Dict[str, int] = {}
+        self.sources: List[Dict[str, Any]] = []
+        self.citation_map: Dict[str, int] = {}
+        self.citations: List[str] = []
+        self._pending = ""
+        self._output: List[str] = []
+
+    def _label(self, match: re.Match) -> str:
+        return self._labels[match.group(1).lower()].get(match.group(2), match.group(0))
+
+    def _number_for(self, citation: str) -> Optional[int]:
+        if citation in self._numbers:
+            return self._numbers[citation]
+        self.citations.append(citation)
+        citation_lower = citation.lower()
+        number = None
+        for source, title, source_id in self._match_keys:
+            if title in citation_lower or citation_lower in title or source_id in citation_lower:
+                number = self._source_numbers.get(source["source_id"])
+                if number is None:
+                    self.sources.append(source)
+                    number = len(self.sources)
+                    self._source_numbers[source["source_id"]] = number
+                self.citation_map[citation] = number
+                break
+        if number is None:
+            logger.warning(f"Could not match citation to source: {citation[:100]}")
+        self._numbers[citation] = number
+        return number
+
+    def _resolve(self, match: re.Match) -> str:
+        content = match.group(1)
+        if len(content) >= MAX_CITATION_CHARS:
+            return match.group(0)
+        resolved = PLACEHOLDER_LABEL_PATTERN.sub(self._label, content)
+        citation = resolved.strip()
+        if not citation or len(citation) >= MAX_CITATION_CHARS:
+            return f"[{resolved}]"
+        number = self._number_for(citation)
+        return f"[{number}]" if number is not None else f"[{resolved}]"
+
+    def feed(self, text: str) -> str:
+        """
+        Process the next piece of the answer.
+
+        Args:
+            text: Next piece of generated text
+
+        Returns:
+            Processed text that can be emitted now (may be empty while a citation is open)
+        """
+        buffer = self._pending + text
+        pieces = []
+        position = 0
+        for match in CITATION_SCANNER.finditer(buffer):
+            pieces.append(buffer[position:match.start()])
+            pieces.append(self._resolve(match))
+            position = match.end()
+
+        rest = buffer[position:]
+        open_at = rest.rfind("[")
+        if open_at != -1 and len(rest) - open_at <= MAX_CITATION_CHARS:
+            pieces.append(rest[:open_at])
+            self._pending = rest[open_at:]
+        else:
+            pieces.append(rest)
+            self._pending = ""
+
+        emitted = "".join(pieces)
+        self._output.append(emitted)
+        return emitted
+
+    def finish(self) -> str:
+        """Flush text held back for an unclosed citation."""
+        emitted, self._pending = self._pending, ""
+        self._output.append(emitted)
+        return emitted
+
+    @property
+    def answer(self) -> str:
+        """The processed answer emitted so far."""
+        return "".join(self._output)
+
+    def result(self) -> Dict[str, Any]:
+        """
+        Returns:
+            Dict with processed_answer, sources (in citation order) and citation_map,
+            as returned by post_process_answer_and_sources
+        """
+        logger.info(f"Found {len(self.citations)} inline citations")
+        logger.info(f"Matched {len(self.sources)} sources with numbered citations")
+        return {
+            "processed_answer": self.answer,
+            "sources": self.sources,
+            "citation_map": dict(self.citation_map),
+        }
+
+
+def process_citations(
+    answer_text: str,
+    all_sources: List[Dict[str, Any]],
+    document_label_map: Optional[Dict[str, str]] = None,
+    chunk_label_map: Optional[Dict[str, str]] = None
+) -> Dict[str, Any]:
+    """
+    Resolve placeholder labels, match citations to sources and number them in one pass.
+
+    Args:
+        answer_text: Answer with inline citations like [Title, Page X] or [Document 1]
+        all_sources: All available sources
+        document_label_map: Mapping of document indices to titles
+        chunk_label_map: Mapping of chunk indices to titles
+
+    Returns:
+        Dict with processed_answer, sources (ordered list) and citation_map
+    """
+    processor = CitationProcessor(all_sources, document_label_map, chunk_label_map)
+    processor.feed(answer_text)
+    processor.finish()
+    return processor.result()
+
+
+def resolve_placeholder_labels(
+    text: str,
+    document_label_map: Dict[str, str],
+    chunk_label_map: Dict[str, str]
+) -> str:
+    """Replace [Document N, ...] / [Chunk N, ...] placeholders inside brackets with titles."""
+    labels = {"document": document_label_map, "chunk": chunk_label_map}
+
+    def _label(match: re.Match) -> str:
+        return labels[match.group(1).lower()].get(match.group(2), match.group(0))
+
+    return CITATION_SCANNER.sub(lambda m: f"[{PLACEHOLDER_LABEL_PATTERN.sub(_label, m.group(1))}]", text)
@@ -0,0 +1,254 @@
+"""
+Direct document fetch for CENTEF RAG system.
+Reads a source's chunk JSONL (manifest.data_path) and summary JSONL
+(manifest.summary_path) directly instead of enumerating them with a search query.
+
+Parsed files are cached in-process, keyed by path and GCS object generation
+(mtime for local files), so repeat opens of a document and citation expansion
+are served from memory, and a re-ingested document is picked up automatically.
+"""
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+from google.api_core import exceptions as core_exceptions
+
+from shared.manifest import get_manifest_entry, ManifestEntry
+from apps.agent_api.retriever_local import format_chunk_result, format_summary_result
+from apps.agent_api.search_result import SearchResult
+
+load_dotenv()
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Environment variables
+PROJECT_ID = os.getenv("PROJECT_ID")
+DOCUMENT_CACHE_MAX_FILES = int(os.getenv("DOCUMENT_CACHE_MAX_FILES", "256"))
+DOCUMENT_CACHE_REVALIDATE_S = float(os.getenv("DOCUMENT_CACHE_REVALIDATE_S", "60"))  # Skip generation checks within this window
+DOCUMENT_READ_ATTEMPTS = int(os.getenv("DOCUMENT_READ_ATTEMPTS", "3"))  # Reads racing a rewrite are retried
+
+
+class DocumentFile:
+    """Parsed chunk/summary JSONL file, sorted for range lookups."""
+
+    __slots__ = ("path", "generation", "records", "pages", "starts", "checked_at")
+
+    def __init__(self, path: str, generation: Any, records: List[Dict[str, Any]]):
+        self.path = path
+        self.generation = generation
+        self.records = sorted(records, key=lambda r: (
+            _page_of(r) if _page_of(r) is not None else float("inf"),
+            r.get("start_sec") if r.get("start_sec") is not None else float("inf"),
+            r.get("chunk_index") or 0,
+        ))
+        self.pages = [_page_of(r) for r in self.records]
+        self.starts = [r.get("start_sec") for r in self.records]
+        self.checked_at = time.monotonic()
+
+    def page_slice(self, page_start: Optional[int], page_end: Optional[int]) -> List[Dict[str, Any]]:
+        """Records whose page is within [page_start, page_end] (inclusive)."""
+        paged = [p for p in self.pages if p is not None]
+        lo = bisect.bisect_left(paged, page_start) if page_start is not None else 0
+        hi = bisect.bisect_right(paged, page_end) if page_end is not None else len(paged)
+        return self.records[lo:hi]
+
+    def time_slice(self, start_sec: Optional[float], end_sec: Optional[float]) -> List[Dict[str, Any]]:
+        """Records whose [start_sec, end_sec] span overlaps the requested window."""
+        results = []
+        for record in self.records:
+            record_start = record.get("start_sec")
+            if record_start is None:
+                continue
+            record_end = record.get("end_sec")
+            if record_end is None:
+                record_end = record_start
+            if end_sec is not None and record_start > end_sec:
+                continue
+            if start_sec is not None and record_end < start_sec:
+                continue
+            results.append(record)
+        return results
+
+
+def _page_of(record: Dict[str, Any]) -> Optional[int]:
+    page = record.get("page_number")
+    if page is None:
+        page = record.get("page")
+    return page
+
+
+def _parse_jsonl(content: str) -> List[Dict[str, Any]]:
+    records = []
+    for line in content.splitlines():
+        if line.strip():
+            records.append(json.loads(line))
+    return records
+
+
+_storage_client = None
+_cache: "OrderedDict[str, DocumentFile]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _get_storage_client():
+    global _storage_client
+    if _storage_client is None:
+        from google.cloud import storage
+        _storage_client = storage.Client(project=PROJECT_ID)
+    return _storage_client
+
+
+def _current_generation(path: str) -> Tuple[Any, Any]:
+    """
+    Look up the current version of a file.
+
+    Returns:
+        Tuple of (generation, handle): the GCS blob or local path, or (None, None) if missing
+    """
+    if path.startswith("gs://"):
+        bucket_name, _, blob_path = path[5:].partition("/")
+        blob = _get_storage_client().bucket(bucket_name).get_blob(blob_path)
+        return (blob.generation, blob) if blob is not None else (None, None)
+    if os.path.exists(path):
+        return os.stat(path).st_mtime_ns, path
+    return None, None
+
+
+def load_document_file(path: str) -> Optional[DocumentFile]:
+    """
+    Load a JSONL document file through the generation-keyed cache.
+
+    Args:
+        path: gs:// URI or local path
+
+    Returns:
+        DocumentFile, or None if the file does not exist
+    """
+    with _cache_lock:
+        cached = _cache.get(path)
+        if cached and time.monotonic() - cached.checked_at < DOCUMENT_CACHE_REVALIDATE_S:
+            _cache.move_to_end(path)
+            return cached
+
+    for attempt in range(DOCUMENT_READ_ATTEMPTS):
+        generation, handle = _current_generation(path)
+        if generation is None:
+            with _cache_lock:
+                _cache.pop(path, None)
+            return None
+
+        if cached and cached.generation == generation:
+            cached.checked_at = time.monotonic()
+            return cached
+
+        if not path.startswith("gs://"):
+            with open(path, "r", encoding="utf-8") as f:
+                content = f.read()
+            break
+
+        # Pin the generation we looked up so a concurrent rewrite cannot mix versions
+        try:
+            content = handle.download_as_text(if_generation_match=generation)
+            break
+        except core_exceptions.PreconditionFailed:
+            # Rewritten between the lookup and the download: read the new generation
+            if attempt == DOCUMENT_READ_ATTEMPTS - 1:
+                raise
+            logger.info(f"{path} generation {generation} replaced during read, retrying")
+
+    document = DocumentFile(path, generation, _parse_jsonl(content))
+    logger.info(f"Loaded {len(document.records)} records from {path} (generation {generation})")
+
+    with _cache_lock:
+        _cache[path] = document
+        _cache.move_to_end(path)
+        while len(_cache) > DOCUMENT_CACHE_MAX_FILES:
+            _cache.popitem(last=False)
+    return document
+
+
+def clear_document_cache() -> None:
+    """Drop all cached document files."""
+    with _cache_lock:
+        _cache.clear()
+
+
+def _resolve_entry(source_id: str, entry: Optional[ManifestEntry]) -> ManifestEntry:
+    entry = entry or get_manifest_entry(source_id)
+    if entry is None:
+        # Fall back to the standard layout (ManifestEntry fills in data/summary paths)
+        entry = ManifestEntry(source_id=source_id, filename="", title="", mimetype="", source_uri="")
+    return entry
+
+
+def fetch_source_chunks(
+    source_id: str,
+    page_start: Optional[int] = None,
+    page_end: Optional[int] = None,
+    start_sec: Optional[float] = None,
+    end_sec: Optional[float] = None,
+    fields: Optional[Sequence[str]] = None,
+    entry: Optional[ManifestEntry] = None
+) -> List[SearchResult]:
+    """
+    Fetch a source's chunks in document order, optionally limited to a page or time range.
+
+    Args:
+        source_id: Source to fetch
+        page_start: First page (inclusive)
+        page_end: Last page (inclusive)
+        start_sec: Start of the time window (audio/video)
+        end_sec: End of the time window (audio/video)
+        fields: Result fields to project (default CHUNK_FIELDS)
+        entry: Manifest entry, if the caller already has it
+
+    Returns:
+        Chunk results shaped like search results (score 0.0)
+    """
+    entry = _resolve_entry(source_id, entry)
+    document = load_document_file(entry.data_path)
+    if document is None:
+        logger.warning(f"No chunk file for source_id={source_id} at {entry.data_path}")
+        return []
+
+    if start_sec is not None or end_sec is not None:
+        records = document.time_slice(start_sec, end_sec)
+    elif page_start is not None or page_end is not None:
+        records = document.page_slice(page_start, page_end)
+    else:
+        records = document.records
+
+    return [format_chunk_result(record, 0.0, fields) for record in records]
+
+
+def fetch_source_summary(
+    source_id: str,
+    fields: Optional[Sequence[str]] = None,
+    entry: Optional[ManifestEntry] = None
+) -> Optional[SearchResult]:
+    """
+    Fetch a source's summary.
+
+    Args:
+        source_id: Source to fetch
+        fields: Result fields to project (default SUMMARY_FIELDS)
+        entry: Manifest entry, if the caller already has it
+
+    Returns:
+        Summary result, or None if there is no summary file
+    """
+    entry = _resolve_entry(source_id, entry)
+    document = load_document_file(entry.summary_path)
+    if document is None or not document.records:
+        return None
+    return format_summary_result(document.records[0], 0.0, fields)
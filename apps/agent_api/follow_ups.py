@@ -0,0 +1,201 @@
+"""
+Follow-up question generation for CENTEF RAG chat, off the answer's critical path.
+
+Follow-up questions need the finished answer, so generating them inline adds a
+second sequential Gemini round trip to every turn. Three modes, chosen per
+request (ChatRequest.follow_ups) with CHAT_FOLLOW_UP_MODE as the default:
+
+    inline  generate before responding (previous behaviour)
+    async   respond first; generate on the generation executor, store them on the
+            saved message and serve them from GET /chat/messages/{id}/follow-ups
+            (or as a late event on /chat/stream)
+    off     never generate them
+
+The saved message carries the follow-up status ("pending", "ready", "failed" or
+"disabled"), so any instance can answer a lookup.
+"""
+import asyncio
+import concurrent.futures
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set
+
+from dotenv import load_dotenv
+
+from shared.chat_history import ChatMessage, get_conversation_history, update_message_follow_ups
+from shared.executors import get_stage_executor, run_blocking
+
+load_dotenv()
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+FOLLOW_UP_MODES = ("inline", "async", "off")
+
+# Environment variables
+CHAT_FOLLOW_UP_MODE = os.getenv("CHAT_FOLLOW_UP_MODE", "async")
+FOLLOW_UP_POLL_INTERVAL_S = float(os.getenv("FOLLOW_UP_POLL_INTERVAL_S", "1"))  # Re-read interval while a lookup waits
+FOLLOW_UP_STALE_S = float(os.getenv("FOLLOW_UP_STALE_S", "120"))  # Still pending after this long: reported as failed
+NUM_FOLLOW_UP_QUESTIONS = 3
+
+# Jobs still running in this process (only so shutdown can wait for them)
+_running: Set[Future] = set()
+_running_lock = threading.Lock()
+
+
+def resolve_follow_up_mode(requested: Optional[str]) -> str:
+    """
+    Resolve a request's follow-up mode.
+
+    Args:
+        requested: Mode from the request, or None for the configured default
+
+    Returns:
+        One of FOLLOW_UP_MODES
+
+    Raises:
+        ValueError: If the mode is not recognised
+    """
+    mode = requested or CHAT_FOLLOW_UP_MODE
+    if mode not in FOLLOW_UP_MODES:
+        raise ValueError(f"Invalid follow_ups mode: {mode}. Must be one of {', '.join(FOLLOW_UP_MODES)}")
+    return mode
+
+
+def _generate_and_store(user_id: str, session_id: str, message_id: str, query: str, answer: str) -> List[str]:
+    from apps.agent_api.synthesizer import generate_follow_up_questions
+    try:
+        questions = generate_follow_up_questions(query, answer, num_questions=NUM_FOLLOW_UP_QUESTIONS)
+    except Exception as e:
+        logger.error(f"Follow-up generation failed for message {message_id}: {e}", exc_info=True)
+        update_message_follow_ups(user_id, session_id, message_id, [], status="failed")
+        return []
+    if not update_message_follow_ups(user_id, session_id, message_id, questions):
+        # Left pending on the message, which lookups report as failed once stale
+        logger.error(f"Follow-up questions for message {message_id} could not be stored")
+    return questions
+
+
+def schedule_follow_ups(user_id: str, session_id: str, message_id: str, query: str, answer: str) -> Future:
+    """
+    Generate follow-up questions in the background for a saved assistant message.
+
+    Args:
+        user_id: User ID
+        session_id: Session ID
+        message_id: Assistant message ID (must already be saved)
+        query: User's question
+        answer: Final answer text
+
+    Returns:
+        Future resolving to the list of questions
+    """
+    future = get_stage_executor("generation").submit(
+        _generate_and_store, user_id, session_id, message_id, query, answer
+    )
+    with _running_lock:
+        _running.add(future)
+    future.add_done_callback(_job_done)
+    logger.info(f"Scheduled follow-up questions for message {message_id}")
+    return future
+
+
+def _job_done(future: Future) -> None:
+    with _running_lock:
+        _running.discard(future)
+
+
+def drain_follow_ups(timeout_s: Optional[float] = None) -> bool:
+    """
+    Wait for the follow-up jobs running in this process (e.g. before shutdown).
+
+    Returns:
+        True if all jobs finished within timeout_s
+    """
+    with _running_lock:
+        jobs = list(_running)
+    _, not_done = concurrent.futures.wait(jobs, timeout_s)
+    return not not_done
+
+
+async def wait_for_follow_ups(future: Future, timeout_s: Optional[float] = None) -> Optional[List[str]]:
+    """
+    Await a scheduled job without cancelling it on timeout.
+
+    Returns:
+        The questions, or None if the job is not done within timeout_s
+    """
+    try:
+        return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout_s)
+    except asyncio.TimeoutError:
+        return None
+
+
+def _age_s(message: ChatMessage) -> float:
+    try:
+        return (datetime.utcnow() - datetime.fromisoformat(message.timestamp)).total_seconds()
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def follow_up_state(message: ChatMessage) -> Dict[str, Any]:
+    """
+    Follow-up status and questions of a saved assistant message.
+
+    Returns:
+        {"status": "ready" | "pending" | "failed" | "disabled" | "unavailable", "follow_up_questions": [...]}
+    """
+    status = message.follow_ups_status
+    if status is None:
+        # Saved before the status was stored on messages
+        if message.follow_up_questions is not None:
+            status = "ready"
+        else:
+            status = {"off": "disabled", "async": "pending"}.get(message.query_metadata.get("follow_ups"), "unavailable")
+    if status == "pending" and _age_s(message) > FOLLOW_UP_STALE_S:
+        # The job never stored a result (its instance restarted, or every write lost a race)
+        status = "failed"
+    questions = (message.follow_up_questions or []) if status == "ready" else []
+    return {"status": status, "follow_up_questions": questions}
+
+
+async def get_follow_ups(
+    user_id: str,
+    session_id: str,
+    message_id: str,
+    wait_s: float = 0.0
+) -> Optional[Dict[str, Any]]:
+    """
+    Look up follow-up questions for an assistant message.
+
+    Only the saved message is read, so the answer does not depend on which
+    instance ran the job. While the status is pending the message is re-read
+    every FOLLOW_UP_POLL_INTERVAL_S, for up to wait_s.
+
+    Args:
+        user_id: User ID
+        session_id: Session ID
+        message_id: Assistant message ID
+        wait_s: How long to wait for pending questions
+
+    Returns:
+        follow_up_state() of the message, or None if the message does not exist
+    """
+    deadline = time.monotonic() + wait_s
+    while True:
+        messages = await run_blocking("storage", get_conversation_history, user_id, session_id)
+        message = next((m for m in messages if m.message_id == message_id), None)
+        if message is None:
+            return None
+        state = follow_up_state(message)
+        remaining = deadline - time.monotonic()
+        if state["status"] != "pending" or remaining <= 0:
+            return state
+        await asyncio.sleep(min(FOLLOW_UP_POLL_INTERVAL_S, remaining))
@@ -2,18 +2,22 @@
 FastAPI application for CENTEF RAG Agent API.
 Provides endpoints for manifest management and document retrieval.
 """
+import json
 import logging
 import os
 import sys
+import time
 import uuid
 from datetime import datetime
 from pathlib import Path
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, AsyncIterator
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing
 
-from fastapi import FastAPI, HTTPException, status, Depends, UploadFile, File, Form, BackgroundTasks
+from fastapi import FastAPI, HTTPException, status, Depends, UploadFile, File, Form, BackgroundTasks, Header, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel, Field
 
 # Add parent directory to path for imports
@@ -54,11 +58,31 @@ from shared.user_management import (
     hash_password,
     update_user
 )
+from shared.executors import run_blocking, iterate_blocking, executor_stats, shutdown_executors, EventLoopLagMonitor
+from shared.telemetry import (
+    CONTENT_TYPE,
+    PrometheusMiddleware,
+    instrument_gcs,
+    metrics_authorized,
+    register_collector,
+    render_metrics,
+)
+from shared.profiling import ProfilingMiddleware, get_profile_store
 from apps.agent_api.retriever_vertex_search import search_two_tier
-from apps.agent_api.synthesizer import synthesize_answer
+from apps.agent_api.document_fetch import fetch_source_chunks
+from apps.agent_api.performance_metrics import get_aggregator
+from apps.agent_api.answer_cache import invalidate_source
+from apps.agent_api.follow_ups import resolve_follow_up_mode, schedule_follow_ups, wait_for_follow_ups, get_follow_ups
 # Optimized versions
-from apps.agent_api.retriever_optimized import search_two_tier_optimized, analyze_query_characteristics
-from apps.agent_api.synthesizer_optimized import synthesize_answer_optimized
+from apps.agent_api.retriever_optimized import RERANK_MODES
+from apps.agent_api.synthesizer_optimized import stream_answer_optimized
+from apps.agent_api.rag_pipeline import (
+    RETRIEVAL_STAGES,
+    PipelineContext,
+    get_chat_pipeline,
+    pipeline_metadata,
+    record_pipeline_metrics,
+)
 
 logging.basicConfig(
     level=logging.INFO,
@@ -82,6 +106,40 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request counts and latency per route for /metrics; GCS calls are counted for every client
+app.add_middleware(PrometheusMiddleware)
+instrument_gcs()
+
+# Samples stacks of 1 in PROFILE_SAMPLE_EVERY requests (and X-Profile-Token requests) for /admin/profiles
+app.add_middleware(ProfilingMiddleware)
+
+# Logs when a blocking call slips onto the event loop (see shared/executors.py)
+loop_lag_monitor = EventLoopLagMonitor()
+
+
+def _collect_loop_lag():
+    stats = loop_lag_monitor.stats()
+    return [
+        ("centef_event_loop_lag_p99_ms", "gauge", "Recent event loop lag (p99)", [({}, stats["lag_ms"]["p99"])]),
+        ("centef_event_loop_stalls_total", "counter", "Event loop lags above EVENT_LOOP_LAG_WARN_MS", [
+            ({}, stats["stalls"])
+        ]),
+    ]
+
+
+register_collector(_collect_loop_lag)
+
+
+@app.on_event("startup")
+async def start_loop_lag_monitor():
+    loop_lag_monitor.start()
+
+
+@app.on_event("shutdown")
+async def stop_executors():
+    await loop_lag_monitor.stop()
+    shutdown_executors()
+
 
 # ============================================================================
 # Background Processing Functions
@@ -442,21 +500,35 @@ def health_check():
     }
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics(authorization: Optional[str] = Header(None)):
+    """
+    Prometheus metrics (text exposition format).
+
+    Scrapers must send METRICS_BEARER_TOKEN as a bearer token; with no token
+    configured the endpoint is closed unless METRICS_PUBLIC=true.
+    """
+    if not metrics_authorized(authorization):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid metrics token")
+    return PlainTextResponse(render_metrics(), media_type=CONTENT_TYPE)
+
+
 @app.get("/manifest", response_model=List[ManifestEntryResponse])
-def list_manifest_entries(status: Optional[str] = None):
+def list_manifest_entries(status_filter: Optional[str] = Query(None, alias="status")):
     """
     Get all manifest entries, optionally filtered by status.
     
     Args:
-        status: Optional status filter (pending_processing, pending_summary, etc.)
+        status_filter: Optional status filter, the `status` query parameter
+            (pending_processing, pending_summary, etc.)
     
     Returns:
         List of manifest entries
     """
-    logger.info(f"GET /manifest with status={status}")
+    logger.info(f"GET /manifest with status={status_filter}")
     
     try:
-        entries = get_manifest_entries(status=status)
+        entries = get_manifest_entries(status=status_filter)
         
         # Convert to response model
         response = [
@@ -587,6 +659,63 @@ def get_summary(source_id: str):
         )
 
 
+@app.get("/manifest/{source_id}/chunks")
+def get_source_chunks(
+    source_id: str,
+    page_start: Optional[int] = None,
+    page_end: Optional[int] = None,
+    start_sec: Optional[float] = None,
+    end_sec: Optional[float] = None
+):
+    """
+    Get a document's chunks in order, read directly from its chunk file.
+    
+    Args:
+        source_id: The source_id to open
+        page_start: First page to return (inclusive)
+        page_end: Last page to return (inclusive)
+        start_sec: Start of the time window (audio/video)
+        end_sec: End of the time window (audio/video)
+    
+    Returns:
+        JSON with the chunks and their count
+    """
+    logger.info(f"GET /manifest/{source_id}/chunks pages={page_start}-{page_end} secs={start_sec}-{end_sec}")
+    
+    try:
+        entry = get_manifest_entry(source_id)
+        
+        if not entry:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Manifest entry not found for source_id={source_id}"
+            )
+        
+        chunks = fetch_source_chunks(
+            source_id,
+            page_start=page_start,
+            page_end=page_end,
+            start_sec=start_sec,
+            end_sec=end_sec,
+            entry=entry
+        )
+        
+        return {
+            "source_id": source_id,
+            "chunks": chunks,
+            "total_chunks": len(chunks)
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting chunks: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error getting chunks: {str(e)}"
+        )
+
+
 @app.put("/manifest/{source_id}", response_model=ManifestEntryResponse)
 def update_manifest(source_id: str, update_request: ManifestUpdateRequest):
     """
@@ -633,6 +762,7 @@ def update_manifest(source_id: str, update_request: ManifestUpdateRequest):
         
         # Update entry (this will also trigger embedding if status = pending_embedding)
         updated_entry = update_manifest_entry(source_id, patch)
+        invalidate_source(source_id)
         
         return ManifestEntryResponse(**updated_entry.to_dict())
         
@@ -756,7 +886,7 @@ async def upload_file(
         
         # Upload to GCS
         from google.cloud import storage
-        storage_client = storage.Client()
+        storage_client = await run_blocking("storage", storage.Client)
         bucket = storage_client.bucket(source_bucket)
         
         # Upload to gs://{bucket}/sources/{filename} (matches existing convention)
@@ -765,7 +895,7 @@ async def upload_file(
         
         # Read and upload file content
         contents = await file.read()
-        blob.upload_from_string(contents, content_type=mimetype)
+        await run_blocking("storage", blob.upload_from_string, contents, content_type=mimetype)
         
         source_uri = f"gs://{source_bucket}/{blob_path}"
         logger.info(f"File uploaded to: {source_uri}")
@@ -783,7 +913,7 @@ async def upload_file(
             status=DocumentStatus.PENDING_PROCESSING
         )
         
-        created_entry = create_manifest_entry(entry)
+        created_entry = await run_blocking("storage", create_manifest_entry, entry)
         
         # Trigger background processing
         background_tasks.add_task(
@@ -857,14 +987,14 @@ async def upload_video(
         # Upload to GCS
         source_bucket = os.getenv("SOURCE_BUCKET", "centef-rag-bucket")
         from google.cloud import storage
-        storage_client = storage.Client()
+        storage_client = await run_blocking("storage", storage.Client)
         bucket = storage_client.bucket(source_bucket)
 
         blob_path = f"sources/{file.filename}"
         blob = bucket.blob(blob_path)
 
         contents = await file.read()
-        blob.upload_from_string(contents, content_type="video/mp4")
+        await run_blocking("storage", blob.upload_from_string, contents, content_type="video/mp4")
 
         source_uri = f"gs://{source_bucket}/{blob_path}"
         logger.info(f"Video uploaded to: {source_uri}")
@@ -882,7 +1012,7 @@ async def upload_video(
             status=DocumentStatus.PENDING_PROCESSING
         )
 
-        created_entry = create_manifest_entry(entry)
+        created_entry = await run_blocking("storage", create_manifest_entry, entry)
 
         # Trigger background video processing
         background_tasks.add_task(
@@ -956,14 +1086,14 @@ async def upload_audio(
         # Upload to GCS
         source_bucket = os.getenv("SOURCE_BUCKET", "centef-rag-bucket")
         from google.cloud import storage
-        storage_client = storage.Client()
+        storage_client = await run_blocking("storage", storage.Client)
         bucket = storage_client.bucket(source_bucket)
 
         blob_path = f"sources/{file.filename}"
         blob = bucket.blob(blob_path)
 
         contents = await file.read()
-        blob.upload_from_string(contents, content_type="audio/wav")
+        await run_blocking("storage", blob.upload_from_string, contents, content_type="audio/wav")
 
         source_uri = f"gs://{source_bucket}/{blob_path}"
         logger.info(f"Audio uploaded to: {source_uri}")
@@ -981,7 +1111,7 @@ async def upload_audio(
             status=DocumentStatus.PENDING_PROCESSING
         )
 
-        created_entry = create_manifest_entry(entry)
+        created_entry = await run_blocking("storage", create_manifest_entry, entry)
 
         # Trigger background audio processing
         background_tasks.add_task(
@@ -1073,7 +1203,7 @@ async def upload_youtube(
             status=DocumentStatus.PENDING_PROCESSING
         )
 
-        created_entry = create_manifest_entry(entry)
+        created_entry = await run_blocking("storage", create_manifest_entry, entry)
 
         # Trigger background YouTube processing
         background_tasks.add_task(
@@ -1121,7 +1251,7 @@ async def get_pending_approvals(current_user: User = Depends(require_role("admin
     logger.info(f"GET /admin/manifest/pending by admin={current_user.user_id}")
     
     try:
-        entries = get_manifest_entries(status="pending_approval")
+        entries = await run_blocking("storage", get_manifest_entries, status="pending_approval")
         
         response = [
             ManifestEntryResponse(**entry.to_dict())
@@ -1167,7 +1297,7 @@ async def approve_document(
     
     try:
         # Get current entry
-        entry = get_manifest_entry(source_id)
+        entry = await run_blocking("storage", get_manifest_entry, source_id)
         if not entry:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -1188,7 +1318,8 @@ async def approve_document(
             logger.info(f"Document approved, moving to pending_embedding: {source_id}")
         
         # Update entry
-        updated_entry = update_manifest_entry(source_id, patch)
+        updated_entry = await run_blocking("storage", update_manifest_entry, source_id, patch)
+        invalidate_source(source_id)
         
         return ManifestEntryResponse(**updated_entry.to_dict())
         
@@ -1217,13 +1348,13 @@ async def get_admin_stats(current_user: User = Depends(require_role("admin"))):
     
     try:
         # Get manifest stats
-        all_entries = get_manifest_entries()
+        all_entries = await run_blocking("storage", get_manifest_entries)
         status_counts = {}
         for entry in all_entries:
             status_counts[entry.status] = status_counts.get(entry.status, 0) + 1
         
         # Get user stats
-        all_users = list_all_users()
+        all_users = await run_blocking("auth", list_all_users)
         active_users = sum(1 for u in all_users if u.is_active)
         admin_users = sum(1 for u in all_users if "admin" in u.roles)
         
@@ -1248,6 +1379,109 @@ async def get_admin_stats(current_user: User = Depends(require_role("admin"))):
         )
 
 
+@app.get("/admin/executors")
+async def get_executor_stats(current_user: User = Depends(require_role("admin"))):
+    """
+    Get executor queue depths, timings and event loop lag (admin only).
+
+    Args:
+        current_user: Authenticated admin user
+
+    Returns:
+        Per-stage executor stats and event loop lag stats
+    """
+    return {
+        "executors": executor_stats(),
+        "event_loop_lag": loop_lag_monitor.stats()
+    }
+
+
+@app.get("/admin/metrics")
+async def get_metrics_summary(current_user: User = Depends(require_role("admin"))):
+    """
+    Get the in-process performance metrics summary (admin only).
+
+    Includes hedged Vertex AI Search calls and the Gemini model circuit breakers
+    (state, short-circuited calls and transition counts per model).
+
+    Args:
+        current_user: Authenticated admin user
+
+    Returns:
+        Metrics summary
+    """
+    return get_aggregator().get_summary()
+
+
+@app.get("/admin/metrics/latency")
+async def get_latency_metrics(current_user: User = Depends(require_role("admin"))):
+    """
+    Get windowed latency percentiles (admin only).
+
+    Covers whole chat requests ("pipeline"), retrieval, synthesis and each
+    pipeline stage ("stage.<name>") over the last PERF_LATENCY_WINDOW_S.
+
+    Args:
+        current_user: Authenticated admin user
+
+    Returns:
+        Window length and count, mean, p50/p95/p99 and max per latency
+    """
+    return get_aggregator().latency_summary()
+
+
+@app.get("/admin/profiles")
+async def list_profiles(current_user: User = Depends(require_role("admin"))):
+    """
+    List recent request profiles, newest first (admin only).
+
+    Requests are profiled 1 in PROFILE_SAMPLE_EVERY, or when they carry an
+    X-Profile-Token header matching PROFILE_TOKEN (the response then has an
+    X-Profile-Id header).
+
+    Args:
+        current_user: Authenticated admin user
+
+    Returns:
+        Profile summaries (request, duration, sample count, stage timings)
+    """
+    return {"profiles": get_profile_store().list()}
+
+
+@app.get("/admin/profiles/{profile_id}")
+async def get_profile(
+    profile_id: str,
+    format: str = "json",
+    current_user: User = Depends(require_role("admin"))
+):
+    """
+    Get one request profile (admin only).
+
+    Args:
+        profile_id: Profile ID from /admin/profiles or the X-Profile-Id header
+        format: "json" (summary and collapsed stacks) or "collapsed" (plain
+            text for flamegraph.pl or speedscope)
+        current_user: Authenticated admin user
+
+    Returns:
+        The profile, or its collapsed stacks as text
+    """
+    profile = get_profile_store().get(profile_id)
+    if not profile:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Profile not found for profile_id={profile_id}"
+        )
+    if format == "collapsed":
+        return PlainTextResponse(profile.collapsed())
+    if format != "json":
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="format must be 'json' or 'collapsed'"
+        )
+    return profile.to_dict()
+
+
 @app.get("/admin/users", response_model=List[Dict[str, Any]])
 async def list_users_admin(current_user: User = Depends(require_role("admin"))):
     """
@@ -1262,7 +1496,7 @@ async def list_users_admin(current_user: User = Depends(require_role("admin"))):
     logger.info(f"GET /admin/users by admin={current_user.user_id}")
     
     try:
-        users = list_all_users()
+        users = await run_blocking("auth", list_all_users)
         
         # Return user info without passwords
         return [
@@ -1314,7 +1548,8 @@ async def delete_source(
     try:
         from shared.source_management import delete_source_completely
         
-        result = delete_source_completely(source_id)
+        result = await run_blocking("storage", delete_source_completely, source_id)
+        invalidate_source(source_id)
         
         if result["success"]:
             return {
@@ -1374,7 +1609,9 @@ async def create_user_admin(
     logger.info(f"POST /admin/users by admin={current_user.user_id}, email={request.email}")
     
     try:
-        user = create_user(
+        user = await run_blocking(
+            "auth",
+            create_user,
             email=request.email,
             password=request.password,
             full_name=request.full_name,
@@ -1433,7 +1670,7 @@ async def update_user_admin(
     
     try:
         # Get existing user
-        user = get_user_by_id(user_id)
+        user = await run_blocking("auth", get_user_by_id, user_id)
         
         if not user:
             raise HTTPException(
@@ -1458,12 +1695,12 @@ async def update_user_admin(
         
         if request.password is not None:
             # Update password separately
-            update_user_password(user_id, request.password)
+            await run_blocking("auth", update_user_password, user_id, request.password)
             updated = True
         
         # Save user if any non-password fields were updated
         if updated and request.password is None:
-            update_user(user)
+            await run_blocking("auth", update_user, user)
         
         logger.info(f"User {user_id} updated successfully")
         
@@ -1519,7 +1756,7 @@ async def delete_user_admin(
             )
         
         # Get user to confirm existence
-        user = get_user_by_id(user_id)
+        user = await run_blocking("auth", get_user_by_id, user_id)
         
         if not user:
             raise HTTPException(
@@ -1528,7 +1765,7 @@ async def delete_user_admin(
             )
         
         # Deactivate user
-        success = deactivate_user(user_id)
+        success = await run_blocking("auth", deactivate_user, user_id)
         
         if success:
             return {
@@ -1592,7 +1829,9 @@ async def register(request: RegisterRequest):
     
     try:
         # Create user
-        user = create_user(
+        user = await run_blocking(
+            "auth",
+            create_user,
             email=request.email,
             password=request.password,
             full_name=request.full_name
@@ -1635,7 +1874,7 @@ async def login(request: LoginRequest):
     
     try:
         # Authenticate user
-        user = authenticate_user(request.email, request.password)
+        user = await run_blocking("auth", authenticate_user, request.email, request.password)
         
         if not user:
             raise HTTPException(
@@ -1676,7 +1915,7 @@ async def get_current_user_info(current_user: User = Depends(get_current_user)):
     logger.info(f"GET /auth/me for user={current_user.user_id}")
 
     # Get full user profile
-    user_profile = get_user_by_id(current_user.user_id)
+    user_profile = await run_blocking("auth", get_user_by_id, current_user.user_id)
 
     if not user_profile:
         # User authenticated via API key or doesn't have profile
@@ -1726,7 +1965,7 @@ async def forgot_password(request: ForgotPasswordRequest):
 
     try:
         # Check if user exists
-        user = get_user_by_email(request.email)
+        user = await run_blocking("auth", get_user_by_email, request.email)
 
         if not user:
             # For security, don't reveal if email exists or not
@@ -1755,7 +1994,9 @@ async def forgot_password(request: ForgotPasswordRequest):
 
         # Import and send email
         from shared.email_service import send_password_reset_email
-        email_sent = send_password_reset_email(
+        email_sent = await run_blocking(
+            "auth",
+            send_password_reset_email,
             to_email=user.email,
             reset_token=reset_token,
             user_name=user.full_name
@@ -1825,7 +2066,7 @@ async def reset_password(request: ResetPasswordRequest):
 
         # Update password
         user_id = token_data["user_id"]
-        update_user_password(user_id, request.new_password)
+        await run_blocking("auth", update_user_password, user_id, request.new_password)
 
         # Remove used token
         del password_reset_tokens[request.token]
@@ -1862,10 +2103,12 @@ class ChatRequest(BaseModel):
     use_optimizations: bool = True  # Master toggle for all optimizations
     enable_query_expansion: Optional[bool] = None  # Expand query with variations (auto-determined)
     enable_reranking: Optional[bool] = None  # LLM-based relevance reranking (auto-determined)
+    rerank_mode: Optional[str] = None  # "local", "llm", "joint", or "hybrid" (defaults to RETRIEVER_RERANK_MODE)
     enable_deduplication: Optional[bool] = None  # Remove similar/duplicate results (auto-determined)
     enable_adaptive_limits: bool = True  # Dynamically adjust chunk/summary counts based on query
     filter_logic: str = "OR"  # "OR" or "AND" for metadata filters
     metadata_filters: Optional[Dict[str, Any]] = None  # Custom metadata filters
+    follow_ups: Optional[str] = None  # "inline", "async" or "off" (defaults to CHAT_FOLLOW_UP_MODE)
 
 
 class ChatResponse(BaseModel):
@@ -1876,6 +2119,7 @@ class ChatResponse(BaseModel):
     sources: List[Dict[str, Any]]
     explicit_citations: List[str]
     follow_up_questions: Optional[List[str]] = None
+    follow_ups_status: Optional[str] = None  # "ready", "pending" (poll /chat/messages/{id}/follow-ups) or "disabled"
     model_used: str
     # Optimization metadata
     optimization_metadata: Optional[Dict[str, Any]] = None  # Details about optimizations applied
@@ -1904,6 +2148,149 @@ class MessageResponse(BaseModel):
     feedback_rating: Optional[str] = None
     feedback_note: Optional[str] = None
     feedback_timestamp: Optional[str] = None
+    follow_up_questions: Optional[List[str]] = None
+
+
+def _validate_chat_request(request: ChatRequest) -> str:
+    """Validate request options; returns the resolved follow-up mode."""
+    if request.rerank_mode is not None and request.rerank_mode not in RERANK_MODES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid rerank_mode: {request.rerank_mode}. Must be one of {', '.join(RERANK_MODES)}"
+        )
+    try:
+        return resolve_follow_up_mode(request.follow_ups)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
+def _start_chat_turn(request: ChatRequest, current_user: User) -> tuple:
+    """
+    Create or reuse the session and save the user's message.
+
+    Returns:
+        Tuple of (session_id, user_message_id)
+    """
+    if request.session_id:
+        session_id = request.session_id
+        # Update title if this is the first message in the session and title is still default
+        current_session = get_session_metadata(current_user.user_id, session_id)
+        if current_session and current_session.message_count == 0 and (
+            current_session.title == "New Conversation" or current_session.title == "New Chat"
+        ):
+            # Use first 50 chars of query as title
+            update_session_title(current_user.user_id, session_id, request.query[:50])
+            logger.info(f"Updated session {session_id} title to: {request.query[:50]}")
+    else:
+        # Create new session with query as title
+        session = create_new_session(current_user.user_id, title=request.query[:50])
+        session_id = session.session_id
+        logger.info(f"Created new session {session_id}")
+
+    # Save user message
+    user_message_id = str(uuid.uuid4())
+    user_message = ChatMessage(
+        message_id=user_message_id,
+        session_id=session_id,
+        user_id=current_user.user_id,
+        role=MessageRole.USER,
+        content=request.query
+    )
+    save_message(user_message)
+    return session_id, user_message_id
+
+
+def _chat_context(
+    request: ChatRequest,
+    current_user: User,
+    session_id: str,
+    user_message_id: str,
+    follow_up_mode: str
+) -> PipelineContext:
+    """Pipeline context for a chat turn (the history stage loads this session's history)."""
+    options = request.model_dump()
+    options["include_follow_ups"] = follow_up_mode == "inline"
+    return PipelineContext(
+        query=request.query,
+        options=options,
+        user_id=current_user.user_id,
+        session_id=session_id,
+        history_loader=lambda: _chat_history(current_user.user_id, session_id, user_message_id)
+    )
+
+
+async def _retrieve_for_chat(request: ChatRequest, context: PipelineContext) -> Dict[str, Any]:
+    """Run the retrieval stages (and history) of the chat pipeline, optimized or standard."""
+    pipeline = get_chat_pipeline(request.use_optimizations).subset(RETRIEVAL_STAGES)
+    await pipeline.run(context, record_metrics=False)
+    logger.info(f"Search complete: {len(context.state['chunks'])} chunks, {len(context.state['summaries'])} summaries")
+    return {"summaries": context.state["summaries"], "chunks": context.state["chunks"]}
+
+
+def _chat_history(user_id: str, session_id: str, user_message_id: str) -> List[ChatMessage]:
+    """Conversation history for context (up to 50 previous messages), excluding the current query."""
+    conversation_history = get_conversation_history(
+        user_id=user_id,
+        session_id=session_id,
+        limit=50
+    )
+    return [msg for msg in conversation_history if msg.message_id != user_message_id]
+
+
+def _save_assistant_turn(
+    request: ChatRequest,
+    current_user: User,
+    session_id: str,
+    synthesis_result: Dict[str, Any],
+    follow_up_mode: str,
+    message_id: Optional[str] = None
+) -> str:
+    """
+    Save the assistant's answer and add its tokens to the user's total.
+    In async follow-up mode the questions are added to the message later.
+
+    Returns:
+        The assistant message ID
+    """
+    # Extract token usage from synthesis result
+    input_tokens = synthesis_result.get('input_tokens')
+    output_tokens = synthesis_result.get('output_tokens')
+    total_tokens = synthesis_result.get('total_tokens')
+
+    # Save assistant message with token tracking
+    assistant_message_id = message_id or str(uuid.uuid4())
+    assistant_message = ChatMessage(
+        message_id=assistant_message_id,
+        session_id=session_id,
+        user_id=current_user.user_id,
+        role=MessageRole.ASSISTANT,
+        content=synthesis_result['answer'],
+        sources=synthesis_result.get('sources', []),
+        citations=synthesis_result.get('explicit_citations', []),
+        model_used=synthesis_result.get('model_used'),
+        input_tokens=input_tokens,
+        output_tokens=output_tokens,
+        total_tokens=total_tokens,
+        query_metadata={
+            "max_chunks": request.max_chunks,
+            "max_summaries": request.max_summaries,
+            "temperature": request.temperature,
+            "follow_ups": follow_up_mode
+        },
+        follow_up_questions=synthesis_result.get('follow_up_questions', []) if follow_up_mode == "inline" else None,
+        follow_ups_status=_FOLLOW_UP_STATUS[follow_up_mode]
+    )
+    save_message(assistant_message)
+
+    # Increment user's total token count
+    if total_tokens:
+        increment_user_tokens(current_user.user_id, total_tokens)
+        logger.info(f"Added {total_tokens} tokens to user {current_user.user_id}")
+    return assistant_message_id
+
+
+# Follow-up status reported for each mode once the answer is ready
+_FOLLOW_UP_STATUS = {"inline": "ready", "async": "pending", "off": "disabled"}
 
 
 @app.post("/chat", response_model=ChatResponse)
@@ -1913,171 +2300,44 @@ async def chat(
 ):
     """
     Send a chat message and get an AI response.
-    
+
     This endpoint:
     1. Creates a new session if session_id is not provided
     2. Saves the user's query
-    3. Performs two-tier search (summaries + chunks)
-    4. Generates an answer with Gemini
-    5. Saves the assistant's response
-    6. Returns the answer with citations and sources
-    
+    3. Runs the RAG pipeline (rag_pipeline.py): two-tier search (summaries + chunks),
+       answer generation with Gemini and saving the assistant's response
+    4. Returns the answer with citations and sources
+
     Args:
         request: Chat request with query and optional session_id
         current_user: Authenticated user
-    
+
     Returns:
         Chat response with answer, sources, and citations
     """
     logger.info(f"POST /chat from user={current_user.user_id}, query={request.query[:100]}")
-    
+
+    follow_up_mode = _validate_chat_request(request)
+
     try:
-        # Create or use existing session
-        if request.session_id:
-            session_id = request.session_id
-            # Update title if this is the first message in the session and title is still default
-            current_session = get_session_metadata(current_user.user_id, session_id)
-            if current_session and current_session.message_count == 0 and (
-                current_session.title == "New Conversation" or current_session.title == "New Chat"
-            ):
-                # Use first 50 chars of query as title
-                update_session_title(current_user.user_id, session_id, request.query[:50])
-                logger.info(f"Updated session {session_id} title to: {request.query[:50]}")
-        else:
-            # Create new session with query as title
-            session = create_new_session(current_user.user_id, title=request.query[:50])
-            session_id = session.session_id
-            logger.info(f"Created new session {session_id}")
-        
-        # Save user message
-        import uuid
-        user_message_id = str(uuid.uuid4())
-        user_message = ChatMessage(
-            message_id=user_message_id,
-            session_id=session_id,
-            user_id=current_user.user_id,
-            role=MessageRole.USER,
-            content=request.query
-        )
-        save_message(user_message)
-        
-        # Initialize optimization metadata
-        optimization_metadata = {}
-        
-        # Perform two-tier search (optimized or standard)
-        if request.use_optimizations:
-            logger.info("Performing OPTIMIZED two-tier search...")
-            
-            # Analyze query characteristics if adaptive limits are enabled
-            if request.enable_adaptive_limits:
-                query_analysis = analyze_query_characteristics(request.query)
-                optimization_metadata['query_analysis'] = query_analysis
-                logger.info(f"Query analysis: type={query_analysis['query_type']}, complexity={query_analysis['complexity']}, scope={query_analysis['scope']}")
-            
-            # Call optimized search
-            search_results = search_two_tier_optimized(
-                query=request.query,
-                max_chunk_results=request.max_chunks if not request.enable_adaptive_limits else None,
-                max_summary_results=request.max_summaries if not request.enable_adaptive_limits else None,
-                enable_query_expansion=request.enable_query_expansion,
-                enable_reranking=request.enable_reranking,
-                enable_deduplication=request.enable_deduplication,
-                use_adaptive_strategy=request.enable_adaptive_limits,
-                filter_logic=request.filter_logic
+        session_id, user_message_id = await run_blocking("storage", _start_chat_turn, request, current_user)
+
+        # Retrieval, history, synthesis and persistence run as one staged pipeline
+        context = _chat_context(request, current_user, session_id, user_message_id, follow_up_mode)
+        context.persist = lambda result: _save_assistant_turn(request, current_user, session_id, result, follow_up_mode)
+        await get_chat_pipeline(request.use_optimizations).run(context)
+        synthesis_result = context.state["result"]
+        assistant_message_id = context.state["assistant_message_id"]
+        optimization_metadata = pipeline_metadata(context)
+
+        # Follow-ups need the final answer; in async mode they are generated after we respond
+        if follow_up_mode == "async":
+            schedule_follow_ups(
+                current_user.user_id, session_id, assistant_message_id, request.query, synthesis_result['answer']
             )
-            
-            # Extract optimization metadata from search results
-            if 'optimizations_applied' in search_results:
-                optimization_metadata['search_optimizations'] = search_results['optimizations_applied']
-            if 'adaptive_limits' in search_results:
-                optimization_metadata['adaptive_limits'] = search_results['adaptive_limits']
-            if 'metadata_filters' in search_results:
-                optimization_metadata['metadata_filters'] = search_results['metadata_filters']
-            
-            logger.info(f"Optimized search complete: {len(search_results.get('chunks', []))} chunks, {len(search_results.get('summaries', []))} summaries")
-        else:
-            logger.info("Performing standard two-tier search...")
-            search_results = search_two_tier(
-                request.query,
-                max_chunk_results=request.max_chunks,
-                max_summary_results=request.max_summaries
-            )
-        
-        # Get conversation history for context (up to 50 previous messages)
-        conversation_history = get_conversation_history(
-            user_id=current_user.user_id,
-            session_id=session_id,
-            limit=50
-        )
-        # Exclude the current user message we just saved
-        conversation_history = [msg for msg in conversation_history if msg.message_id != user_message_id]
-        
-        # Synthesize answer (optimized or standard)
-        if request.use_optimizations:
-            logger.info("Synthesizing answer with OPTIMIZED synthesizer...")
-            synthesis_result = synthesize_answer_optimized(
-                query=request.query,
-                summary_results=search_results.get('summaries', []),
-                chunk_results=search_results.get('chunks', []),
-                temperature=request.temperature,
-                user_id=current_user.user_id,
-                session_id=session_id,
-                conversation_history=conversation_history
-            )
-            
-            # Extract format detection metadata
-            if 'format_info' in synthesis_result:
-                optimization_metadata['format_detection'] = synthesis_result['format_info']
-            if 'optimizations_applied' in synthesis_result:
-                optimization_metadata['synthesis_optimizations'] = synthesis_result['optimizations_applied']
-                
-            logger.info(f"Optimized synthesis complete with format: {synthesis_result.get('format_info', {}).get('format_type', 'unknown')}")
-        else:
-            logger.info("Synthesizing answer with standard synthesizer...")
-            synthesis_result = synthesize_answer(
-                query=request.query,
-                summary_results=search_results.get('summaries', []),
-                chunk_results=search_results.get('chunks', []),
-                temperature=request.temperature,
-                user_id=current_user.user_id,
-                session_id=session_id,
-                conversation_history=conversation_history
-            )
-        
-        # Extract token usage from synthesis result
-        input_tokens = synthesis_result.get('input_tokens')
-        output_tokens = synthesis_result.get('output_tokens')
-        total_tokens = synthesis_result.get('total_tokens')
-        
-        # Save assistant message with token tracking
-        assistant_message_id = str(uuid.uuid4())
-        assistant_message = ChatMessage(
-            message_id=assistant_message_id,
-            session_id=session_id,
-            user_id=current_user.user_id,
-            role=MessageRole.ASSISTANT,
-            content=synthesis_result['answer'],
-            sources=synthesis_result.get('sources', []),
-            citations=synthesis_result.get('explicit_citations', []),
-            model_used=synthesis_result.get('model_used'),
-            input_tokens=input_tokens,
-            output_tokens=output_tokens,
-            total_tokens=total_tokens,
-            query_metadata={
-                "max_chunks": request.max_chunks,
-                "max_summaries": request.max_summaries,
-                "temperature": request.temperature
-            }
-        )
-        save_message(assistant_message)
-        
-        # Increment user's total token count
-        if total_tokens:
-            increment_user_tokens(current_user.user_id, total_tokens)
-            logger.info(f"Added {total_tokens} tokens to user {current_user.user_id}")
-        
+
         logger.info(f"Chat completed successfully for session {session_id}")
-        
+
         return ChatResponse(
             message_id=assistant_message_id,
             session_id=session_id,
@@ -2085,10 +2345,11 @@ async def chat(
             sources=synthesis_result.get('sources', []),
             explicit_citations=synthesis_result.get('explicit_citations', []),
             follow_up_questions=synthesis_result.get('follow_up_questions', []),
+            follow_ups_status=_FOLLOW_UP_STATUS[follow_up_mode],
             model_used=synthesis_result.get('model_used', 'unknown'),
             optimization_metadata=optimization_metadata if request.use_optimizations else None
         )
-        
+
     except Exception as e:
         logger.error(f"Error in chat endpoint: {e}", exc_info=True)
         raise HTTPException(
@@ -2097,6 +2358,161 @@ async def chat(
         )
 
 
+def format_sse(event: str, data: Any) -> str:
+    """Encode one Server-Sent Event."""
+    payload = json.dumps(data, default=lambda value: value.to_dict() if hasattr(value, "to_dict") else str(value))
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+async def _chat_event_stream(
+    request: ChatRequest,
+    current_user: User,
+    session_id: str,
+    user_message_id: str,
+    follow_up_mode: str
+) -> AsyncIterator[str]:
+    """SSE body for /chat/stream. Each blocking stage runs on its executor."""
+    start = time.perf_counter()
+    assistant_message_id = str(uuid.uuid4())
+    context = _chat_context(request, current_user, session_id, user_message_id, follow_up_mode)
+    try:
+        search_results = await _retrieve_for_chat(request, context)
+        retrieval_ms = (time.perf_counter() - start) * 1000
+        summaries = search_results.get('summaries', [])
+        chunks = search_results.get('chunks', [])
+        yield format_sse("retrieval", {
+            "session_id": session_id,
+            "num_summaries": len(summaries),
+            "num_chunks": len(chunks),
+            "retrieval_ms": round(retrieval_ms, 1)
+        })
+
+        # Loaded by the pipeline's history stage alongside retrieval
+        conversation_history = context.state.get("conversation_history", [])
+
+        synthesis_result = None
+        generate_start = time.perf_counter()
+        answer_events = stream_answer_optimized(
+            query=request.query,
+            summary_results=summaries,
+            chunk_results=chunks,
+            temperature=request.temperature,
+            user_id=current_user.user_id,
+            session_id=session_id,
+            conversation_history=conversation_history,
+            include_follow_ups=follow_up_mode == "inline"
+        )
+        # Closed as soon as this stream stops, so a disconnect releases the model stream
+        async with aclosing(iterate_blocking("generation", answer_events)) as answer_stream:
+            async for event, data in answer_stream:
+                if event == "result":
+                    synthesis_result = data
+                else:
+                    yield format_sse(event, data)
+
+        context.state["result"] = synthesis_result
+        # Budgeting, generation and citation processing happen inside the stream
+        context.timings_ms["generate"] = round((time.perf_counter() - generate_start) * 1000, 1)
+
+        # Persist only once the answer and citations (and inline follow-ups) have been sent
+        persist_start = time.perf_counter()
+        await run_blocking(
+            "storage", _save_assistant_turn, request, current_user, session_id, synthesis_result,
+            follow_up_mode, message_id=assistant_message_id
+        )
+        context.timings_ms["persist"] = round((time.perf_counter() - persist_start) * 1000, 1)
+        record_pipeline_metrics(context)
+        follow_up_job = None
+        if follow_up_mode == "async":
+            follow_up_job = schedule_follow_ups(
+                current_user.user_id, session_id, assistant_message_id, request.query, synthesis_result['answer']
+            )
+
+        time_to_first_token_ms = retrieval_ms + synthesis_result['time_to_first_token_ms']
+        total_ms = (time.perf_counter() - start) * 1000
+        logger.info(
+            f"Chat stream completed for session {session_id}: "
+            f"first token {time_to_first_token_ms:.0f}ms, total {total_ms:.0f}ms"
+        )
+
+        optimization_metadata = pipeline_metadata(context)
+        yield format_sse("done", {
+            "message_id": assistant_message_id,
+            "session_id": session_id,
+            "model_used": synthesis_result.get('model_used', 'unknown'),
+            "follow_ups_status": _FOLLOW_UP_STATUS[follow_up_mode],
+            "timings_ms": {
+                "retrieval": round(retrieval_ms, 1),
+                "time_to_first_token": round(time_to_first_token_ms, 1),
+                "total": round(total_ms, 1)
+            },
+            "optimization_metadata": optimization_metadata if request.use_optimizations else None
+        })
+
+        # Async follow-ups arrive after "done"; clients that close the stream can fetch them later
+        if follow_up_job is not None:
+            follow_up_questions = await wait_for_follow_ups(follow_up_job)
+            yield format_sse("follow_ups", {"follow_up_questions": follow_up_questions})
+
+    except (GeneratorExit, asyncio.CancelledError):
+        # Client went away: nothing to persist, the partial answer was never delivered
+        logger.info(f"Chat stream for session {session_id} closed by client")
+        raise
+    except Exception as e:
+        logger.error(f"Error in chat stream: {e}", exc_info=True)
+        yield format_sse("error", {"detail": f"Error processing chat: {str(e)}"})
+
+
+@app.post("/chat/stream")
+async def chat_stream(
+    request: ChatRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Send a chat message and stream the response as Server-Sent Events.
+
+    Takes the same request as /chat. Events, in order:
+    - retrieval: search finished (session_id, result counts, retrieval_ms)
+    - sources: candidate sources for the answer
+    - token: answer text as it is generated ({"text": ...}, repeated)
+    - citation: a newly cited source ({"number", "source"}), sent before the token containing [number]
+    - citations: final answer with numbered citations and the cited sources
+    - follow_ups: follow-up questions (inline mode)
+    - done: message_id, model_used, follow_ups_status and timings (retrieval, time_to_first_token, total)
+    - follow_ups: follow-up questions (async mode; also at GET /chat/messages/{id}/follow-ups)
+    - error: sent instead of the remaining events if the pipeline fails
+
+    The assistant message is saved before "done".
+    Answers always use the optimized (streaming) synthesizer; use_optimizations
+    controls retrieval only.
+
+    Args:
+        request: Chat request with query and optional session_id
+        current_user: Authenticated user
+
+    Returns:
+        text/event-stream response
+    """
+    logger.info(f"POST /chat/stream from user={current_user.user_id}, query={request.query[:100]}")
+
+    follow_up_mode = _validate_chat_request(request)
+
+    try:
+        session_id, user_message_id = await run_blocking("storage", _start_chat_turn, request, current_user)
+    except Exception as e:
+        logger.error(f"Error starting chat stream: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error processing chat: {str(e)}"
+        )
+
+    return StreamingResponse(
+        _chat_event_stream(request, current_user, session_id, user_message_id, follow_up_mode),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @app.get("/chat/sessions", response_model=List[SessionResponse])
 async def get_sessions(current_user: User = Depends(get_current_user)):
     """
@@ -2111,7 +2527,7 @@ async def get_sessions(current_user: User = Depends(get_current_user)):
     logger.info(f"GET /chat/sessions for user={current_user.user_id}")
     
     try:
-        sessions = get_user_sessions(current_user.user_id)
+        sessions = await run_blocking("storage", get_user_sessions, current_user.user_id)
         
         return [
             SessionResponse(**session.to_dict())
@@ -2146,7 +2562,9 @@ async def get_history(
     logger.info(f"GET /chat/history/{session_id} for user={current_user.user_id}")
     
     try:
-        messages = get_conversation_history(
+        messages = await run_blocking(
+            "storage",
+            get_conversation_history,
             current_user.user_id,
             session_id,
             limit=limit
@@ -2164,7 +2582,8 @@ async def get_history(
                 model_used=msg.model_used,
                 feedback_rating=msg.feedback_rating,
                 feedback_note=msg.feedback_note,
-                feedback_timestamp=msg.feedback_timestamp
+                feedback_timestamp=msg.feedback_timestamp,
+                follow_up_questions=msg.follow_up_questions
             )
             for msg in messages
         ]
@@ -2195,7 +2614,7 @@ async def create_session(
     logger.info(f"POST /chat/sessions for user={current_user.user_id}")
     
     try:
-        session = create_new_session(current_user.user_id, title=title)
+        session = await run_blocking("storage", create_new_session, current_user.user_id, title=title)
         return SessionResponse(**session.to_dict())
         
     except Exception as e:
@@ -2224,7 +2643,7 @@ async def delete_session_endpoint(
     logger.info(f"DELETE /chat/sessions/{session_id} for user={current_user.user_id}")
     
     try:
-        success = delete_session(current_user.user_id, session_id)
+        success = await run_blocking("storage", delete_session, current_user.user_id, session_id)
         
         if success:
             return {"message": "Session deleted successfully", "session_id": session_id}
@@ -2264,7 +2683,7 @@ async def update_session_title_endpoint(
     logger.info(f"PATCH /chat/sessions/{session_id}/title for user={current_user.user_id}")
 
     try:
-        session = update_session_title(current_user.user_id, session_id, title)
+        session = await run_blocking("storage", update_session_title, current_user.user_id, session_id, title)
 
         if not session:
             raise HTTPException(
@@ -2319,7 +2738,9 @@ async def update_message_feedback_endpoint(
                 detail="feedback_rating must be 'thumbs_up' or 'thumbs_down'"
             )
 
-        success = update_message_feedback(
+        success = await run_blocking(
+            "storage",
+            update_message_feedback,
             user_id=current_user.user_id,
             session_id=session_id,
             message_id=message_id,
@@ -2349,6 +2770,49 @@ async def update_message_feedback_endpoint(
         )
 
 
+@app.get("/chat/messages/{message_id}/follow-ups")
+async def get_message_follow_ups(
+    message_id: str,
+    session_id: str,
+    wait_ms: int = 0,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Get follow-up questions for an assistant message.
+
+    Follow-ups generated in async mode are stored on the message when ready,
+    together with their status, so any instance can answer.
+
+    Args:
+        message_id: Assistant message ID
+        session_id: Session ID (query parameter)
+        wait_ms: Wait up to this long for a running job (capped at 10s)
+        current_user: Authenticated user
+
+    Returns:
+        status ("ready", "pending", "failed", "disabled" or "unavailable") and follow_up_questions
+    """
+    logger.info(f"GET /chat/messages/{message_id}/follow-ups for user={current_user.user_id}")
+
+    try:
+        result = await get_follow_ups(
+            current_user.user_id, session_id, message_id, wait_s=min(max(wait_ms, 0), 10000) / 1000
+        )
+    except Exception as e:
+        logger.error(f"Error getting follow-up questions: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error getting follow-up questions: {str(e)}"
+        )
+
+    if result is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Message {message_id} not found in session {session_id}"
+        )
+    return {"message_id": message_id, **result}
+
+
 # ============================================================================
 # Legacy Search Endpoint (kept for backwards compatibility)
 # ============================================================================
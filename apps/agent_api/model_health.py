@@ -0,0 +1,168 @@
+"""
+Per-model circuit breakers for Gemini generation in CENTEF RAG system.
+
+Without them every request walks FALLBACK_MODELS in order, so while the primary
+model is rate-limited each request first spends a full failing call on it. A
+breaker is shared by all requests in the process:
+
+    closed     calls go through
+    open       a 429/quota error was seen; the model is skipped until the cooldown ends
+    half_open  cooldown over; one probe request is let through. Success closes the
+               breaker, another rate-limit error reopens it with a longer cooldown.
+
+Other errors (bad request, safety blocks, ...) do not open the breaker.
+"""
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# Environment variables
+MODEL_BREAKER_FAILURE_THRESHOLD = int(os.getenv("MODEL_BREAKER_FAILURE_THRESHOLD", "1"))  # Consecutive rate-limit errors to open
+MODEL_BREAKER_COOLDOWN_S = float(os.getenv("MODEL_BREAKER_COOLDOWN_S", "30"))
+MODEL_BREAKER_MAX_COOLDOWN_S = float(os.getenv("MODEL_BREAKER_MAX_COOLDOWN_S", "300"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+RATE_LIMIT_MARKERS = ("429", "resource exhausted", "quota", "insufficient", "rate limit")
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    """Whether an exception from generate_content means the model is rate-limited or out of quota."""
+    if getattr(error, "code", None) == 429:
+        return True
+    message = str(error).lower()
+    return any(marker in message for marker in RATE_LIMIT_MARKERS)
+
+
+class ModelCircuitBreaker:
+    """Circuit breaker for one model."""
+
+    def __init__(
+        self,
+        model: str,
+        failure_threshold: int = MODEL_BREAKER_FAILURE_THRESHOLD,
+        cooldown_s: float = MODEL_BREAKER_COOLDOWN_S,
+        max_cooldown_s: float = MODEL_BREAKER_MAX_COOLDOWN_S,
+        clock=time.monotonic
+    ):
+        self.model = model
+        self.failure_threshold = failure_threshold
+        self.base_cooldown_s = cooldown_s
+        self.max_cooldown_s = max_cooldown_s
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.cooldown_s = cooldown_s
+        self.open_until = 0.0
+        self.consecutive_failures = 0
+        self.probe_in_flight = False
+        self.short_circuited = 0
+        self.transitions: Dict[str, int] = {}
+
+    def _transition(self, state: str) -> None:
+        key = f"{self.state}->{state}"
+        self.transitions[key] = self.transitions.get(key, 0) + 1
+        level = logging.WARNING if state == OPEN else logging.INFO
+        logger.log(level, f"Model breaker {self.model}: {key}")
+        self.state = state
+
+    def allow_request(self) -> bool:
+        """
+        Whether a call to this model may go ahead. In half-open state only one
+        caller (the probe) gets True until it reports back.
+        """
+        with self._lock:
+            if self.state == OPEN and self._clock() >= self.open_until:
+                self._transition(HALF_OPEN)
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self.probe_in_flight:
+                self.probe_in_flight = True
+                return True
+            self.short_circuited += 1
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.consecutive_failures = 0
+            self.probe_in_flight = False
+            if self.state != CLOSED:
+                self._transition(CLOSED)
+                self.cooldown_s = self.base_cooldown_s
+
+    def record_failure(self, error: BaseException) -> None:
+        with self._lock:
+            was_probe = self.probe_in_flight
+            self.probe_in_flight = False
+            if not is_rate_limit_error(error):
+                # Not an availability problem; the next request can probe again
+                return
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN and was_probe:
+                self.cooldown_s = min(self.cooldown_s * 2, self.max_cooldown_s)
+            elif self.state != CLOSED or self.consecutive_failures < self.failure_threshold:
+                return
+            self.open_until = self._clock() + self.cooldown_s
+            self._transition(OPEN)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self.state,
+                "cooldown_s": self.cooldown_s,
+                "reopens_in_s": round(max(0.0, self.open_until - self._clock()), 1) if self.state == OPEN else None,
+                "short_circuited": self.short_circuited,
+                "transitions": dict(self.transitions),
+            }
+
+
+_breakers: Dict[str, ModelCircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(model: str) -> ModelCircuitBreaker:
+    """Get (or create) the shared breaker for a model."""
+    with _breakers_lock:
+        if model not in _breakers:
+            _breakers[model] = ModelCircuitBreaker(model)
+        return _breakers[model]
+
+
+def next_available_model(models: Sequence[str], after: Optional[str] = None) -> Optional[str]:
+    """
+    The next model in fallback order (after `after`) whose breaker allows a call.
+    Asking claims the half-open probe, so callers must try the returned model and
+    report the outcome with record_success/record_failure.
+
+    Args:
+        models: Fallback order
+        after: Model just tried, or None to start from the top
+
+    Returns:
+        Model name, or None if every remaining breaker is open
+    """
+    start = list(models).index(after) + 1 if after in models else 0
+    for model in list(models)[start:]:
+        if get_breaker(model).allow_request():
+            return model
+        logger.info(f"Skipping {model}: circuit open")
+    return None
+
+
+def breaker_states() -> Dict[str, Dict[str, Any]]:
+    """Snapshot of every model breaker, for metrics."""
+    with _breakers_lock:
+        breakers = dict(_breakers)
+    return {model: breaker.snapshot() for model, breaker in breakers.items()}
+
+
+def reset_breakers() -> None:
+    """Forget all breaker state."""
+    with _breakers_lock:
+        _breakers.clear()
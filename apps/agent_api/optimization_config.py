@@ -3,17 +3,34 @@ Configuration for RAG optimization features.
 Centralized settings for retriever and synthesizer optimizations.
 """
 import os
-from dataclasses import dataclass
-from typing import Optional
+from dataclasses import dataclass, field
+from typing import Dict, Optional
 from dotenv import load_dotenv
 
 load_dotenv()
 
 
+def _parse_weights(value: str) -> Dict[str, float]:
+    """Parse "name:weight,name:weight" into a dict (a bare name gets weight 1.0)."""
+    weights = {}
+    for item in value.split(","):
+        name, _, weight = item.strip().partition(":")
+        if name:
+            weights[name.strip().lower()] = float(weight) if weight else 1.0
+    return weights
+
+
 @dataclass
 class RetrieverOptimizationConfig:
     """Configuration for retriever optimizations."""
     
+    # Search backend
+    backend: str = "vertex"  # "vertex" (Vertex AI Search), "local" (BM25), "vector" (dense index) or "hybrid"
+    
+    # Hybrid retrieval (backend="hybrid"): sources run concurrently and are fused with weighted RRF
+    hybrid_weights: Dict[str, float] = field(default_factory=lambda: {"vertex": 1.0, "local": 0.7, "vector": 0.7})
+    hybrid_budget_ms: int = 1500  # Fuse whatever has arrived when this per-request budget expires
+    
     # Query expansion
     enable_query_expansion: bool = True
     query_expansion_model: str = "gemini-2.0-flash-exp"
@@ -22,6 +39,9 @@ class RetrieverOptimizationConfig:
     enable_reranking: bool = True
     reranking_model: str = "gemini-2.0-flash-exp"
     rerank_top_k: Optional[int] = None  # None = no limit after reranking
+    rerank_mode: str = "llm"  # "local" (BM25 + proximity), "llm" (per tier), "joint" (one call), or "hybrid"
+    hybrid_rerank_margin: float = 0.15  # Local scores within this margin of the top-k cutoff go to the LLM
+    hybrid_rerank_max_llm_candidates: int = 8
     
     # Deduplication
     enable_deduplication: bool = True
@@ -41,11 +61,17 @@ class RetrieverOptimizationConfig:
     def from_env(cls) -> 'RetrieverOptimizationConfig':
         """Create configuration from environment variables."""
         return cls(
+            backend=os.getenv("RETRIEVER_BACKEND", "vertex").lower(),
+            hybrid_weights=_parse_weights(os.getenv("RETRIEVER_HYBRID_WEIGHTS", "vertex:1.0,local:0.7,vector:0.7")),
+            hybrid_budget_ms=int(os.getenv("RETRIEVER_HYBRID_BUDGET_MS", "1500")),
             enable_query_expansion=os.getenv("RETRIEVER_ENABLE_QUERY_EXPANSION", "true").lower() == "true",
             query_expansion_model=os.getenv("QUERY_EXPANSION_MODEL", "gemini-2.0-flash-exp"),
             enable_reranking=os.getenv("RETRIEVER_ENABLE_RERANKING", "true").lower() == "true",
             reranking_model=os.getenv("RERANKING_MODEL", "gemini-2.0-flash-exp"),
             rerank_top_k=int(os.getenv("RETRIEVER_RERANK_TOP_K")) if os.getenv("RETRIEVER_RERANK_TOP_K") else None,
+            rerank_mode=os.getenv("RETRIEVER_RERANK_MODE", "llm").lower(),
+            hybrid_rerank_margin=float(os.getenv("RETRIEVER_HYBRID_RERANK_MARGIN", "0.15")),
+            hybrid_rerank_max_llm_candidates=int(os.getenv("RETRIEVER_HYBRID_RERANK_MAX_LLM", "8")),
             enable_deduplication=os.getenv("RETRIEVER_ENABLE_DEDUPLICATION", "true").lower() == "true",
             deduplication_threshold=float(os.getenv("RETRIEVER_DEDUP_THRESHOLD", "0.85")),
             enable_adaptive_limits=os.getenv("RETRIEVER_ENABLE_ADAPTIVE_LIMITS", "false").lower() == "true",
@@ -153,8 +179,12 @@ class RAGOptimizationConfig:
         """Convert configuration to dictionary."""
         return {
             "retriever": {
+                "backend": self.retriever.backend,
+                "hybrid_weights": self.retriever.hybrid_weights,
+                "hybrid_budget_ms": self.retriever.hybrid_budget_ms,
                 "query_expansion": self.retriever.enable_query_expansion,
                 "reranking": self.retriever.enable_reranking,
+                "rerank_mode": self.retriever.rerank_mode,
                 "deduplication": self.retriever.enable_deduplication,
                 "adaptive_limits": self.retriever.enable_adaptive_limits,
                 "max_chunks": self.retriever.default_max_chunks,
@@ -3,15 +3,36 @@ Performance monitoring utilities for RAG optimization.
 Tracks latency, token usage, and retrieval quality metrics.
 """
 import logging
+import math
+import os
+import threading
 import time
+from collections import deque
 from contextlib import contextmanager
 from typing import Dict, Any, Optional, List
 from dataclasses import dataclass, field
 from datetime import datetime
 import statistics
 
+from apps.agent_api.model_health import breaker_states
+from apps.agent_api.token_budget import get_token_counter
+from apps.agent_api.answer_cache import get_answer_cache
+from apps.agent_api.prompt_cache import get_prompt_prefix_cache
+from shared.telemetry import observe_stage, register_collector
+
 logger = logging.getLogger(__name__)
 
+# Environment variables
+PERF_METRICS_WINDOW = int(os.getenv("PERF_METRICS_WINDOW", "1000"))  # Requests kept per metrics kind
+PERF_LATENCY_WINDOW_S = float(os.getenv("PERF_LATENCY_WINDOW_S", "300"))  # Window for latency percentiles
+PERF_LATENCY_INTERVALS = int(os.getenv("PERF_LATENCY_INTERVALS", "5"))  # Sub-intervals the window slides by
+
+# Latency histogram range and bucket growth (each bucket is 2% wider: values within ~1%)
+HISTOGRAM_MIN_MS = 0.01
+HISTOGRAM_MAX_MS = 3_600_000.0
+HISTOGRAM_BUCKET_GROWTH = 1.02
+HEDGE_DELAY_REFRESH_S = 1.0  # How long a computed hedge delay is reused
+
 
 @dataclass
 class LatencyMetrics:
@@ -184,16 +205,24 @@ class RAGPipelineMetrics:
     
     total_duration_ms: Optional[float] = None
     
+    # Per-stage wall time (rag_pipeline stages) and the stages served from cache
+    stage_timings_ms: Dict[str, float] = field(default_factory=dict)
+    cached_stages: List[str] = field(default_factory=list)
+    
     def to_dict(self) -> Dict[str, Any]:
         """Convert to dictionary."""
         return {
             "query": self.query,
             "timestamp": self.timestamp,
             "session_id": self.session_id,
-            "user_id": user_id,
+            "user_id": self.user_id,
             "retrieval": self.retrieval.to_dict() if self.retrieval else None,
             "synthesis": self.synthesis.to_dict() if self.synthesis else None,
             "total_duration_ms": self.total_duration_ms,
+            "stages": {
+                "timings_ms": self.stage_timings_ms,
+                "cached": self.cached_stages
+            },
             "breakdown": {
                 "retrieval_percent": (self.retrieval.total_duration_ms / self.total_duration_ms * 100) 
                     if self.retrieval and self.total_duration_ms else None,
@@ -225,6 +254,7 @@ def track_latency(operation: str, warning_threshold_ms: float = 5000.0):
     try:
         yield metrics
         metrics.complete()
+        get_aggregator().record_latency(f"op.{operation}", metrics.duration_ms)
         
         if metrics.duration_ms and metrics.duration_ms > warning_threshold_ms:
             logger.warning(
@@ -286,25 +316,301 @@ def calculate_citation_quality_score(
     return total_score
 
 
-class MetricsAggregator:
-    """Aggregates metrics across multiple requests for analysis."""
+class LatencyHistogram:
+    """
+    Fixed-memory latency histogram with logarithmic buckets (HDR histogram style).
+    
+    Bucket i covers [HISTOGRAM_MIN_MS * g^i, HISTOGRAM_MIN_MS * g^(i+1)) with
+    g = HISTOGRAM_BUCKET_GROWTH, and quantiles are read from the bucket midpoint,
+    so any quantile is within about 1% of the exact value however many samples
+    are recorded. Buckets are stored sparsely; there are at most ~1000 of them.
+    Not thread-safe (WindowedHistogram locks around it).
+    """
+    
+    _LOG_GROWTH = math.log(HISTOGRAM_BUCKET_GROWTH)
+    _MAX_BUCKET = int(math.log(HISTOGRAM_MAX_MS / HISTOGRAM_MIN_MS) / math.log(HISTOGRAM_BUCKET_GROWTH))
     
     def __init__(self):
-        self.retrieval_metrics: List[RetrievalMetrics] = []
-        self.synthesis_metrics: List[SynthesisMetrics] = []
-        self.pipeline_metrics: List[RAGPipelineMetrics] = []
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+        self.total_ms = 0.0
+        self.min_ms: Optional[float] = None
+        self.max_ms: Optional[float] = None
+    
+    def record(self, value_ms: float):
+        """Record one latency (clamped to the histogram range)."""
+        value_ms = min(max(value_ms, HISTOGRAM_MIN_MS), HISTOGRAM_MAX_MS)
+        bucket = min(int(math.log(value_ms / HISTOGRAM_MIN_MS) / self._LOG_GROWTH), self._MAX_BUCKET)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total_ms += value_ms
+        self.min_ms = value_ms if self.min_ms is None else min(self.min_ms, value_ms)
+        self.max_ms = value_ms if self.max_ms is None else max(self.max_ms, value_ms)
+    
+    def merge(self, other: "LatencyHistogram"):
+        """Add another histogram's samples to this one."""
+        for bucket, count in other.buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+        self.count += other.count
+        self.total_ms += other.total_ms
+        for value in (other.min_ms, other.max_ms):
+            if value is not None:
+                self.min_ms = value if self.min_ms is None else min(self.min_ms, value)
+                self.max_ms = value if self.max_ms is None else max(self.max_ms, value)
+    
+    def quantile(self, q: float) -> Optional[float]:
+        """Nearest-rank quantile (q in 0-1), or None if empty."""
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(q * self.count))
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                midpoint = HISTOGRAM_MIN_MS * HISTOGRAM_BUCKET_GROWTH ** (bucket + 0.5)
+                return round(min(max(midpoint, self.min_ms), self.max_ms), 2)
+        return round(self.max_ms, 2)
+    
+    def summary(self) -> Dict[str, Any]:
+        """Count, mean, p50/p95/p99 and max in milliseconds."""
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total_ms / self.count, 2) if self.count else None,
+            "p50_ms": self.quantile(0.5),
+            "p95_ms": self.quantile(0.95),
+            "p99_ms": self.quantile(0.99),
+            "max_ms": round(self.max_ms, 2) if self.max_ms is not None else None
+        }
+
+
+class WindowedHistogram:
+    """
+    Latency histogram over a sliding time window.
+    
+    The window is split into `intervals` sub-histograms; each new interval
+    replaces the oldest, and a snapshot merges the intervals still inside the
+    window. Memory stays fixed regardless of traffic. Thread-safe.
+    """
+    
+    def __init__(
+        self,
+        window_s: float = PERF_LATENCY_WINDOW_S,
+        intervals: int = PERF_LATENCY_INTERVALS,
+        clock=time.monotonic
+    ):
+        self.window_s = window_s
+        self.intervals = max(1, intervals)
+        self._interval_s = window_s / self.intervals
+        self._clock = clock
+        self._lock = threading.Lock()
+        # (interval number, histogram) per slot; one extra slot so a full window is always covered
+        self._slots: List[tuple] = [(None, LatencyHistogram()) for _ in range(self.intervals + 1)]
+        self.total_count = 0
+    
+    def _interval(self) -> int:
+        return int(self._clock() // self._interval_s)
+    
+    def record(self, value_ms: float):
+        interval = self._interval()
+        slot = interval % len(self._slots)
+        with self._lock:
+            if self._slots[slot][0] != interval:
+                self._slots[slot] = (interval, LatencyHistogram())
+            self._slots[slot][1].record(value_ms)
+            self.total_count += 1
+    
+    def snapshot(self) -> LatencyHistogram:
+        """The samples recorded within the window, merged into one histogram."""
+        oldest = self._interval() - self.intervals
+        merged = LatencyHistogram()
+        with self._lock:
+            for interval, histogram in self._slots:
+                if interval is not None and interval >= oldest:
+                    merged.merge(histogram)
+        return merged
+
+
+class HedgedCallMetrics:
+    """
+    Windowed latency and hedging statistics for one hedged remote call.
+    
+    Calls made without hedging (warm-up, or the control sample kept unhedged on
+    purpose) give the "unhedged" latency distribution; calls with hedging armed
+    give the "hedged" one, so p50/p95/p99 before and after can be compared on
+    live traffic. Primary-attempt latencies (cut off at cancellation when a hedge
+    wins, which does not move quantiles below that point) drive the hedge delay.
+    Latencies are kept in WindowedHistograms, so recording is O(1) and the hedge
+    delay read on every call is recomputed at most every HEDGE_DELAY_REFRESH_S.
+    Thread-safe.
+    """
+    
+    def __init__(
+        self,
+        operation: str,
+        window_s: float = PERF_LATENCY_WINDOW_S,
+        intervals: int = PERF_LATENCY_INTERVALS,
+        clock=time.monotonic
+    ):
+        self.operation = operation
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._primary_ms = WindowedHistogram(window_s, intervals, clock)
+        self._unhedged_ms = WindowedHistogram(window_s, intervals, clock)
+        self._hedged_ms = WindowedHistogram(window_s, intervals, clock)
+        self._hedge_delay: Optional[tuple] = None  # ((quantile, min_samples), expires_at, delay_ms)
+        self.calls = 0
+        self.hedging_armed = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.timeouts = 0
+    
+    def record(
+        self,
+        latency_ms: float,
+        primary_ms: float,
+        armed: bool,
+        hedged: bool = False,
+        hedge_won: bool = False,
+        timed_out: bool = False
+    ):
+        """
+        Record one call.
+        
+        Args:
+            latency_ms: Latency seen by the caller
+            primary_ms: Latency of the first attempt (or time until it was cancelled)
+            armed: Whether a hedge would have been sent once the delay passed
+            hedged: Whether a hedged request was actually sent
+            hedge_won: Whether the hedged request answered first
+            timed_out: Whether the call hit its deadline
+        """
+        self._primary_ms.record(primary_ms)
+        (self._hedged_ms if armed else self._unhedged_ms).record(latency_ms)
+        with self._lock:
+            self.calls += 1
+            self.hedging_armed += int(armed)
+            self.hedges += int(hedged)
+            self.hedge_wins += int(hedge_won)
+            self.timeouts += int(timed_out)
+    
+    def hedge_delay_ms(self, quantile: float = 0.95, min_samples: int = 20) -> Optional[float]:
+        """
+        Delay after which to issue a hedged request: the given quantile of
+        primary latencies in the window, or None until enough samples are collected.
+        """
+        key = (quantile, min_samples)
+        now = self._clock()
+        with self._lock:
+            cached = self._hedge_delay
+            if cached is not None and cached[0] == key and now < cached[1]:
+                return cached[2]
+        snapshot = self._primary_ms.snapshot()
+        if snapshot.count < min_samples:
+            return None
+        delay_ms = snapshot.quantile(quantile)
+        with self._lock:
+            self._hedge_delay = (key, now + HEDGE_DELAY_REFRESH_S, delay_ms)
+        return delay_ms
+    
+    def summary(self) -> Dict[str, Any]:
+        """Hedge rate and p50/p95/p99 latency for unhedged and hedged calls."""
+        unhedged = self._unhedged_ms.snapshot()
+        hedged = self._hedged_ms.snapshot()
+        with self._lock:
+            counts = (self.calls, self.hedging_armed, self.hedges, self.hedge_wins, self.timeouts)
+        calls, armed, hedges, hedge_wins, timeouts = counts
+        return {
+            "calls": calls,
+            "hedges": hedges,
+            "hedge_rate": hedges / armed if armed else 0.0,
+            "hedge_wins": hedge_wins,
+            "timeouts": timeouts,
+            "unhedged_latency_ms": {f"p{int(q * 100)}": unhedged.quantile(q) for q in (0.5, 0.95, 0.99)},
+            "hedged_latency_ms": {f"p{int(q * 100)}": hedged.quantile(q) for q in (0.5, 0.95, 0.99)},
+        }
+
+
+_hedged_call_metrics: Dict[str, HedgedCallMetrics] = {}
+_hedged_call_metrics_lock = threading.Lock()
+
+
+def get_hedged_call_metrics(operation: str) -> HedgedCallMetrics:
+    """Get (or create) the hedging metrics for an operation."""
+    with _hedged_call_metrics_lock:
+        if operation not in _hedged_call_metrics:
+            _hedged_call_metrics[operation] = HedgedCallMetrics(operation)
+        return _hedged_call_metrics[operation]
+
+
+class MetricsAggregator:
+    """
+    Aggregates metrics across multiple requests for analysis.
+    
+    Latencies (whole requests, retrieval, synthesis and each pipeline stage) go
+    into windowed histograms, so percentiles cost fixed memory; the last
+    `window` records of each kind are kept for the non-latency averages.
+    """
+    
+    def __init__(
+        self,
+        window: int = PERF_METRICS_WINDOW,
+        latency_window_s: float = PERF_LATENCY_WINDOW_S,
+        latency_intervals: int = PERF_LATENCY_INTERVALS
+    ):
+        # Bounded: the aggregator lives for the whole process
+        self.retrieval_metrics: deque = deque(maxlen=window)
+        self.synthesis_metrics: deque = deque(maxlen=window)
+        self.pipeline_metrics: deque = deque(maxlen=window)
+        self.latency_window_s = latency_window_s
+        self.latency_intervals = latency_intervals
+        self._latency: Dict[str, WindowedHistogram] = {}
+        self._latency_lock = threading.Lock()
+    
+    def record_latency(self, name: str, duration_ms: Optional[float]):
+        """Record a latency sample under a name (e.g. "pipeline", "stage.rerank")."""
+        if duration_ms is None:
+            return
+        with self._latency_lock:
+            histogram = self._latency.get(name)
+            if histogram is None:
+                histogram = self._latency[name] = WindowedHistogram(self.latency_window_s, self.latency_intervals)
+        histogram.record(duration_ms)
+    
+    def latency_snapshot(self, name: str) -> LatencyHistogram:
+        """Windowed histogram for a name (empty if nothing was recorded)."""
+        with self._latency_lock:
+            histogram = self._latency.get(name)
+        return histogram.snapshot() if histogram else LatencyHistogram()
+    
+    def latency_summary(self) -> Dict[str, Any]:
+        """Windowed count, mean, p50/p95/p99 and max for every recorded latency."""
+        with self._latency_lock:
+            histograms = dict(self._latency)
+        return {
+            "window_s": self.latency_window_s,
+            "latency": {
+                name: {**histogram.snapshot().summary(), "total_count": histogram.total_count}
+                for name, histogram in sorted(histograms.items())
+            }
+        }
     
     def add_retrieval(self, metrics: RetrievalMetrics):
         """Add retrieval metrics."""
         self.retrieval_metrics.append(metrics)
+        self.record_latency("retrieval", metrics.total_duration_ms)
     
     def add_synthesis(self, metrics: SynthesisMetrics):
         """Add synthesis metrics."""
         self.synthesis_metrics.append(metrics)
+        self.record_latency("synthesis", metrics.total_duration_ms)
     
     def add_pipeline(self, metrics: RAGPipelineMetrics):
         """Add complete pipeline metrics."""
         self.pipeline_metrics.append(metrics)
+        self.record_latency("pipeline", metrics.total_duration_ms)
+        for stage, duration_ms in metrics.stage_timings_ms.items():
+            self.record_latency(f"stage.{stage}", duration_ms)
+            observe_stage(stage, duration_ms / 1000, stage in metrics.cached_stages)
     
     def get_summary(self) -> Dict[str, Any]:
         """Get summary statistics across all collected metrics."""
@@ -312,23 +618,34 @@ class MetricsAggregator:
             "total_requests": len(self.pipeline_metrics),
             "retrieval": self._summarize_retrieval(),
             "synthesis": self._summarize_synthesis(),
-            "pipeline": self._summarize_pipeline()
+            "pipeline": self._summarize_pipeline(),
+            "hedged_calls": {name: m.summary() for name, m in list(_hedged_call_metrics.items())},
+            "model_breakers": breaker_states(),
+            "token_budget": get_token_counter().stats(),
+            "answer_cache": get_answer_cache().stats(),
+            "prompt_prefix_cache": get_prompt_prefix_cache().stats()
         }
         return summary
     
+    def _duration_summary(self, name: str) -> Dict[str, Any]:
+        latency = self.latency_snapshot(name)
+        return {
+            "avg_duration_ms": latency.summary()["mean_ms"],
+            "median_duration_ms": latency.quantile(0.5),
+            "p95_duration_ms": latency.quantile(0.95)
+        }
+    
     def _summarize_retrieval(self) -> Dict[str, Any]:
         """Summarize retrieval metrics."""
         if not self.retrieval_metrics:
             return {}
         
-        durations = [m.total_duration_ms for m in self.retrieval_metrics if m.total_duration_ms]
         chunks = [m.chunks_retrieved for m in self.retrieval_metrics]
         summaries = [m.summaries_retrieved for m in self.retrieval_metrics]
         
         return {
             "count": len(self.retrieval_metrics),
-            "avg_duration_ms": statistics.mean(durations) if durations else None,
-            "median_duration_ms": statistics.median(durations) if durations else None,
+            **self._duration_summary("retrieval"),
             "avg_chunks": statistics.mean(chunks) if chunks else None,
             "avg_summaries": statistics.mean(summaries) if summaries else None
         }
@@ -338,14 +655,12 @@ class MetricsAggregator:
         if not self.synthesis_metrics:
             return {}
         
-        durations = [m.total_duration_ms for m in self.synthesis_metrics if m.total_duration_ms]
         tokens = [m.total_tokens for m in self.synthesis_metrics if m.total_tokens]
         citations = [m.citations_count for m in self.synthesis_metrics]
         
         return {
             "count": len(self.synthesis_metrics),
-            "avg_duration_ms": statistics.mean(durations) if durations else None,
-            "median_duration_ms": statistics.median(durations) if durations else None,
+            **self._duration_summary("synthesis"),
             "avg_total_tokens": statistics.mean(tokens) if tokens else None,
             "avg_citations": statistics.mean(citations) if citations else None
         }
@@ -355,13 +670,29 @@ class MetricsAggregator:
         if not self.pipeline_metrics:
             return {}
         
-        durations = [m.total_duration_ms for m in self.pipeline_metrics if m.total_duration_ms]
+        pipeline_metrics = list(self.pipeline_metrics)
+        stage_runs: Dict[str, int] = {}
+        stage_cached: Dict[str, int] = {}
+        for m in pipeline_metrics:
+            for stage in m.stage_timings_ms:
+                stage_runs[stage] = stage_runs.get(stage, 0) + 1
+            for stage in m.cached_stages:
+                stage_cached[stage] = stage_cached.get(stage, 0) + 1
+        
+        stages = {}
+        for stage, runs in stage_runs.items():
+            latency = self.latency_snapshot(f"stage.{stage}")
+            stages[stage] = {
+                "count": latency.count,
+                "avg_ms": latency.summary()["mean_ms"],
+                "p95_ms": latency.quantile(0.95),
+                "cache_hit_rate": round(stage_cached.get(stage, 0) / runs, 3)
+            }
         
         return {
-            "count": len(self.pipeline_metrics),
-            "avg_duration_ms": statistics.mean(durations) if durations else None,
-            "median_duration_ms": statistics.median(durations) if durations else None,
-            "p95_duration_ms": statistics.quantiles(durations, n=20)[18] if len(durations) > 20 else None
+            "count": len(pipeline_metrics),
+            **self._duration_summary("pipeline"),
+            "stages": stages
         }
     
     def reset(self):
@@ -369,6 +700,8 @@ class MetricsAggregator:
         self.retrieval_metrics.clear()
         self.synthesis_metrics.clear()
         self.pipeline_metrics.clear()
+        with self._latency_lock:
+            self._latency.clear()
 
 
 # Global aggregator instance
@@ -378,3 +711,37 @@ _aggregator = MetricsAggregator()
 def get_aggregator() -> MetricsAggregator:
     """Get global metrics aggregator."""
     return _aggregator
+
+
+def _collect_prometheus_metrics() -> List[tuple]:
+    """Cache, circuit breaker and hedging state for /metrics (read at scrape time)."""
+    answer_cache = get_answer_cache().stats()
+    prefix_cache = get_prompt_prefix_cache().stats()
+    breakers = breaker_states()
+    hedged = {name: m.summary() for name, m in list(_hedged_call_metrics.items())}
+    return [
+        ("centef_answer_cache_lookups_total", "counter", "Answer cache lookups by result", [
+            ({"result": "hit"}, answer_cache["hits"]), ({"result": "miss"}, answer_cache["misses"])
+        ]),
+        ("centef_answer_cache_hit_ratio", "gauge", "Answer cache hits / lookups", [({}, answer_cache["hit_rate"])]),
+        ("centef_answer_cache_entries", "gauge", "Answers cached", [({}, answer_cache["entries"])]),
+        ("centef_prompt_prefix_reuse_ratio", "gauge", "Synthesis prompt prefixes reused instead of built", [
+            ({}, prefix_cache["reuse_rate"])
+        ]),
+        ("centef_model_breaker_open", "gauge", "1 if the model's circuit breaker is not closed", [
+            ({"model": model}, float(state["state"] != "closed")) for model, state in breakers.items()
+        ]),
+        ("centef_model_breaker_short_circuited_total", "counter", "Calls skipped by an open breaker", [
+            ({"model": model}, state["short_circuited"]) for model, state in breakers.items()
+        ]),
+        ("centef_hedged_calls_total", "counter", "Hedged remote calls by outcome", [
+            sample for name, summary in hedged.items() for sample in (
+                ({"operation": name, "outcome": "hedged"}, summary["hedges"]),
+                ({"operation": name, "outcome": "hedge_won"}, summary["hedge_wins"]),
+                ({"operation": name, "outcome": "timeout"}, summary["timeouts"]),
+            )
+        ]),
+    ]
+
+
+register_collector(_collect_prometheus_metrics)
@@ -0,0 +1,207 @@
+"""
+Static prompt prefix caching for Gemini synthesis in CENTEF RAG system.
+
+The synthesis prompts start with a long instruction block (role, domain
+abbreviations, output format rules, citation rules) that only depends on the
+output format, yet it was rebuilt and sent in full with every request. Prompts
+are now built as a SplitPrompt: a static prefix per format, built once per
+process, followed by the per-request suffix (history, question, evidence).
+
+Where the installed Vertex AI SDK supports context caching
+(vertexai.preview.caching) and a prefix is at least CONTEXT_CACHE_MIN_TOKENS
+long (Vertex rejects smaller cached contents), the prefix is uploaded once per
+model as CachedContent and requests send only the suffix; Gemini then bills
+the cached tokens at the reduced rate. Otherwise the local stand-in is used:
+the full prompt is sent and the cache only measures how often, and how many
+tokens of, prefix are reused.
+"""
+import datetime
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from apps.agent_api.token_budget import get_token_counter
+
+logger = logging.getLogger(__name__)
+
+# Environment variables
+CONTEXT_CACHE_ENABLED = os.getenv("CONTEXT_CACHE_ENABLED", "true").lower() == "true"
+CONTEXT_CACHE_TTL_S = int(os.getenv("CONTEXT_CACHE_TTL_S", "3600"))
+CONTEXT_CACHE_MIN_TOKENS = int(os.getenv("CONTEXT_CACHE_MIN_TOKENS", "32768"))
+
+
+class SplitPrompt(str):
+    """
+    A prompt made of a static prefix and a per-request suffix.
+    It is the full prompt string, so it can be used anywhere a prompt is expected.
+    """
+
+    def __new__(cls, prefix: str, suffix: str, prefix_key: str, prefix_tokens: int = 0):
+        prompt = super().__new__(cls, prefix + suffix)
+        prompt.prefix = prefix
+        prompt.suffix = suffix
+        prompt.prefix_key = prefix_key
+        prompt.prefix_tokens = prefix_tokens
+        return prompt
+
+
+def _load_caching_module():
+    """vertexai.preview.caching, if this SDK version has it."""
+    try:
+        from vertexai.preview import caching
+    except ImportError:
+        return None
+    return caching
+
+
+class PromptPrefixCache:
+    """Builds each static prefix once and, where supported, keeps it in Vertex context caches."""
+
+    def __init__(
+        self,
+        enabled: bool = CONTEXT_CACHE_ENABLED,
+        min_tokens: int = CONTEXT_CACHE_MIN_TOKENS,
+        ttl_s: int = CONTEXT_CACHE_TTL_S,
+        caching_module: Any = None,
+        clock=time.monotonic
+    ):
+        self.enabled = enabled
+        self.min_tokens = min_tokens
+        self.ttl_s = ttl_s
+        self._caching = caching_module if caching_module is not None else (_load_caching_module() if enabled else None)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._prefixes: Dict[str, Tuple[str, int]] = {}
+        self._remote: Dict[Tuple[str, str], Tuple[Any, float]] = {}  # (model, prefix key) -> (CachedContent or None, expires)
+        self.requests = 0
+        self.builds = 0
+        self.reused_prefix_tokens = 0
+        self.remote_created = 0
+        self.remote_requests = 0
+        self.cached_tokens_billed = 0
+
+    @property
+    def mode(self) -> str:
+        return "vertex" if self.enabled and self._caching is not None else "local"
+
+    def prefix(self, key: str, build: Callable[[], str]) -> Tuple[str, int]:
+        """
+        Get a static prefix, building it on first use.
+
+        Args:
+            key: Prefix identity (e.g. "optimized:table:citations")
+            build: Builds the prefix text
+
+        Returns:
+            Tuple of (prefix text, token count)
+        """
+        with self._lock:
+            self.requests += 1
+            cached = self._prefixes.get(key)
+            if cached is not None:
+                self.reused_prefix_tokens += cached[1]
+                return cached
+        text = build()
+        tokens = get_token_counter().count(text)
+        with self._lock:
+            if key not in self._prefixes:
+                self.builds += 1
+            self._prefixes[key] = (text, tokens)
+        return text, tokens
+
+    def cached_content(self, model_name: str, prompt: SplitPrompt) -> Optional[Any]:
+        """
+        Vertex CachedContent holding the prompt's prefix for a model, created on
+        first use; None when context caching is unavailable or the prefix is too short.
+        """
+        if self.mode != "vertex" or prompt.prefix_tokens < self.min_tokens:
+            return None
+        key = (model_name, prompt.prefix_key)
+        now = self._clock()
+        with self._lock:
+            entry = self._remote.get(key)
+            if entry is not None and entry[1] > now:
+                if entry[0] is not None:
+                    self.remote_requests += 1
+                return entry[0]
+        try:
+            cached = self._caching.CachedContent.create(
+                model_name=model_name,
+                contents=[prompt.prefix],
+                ttl=datetime.timedelta(seconds=self.ttl_s),
+            )
+            logger.info(f"Created context cache for {prompt.prefix_key} on {model_name} ({prompt.prefix_tokens} tokens)")
+        except Exception as e:
+            # Model without caching support, quota, ...: don't retry until the TTL passes
+            logger.warning(f"Context caching unavailable for {model_name}: {e}")
+            cached = None
+        with self._lock:
+            # Refresh a little before Vertex expires it
+            self._remote[key] = (cached, now + self.ttl_s * 0.9)
+            if cached is not None:
+                self.remote_created += 1
+                self.remote_requests += 1
+        return cached
+
+    def record_usage(self, usage_metadata: Optional[Dict[str, int]]) -> None:
+        """Record prompt tokens Gemini served from a context cache."""
+        if usage_metadata and usage_metadata.get("cached_content_token_count"):
+            with self._lock:
+                self.cached_tokens_billed += usage_metadata["cached_content_token_count"]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "prefixes": len(self._prefixes),
+                "requests": self.requests,
+                "builds": self.builds,
+                "reuse_rate": round(1 - self.builds / self.requests, 3) if self.requests else None,
+                "reused_prefix_tokens": self.reused_prefix_tokens,
+                "remote_caches_created": self.remote_created,
+                "remote_cached_requests": self.remote_requests,
+                "cached_tokens_billed": self.cached_tokens_billed,
+            }
+
+
+_prefix_cache: Optional[PromptPrefixCache] = None
+_prefix_cache_lock = threading.Lock()
+
+
+def get_prompt_prefix_cache() -> PromptPrefixCache:
+    """Get the shared prompt prefix cache."""
+    global _prefix_cache
+    with _prefix_cache_lock:
+        if _prefix_cache is None:
+            _prefix_cache = PromptPrefixCache()
+            logger.info(f"Prompt prefix cache mode: {_prefix_cache.mode}")
+        return _prefix_cache
+
+
+def build_split_prompt(prefix_key: str, build_prefix: Callable[[], str], suffix: str) -> SplitPrompt:
+    """Combine a cached static prefix with a request's suffix."""
+    prefix, prefix_tokens = get_prompt_prefix_cache().prefix(prefix_key, build_prefix)
+    return SplitPrompt(prefix, suffix, prefix_key, prefix_tokens)
+
+
+def model_for_prompt(model_cls: Any, model_name: str, prompt: str) -> Tuple[Any, str]:
+    """
+    The model instance and contents to send for a prompt: a model bound to the
+    prefix's context cache plus the suffix when available, else the plain model
+    and the full prompt.
+
+    Args:
+        model_cls: GenerativeModel class
+        model_name: Model name
+        prompt: Prompt (a SplitPrompt to use context caching)
+
+    Returns:
+        Tuple of (model, contents)
+    """
+    if isinstance(prompt, SplitPrompt):
+        cached = get_prompt_prefix_cache().cached_content(model_name, prompt)
+        if cached is not None and hasattr(model_cls, "from_cached_content"):
+            return model_cls.from_cached_content(cached_content=cached), prompt.suffix
+    return model_cls(model_name), prompt
@@ -0,0 +1,222 @@
+"""
+Keyword rules for query analysis and output format detection in CENTEF RAG system.
+All rules are compiled once at import into a single word-boundary regex, so a
+query is scanned in one pass regardless of how many keywords are defined.
+"""
+import re
+from functools import lru_cache
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+# Declarative rules table: group -> [(label, keywords), ...]
+# Labels within a group are listed in priority order; when a query matches
+# several labels of the same group, callers usually take the first one.
+# Keywords match whole words only (optionally pluralised with -s/-es);
+# spaces and hyphens are interchangeable.
+RULES: Dict[str, List[Tuple[str, Tuple[str, ...]]]] = {
+    "query_type": [
+        ("factual", ("what is", "define", "definition", "meaning of")),
+        ("comparative", ("compare", "difference", "versus", "vs", "contrast")),
+        ("procedural", ("how to", "steps", "process", "procedure", "protocol")),
+        ("analytical", ("analyze", "analysis", "evaluate", "assess", "examine")),
+        ("exploratory", ("overview", "about", "tell me about", "explain", "describe")),
+    ],
+    "complexity": [
+        ("complex", ("comprehensive", "detailed", "thorough", "in-depth")),
+    ],
+    "scope": [
+        ("narrow", ("specific", "particular", "exact", "precise")),
+        ("broad", ("all", "every", "comprehensive", "complete", "entire", "global")),
+    ],
+    "organization": [
+        ("FATF", ("fatf", "financial action task force")),
+        ("FIU", ("fiu", "financial intelligence unit")),
+        ("UN", ("un", "united nations")),
+        ("IMF", ("imf", "international monetary fund")),
+        ("World Bank", ("world bank",)),
+        ("Egmont Group", ("egmont", "egmont group")),
+        ("Wolfsberg Group", ("wolfsberg", "wolfsberg group")),
+        ("Basel Committee", ("basel", "basel committee")),
+        ("OECD", ("oecd",)),
+    ],
+    # Topic tags match the tags generated by summarize_chunks.py
+    "topic": [
+        ("virtual_assets", ("crypto", "virtual asset", "vasp", "cryptocurrency", "bitcoin", "digital currency")),
+        ("sanctions", ("sanction", "sanctions", "sanctioned", "embargo")),
+        ("beneficial_ownership", ("beneficial ownership", "beneficial owner", "bo", "ubo", "ultimate beneficial")),
+        ("customer_due_diligence", ("cdd", "customer due diligence", "kyc", "know your customer")),
+        ("enhanced_due_diligence", ("edd", "enhanced due diligence")),
+        ("peps", ("pep", "peps", "politically exposed", "politically exposed person")),
+        ("risk_assessment", ("risk assessment", "risk based approach", "rba", "risk management")),
+        ("transaction_monitoring", ("transaction monitoring", "suspicious transaction", "unusual transaction")),
+        ("suspicious_activity_reporting", ("sar", "str", "suspicious activity report", "suspicious transaction report")),
+        ("wire_transfers", ("wire transfer", "funds transfer", "remittance")),
+        ("trade_based_money_laundering", ("tbml", "trade based", "trade finance")),
+        ("correspondent_banking", ("correspondent bank", "correspondent banking", "nostro", "vostro")),
+        ("dnfbps", ("dnfbp", "designated non-financial", "casino", "real estate", "lawyer", "accountant")),
+        ("non_profit_organizations", ("npo", "non-profit", "nonprofit", "charity", "charitable")),
+        ("terrorism_financing", ("terrorism financing", "terrorist financing", "ctf", "cft", "counter terrorism")),
+        ("money_laundering", ("money laundering", "aml", "anti money laundering", "laundering")),
+        ("proliferation_financing", ("proliferation financing", "wmd", "weapons of mass destruction")),
+    ],
+    "output_format": [
+        ("brief_summary", (
+            "brief", "summary", "summarize", "briefly", "quick overview",
+            "tldr", "tl;dr", "in short", "key points", "bullet points",
+            "main points", "highlights",
+        )),
+        ("social_media", (
+            "tweet", "twitter post", "social media post", "linkedin post",
+            "facebook post", "instagram caption", "280 characters",
+        )),
+        ("blog_post", (
+            "blog post", "article", "write an article", "blog about",
+            "essay", "write about", "detailed article", "medium post",
+        )),
+        ("newsletter", (
+            "newsletter", "email newsletter", "weekly update", "monthly update",
+            "news brief", "digest",
+        )),
+        ("outline", (
+            "outline", "presentation outline", "talk outline", "speaking points",
+            "presentation", "prepare a presentation", "slide outline",
+            "interview prep", "talking points", "key topics",
+        )),
+        ("protocol", (
+            "protocol", "procedure", "guidelines", "step-by-step", "how to",
+            "instructions", "best practices", "framework", "methodology",
+            "process", "workflow",
+        )),
+        ("comprehensive_analysis", (
+            "comprehensive", "in-depth", "detailed", "thorough", "complete analysis",
+            "full report", "extensive", "deep dive", "exhaustive",
+        )),
+        ("report", (
+            "report", "write a report", "formal report", "research report",
+            "findings", "assessment report",
+        )),
+        ("factual_answer", ("what is", "when did", "who is", "where is", "define", "definition")),
+    ],
+}
+
+_WORD_SEPARATOR = re.compile(r"[\s\-]+")
+
+
+def _keyword_words(keyword: str) -> Tuple[str, ...]:
+    """Split a keyword into words (spaces and hyphens both separate words)."""
+    return tuple(w for w in _WORD_SEPARATOR.split(keyword.lower()) if w)
+
+
+def _build_matcher():
+    """
+    Compile the rules table into one regex plus lookup tables.
+
+    The regex is a zero-width lookahead tried at every word start, so keywords
+    overlapping at different positions are all found. Keywords that are a
+    word-prefix of a longer keyword starting at the same position (e.g.
+    "suspicious transaction" inside "suspicious transaction report") are
+    resolved through a precomputed prefix table instead of a second scan.
+    """
+    labels_by_words: Dict[Tuple[str, ...], List[Tuple[str, str]]] = {}
+    for group, entries in RULES.items():
+        for label, keywords in entries:
+            for keyword in keywords:
+                labels_by_words.setdefault(_keyword_words(keyword), []).append((group, label))
+
+    # Keyed by the canonical keyword text (words joined by single spaces)
+    hits_by_text: Dict[str, FrozenSet[Tuple[str, str]]] = {}
+    for words in labels_by_words:
+        hits = set()
+        for n in range(1, len(words) + 1):
+            hits.update(labels_by_words.get(words[:n], ()))
+        hits_by_text[" ".join(words)] = frozenset(hits)
+
+    pattern = re.compile(r"(?<!\w)(?=(" + _trie_regex(labels_by_words) + r")(?:e?s)?(?!\w))")
+    return pattern, hits_by_text
+
+
+def _trie_regex(keywords) -> str:
+    """
+    Build a regex matching any of the keywords (word tuples), factored as a prefix
+    trie so the regex engine never tries alternatives one by one. Optional suffixes
+    are greedy, so the longest keyword ending at a word boundary wins.
+    """
+    separator = "\0"
+    trie: Dict[str, dict] = {}
+    for words in keywords:
+        node = trie
+        for ch in separator.join(words):
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def emit(node: Dict[str, dict]) -> str:
+        terminal = "" in node
+        alternatives = [
+            (r"[\s\-]+" if ch == separator else re.escape(ch)) + emit(child)
+            for ch, child in sorted(node.items()) if ch
+        ]
+        if not alternatives:
+            return ""
+        body = alternatives[0] if len(alternatives) == 1 else "(?:" + "|".join(alternatives) + ")"
+        if terminal:
+            return "(?:" + body + ")?"
+        return body
+
+    return emit(trie)
+
+
+_PATTERN, _HITS_BY_TEXT = _build_matcher()
+
+_PRIORITY: Dict[str, Dict[str, int]] = {
+    group: {label: i for i, (label, _) in enumerate(entries)}
+    for group, entries in RULES.items()
+}
+
+
+class QueryMatch:
+    """All rule hits for one query, grouped by rule group."""
+
+    __slots__ = ("hits",)
+
+    def __init__(self, hits: Dict[str, FrozenSet[str]]):
+        self.hits = hits
+
+    def has(self, group: str, label: Optional[str] = None) -> bool:
+        """Whether the query matched a group (or a specific label in it)."""
+        labels = self.hits.get(group, frozenset())
+        return bool(labels) if label is None else label in labels
+
+    def first(self, group: str) -> Optional[str]:
+        """Highest-priority matched label of a group, per the RULES order."""
+        labels = self.hits.get(group)
+        if not labels:
+            return None
+        return min(labels, key=_PRIORITY[group].__getitem__)
+
+    def labels(self, group: str) -> List[str]:
+        """All matched labels of a group, in priority order."""
+        return sorted(self.hits.get(group, ()), key=_PRIORITY[group].__getitem__)
+
+
+@lru_cache(maxsize=1024)
+def match_query(query: str) -> QueryMatch:
+    """
+    Match a query against all rules in a single pass.
+
+    Args:
+        query: User query
+
+    Returns:
+        QueryMatch with every matched label per group
+    """
+    pairs = set()
+    for text in _PATTERN.findall(query.lower()):
+        found = _HITS_BY_TEXT.get(text)
+        if found is None:
+            # Matched with extra whitespace or hyphens between words
+            found = _HITS_BY_TEXT[" ".join(_keyword_words(text))]
+        pairs |= found
+
+    hits: Dict[str, set] = {}
+    for group, label in pairs:
+        hits.setdefault(group, set()).add(label)
+    return QueryMatch({group: frozenset(labels) for group, labels in hits.items()})
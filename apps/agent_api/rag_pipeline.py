@@ -0,0 +1,722 @@
+"""
+Staged RAG pipeline for CENTEF RAG system.
+
+/chat used to hand-wire two parallel paths (search_two_tier + synthesize_answer,
+and search_two_tier_optimized + synthesize_answer_optimized), with no common
+place to time, cache or parallelize the steps. A chat turn is now a
+RAGPipeline of named stages:
+
+    analyze      query characteristics, search strategy and result limits
+    expand       query variations (LLM)
+    retrieve     chunk and summary searches for every variation, concurrently
+    dedup        near-duplicate removal
+    rerank       reranking, or truncation to the result limits
+    history      conversation history (independent of retrieval, runs alongside it)
+    budget       output format, token-budgeted context and the prompt
+    generate     answer cache lookup, then Gemini with fallback models
+    postprocess  citations, follow-up questions, answer cache store
+    persist      save the assistant message
+
+Each stage names the stages it runs after; the pipeline starts every stage
+whose dependencies are done, so independent stages overlap. Blocking stages
+run on the shared/executors.py pool they name. Every stage is timed, can be
+swapped (RAGPipeline.replace), and can cache its output under a key derived
+from the request for RAG_STAGE_CACHE_TTL_S. Caching is enabled per stage with
+RAG_STAGE_CACHE (by default the LLM-backed expand and rerank stages; retrieve
+can be added where a few minutes of index staleness are acceptable).
+
+Each completed run adds a RAGPipelineMetrics record, with the stage timings,
+to the performance_metrics aggregator.
+"""
+import asyncio
+import copy
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional
+
+from apps.agent_api.optimization_config import get_config
+from apps.agent_api.performance_metrics import (
+    RAGPipelineMetrics,
+    RetrievalMetrics,
+    SynthesisMetrics,
+    calculate_citation_quality_score,
+    get_aggregator,
+)
+from apps.agent_api.retriever_optimized import (
+    RERANK_MODES,
+    HybridSearcher,
+    adaptive_result_limits,
+    analyze_query_characteristics,
+    deduplicate_results,
+    expand_query_with_llm,
+    get_search_functions,
+    merge_multi_query_results,
+    rerank_two_tier,
+    select_search_strategy,
+)
+from apps.agent_api.synthesizer import synthesize_answer
+from apps.agent_api.synthesizer_optimized import (
+    complete_optimized_answer,
+    generate_optimized_answer,
+    prepare_optimized_synthesis,
+)
+from shared.executors import run_blocking
+from shared.profiling import annotate_profile
+from shared.telemetry import register_collector
+
+logger = logging.getLogger(__name__)
+
+# Environment variables
+RAG_STAGE_CACHE = {name.strip() for name in os.getenv("RAG_STAGE_CACHE", "expand,rerank").split(",") if name.strip()}
+RAG_STAGE_CACHE_TTL_S = float(os.getenv("RAG_STAGE_CACHE_TTL_S", "300"))
+RAG_STAGE_CACHE_MAX_ENTRIES = int(os.getenv("RAG_STAGE_CACHE_MAX_ENTRIES", "256"))
+
+# Stages that produce the evidence (what /chat/stream runs before streaming the answer)
+RETRIEVAL_STAGES = ("analyze", "expand", "retrieve", "dedup", "rerank", "history")
+
+
+class StageCache:
+    """In-process TTL/LRU cache of one stage's outputs."""
+
+    def __init__(
+        self,
+        ttl_s: float = RAG_STAGE_CACHE_TTL_S,
+        max_entries: int = RAG_STAGE_CACHE_MAX_ENTRIES,
+        clock=time.monotonic
+    ):
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self._clock = clock
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Dict[str, Any]]:
+        """A copy of the cached outputs, or None on a miss or if they expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._clock() - entry[1] > self.ttl_s:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(entry[0])
+
+    def put(self, key: Hashable, outputs: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries[key] = (copy.deepcopy(outputs), self._clock())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class PipelineContext:
+    """The inputs of one pipeline run and the state its stages build up."""
+
+    def __init__(
+        self,
+        query: str,
+        options: Optional[Dict[str, Any]] = None,
+        user_id: Optional[str] = None,
+        session_id: Optional[str] = None,
+        history_loader: Optional[Callable[[], List[Any]]] = None,
+        persist: Optional[Callable[[Dict[str, Any]], Any]] = None
+    ):
+        """
+        Args:
+            query: User's question
+            options: Request options (ChatRequest fields: max_chunks, temperature,
+                enable_reranking, rerank_mode, ... and include_follow_ups)
+            user_id: User ID for tracking
+            session_id: Session ID for tracking
+            history_loader: Loads the conversation history for the history stage
+            persist: Saves the final result for the persist stage; returns the message ID
+        """
+        self.query = query
+        self.options = dict(options or {})
+        self.user_id = user_id
+        self.session_id = session_id
+        self.history_loader = history_loader
+        self.persist = persist
+        self.state: Dict[str, Any] = {}
+        self.timings_ms: Dict[str, float] = {}
+        self.cached_stages: List[str] = []
+        self.timestamp = datetime.utcnow().isoformat()
+        self.started = time.perf_counter()
+
+    def option(self, name: str, default: Any = None) -> Any:
+        """A request option, or default if it is unset (None)."""
+        value = self.options.get(name)
+        return default if value is None else value
+
+
+class Stage:
+    """One named step of a RAGPipeline."""
+
+    def __init__(
+        self,
+        name: str,
+        run: Callable[[PipelineContext], Any],
+        after: Iterable[str] = (),
+        executor: Optional[str] = None,
+        cache_key: Optional[Callable[[PipelineContext], Optional[Hashable]]] = None,
+        cache_enabled: Optional[bool] = None
+    ):
+        """
+        Args:
+            name: Stage name (unique within a pipeline)
+            run: Takes the context and returns a dict of outputs merged into
+                context.state; may be a coroutine function
+            after: Stages that must finish first
+            executor: shared/executors.py stage to run a blocking run function on
+                (None runs it inline; coroutine functions are always awaited directly)
+            cache_key: Builds the cache key from the context (None result = don't cache)
+            cache_enabled: Whether to cache (None = name is listed in RAG_STAGE_CACHE)
+        """
+        self.name = name
+        self.run = run
+        self.after = tuple(after)
+        self.executor = executor
+        self.cache_key = cache_key
+        if cache_enabled is None:
+            cache_enabled = name in RAG_STAGE_CACHE
+        self.cache = StageCache() if cache_key is not None and cache_enabled else None
+
+    async def execute(self, context: PipelineContext) -> Dict[str, Any]:
+        """Run the stage (or serve it from its cache) and return its outputs."""
+        key = self.cache_key(context) if self.cache is not None else None
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                context.cached_stages.append(self.name)
+                return cached
+
+        if asyncio.iscoroutinefunction(self.run):
+            outputs = await self.run(context)
+        elif self.executor is not None:
+            outputs = await run_blocking(self.executor, self.run, context)
+        else:
+            outputs = self.run(context)
+        outputs = outputs or {}
+
+        if key is not None:
+            self.cache.put(key, outputs)
+        return outputs
+
+
+class RAGPipeline:
+    """A set of stages run in dependency order, independent stages concurrently."""
+
+    def __init__(self, stages: Iterable[Stage]):
+        self.stages: "OrderedDict[str, Stage]" = OrderedDict()
+        for stage in stages:
+            if stage.name in self.stages:
+                raise ValueError(f"Duplicate pipeline stage: {stage.name}")
+            self.stages[stage.name] = stage
+        for stage in self.stages.values():
+            missing = [name for name in stage.after if name not in self.stages]
+            if missing:
+                raise ValueError(f"Stage {stage.name} runs after unknown stages: {missing}")
+        self._check_acyclic()
+
+    def _check_acyclic(self) -> None:
+        done: set = set()
+        remaining = dict(self.stages)
+        while remaining:
+            ready = [name for name, stage in remaining.items() if all(d in done for d in stage.after)]
+            if not ready:
+                raise ValueError(f"Pipeline stages have a dependency cycle: {sorted(remaining)}")
+            for name in ready:
+                done.add(name)
+                del remaining[name]
+
+    @property
+    def names(self) -> List[str]:
+        return list(self.stages)
+
+    def replace(self, name: str, stage: Stage) -> "RAGPipeline":
+        """A copy of the pipeline with one stage swapped for another."""
+        if name not in self.stages:
+            raise ValueError(f"Unknown pipeline stage: {name}")
+        return RAGPipeline(stage if existing.name == name else existing for existing in self.stages.values())
+
+    def subset(self, names: Iterable[str]) -> "RAGPipeline":
+        """
+        A pipeline of just the named stages (sharing their caches), with
+        dependencies on left-out stages dropped.
+        """
+        names = set(names)
+        stages = []
+        for stage in self.stages.values():
+            if stage.name in names:
+                part = copy.copy(stage)
+                part.after = tuple(d for d in stage.after if d in names)
+                stages.append(part)
+        return RAGPipeline(stages)
+
+    async def _timed(self, stage: Stage, context: PipelineContext) -> Dict[str, Any]:
+        start = time.perf_counter()
+        try:
+            return await stage.execute(context)
+        finally:
+            context.timings_ms[stage.name] = round((time.perf_counter() - start) * 1000, 1)
+
+    async def run(self, context: PipelineContext, record_metrics: bool = True) -> PipelineContext:
+        """
+        Run every stage. A failing stage cancels the ones still running and its
+        exception propagates.
+
+        Args:
+            context: Pipeline context (its state is updated in place)
+            record_metrics: Whether to add a RAGPipelineMetrics record to the aggregator
+
+        Returns:
+            The context
+        """
+        done: set = set()
+        running: Dict["asyncio.Future", str] = {}
+        while len(done) < len(self.stages):
+            for name, stage in self.stages.items():
+                if name not in done and name not in running.values() and all(d in done for d in stage.after):
+                    running[asyncio.ensure_future(self._timed(stage, context))] = name
+            finished, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in finished:
+                name = running.pop(task)
+                try:
+                    outputs = task.result()
+                except BaseException:
+                    for other in running:
+                        other.cancel()
+                    logger.error(f"Pipeline stage {name} failed after {context.timings_ms.get(name)}ms")
+                    if record_metrics:
+                        get_aggregator().record_latency(
+                            "pipeline.failed", (time.perf_counter() - context.started) * 1000
+                        )
+                    raise
+                # Merged on the event loop, so concurrent stages never see a half-written state
+                context.state.update(outputs)
+                done.add(name)
+
+        logger.info(
+            "Pipeline stages (ms): " + ", ".join(f"{name}={context.timings_ms[name]}" for name in self.stages)
+            + (f"; cached: {', '.join(context.cached_stages)}" if context.cached_stages else "")
+        )
+        if record_metrics:
+            record_pipeline_metrics(context)
+        return context
+
+
+# --- Optimized stages ---
+
+def analyze_query(context: PipelineContext) -> Dict[str, Any]:
+    """Query characteristics, search strategy and result limits."""
+    query = context.query
+    rerank_mode = context.option("rerank_mode") or get_config().retriever.rerank_mode
+    if rerank_mode not in RERANK_MODES:
+        raise ValueError(f"Invalid rerank_mode '{rerank_mode}'. Must be one of {RERANK_MODES}")
+
+    expansion = context.options.get("enable_query_expansion")
+    reranking = context.options.get("enable_reranking")
+    dedup = context.options.get("enable_deduplication")
+    characteristics = None
+    search_chunks = search_summaries = True
+
+    if context.option("enable_adaptive_limits", True):
+        characteristics = analyze_query_characteristics(query)
+        strategy = select_search_strategy(query, characteristics)
+        expansion = strategy['enable_query_expansion'] if expansion is None else expansion
+        reranking = strategy['enable_reranking'] if reranking is None else reranking
+        dedup = strategy['enable_deduplication'] if dedup is None else dedup
+        search_chunks, search_summaries = strategy['search_chunks'], strategy['search_summaries']
+        max_chunks, max_summaries = adaptive_result_limits(query, characteristics)
+    else:
+        expansion = True if expansion is None else expansion
+        reranking = True if reranking is None else reranking
+        dedup = True if dedup is None else dedup
+        max_chunks, max_summaries = context.option("max_chunks", 8), context.option("max_summaries", 3)
+
+    return {"analysis": {
+        "query_characteristics": characteristics,
+        "adaptive_strategy": characteristics is not None,
+        "enable_query_expansion": expansion,
+        "enable_reranking": reranking,
+        "enable_deduplication": dedup,
+        "rerank_mode": rerank_mode,
+        "search_chunks": search_chunks,
+        "search_summaries": search_summaries,
+        "max_chunks": max_chunks,
+        "max_summaries": max_summaries,
+        "search_backend": get_config().retriever.backend,
+        # Automatic metadata filters stay disabled (see search_two_tier_optimized)
+        "filter_expression": None,
+        "filter_logic": context.option("filter_logic", "OR"),
+    }}
+
+
+def expand_query(context: PipelineContext) -> Dict[str, Any]:
+    if not context.state["analysis"]["enable_query_expansion"]:
+        return {"queries": [context.query]}
+    return {"queries": expand_query_with_llm(context.query)}
+
+
+def _expand_cache_key(context: PipelineContext) -> Optional[Hashable]:
+    return context.query if context.state["analysis"]["enable_query_expansion"] else None
+
+
+async def retrieve(context: PipelineContext) -> Dict[str, Any]:
+    """Search both tiers for every query variation concurrently; fuse variations with RRF."""
+    analysis = context.state["analysis"]
+    queries = context.state["queries"]
+    backend = analysis["search_backend"]
+    hybrid_searcher = HybridSearcher() if backend == "hybrid" else None
+    if hybrid_searcher is not None:
+        chunk_search, summary_search = hybrid_searcher.search_chunks, hybrid_searcher.search_summaries
+    else:
+        chunk_search, summary_search = get_search_functions(backend)
+
+    searches = []
+    for tier, enabled, search, limit in (
+        ("chunks", analysis["search_chunks"], chunk_search, analysis["max_chunks"]),
+        ("summaries", analysis["search_summaries"], summary_search, analysis["max_summaries"]),
+    ):
+        if enabled:
+            for query in queries:
+                searches.append((tier, run_blocking(
+                    "retrieval", search, query, max_results=limit, filter_expression=analysis["filter_expression"]
+                )))
+    results = await asyncio.gather(*(search for _, search in searches))
+
+    per_tier: Dict[str, List[List[Dict[str, Any]]]] = {"chunks": [], "summaries": []}
+    for (tier, _), tier_results in zip(searches, results):
+        per_tier[tier].append(tier_results)
+    fused = {}
+    for tier, lists in per_tier.items():
+        if not lists:
+            fused[tier] = []
+        elif len(lists) == 1:
+            fused[tier] = lists[0]
+        else:
+            fused[tier] = merge_multi_query_results(queries, lists)
+
+    return {
+        "chunks": fused["chunks"],
+        "summaries": fused["summaries"],
+        "num_retrieved": (len(fused["chunks"]), len(fused["summaries"])),
+        "hybrid_searcher": hybrid_searcher,
+    }
+
+
+def _retrieve_cache_key(context: PipelineContext) -> Optional[Hashable]:
+    analysis = context.state["analysis"]
+    if analysis["search_backend"] == "hybrid":
+        return None  # The per-source report needs the live searcher
+    return (
+        analysis["search_backend"], tuple(context.state["queries"]),
+        analysis["search_chunks"] and analysis["max_chunks"], analysis["search_summaries"] and analysis["max_summaries"],
+        analysis["filter_expression"],
+    )
+
+
+def deduplicate(context: PipelineContext) -> Dict[str, Any]:
+    chunks, summaries = context.state["chunks"], context.state["summaries"]
+    if context.state["analysis"]["enable_deduplication"]:
+        threshold = get_config().retriever.deduplication_threshold
+        chunks = deduplicate_results(chunks, threshold=threshold) if chunks else chunks
+        summaries = deduplicate_results(summaries, threshold=threshold) if summaries else summaries
+    return {"chunks": chunks, "summaries": summaries, "num_after_dedup": (len(chunks), len(summaries))}
+
+
+def rerank(context: PipelineContext) -> Dict[str, Any]:
+    analysis = context.state["analysis"]
+    chunks, summaries = context.state["chunks"], context.state["summaries"]
+    if analysis["enable_reranking"]:
+        chunks, summaries = rerank_two_tier(
+            context.query,
+            chunks,
+            summaries,
+            chunk_top_k=analysis["max_chunks"],
+            summary_top_k=analysis["max_summaries"],
+            mode=analysis["rerank_mode"]
+        )
+    else:
+        chunks, summaries = chunks[:analysis["max_chunks"]], summaries[:analysis["max_summaries"]]
+    logger.info(f"Final results: {len(summaries)} summaries, {len(chunks)} chunks")
+    return {"chunks": chunks, "summaries": summaries, "num_after_rerank": (len(chunks), len(summaries))}
+
+
+def _rerank_cache_key(context: PipelineContext) -> Optional[Hashable]:
+    analysis = context.state["analysis"]
+    if not analysis["enable_reranking"]:
+        return None
+    return (
+        context.query, analysis["rerank_mode"], analysis["max_chunks"], analysis["max_summaries"],
+        tuple(r.get("id") for r in context.state["chunks"]),
+        tuple(r.get("id") or r.get("source_id") for r in context.state["summaries"]),
+    )
+
+
+def load_history(context: PipelineContext) -> Dict[str, Any]:
+    return {"conversation_history": context.history_loader() if context.history_loader else []}
+
+
+def budget_context(context: PipelineContext) -> Dict[str, Any]:
+    return {"prepared": prepare_optimized_synthesis(
+        context.query,
+        context.state["summaries"],
+        context.state["chunks"],
+        temperature=context.option("temperature"),
+        conversation_history=context.state.get("conversation_history")
+    )}
+
+
+def generate(context: PipelineContext) -> Dict[str, Any]:
+    return {"generated": generate_optimized_answer(
+        context.query,
+        context.state["prepared"],
+        user_id=context.user_id,
+        session_id=context.session_id,
+        conversation_history=context.state.get("conversation_history")
+    )}
+
+
+def postprocess(context: PipelineContext) -> Dict[str, Any]:
+    return {"result": complete_optimized_answer(
+        context.query,
+        context.state["prepared"],
+        context.state["generated"],
+        include_follow_ups=context.option("include_follow_ups", True)
+    )}
+
+
+def persist(context: PipelineContext) -> Dict[str, Any]:
+    if context.persist is None:
+        return {}
+    return {"assistant_message_id": context.persist(context.state["result"])}
+
+
+# --- Standard stages (use_optimizations=False) ---
+
+def analyze_standard(context: PipelineContext) -> Dict[str, Any]:
+    """Fixed limits, Vertex AI Search only, no expansion, deduplication or reranking."""
+    return {"analysis": {
+        "query_characteristics": None,
+        "adaptive_strategy": False,
+        "enable_query_expansion": False,
+        "enable_reranking": False,
+        "enable_deduplication": False,
+        "rerank_mode": None,
+        "search_chunks": True,
+        "search_summaries": True,
+        "max_chunks": context.option("max_chunks", 8),
+        "max_summaries": context.option("max_summaries", 3),
+        "search_backend": "vertex",
+        "filter_expression": None,
+        "filter_logic": None,
+    }}
+
+
+def generate_standard(context: PipelineContext) -> Dict[str, Any]:
+    """synthesize_answer does its own context handling and citation processing."""
+    return {"result": synthesize_answer(
+        query=context.query,
+        summary_results=context.state["summaries"],
+        chunk_results=context.state["chunks"],
+        temperature=context.option("temperature", 0.2),
+        user_id=context.user_id,
+        session_id=context.session_id,
+        conversation_history=context.state.get("conversation_history"),
+        include_follow_ups=context.option("include_follow_ups", True)
+    )}
+
+
+def _no_op(context: PipelineContext) -> Dict[str, Any]:
+    return {}
+
+
+def build_chat_pipeline() -> RAGPipeline:
+    """The optimized chat pipeline."""
+    return RAGPipeline([
+        Stage("analyze", analyze_query),
+        Stage("expand", expand_query, after=("analyze",), executor="generation", cache_key=_expand_cache_key),
+        Stage("retrieve", retrieve, after=("expand",), cache_key=_retrieve_cache_key),
+        Stage("dedup", deduplicate, after=("retrieve",), executor="retrieval"),
+        Stage("rerank", rerank, after=("dedup",), executor="generation", cache_key=_rerank_cache_key),
+        Stage("history", load_history, executor="storage"),
+        Stage("budget", budget_context, after=("rerank", "history"), executor="generation"),
+        Stage("generate", generate, after=("budget",), executor="generation"),
+        Stage("postprocess", postprocess, after=("generate",), executor="generation"),
+        Stage("persist", persist, after=("postprocess",), executor="storage"),
+    ])
+
+
+def build_standard_pipeline() -> RAGPipeline:
+    """The standard (unoptimized) chat pipeline: the optimized one with stages swapped."""
+    return (
+        build_chat_pipeline()
+        .replace("analyze", Stage("analyze", analyze_standard))
+        .replace("budget", Stage("budget", _no_op, after=("rerank", "history")))
+        .replace("generate", Stage("generate", generate_standard, after=("budget",), executor="generation"))
+        .replace("postprocess", Stage("postprocess", _no_op, after=("generate",)))
+    )
+
+
+_pipelines: Dict[bool, RAGPipeline] = {}
+_pipelines_lock = threading.Lock()
+
+
+def get_chat_pipeline(use_optimizations: bool = True) -> RAGPipeline:
+    """Get the shared chat pipeline (optimized or standard)."""
+    with _pipelines_lock:
+        if use_optimizations not in _pipelines:
+            _pipelines[use_optimizations] = build_chat_pipeline() if use_optimizations else build_standard_pipeline()
+        return _pipelines[use_optimizations]
+
+
+def _collect_stage_cache_metrics() -> List[tuple]:
+    """Stage cache hit ratios for /metrics."""
+    with _pipelines_lock:
+        pipelines = list(_pipelines.values())
+    lookups: Dict[str, List[int]] = {}  # stage -> [hits, misses], summed over pipelines
+    for pipeline in pipelines:
+        for stage in pipeline.stages.values():
+            if stage.cache is not None:
+                stats = stage.cache.stats()
+                totals = lookups.setdefault(stage.name, [0, 0])
+                totals[0] += stats["hits"]
+                totals[1] += stats["misses"]
+    return [(
+        "centef_rag_stage_cache_hit_ratio", "gauge", "Stage cache hits / lookups", [
+            ({"stage": name}, round(hits / (hits + misses), 3))
+            for name, (hits, misses) in lookups.items() if hits + misses
+        ]
+    )]
+
+
+register_collector(_collect_stage_cache_metrics)
+
+
+def pipeline_metadata(context: PipelineContext) -> Dict[str, Any]:
+    """The optimization_metadata /chat returns, built from a run's state."""
+    analysis = context.state.get("analysis", {})
+    metadata: Dict[str, Any] = {
+        "pipeline": {"stages_ms": dict(context.timings_ms), "cached_stages": list(context.cached_stages)}
+    }
+    if analysis.get("query_characteristics"):
+        metadata["query_analysis"] = analysis["query_characteristics"]
+    if analysis:
+        metadata["search_optimizations"] = {
+            "query_expansion": analysis["enable_query_expansion"],
+            "reranking": analysis["enable_reranking"],
+            "rerank_mode": analysis["rerank_mode"] if analysis["enable_reranking"] else None,
+            "deduplication": analysis["enable_deduplication"],
+            "adaptive_strategy": analysis["adaptive_strategy"],
+            "search_backend": analysis["search_backend"],
+            "metadata_filter": analysis["filter_expression"] is not None,
+            "filter_logic": analysis["filter_logic"] if analysis["filter_expression"] else None,
+            "filter_expression": analysis["filter_expression"],
+        }
+    if context.state.get("hybrid_searcher") is not None:
+        metadata["hybrid_retrieval"] = context.state["hybrid_searcher"].report(
+            context.state.get("chunks", []), context.state.get("summaries", [])
+        )
+    result = context.state.get("result") or {}
+    if "format_info" in result:
+        metadata["format_detection"] = result["format_info"]
+    if "optimizations_applied" in result:
+        metadata["synthesis_optimizations"] = result["optimizations_applied"]
+    return metadata
+
+
+def _stage_sum(context: PipelineContext, names: Iterable[str]) -> Optional[float]:
+    timings = [context.timings_ms[name] for name in names if name in context.timings_ms]
+    return round(sum(timings), 1) if timings else None
+
+
+def record_pipeline_metrics(context: PipelineContext) -> RAGPipelineMetrics:
+    """
+    Build a RAGPipelineMetrics record for a run, add it to the aggregator and
+    attach the stage timings to the request's profile (if it is being profiled).
+    """
+    state = context.state
+    analysis = state.get("analysis")
+    retrieval = None
+    if analysis and "num_retrieved" in state:
+        retrieval = RetrievalMetrics(
+            query=context.query,
+            timestamp=context.timestamp,
+            max_chunks_requested=analysis["max_chunks"],
+            max_summaries_requested=analysis["max_summaries"],
+            chunks_retrieved=state["num_retrieved"][0],
+            summaries_retrieved=state["num_retrieved"][1],
+            chunks_after_dedup=state.get("num_after_dedup", (None,))[0],
+            chunks_after_rerank=state.get("num_after_rerank", (None,))[0],
+            expanded_queries=state.get("queries"),
+            total_duration_ms=_stage_sum(context, ("analyze", "expand", "retrieve", "dedup", "rerank")),
+            search_duration_ms=context.timings_ms.get("retrieve"),
+            rerank_duration_ms=context.timings_ms.get("rerank"),
+            optimizations={
+                "query_expansion": analysis["enable_query_expansion"],
+                "deduplication": analysis["enable_deduplication"],
+                "reranking": analysis["enable_reranking"],
+            }
+        )
+
+    synthesis = None
+    result = state.get("result")
+    if result:
+        citations = result.get("explicit_citations", [])
+        synthesis = SynthesisMetrics(
+            query=context.query,
+            timestamp=context.timestamp,
+            summaries_provided=len(state.get("summaries", [])),
+            chunks_provided=len(state.get("chunks", [])),
+            summaries_used=result.get("num_summaries_used", 0),
+            chunks_used=result.get("num_chunks_used", 0),
+            answer_length=len(result.get("answer", "")),
+            citations_count=len(citations),
+            input_tokens=result.get("input_tokens"),
+            output_tokens=result.get("output_tokens"),
+            total_tokens=result.get("total_tokens"),
+            estimated_prompt_tokens=result.get("optimizations_applied", {}).get("estimated_prompt_tokens"),
+            model_used=result.get("model_used", "unknown"),
+            temperature=result.get("temperature") or 0.2,
+            total_duration_ms=_stage_sum(context, ("budget", "generate", "postprocess")),
+            optimizations=result.get("optimizations_applied", {}),
+            citation_quality_score=calculate_citation_quality_score(citations)
+        )
+
+    metrics = RAGPipelineMetrics(
+        query=context.query,
+        timestamp=context.timestamp,
+        session_id=context.session_id,
+        user_id=context.user_id,
+        retrieval=retrieval,
+        synthesis=synthesis,
+        total_duration_ms=round((time.perf_counter() - context.started) * 1000, 1),
+        stage_timings_ms=dict(context.timings_ms),
+        cached_stages=list(context.cached_stages)
+    )
+    aggregator = get_aggregator()
+    if retrieval:
+        aggregator.add_retrieval(retrieval)
+    if synthesis:
+        aggregator.add_synthesis(synthesis)
+    aggregator.add_pipeline(metrics)
+    annotate_profile(stages_ms=metrics.stage_timings_ms, cached_stages=metrics.cached_stages)
+    return metrics
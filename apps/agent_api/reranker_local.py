@@ -0,0 +1,326 @@
+"""
+Local lexical reranker for CENTEF RAG system.
+Scores candidate results with BM25 plus a term-proximity bonus, without any LLM call.
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import re
+import sys
+from collections import Counter
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Iterable
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Environment variables
+LOCAL_RERANK_IDF_PATH = os.getenv("LOCAL_RERANK_IDF_PATH")
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Weight of the proximity bonus relative to the normalized BM25 score
+PROXIMITY_WEIGHT = 0.3
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+STOPWORDS = frozenset([
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for",
+    "from", "has", "have", "how", "i", "in", "is", "it", "its", "me", "of", "on",
+    "or", "our", "that", "the", "their", "this", "to", "was", "we", "what", "when",
+    "where", "which", "who", "why", "will", "with", "you", "your", "about", "tell",
+])
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """
+    Split text into lowercase word tokens, dropping common English stopwords.
+    Works for Latin and Arabic script alike since it relies on Unicode word characters.
+
+    Args:
+        text: Input text
+
+    Returns:
+        List of tokens in document order
+    """
+    if not text:
+        return []
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+
+def result_text(result: Dict[str, Any]) -> str:
+    """Return the searchable text of a chunk or summary result (title + body)."""
+    body = result.get('content') or result.get('summary_text') or ''
+    title = result.get('title') or ''
+    return f"{title}\n{body}" if title else body
+
+
+class IDFTable:
+    """
+    Inverse document frequency table computed over the whole corpus.
+
+    Candidate sets are small (10-50 results), so IDF estimated from the candidates
+    alone is noisy. A table built offline from the chunk/summary JSONL files gives
+    stable term weights; terms missing from the table get the maximum IDF.
+    """
+
+    def __init__(self, idf: Dict[str, float], num_docs: int, avg_doc_len: float):
+        self.idf = idf
+        self.num_docs = num_docs
+        self.avg_doc_len = avg_doc_len
+        self.default_idf = max(idf.values()) if idf else 1.0
+
+    @classmethod
+    def build(cls, texts: Iterable[str]) -> "IDFTable":
+        """Build an IDF table from an iterable of document texts."""
+        doc_freq: Counter = Counter()
+        num_docs = 0
+        total_len = 0
+
+        for text in texts:
+            tokens = tokenize(text)
+            num_docs += 1
+            total_len += len(tokens)
+            doc_freq.update(set(tokens))
+
+        idf = {
+            term: math.log(1.0 + (num_docs - df + 0.5) / (df + 0.5))
+            for term, df in doc_freq.items()
+        }
+        avg_doc_len = (total_len / num_docs) if num_docs else 0.0
+        return cls(idf, num_docs, avg_doc_len)
+
+    @classmethod
+    def from_jsonl_dir(cls, root: str) -> "IDFTable":
+        """
+        Build an IDF table from the data/*.jsonl and summaries/*.jsonl files under root.
+
+        Args:
+            root: Local directory mirroring the chunks bucket layout
+
+        Returns:
+            IDFTable over all chunk contents and summary texts
+        """
+        def _iter_texts():
+            for sub in ("data", "summaries"):
+                for path in sorted(Path(root, sub).glob("*.jsonl")):
+                    with open(path, 'r', encoding='utf-8') as f:
+                        for line in f:
+                            if not line.strip():
+                                continue
+                            try:
+                                record = json.loads(line)
+                            except json.JSONDecodeError:
+                                continue
+                            yield result_text(record)
+
+        return cls.build(_iter_texts())
+
+    def weights(self, terms: List[str]) -> np.ndarray:
+        """Return IDF weights for the given terms as a float array."""
+        return np.array([self.idf.get(t, self.default_idf) for t in terms], dtype=np.float64)
+
+    def save(self, path: str) -> None:
+        """Write the table as JSON."""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({
+                "num_docs": self.num_docs,
+                "avg_doc_len": self.avg_doc_len,
+                "idf": self.idf
+            }, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str) -> "IDFTable":
+        """Load a table written by save()."""
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(data["idf"], data.get("num_docs", 0), data.get("avg_doc_len", 0.0))
+
+
+_idf_table: Optional[IDFTable] = None
+_idf_table_loaded = False
+
+
+def get_idf_table() -> Optional[IDFTable]:
+    """Get the corpus IDF table configured by LOCAL_RERANK_IDF_PATH (loaded once)."""
+    global _idf_table, _idf_table_loaded
+    if not _idf_table_loaded:
+        _idf_table_loaded = True
+        if LOCAL_RERANK_IDF_PATH and os.path.exists(LOCAL_RERANK_IDF_PATH):
+            try:
+                _idf_table = IDFTable.load(LOCAL_RERANK_IDF_PATH)
+                logger.info(f"Loaded IDF table with {len(_idf_table.idf)} terms from {LOCAL_RERANK_IDF_PATH}")
+            except Exception as e:
+                logger.warning(f"Failed to load IDF table from {LOCAL_RERANK_IDF_PATH}: {e}")
+        elif LOCAL_RERANK_IDF_PATH:
+            logger.warning(f"IDF table not found at {LOCAL_RERANK_IDF_PATH}; using candidate-level IDF")
+    return _idf_table
+
+
+def _proximity_scores(query_terms: List[str], docs_tokens: List[List[str]]) -> np.ndarray:
+    """
+    Score how tightly the query terms cluster in each document.
+
+    For each document, finds the smallest token window containing every distinct
+    query term present, and scores matched_terms / window_length scaled by the
+    fraction of query terms covered. Single-term matches score 0.
+    """
+    term_set = set(query_terms)
+    scores = np.zeros(len(docs_tokens), dtype=np.float64)
+    if len(term_set) < 2:
+        return scores
+
+    for i, tokens in enumerate(docs_tokens):
+        hits = [(pos, tok) for pos, tok in enumerate(tokens) if tok in term_set]
+        distinct = {tok for _, tok in hits}
+        if len(distinct) < 2:
+            continue
+
+        # Minimal window covering all distinct matched terms (two-pointer sweep)
+        needed = len(distinct)
+        counts: Counter = Counter()
+        covered = 0
+        best = len(tokens) + 1
+        left = 0
+        for right in range(len(hits)):
+            tok = hits[right][1]
+            counts[tok] += 1
+            if counts[tok] == 1:
+                covered += 1
+            while covered == needed:
+                span = hits[right][0] - hits[left][0] + 1
+                best = min(best, span)
+                left_tok = hits[left][1]
+                counts[left_tok] -= 1
+                if counts[left_tok] == 0:
+                    covered -= 1
+                left += 1
+
+        scores[i] = (needed / best) * (needed / len(term_set))
+
+    return scores
+
+
+def local_relevance_scores(
+    query: str,
+    texts: List[str],
+    idf_table: Optional[IDFTable] = None
+) -> np.ndarray:
+    """
+    Compute BM25 + proximity relevance scores for candidate texts.
+
+    Args:
+        query: User query
+        texts: Candidate texts, in retrieval order
+        idf_table: Optional corpus IDF table (defaults to the configured table)
+
+    Returns:
+        Array of scores, one per text (higher is more relevant)
+    """
+    if not texts:
+        return np.zeros(0, dtype=np.float64)
+
+    query_terms = list(dict.fromkeys(tokenize(query)))
+    if not query_terms:
+        return np.zeros(len(texts), dtype=np.float64)
+
+    docs_tokens = [tokenize(t) for t in texts]
+    term_index = {t: j for j, t in enumerate(query_terms)}
+
+    # Term-frequency matrix (docs x query terms)
+    tf = np.zeros((len(texts), len(query_terms)), dtype=np.float64)
+    for i, tokens in enumerate(docs_tokens):
+        for tok in tokens:
+            j = term_index.get(tok)
+            if j is not None:
+                tf[i, j] += 1.0
+    doc_len = np.array([len(tokens) for tokens in docs_tokens], dtype=np.float64)
+
+    if idf_table is None:
+        idf_table = get_idf_table()
+
+    if idf_table is not None and idf_table.num_docs:
+        idf = idf_table.weights(query_terms)
+        avg_len = idf_table.avg_doc_len or float(doc_len.mean() or 1.0)
+    else:
+        # Fall back to IDF over the candidate set itself
+        n = len(texts)
+        df = (tf > 0).sum(axis=0)
+        idf = np.log(1.0 + (n - df + 0.5) / (df + 0.5))
+        avg_len = float(doc_len.mean() or 1.0)
+
+    norm = BM25_K1 * (1.0 - BM25_B + BM25_B * doc_len / max(avg_len, 1.0))
+    bm25 = (tf * (BM25_K1 + 1.0) / (tf + norm[:, None])) @ idf
+
+    max_bm25 = bm25.max()
+    if max_bm25 > 0:
+        bm25 = bm25 / max_bm25
+
+    return bm25 + PROXIMITY_WEIGHT * _proximity_scores(query_terms, docs_tokens)
+
+
+def rerank_local(
+    query: str,
+    results: List[Dict[str, Any]],
+    top_k: Optional[int] = None,
+    idf_table: Optional[IDFTable] = None
+) -> List[Dict[str, Any]]:
+    """
+    Rerank results locally with BM25 and term proximity.
+    Each result gets a 'rerank_score' field; ties keep the original retrieval order.
+
+    Args:
+        query: Original user query
+        results: List of search results
+        top_k: Optional limit on number of results to return after reranking
+        idf_table: Optional corpus IDF table
+
+    Returns:
+        Reranked list of results
+    """
+    if not results:
+        return results
+
+    scores = local_relevance_scores(query, [result_text(r) for r in results], idf_table)
+    order = np.argsort(-scores, kind='stable')
+
+    reranked = []
+    for idx in order:
+        result = results[int(idx)]
+        result['rerank_score'] = float(scores[idx])
+        reranked.append(result)
+
+    if top_k:
+        reranked = reranked[:top_k]
+
+    logger.info(f"Locally reranked {len(results)} results. New order: {[int(i) for i in order[:5]]}...")
+    return reranked
+
+
+def main():
+    """CLI entry point for building the corpus IDF table."""
+    parser = argparse.ArgumentParser(description="Build the IDF table used by the local reranker")
+    parser.add_argument("--input", required=True, help="Directory containing data/ and summaries/ JSONL folders")
+    parser.add_argument("--output", required=True, help="Path to write the IDF table JSON")
+    args = parser.parse_args()
+
+    table = IDFTable.from_jsonl_dir(args.input)
+    table.save(args.output)
+    logger.info(f"Wrote IDF table: {len(table.idf)} terms over {table.num_docs} documents -> {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
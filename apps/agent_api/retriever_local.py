@@ -0,0 +1,628 @@
+"""
+Local BM25 retriever for CENTEF RAG system.
+Builds an inverted index from the data/*.jsonl and summaries/*.jsonl files and
+serves the same search_chunks/search_summaries interface as the Vertex AI Search
+retriever, so the chat path can run without network access.
+
+Index layout (one directory per tier, "chunks" and "summaries"):
+    meta.json          - document count, average length, build time
+    lexicon_terms.bin  - every term (UTF-8), concatenated in sorted order
+    lexicon_terms.u64  - byte offset of each term in lexicon_terms.bin, plus the end (uint64)
+    lexicon_postings.u64 - offset of each term's postings, plus the end (uint64);
+                         document frequency is the difference to the next offset
+    postings_docs.u32  - document ids, grouped by term (uint32)
+    postings_tfs.u16   - term frequencies, parallel to postings_docs (uint16)
+    doc_lengths.u32    - token count per document (uint32)
+    docs.jsonl         - original records, one per line
+    doc_offsets.u64    - byte offset of each record in docs.jsonl (uint64)
+
+Binary files are written with `array` and memory-mapped at load time, so several
+worker processes share one copy of the lexicon and postings through the page
+cache. Terms are looked up by binary search over the mapped term table.
+"""
+import argparse
+import json
+import logging
+import mmap
+import os
+import re
+import sys
+import threading
+from array import array
+from collections import Counter, defaultdict
+from datetime import datetime
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Callable, Iterator, Sequence, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+# Add parent directory to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from apps.agent_api.reranker_local import tokenize, BM25_K1, BM25_B
+from apps.agent_api.search_result import CHUNK_FIELDS, SUMMARY_FIELDS, SearchResult
+
+load_dotenv()
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Environment variables
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", "./local_index")
+
+TIERS = ("chunks", "summaries")
+TIER_SOURCE_DIRS = {"chunks": "data", "summaries": "summaries"}
+
+# Fields indexed in addition to the body text
+TITLE_FIELD = "title"
+BODY_FIELDS = {"chunks": "content", "summaries": "summary_text"}
+
+
+# ============================================================================
+# Filter expressions
+# ============================================================================
+
+_FILTER_TOKEN = re.compile(
+    r'\s*(?:(?P<lparen>\()|(?P<rparen>\))|(?P<comma>,)|(?P<colon>:)'
+    r'|(?P<op><=|>=|!=|=|<|>)|(?P<string>"(?:[^"\\]|\\.)*")'
+    r'|(?P<number>-?\d+(?:\.\d+)?)|(?P<word>[A-Za-z_][\w.]*))'
+)
+
+
+def _tokenize_filter(expression: str) -> List[Tuple[str, str]]:
+    tokens = []
+    pos = 0
+    expression = expression.strip()
+    while pos < len(expression):
+        m = _FILTER_TOKEN.match(expression, pos)
+        if not m or m.end() == pos:
+            raise ValueError(f"Invalid filter expression near: {expression[pos:pos + 20]!r}")
+        kind = m.lastgroup
+        value = m.group(kind)
+        if kind == "string":
+            value = json.loads(value)
+        tokens.append((kind, value))
+        pos = m.end()
+    return tokens
+
+
+def _values_of(record: Dict[str, Any], field: str) -> List[Any]:
+    value = record.get(field)
+    if value is None and field == "page_number":
+        value = record.get("page")
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _compare(left: Any, op: str, right: Any) -> bool:
+    try:
+        if isinstance(right, float):
+            left = float(left)
+        else:
+            left = str(left)
+    except (TypeError, ValueError):
+        return False
+    if op == "=":
+        return left == right
+    if op == "!=":
+        return left != right
+    if op == "<":
+        return left < right
+    if op == ">":
+        return left > right
+    if op == "<=":
+        return left <= right
+    return left >= right
+
+
+def parse_filter(expression: Optional[str]) -> Optional[Callable[[Dict[str, Any]], bool]]:
+    """
+    Parse a Vertex AI Search filter expression into a predicate over records.
+
+    Supports the syntax produced by build_metadata_filter and retrieve_by_source_id:
+        field: "value"                 (string equality; any element for arrays)
+        field: ANY("v1", "v2")         (matches if any value is present)
+        field > 3, date >= "2020-01"   (numeric or string comparison)
+        NOT expr, expr AND expr, expr OR expr, parentheses (AND binds tighter)
+
+    Args:
+        expression: Filter expression, or None
+
+    Returns:
+        Predicate function, or None if no filter was given
+
+    Raises:
+        ValueError: If the expression cannot be parsed
+    """
+    if not expression or not expression.strip():
+        return None
+
+    tokens = _tokenize_filter(expression)
+    pos = 0
+
+    def peek(kind: Optional[str] = None, value: Optional[str] = None) -> bool:
+        if pos >= len(tokens):
+            return False
+        tok_kind, tok_value = tokens[pos]
+        if kind and tok_kind != kind:
+            return False
+        if value and (not isinstance(tok_value, str) or tok_value.upper() != value):
+            return False
+        return True
+
+    def take(kind: str) -> Any:
+        nonlocal pos
+        if not peek(kind):
+            found = tokens[pos][1] if pos < len(tokens) else "end of expression"
+            raise ValueError(f"Invalid filter expression: expected {kind}, found {found!r}")
+        value = tokens[pos][1]
+        pos += 1
+        return value
+
+    def literal() -> Any:
+        if peek("string"):
+            return take("string")
+        return float(take("number"))
+
+    def parse_or():
+        nonlocal pos
+        left = parse_and()
+        while peek("word", "OR"):
+            pos += 1
+            right = parse_and()
+            left = (lambda a, b: lambda r: a(r) or b(r))(left, right)
+        return left
+
+    def parse_and():
+        nonlocal pos
+        left = parse_unary()
+        while peek("word", "AND"):
+            pos += 1
+            right = parse_unary()
+            left = (lambda a, b: lambda r: a(r) and b(r))(left, right)
+        return left
+
+    def parse_unary():
+        nonlocal pos
+        if peek("word", "NOT"):
+            pos += 1
+            inner = parse_unary()
+            return lambda r: not inner(r)
+        if peek("lparen"):
+            pos += 1
+            inner = parse_or()
+            take("rparen")
+            return inner
+        return parse_comparison()
+
+    def parse_comparison():
+        nonlocal pos
+        field = take("word")
+        if peek("colon"):
+            pos += 1
+            if peek("word", "ANY"):
+                pos += 1
+                take("lparen")
+                wanted = [literal()]
+                while peek("comma"):
+                    pos += 1
+                    wanted.append(literal())
+                take("rparen")
+            else:
+                wanted = [literal()]
+            wanted_set = {str(w) if not isinstance(w, float) else w for w in wanted}
+            return lambda r: any(
+                (float(v) if isinstance(v, (int, float)) and not isinstance(v, bool) else str(v)) in wanted_set
+                for v in _values_of(r, field)
+            )
+        op = take("op")
+        value = literal()
+        return lambda r: any(_compare(v, op, value) for v in _values_of(r, field))
+
+    predicate = parse_or()
+    if pos != len(tokens):
+        raise ValueError(f"Invalid filter expression: unexpected {tokens[pos][1]!r}")
+    return predicate
+
+
+# ============================================================================
+# Index building
+# ============================================================================
+
+def _record_text(record: Dict[str, Any], tier: str) -> str:
+    title = record.get(TITLE_FIELD) or ""
+    body = record.get(BODY_FIELDS[tier]) or ""
+    return f"{title}\n{body}" if title else body
+
+
+def iter_jsonl_records(root: str, subdir: str) -> Iterator[Dict[str, Any]]:
+    """Yield records from root/subdir/*.jsonl (local directory or gs:// prefix)."""
+    if root.startswith("gs://"):
+        from google.cloud import storage
+
+        bucket_name, _, prefix = root[len("gs://"):].partition("/")
+        prefix = f"{prefix.rstrip('/')}/{subdir}/" if prefix else f"{subdir}/"
+        client = storage.Client(project=os.getenv("PROJECT_ID"))
+        for blob in client.list_blobs(bucket_name, prefix=prefix):
+            if not blob.name.endswith(".jsonl"):
+                continue
+            for line in blob.download_as_text().splitlines():
+                if line.strip():
+                    yield json.loads(line)
+        return
+
+    for path in sorted(Path(root, subdir).glob("*.jsonl")):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def build_tier_index(records: Iterator[Dict[str, Any]], tier: str, out_dir: str) -> Dict[str, Any]:
+    """
+    Build the inverted index for one tier.
+
+    Args:
+        records: Chunk or summary records (as written by shared.schemas)
+        tier: "chunks" or "summaries"
+        out_dir: Output directory for this tier
+
+    Returns:
+        Index metadata
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+    doc_lengths = array("I")
+    doc_offsets = array("Q")
+
+    with open(os.path.join(out_dir, "docs.jsonl"), "wb") as docs_file:
+        for doc_id, record in enumerate(records):
+            doc_offsets.append(docs_file.tell())
+            docs_file.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+
+            tokens = tokenize(_record_text(record, tier))
+            doc_lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                postings[term].append((doc_id, min(tf, 65535)))
+
+    # Sorted by UTF-8 bytes, the order the binary search compares in
+    terms = sorted(postings, key=lambda term: term.encode("utf-8"))
+    term_offsets = array("Q", [0])
+    postings_offsets = array("Q", [0])
+    postings_docs = array("I")
+    postings_tfs = array("H")
+    with open(os.path.join(out_dir, "lexicon_terms.bin"), "wb") as terms_file:
+        for term in terms:
+            term_offsets.append(term_offsets[-1] + terms_file.write(term.encode("utf-8")))
+            for doc_id, tf in postings[term]:
+                postings_docs.append(doc_id)
+                postings_tfs.append(tf)
+            postings_offsets.append(len(postings_docs))
+
+    for name, data in (
+        ("lexicon_terms.u64", term_offsets),
+        ("lexicon_postings.u64", postings_offsets),
+        ("postings_docs.u32", postings_docs),
+        ("postings_tfs.u16", postings_tfs),
+        ("doc_lengths.u32", doc_lengths),
+        ("doc_offsets.u64", doc_offsets),
+    ):
+        with open(os.path.join(out_dir, name), "wb") as f:
+            data.tofile(f)
+
+    num_docs = len(doc_lengths)
+    meta = {
+        "tier": tier,
+        "num_docs": num_docs,
+        "num_terms": len(terms),
+        "avg_doc_len": (sum(doc_lengths) / num_docs) if num_docs else 0.0,
+        "built_at": datetime.utcnow().isoformat(),
+    }
+    with open(os.path.join(out_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+
+    logger.info(f"Built {tier} index: {num_docs} documents, {len(terms)} terms -> {out_dir}")
+    return meta
+
+
+def build_index(source_root: str, index_dir: str = LOCAL_INDEX_DIR) -> Dict[str, Any]:
+    """
+    Build chunk and summary indexes from source_root/data and source_root/summaries.
+
+    Args:
+        source_root: Local directory or gs://bucket[/prefix] with data/ and summaries/
+        index_dir: Output index directory
+
+    Returns:
+        Metadata for each tier
+    """
+    return {
+        tier: build_tier_index(
+            iter_jsonl_records(source_root, TIER_SOURCE_DIRS[tier]),
+            tier,
+            os.path.join(index_dir, tier)
+        )
+        for tier in TIERS
+    }
+
+
+# ============================================================================
+# Index loading and search
+# ============================================================================
+
+def _map_array(path: str, dtype) -> Tuple[Optional[mmap.mmap], np.ndarray]:
+    """Memory-map a binary array file (empty files map to an empty array)."""
+    if os.path.getsize(path) == 0:
+        return None, np.zeros(0, dtype=dtype)
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return mm, np.frombuffer(mm, dtype=dtype)
+
+
+class LocalIndex:
+    """Read-only, memory-mapped BM25 index for one tier."""
+
+    def __init__(self, index_dir: str):
+        self.index_dir = index_dir
+        with open(os.path.join(index_dir, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if not os.path.exists(os.path.join(index_dir, "lexicon_terms.bin")):
+            raise FileNotFoundError(
+                f"No memory-mapped lexicon in {index_dir} (built by an older version); rebuild with "
+                f"'python apps/agent_api/retriever_local.py build'"
+            )
+
+        self._maps = []
+        for attr, name, dtype in (
+            ("term_offsets", "lexicon_terms.u64", np.uint64),
+            ("term_postings", "lexicon_postings.u64", np.uint64),
+            ("postings_docs", "postings_docs.u32", np.uint32),
+            ("postings_tfs", "postings_tfs.u16", np.uint16),
+            ("doc_lengths", "doc_lengths.u32", np.uint32),
+            ("doc_offsets", "doc_offsets.u64", np.uint64),
+        ):
+            mm, data = _map_array(os.path.join(index_dir, name), dtype)
+            self._maps.append(mm)
+            setattr(self, attr, data)
+
+        terms_path = os.path.join(index_dir, "lexicon_terms.bin")
+        self._terms = b""
+        if os.path.getsize(terms_path):
+            with open(terms_path, "rb") as f:
+                self._terms = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps.append(self._terms)
+        self.num_terms = max(len(self.term_offsets) - 1, 0)
+
+        self._docs_file = open(os.path.join(index_dir, "docs.jsonl"), "rb")
+        self._docs_lock = threading.Lock()
+        self.num_docs = int(self.meta.get("num_docs", len(self.doc_lengths)))
+        self.avg_doc_len = float(self.meta.get("avg_doc_len") or 1.0)
+        # BM25 length normalization, fixed for the lifetime of the index
+        self._length_norm = BM25_K1 * (
+            1.0 - BM25_B + BM25_B * self.doc_lengths.astype(np.float32) / max(self.avg_doc_len, 1.0)
+        )
+
+    def get_record(self, doc_id: int) -> Dict[str, Any]:
+        """Read one original record from the docstore."""
+        with self._docs_lock:
+            self._docs_file.seek(int(self.doc_offsets[doc_id]))
+            line = self._docs_file.readline()
+        return json.loads(line)
+
+    def lookup(self, term: str) -> Optional[Tuple[int, int]]:
+        """Postings (offset, document frequency) of a term, by binary search over the term table."""
+        key = term.encode("utf-8")
+        low, high = 0, self.num_terms
+        while low < high:
+            mid = (low + high) // 2
+            candidate = self._terms[int(self.term_offsets[mid]):int(self.term_offsets[mid + 1])]
+            if candidate < key:
+                low = mid + 1
+            elif candidate > key:
+                high = mid
+            else:
+                offset = int(self.term_postings[mid])
+                return offset, int(self.term_postings[mid + 1]) - offset
+        return None
+
+    def score(self, query: str) -> np.ndarray:
+        """BM25 score of every document for the query (zeros where no term matches)."""
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        if not self.num_docs:
+            return scores
+
+        norm = self._length_norm
+        for term in set(tokenize(query)):
+            entry = self.lookup(term)
+            if not entry:
+                continue
+            offset, df = entry
+            docs = self.postings_docs[offset:offset + df]
+            tfs = self.postings_tfs[offset:offset + df].astype(np.float32)
+            idf = np.log(1.0 + (self.num_docs - df + 0.5) / (df + 0.5))
+            scores[docs] += idf * tfs * (BM25_K1 + 1.0) / (tfs + norm[docs])
+        return scores
+
+    def search(
+        self,
+        query: str,
+        max_results: int,
+        filter_expression: Optional[str] = None
+    ) -> List[Tuple[Dict[str, Any], float]]:
+        """
+        Search the index.
+
+        Args:
+            query: Search query ("*" or empty matches every document)
+            max_results: Maximum number of results
+            filter_expression: Optional Vertex AI Search style filter
+
+        Returns:
+            List of (record, score) tuples, best first
+        """
+        predicate = parse_filter(filter_expression)
+
+        if query.strip() in ("", "*"):
+            candidates = np.arange(self.num_docs)
+            scores = np.zeros(self.num_docs, dtype=np.float32)
+        else:
+            scores = self.score(query)
+            candidates = np.flatnonzero(scores)
+            if not predicate and len(candidates) > max_results > 0:
+                top = np.argpartition(-scores[candidates], max_results - 1)[:max_results]
+                candidates = candidates[top]
+            # Stable order: score descending, then document order
+            candidates = candidates[np.lexsort((candidates, -scores[candidates]))]
+
+        results = []
+        for doc_id in candidates:
+            record = self.get_record(int(doc_id))
+            if predicate and not predicate(record):
+                continue
+            results.append((record, float(scores[doc_id])))
+            if len(results) >= max_results:
+                break
+        return results
+
+    def close(self) -> None:
+        self._docs_file.close()
+        for mm in self._maps:
+            if mm is not None:
+                mm.close()
+
+
+_indexes: Dict[str, LocalIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_local_index(tier: str, index_dir: Optional[str] = None) -> LocalIndex:
+    """Get the memory-mapped index for a tier (loaded once per process)."""
+    path = os.path.join(index_dir or LOCAL_INDEX_DIR, tier)
+    with _indexes_lock:
+        if path not in _indexes:
+            if not os.path.exists(os.path.join(path, "meta.json")):
+                raise FileNotFoundError(
+                    f"Local {tier} index not found at {path}. "
+                    f"Build it with: python -m apps.agent_api.retriever_local build --source <dir>"
+                )
+            _indexes[path] = LocalIndex(path)
+            logger.info(f"Loaded local {tier} index from {path} ({_indexes[path].num_docs} documents)")
+        return _indexes[path]
+
+
+def format_chunk_result(
+    record: Dict[str, Any],
+    score: float,
+    fields: Optional[Sequence[str]] = None
+) -> SearchResult:
+    """Shape a chunk record like a Vertex AI Search chunk result."""
+    return SearchResult.project(record, fields or CHUNK_FIELDS, score=score)
+
+
+def format_summary_result(
+    record: Dict[str, Any],
+    score: float,
+    fields: Optional[Sequence[str]] = None
+) -> SearchResult:
+    """Shape a summary record like a Vertex AI Search summary result."""
+    return SearchResult.project(
+        record, fields or SUMMARY_FIELDS, doc_id=record.get("id") or record.get("source_id"), score=score
+    )
+
+
+def search_chunks(
+    query: str,
+    max_results: int = 10,
+    filter_expression: Optional[str] = None,
+    fields: Optional[Sequence[str]] = None
+) -> List[SearchResult]:
+    """
+    Search the local chunk index.
+
+    Args:
+        query: Search query string
+        max_results: Maximum number of results to return
+        filter_expression: Optional filter (e.g., 'source_id: ANY("doc1")')
+        fields: Result fields to project (default CHUNK_FIELDS)
+
+    Returns:
+        List of chunk results with content and metadata
+    """
+    logger.info(f"Searching local chunk index with query: {query}")
+
+    results = [
+        format_chunk_result(record, score, fields)
+        for record, score in get_local_index("chunks").search(query, max_results, filter_expression)
+    ]
+
+    logger.info(f"Found {len(results)} chunk results from local index")
+    return results
+
+
+def search_summaries(
+    query: str,
+    max_results: int = 5,
+    filter_expression: Optional[str] = None,
+    fields: Optional[Sequence[str]] = None
+) -> List[SearchResult]:
+    """
+    Search the local summary index.
+
+    Args:
+        query: Search query string
+        max_results: Maximum number of results to return
+        filter_expression: Optional filter
+        fields: Result fields to project (default SUMMARY_FIELDS)
+
+    Returns:
+        List of summary results with content and metadata
+    """
+    logger.info(f"Searching local summary index with query: {query}")
+
+    results = [
+        format_summary_result(record, score, fields)
+        for record, score in get_local_index("summaries").search(query, max_results, filter_expression)
+    ]
+
+    logger.info(f"Found {len(results)} summary results from local index")
+    return results
+
+
+def main():
+    """CLI entry point for building and querying the local index."""
+    parser = argparse.ArgumentParser(description="Local BM25 index for chunk/summary JSONL files")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="Build the index")
+    build_parser.add_argument("--source", required=True,
+                              help="Directory or gs://bucket[/prefix] containing data/ and summaries/")
+    build_parser.add_argument("--index-dir", default=LOCAL_INDEX_DIR, help="Output index directory")
+
+    search_parser = subparsers.add_parser("search", help="Query the index")
+    search_parser.add_argument("query")
+    search_parser.add_argument("--tier", choices=TIERS, default="chunks")
+    search_parser.add_argument("--max-results", type=int, default=5)
+    search_parser.add_argument("--filter", default=None)
+    search_parser.add_argument("--index-dir", default=LOCAL_INDEX_DIR)
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        meta = build_index(args.source, args.index_dir)
+        print(json.dumps(meta, indent=2))
+        return 0
+
+    index = get_local_index(args.tier, args.index_dir)
+    for record, score in index.search(args.query, args.max_results, args.filter):
+        text = record.get(BODY_FIELDS[args.tier], "")[:120].replace("\n", " ")
+        print(f"{score:8.3f}  {record.get('id')}  {text}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,17 +2,26 @@
 Optimized retriever for CENTEF RAG system with advanced retrieval techniques.
 Includes query rewriting, reranking, deduplication, and hybrid search.
 """
+import json
 import logging
 import os
 import re
-from typing import List, Dict, Any, Optional, Tuple
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, List, Dict, Any, Optional, Tuple
 from collections import defaultdict
 
 from dotenv import load_dotenv
 import vertexai
 from vertexai.preview.generative_models import GenerativeModel, GenerationConfig
 
-from apps.agent_api.retriever_vertex_search import search_chunks, search_summaries
+from apps.agent_api.retriever_vertex_search import SEARCH_TIMEOUT_S, search_chunks, search_summaries
+from apps.agent_api import retriever_local, vector_index
+from apps.agent_api.reranker_local import rerank_local
+from apps.agent_api.query_patterns import match_query
+from apps.agent_api.optimization_config import get_config
+from shared.similarity import SimHashLSH, max_distance_for_threshold, simhash
 
 load_dotenv()
 
@@ -27,10 +36,245 @@ PROJECT_ID = os.getenv("PROJECT_ID")
 GENERATION_LOCATION = os.getenv("GENERATION_LOCATION", "us-central1")
 QUERY_EXPANSION_MODEL = os.getenv("QUERY_EXPANSION_MODEL", "gemini-2.0-flash-exp")
 
+# Supported search backends
+SEARCH_BACKENDS = ("vertex", "local", "vector", "hybrid")
+
+# Supported reranking modes
+RERANK_MODES = ("local", "llm", "joint", "hybrid")
+
+# Worker pool per hybrid source, so abandoned slow calls to one source cannot queue the others
+HYBRID_SEARCH_WORKERS = int(os.getenv("RETRIEVER_HYBRID_WORKERS", "16"))
+_hybrid_executors: Dict[str, ThreadPoolExecutor] = {}
+_hybrid_executors_lock = threading.Lock()
+
 # Initialize Vertex AI
 vertexai.init(project=PROJECT_ID, location=GENERATION_LOCATION)
 
 
+def get_search_functions(backend: Optional[str] = None):
+    """
+    Get the (search_chunks, search_summaries) pair for a search backend.
+    
+    Args:
+        backend: "vertex", "local", "vector" or "hybrid" (None = RETRIEVER_BACKEND)
+    
+    Returns:
+        Tuple of search functions with the retriever_vertex_search signatures
+    """
+    backend = backend or get_config().retriever.backend
+    if backend == "hybrid":
+        searcher = HybridSearcher()
+        return searcher.search_chunks, searcher.search_summaries
+    if backend == "local":
+        return retriever_local.search_chunks, retriever_local.search_summaries
+    if backend == "vector":
+        return vector_index.search_chunks, vector_index.search_summaries
+    if backend != "vertex":
+        raise ValueError(f"Invalid search backend '{backend}'. Must be one of {SEARCH_BACKENDS}")
+    return search_chunks, search_summaries
+
+
+def weighted_rrf_fusion(
+    ranked_lists: List[Tuple[str, List[Dict[str, Any]]]],
+    weights: Optional[Dict[str, float]] = None,
+    key: Optional[Callable[[Dict[str, Any]], str]] = None
+) -> Tuple[List[Dict[str, Any]], Dict[str, List[str]]]:
+    """
+    Fuse ranked result lists with weighted reciprocal rank fusion.
+    
+    Score = sum(weight(list) / (rank + k)) over every list a result appears in.
+    
+    Args:
+        ranked_lists: (name, results) pairs, each results list best-first
+        weights: Weight per list name (missing names weigh 1.0)
+        key: Function giving a result's identity (default: result['id'])
+    
+    Returns:
+        Tuple of (fused results best-first, list names that returned each result key)
+    """
+    k = get_config().retriever.reciprocal_rank_k
+    weights = weights or {}
+    key = key or (lambda result: result.get('id', ''))
+    
+    result_scores = defaultdict(float)
+    result_map = {}
+    found_in = defaultdict(list)
+    
+    for name, results in ranked_lists:
+        weight = weights.get(name, 1.0)
+        for rank, result in enumerate(results, start=1):
+            result_id = key(result)
+            if not result_id:
+                continue
+            result_scores[result_id] += weight / (rank + k)
+            if result_id not in result_map:
+                result_map[result_id] = result
+            if name not in found_in[result_id]:
+                found_in[result_id].append(name)
+    
+    sorted_ids = sorted(result_scores.keys(), key=lambda x: result_scores[x], reverse=True)
+    return [result_map[result_id] for result_id in sorted_ids], dict(found_in)
+
+
+def _hybrid_executor(source: str) -> ThreadPoolExecutor:
+    """Get the worker pool for a hybrid source (created on first use)."""
+    with _hybrid_executors_lock:
+        if source not in _hybrid_executors:
+            _hybrid_executors[source] = ThreadPoolExecutor(
+                max_workers=HYBRID_SEARCH_WORKERS, thread_name_prefix=f"hybrid-{source}"
+            )
+        return _hybrid_executors[source]
+
+
+def _timed_search(search_fn, query: str, max_results: int, filter_expression: Optional[str]):
+    start = time.perf_counter()
+    results = search_fn(query, max_results=max_results, filter_expression=filter_expression)
+    return results, (time.perf_counter() - start) * 1000
+
+
+class HybridSearcher:
+    """
+    Runs Vertex AI Search and the local BM25/vector indexes concurrently and fuses
+    them with weighted RRF, within a latency budget per request.
+    
+    One searcher serves one request: the budget starts when it is created and
+    every tier and query variation searched through it shares the remaining
+    time. Each source has its own worker pool. Sources still running when the
+    budget expires are abandoned (their threads finish in the background and the
+    results are dropped). If nothing has arrived by then, the searcher waits for
+    the first successful source, at most VERTEX_SEARCH_TIMEOUT_S from the call,
+    so a slow Vertex call only delays answers when every local tier has failed too.
+    """
+    
+    SOURCES = {
+        "vertex": (search_chunks, search_summaries),
+        "local": (retriever_local.search_chunks, retriever_local.search_summaries),
+        "vector": (vector_index.search_chunks, vector_index.search_summaries),
+    }
+    
+    def __init__(
+        self,
+        weights: Optional[Dict[str, float]] = None,
+        budget_ms: Optional[int] = None,
+        deadline: Optional[float] = None
+    ):
+        """
+        Args:
+            weights: RRF weight per source (None = RETRIEVER_HYBRID_WEIGHTS)
+            budget_ms: Latency budget for the request (None = RETRIEVER_HYBRID_BUDGET_MS)
+            deadline: time.monotonic() by which the request's searches should fuse
+                (None = budget_ms from now)
+        """
+        config = get_config().retriever
+        weights = weights if weights is not None else config.hybrid_weights
+        unknown = set(weights) - set(self.SOURCES)
+        if unknown:
+            raise ValueError(f"Unknown hybrid sources {sorted(unknown)}. Must be among {tuple(self.SOURCES)}")
+        self.weights = {name: weight for name, weight in weights.items() if weight > 0}
+        self.budget_ms = budget_ms if budget_ms is not None else config.hybrid_budget_ms
+        self.deadline = deadline if deadline is not None else time.monotonic() + self.budget_ms / 1000
+        self.stats: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._found_in: Dict[str, Dict[str, List[str]]] = {"chunks": {}, "summaries": {}}
+        self._lock = threading.Lock()  # Tiers and query variations may be searched concurrently
+    
+    def search_chunks(self, query: str, max_results: int = 10, filter_expression: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Hybrid chunk search (same signature as retriever_vertex_search.search_chunks)."""
+        return self._search("chunks", query, max_results, filter_expression)
+    
+    def search_summaries(self, query: str, max_results: int = 5, filter_expression: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Hybrid summary search (same signature as retriever_vertex_search.search_summaries)."""
+        return self._search("summaries", query, max_results, filter_expression)
+    
+    @staticmethod
+    def _result_key(tier: str, result: Dict[str, Any]) -> str:
+        # Summary document IDs differ between backends; the source_id does not
+        if tier == "summaries":
+            return result.get('source_id') or result.get('id', '')
+        return result.get('id', '')
+    
+    def _record(self, source: str, tier: str, status: str, latency_ms: float, num_results: int = 0) -> None:
+        with self._lock:
+            entry = self.stats.setdefault(source, {}).setdefault(tier, {
+                "calls": 0, "ok": 0, "timeouts": 0, "errors": 0, "results": 0, "max_latency_ms": 0.0
+            })
+            entry["calls"] += 1
+            entry[status] += 1
+            entry["results"] += num_results
+            entry["max_latency_ms"] = round(max(entry["max_latency_ms"], latency_ms), 1)
+    
+    def _search(self, tier: str, query: str, max_results: int, filter_expression: Optional[str]) -> List[Dict[str, Any]]:
+        tier_index = 0 if tier == "chunks" else 1
+        start = time.monotonic()
+        futures = {
+            _hybrid_executor(source).submit(
+                _timed_search, self.SOURCES[source][tier_index], query, max_results, filter_expression
+            ): source
+            for source in self.weights
+        }
+        
+        done, pending = wait(futures, timeout=max(0.0, self.deadline - start))
+        ranked_lists = []
+        
+        def collect(finished):
+            for future in finished:
+                source = futures[future]
+                try:
+                    results, latency_ms = future.result()
+                except Exception as e:
+                    logger.warning(f"Hybrid {tier} search failed for {source}: {e}")
+                    self._record(source, tier, "errors", 0.0)
+                    continue
+                self._record(source, tier, "ok", latency_ms, len(results))
+                ranked_lists.append((source, results))
+        
+        collect(done)
+        fallback_deadline = start + SEARCH_TIMEOUT_S
+        while not ranked_lists and pending:
+            remaining = fallback_deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            collect(done)
+        
+        waited_ms = (time.monotonic() - start) * 1000
+        for future in pending:
+            future.cancel()
+            self._record(futures[future], tier, "timeouts", waited_ms)
+        
+        # Keep a stable fusion order regardless of arrival order
+        ranked_lists.sort(key=lambda item: list(self.weights).index(item[0]))
+        fused, found_in = weighted_rrf_fusion(
+            ranked_lists, self.weights, key=lambda result: self._result_key(tier, result)
+        )
+        with self._lock:
+            for result_id, sources in found_in.items():
+                merged = self._found_in[tier].setdefault(result_id, [])
+                merged.extend(s for s in sources if s not in merged)
+        return fused[:max_results]
+    
+    def report(self, chunks: List[Dict[str, Any]], summaries: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Per-source latency and contribution to the final (post-rerank) results.
+        
+        Returns:
+            Dict with weights, budget, per-source call stats and, per tier, how many
+            final results each source returned
+        """
+        contribution = {}
+        for tier, results in (("chunks", chunks), ("summaries", summaries)):
+            counts = {source: 0 for source in self.weights}
+            for result in results:
+                for source in self._found_in[tier].get(self._result_key(tier, result), []):
+                    counts[source] += 1
+            contribution[tier] = counts
+        return {
+            "weights": self.weights,
+            "budget_ms": self.budget_ms,
+            "sources": self.stats,
+            "contribution": contribution,
+        }
+
+
 def expand_query_with_llm(query: str) -> List[str]:
     """
     Use LLM to generate query variations for better retrieval coverage.
@@ -79,9 +323,14 @@ def deduplicate_results(results: List[Dict[str, Any]], threshold: float = 0.85)
     """
     Remove duplicate or highly similar results based on content similarity.
     
+    Exact duplicates are detected by source location; near-duplicates (e.g. the
+    same passage from a re-uploaded document) by SimHash similarity, using an LSH
+    index so each result is only compared against colliding candidates. The
+    higher-ranked result of each duplicate pair is kept.
+    
     Args:
         results: List of search results
-        threshold: Similarity threshold (0-1) for considering duplicates
+        threshold: Similarity threshold (0-1) for considering duplicates (>= 1.0 disables near-duplicate removal)
     
     Returns:
         Deduplicated list of results
@@ -91,12 +340,14 @@ def deduplicate_results(results: List[Dict[str, Any]], threshold: float = 0.85)
     
     logger.info(f"Deduplicating {len(results)} results...")
     
-    # Simple deduplication based on:
+    # Deduplication based on:
     # 1. Exact source_id + page_number match (for chunks)
-    # 2. Content similarity (basic token overlap for now)
+    # 2. Content similarity (SimHash signature computed at ingestion, or on the fly)
     
     seen_keys = set()
+    lsh = SimHashLSH(max_distance_for_threshold(threshold)) if threshold < 1.0 else None
     deduplicated = []
+    near_duplicates = 0
     
     for result in results:
         # Create deduplication key
@@ -111,13 +362,25 @@ def deduplicate_results(results: List[Dict[str, Any]], threshold: float = 0.85)
             # For summaries or chunks without location, use ID
             key = result.get('id', '')
         
-        if key and key not in seen_keys:
-            seen_keys.add(key)
-            deduplicated.append(result)
+        if not key or key in seen_keys:
+            continue
+        
+        if lsh is not None:
+            signature = result.get('simhash') or (result.get('metadata') or {}).get('simhash')
+            if not signature:
+                signature = simhash(result.get('content') or result.get('summary_text'))
+            if signature:
+                if lsh.query(signature):
+                    near_duplicates += 1
+                    continue
+                lsh.add(key, signature)
+        
+        seen_keys.add(key)
+        deduplicated.append(result)
     
     removed = len(results) - len(deduplicated)
     if removed > 0:
-        logger.info(f"Removed {removed} duplicate results")
+        logger.info(f"Removed {removed} duplicate results ({near_duplicates} near-duplicates)")
     
     return deduplicated
 
@@ -195,6 +458,298 @@ Order (indices only, comma-separated):"""
         return results[:top_k] if top_k else results
 
 
+def _json_generation_config(**kwargs) -> GenerationConfig:
+    """Build a GenerationConfig requesting JSON output when the SDK supports it."""
+    try:
+        return GenerationConfig(response_mime_type="application/json", **kwargs)
+    except TypeError:
+        return GenerationConfig(**kwargs)
+
+
+def _parse_json_object(text: str) -> Dict[str, Any]:
+    """
+    Parse a JSON object from an LLM response.
+    Strips markdown code fences and any text around the outermost braces.
+
+    Raises:
+        ValueError: If no JSON object can be parsed
+    """
+    cleaned = text.strip()
+    if cleaned.startswith("```"):
+        cleaned = re.sub(r"^```(?:json)?\s*|\s*```$", "", cleaned)
+    try:
+        data = json.loads(cleaned)
+    except json.JSONDecodeError:
+        start, end = cleaned.find("{"), cleaned.rfind("}")
+        if start == -1 or end <= start:
+            raise ValueError(f"No JSON object in response: {text[:200]}")
+        data = json.loads(cleaned[start:end + 1])
+    if not isinstance(data, dict):
+        raise ValueError(f"Expected JSON object, got {type(data).__name__}")
+    return data
+
+
+def score_results_jointly(
+    query: str,
+    chunk_results: List[Dict[str, Any]],
+    summary_results: List[Dict[str, Any]]
+) -> Tuple[List[Optional[float]], List[Optional[float]]]:
+    """
+    Score chunks and summaries for relevance in a single LLM call.
+
+    Items are labelled C0..Cn (chunks) and S0..Sn (summaries); the model returns
+    a JSON object mapping each label to a 0-10 relevance score.
+
+    Args:
+        query: Original user query
+        chunk_results: Chunk candidates
+        summary_results: Summary candidates
+
+    Returns:
+        Tuple of (chunk_scores, summary_scores) in 0-1, None where the model gave no score
+
+    Raises:
+        ValueError: If the response cannot be parsed
+    """
+    snippets = []
+    for i, result in enumerate(chunk_results):
+        snippets.append(f"[C{i}] {result.get('content', '')[:300]}")
+    for i, result in enumerate(summary_results):
+        snippets.append(f"[S{i}] {result.get('summary_text', '')[:300]}")
+
+    prompt = f"""Given this query: "{query}"
+
+Rate the relevance of each item from 0-10 (10 = most relevant).
+Items labelled C are document chunks, items labelled S are document summaries.
+Return ONLY a JSON object mapping every label to its score, e.g. {{"C0": 7, "S0": 3}}.
+
+Items:
+{chr(10).join(snippets)}"""
+
+    model = GenerativeModel(QUERY_EXPANSION_MODEL)
+    response = model.generate_content(
+        prompt,
+        generation_config=_json_generation_config(temperature=0.0, max_output_tokens=512)
+    )
+    data = _parse_json_object(response.text)
+
+    def _scores(prefix: str, count: int) -> List[Optional[float]]:
+        scores = []
+        for i in range(count):
+            value = data.get(f"{prefix}{i}")
+            try:
+                scores.append(min(max(float(value), 0.0), 10.0) / 10.0)
+            except (TypeError, ValueError):
+                scores.append(None)
+        return scores
+
+    return _scores("C", len(chunk_results)), _scores("S", len(summary_results))
+
+
+def _order_by_scores(
+    results: List[Dict[str, Any]],
+    scores: List[Optional[float]]
+) -> List[Dict[str, Any]]:
+    """Sort results by score (stable, unscored items last) and attach 'rerank_score'."""
+    for result, score in zip(results, scores):
+        if score is not None:
+            result['rerank_score'] = score
+    order = sorted(range(len(results)), key=lambda i: 1.0 if scores[i] is None else -scores[i])
+    return [results[i] for i in order]
+
+
+def rerank_joint(
+    query: str,
+    chunk_results: List[Dict[str, Any]],
+    summary_results: List[Dict[str, Any]],
+    chunk_top_k: Optional[int] = None,
+    summary_top_k: Optional[int] = None
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Rerank both tiers with one LLM call, attaching per-item 'rerank_score' (0-1).
+    Falls back to local reranking if the LLM call or JSON parsing fails.
+
+    Args:
+        query: Original user query
+        chunk_results: Chunk candidates
+        summary_results: Summary candidates
+        chunk_top_k: Optional limit on chunks after reranking
+        summary_top_k: Optional limit on summaries after reranking
+
+    Returns:
+        Tuple of (reranked_chunks, reranked_summaries)
+    """
+    if len(chunk_results) + len(summary_results) <= 1:
+        return chunk_results[:chunk_top_k] if chunk_top_k else chunk_results, \
+            summary_results[:summary_top_k] if summary_top_k else summary_results
+
+    logger.info(f"Joint reranking {len(chunk_results)} chunks and {len(summary_results)} summaries for query: {query}")
+
+    try:
+        chunk_scores, summary_scores = score_results_jointly(query, chunk_results, summary_results)
+    except Exception as e:
+        logger.warning(f"Joint reranking failed: {e}. Falling back to local reranking.")
+        return rerank_local(query, chunk_results, top_k=chunk_top_k), \
+            rerank_local(query, summary_results, top_k=summary_top_k)
+
+    chunks = _order_by_scores(chunk_results, chunk_scores)
+    summaries = _order_by_scores(summary_results, summary_scores)
+    return chunks[:chunk_top_k] if chunk_top_k else chunks, \
+        summaries[:summary_top_k] if summary_top_k else summaries
+
+
+def _ambiguous_band(
+    ranked: List[Dict[str, Any]],
+    top_k: Optional[int],
+    margin: float,
+    max_candidates: int
+) -> Tuple[int, int]:
+    """
+    Find the span of locally ranked results whose scores are close to the top-k cutoff.
+
+    Returns:
+        (start, end) slice bounds; an empty or single-item span means no ambiguity
+    """
+    if len(ranked) <= 1:
+        return 0, 0
+    cutoff = min(top_k or len(ranked), len(ranked))
+    max_score = ranked[0].get('rerank_score', 0.0) or 1.0
+    cutoff_score = ranked[cutoff - 1].get('rerank_score', 0.0) / max_score
+
+    band = [
+        i for i, r in enumerate(ranked)
+        if abs(r.get('rerank_score', 0.0) / max_score - cutoff_score) <= margin
+    ][:max_candidates]
+    if len(band) <= 1:
+        return 0, 0
+    return band[0], band[-1] + 1
+
+
+def _normalize_scores(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Scale local 'rerank_score's (unbounded BM25 + proximity) to 0-1, the LLM score range."""
+    max_score = max((r.get('rerank_score', 0.0) for r in results), default=0.0)
+    for result in results:
+        result['rerank_score'] = result.get('rerank_score', 0.0) / max_score if max_score > 0 else 0.0
+    return results
+
+
+def _rescore_band(
+    ranked: List[Dict[str, Any]],
+    start: int,
+    end: int,
+    llm_scores: List[Optional[float]]
+) -> None:
+    """
+    Reorder ranked[start:end] by LLM score, mapping the 0-1 LLM scores into the
+    gap between the neighbouring local scores so the whole list keeps one
+    monotonic 'rerank_score' scale. Unscored items go to the bottom of the gap.
+    """
+    upper = ranked[start - 1]['rerank_score'] if start > 0 else 1.0
+    lower = ranked[end]['rerank_score'] if end < len(ranked) else 0.0
+    scores = [lower + (upper - lower) * min(max(score, 0.0), 1.0) if score is not None else lower
+              for score in llm_scores]
+    ranked[start:end] = _order_by_scores(ranked[start:end], scores)
+
+
+def rerank_hybrid(
+    query: str,
+    chunk_results: List[Dict[str, Any]],
+    summary_results: List[Dict[str, Any]],
+    chunk_top_k: Optional[int] = None,
+    summary_top_k: Optional[int] = None,
+    margin: Optional[float] = None,
+    max_llm_candidates: Optional[int] = None
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Rerank locally, then send only the ambiguous results around each tier's top-k
+    cutoff to the LLM, in a single joint call for both tiers.
+
+    Results whose normalized local score lies within `margin` of the score at the
+    cutoff are considered ambiguous; clear winners keep their local position and
+    clear losers are dropped without an LLM call. Every result's 'rerank_score'
+    is on one 0-1 scale: local scores are normalized per tier, and LLM scores
+    are mapped between the local scores around the ambiguous band.
+
+    Args:
+        query: Original user query
+        chunk_results: Chunk candidates
+        summary_results: Summary candidates
+        chunk_top_k: Optional limit on chunks after reranking
+        summary_top_k: Optional limit on summaries after reranking
+        margin: Score margin defining the ambiguous band (default from config)
+        max_llm_candidates: Maximum results per tier sent to the LLM (default from config)
+
+    Returns:
+        Tuple of (reranked_chunks, reranked_summaries)
+    """
+    retriever_config = get_config().retriever
+    if margin is None:
+        margin = retriever_config.hybrid_rerank_margin
+    if max_llm_candidates is None:
+        max_llm_candidates = retriever_config.hybrid_rerank_max_llm_candidates
+
+    chunks = _normalize_scores(rerank_local(query, chunk_results))
+    summaries = _normalize_scores(rerank_local(query, summary_results))
+
+    chunk_start, chunk_end = _ambiguous_band(chunks, chunk_top_k, margin, max_llm_candidates)
+    summary_start, summary_end = _ambiguous_band(summaries, summary_top_k, margin, max_llm_candidates)
+
+    if chunk_end or summary_end:
+        logger.info(f"Hybrid rerank: sending {chunk_end - chunk_start} chunks and "
+                    f"{summary_end - summary_start} summaries to LLM")
+        try:
+            chunk_scores, summary_scores = score_results_jointly(
+                query, chunks[chunk_start:chunk_end], summaries[summary_start:summary_end]
+            )
+            if chunk_end:
+                _rescore_band(chunks, chunk_start, chunk_end, chunk_scores)
+            if summary_end:
+                _rescore_band(summaries, summary_start, summary_end, summary_scores)
+        except Exception as e:
+            logger.warning(f"Hybrid LLM rerank failed: {e}. Keeping local order.")
+    else:
+        logger.info("Hybrid rerank: local order is unambiguous, skipping LLM")
+
+    return chunks[:chunk_top_k] if chunk_top_k else chunks, \
+        summaries[:summary_top_k] if summary_top_k else summaries
+
+
+def rerank_two_tier(
+    query: str,
+    chunk_results: List[Dict[str, Any]],
+    summary_results: List[Dict[str, Any]],
+    chunk_top_k: Optional[int] = None,
+    summary_top_k: Optional[int] = None,
+    mode: str = "llm"
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Rerank chunk and summary results with the selected reranking mode.
+
+    Args:
+        query: Original user query
+        chunk_results: Chunk candidates
+        summary_results: Summary candidates
+        chunk_top_k: Optional limit on chunks after reranking
+        summary_top_k: Optional limit on summaries after reranking
+        mode: "local", "llm" (one LLM call per tier), "joint" (one LLM call for both tiers),
+            or "hybrid" (local, with one joint LLM call for ambiguous results)
+
+    Returns:
+        Tuple of (reranked_chunks, reranked_summaries)
+    """
+    if mode == "joint":
+        return rerank_joint(query, chunk_results, summary_results, chunk_top_k, summary_top_k)
+    if mode == "hybrid":
+        return rerank_hybrid(query, chunk_results, summary_results, chunk_top_k, summary_top_k)
+
+    rerank = rerank_local if mode == "local" else rerank_by_relevance
+    if chunk_results:
+        chunk_results = rerank(query, chunk_results, top_k=chunk_top_k)
+    if summary_results:
+        summary_results = rerank(query, summary_results, top_k=summary_top_k)
+    return chunk_results, summary_results
+
+
 def merge_multi_query_results(
     queries: List[str],
     results_per_query: List[List[Dict[str, Any]]]
@@ -211,25 +766,8 @@ def merge_multi_query_results(
     """
     logger.info(f"Merging results from {len(queries)} query variations")
     
-    # Reciprocal Rank Fusion (RRF) scoring
-    # Score = sum(1 / (rank + k)) for each result's appearances
-    k = 60  # Constant from RRF paper
-    
-    result_scores = defaultdict(float)
-    result_map = {}
-    
-    for query_results in results_per_query:
-        for rank, result in enumerate(query_results, start=1):
-            result_id = result.get('id', '')
-            if result_id:
-                result_scores[result_id] += 1.0 / (rank + k)
-                if result_id not in result_map:
-                    result_map[result_id] = result
-    
-    # Sort by RRF score
-    sorted_ids = sorted(result_scores.keys(), key=lambda x: result_scores[x], reverse=True)
-    
-    merged = [result_map[result_id] for result_id in sorted_ids]
+    # Reciprocal Rank Fusion (RRF), every query variation weighted equally
+    merged, _ = weighted_rrf_fusion(list(zip(queries, results_per_query)))
     
     logger.info(f"Merged to {len(merged)} unique results")
     return merged
@@ -244,7 +782,8 @@ def search_two_tier_optimized(
     enable_deduplication: Optional[bool] = None,
     rerank_top_k: Optional[int] = None,
     use_adaptive_strategy: bool = True,
-    filter_logic: str = "OR"
+    filter_logic: str = "OR",
+    rerank_mode: Optional[str] = None
 ) -> Dict[str, Any]:
     """
     Optimized two-tier search with dynamic strategy selection.
@@ -260,12 +799,18 @@ def search_two_tier_optimized(
         rerank_top_k: Limit results after reranking (None = no limit)
         use_adaptive_strategy: Whether to use query analysis for dynamic decisions
         filter_logic: "OR" (match any filter) or "AND" (match all filters)
+        rerank_mode: "local", "llm", "joint", or "hybrid" (None = RETRIEVER_RERANK_MODE)
     
     Returns:
         Combined and optimized search results with metadata
     """
     logger.info(f"Optimized two-tier search for: {query}")
     
+    if rerank_mode is None:
+        rerank_mode = get_config().retriever.rerank_mode
+    if rerank_mode not in RERANK_MODES:
+        raise ValueError(f"Invalid rerank_mode '{rerank_mode}'. Must be one of {RERANK_MODES}")
+    
     # Step 1: Analyze query characteristics (if using adaptive strategy)
     query_characteristics = None
     if use_adaptive_strategy:
@@ -324,58 +869,69 @@ def search_two_tier_optimized(
         queries = expand_query_with_llm(query)
     
     # Step 6: Execute searches
+    search_backend = get_config().retriever.backend
+    hybrid_searcher = None
+    if search_backend == "hybrid":
+        hybrid_searcher = HybridSearcher()
+        chunk_search, summary_search = hybrid_searcher.search_chunks, hybrid_searcher.search_summaries
+    else:
+        chunk_search, summary_search = get_search_functions(search_backend)
     all_chunk_results = []
     all_summary_results = []
     
+    searches = []
+    for q in queries:
+        if search_chunks_enabled:
+            searches.append(("chunks", chunk_search, q, max_chunk_results))
+        if search_summaries_enabled:
+            searches.append(("summaries", summary_search, q, max_summary_results))
+    
+    def run_search(search):
+        tier, search_fn, q, limit = search
+        logger.info(f"Searching {tier} with: {q}")
+        return search_fn(q, max_results=limit, filter_expression=filter_expression)
+    
+    if hybrid_searcher and len(searches) > 1:
+        # Every hybrid search shares the request's budget, so run them together
+        with ThreadPoolExecutor(max_workers=len(searches), thread_name_prefix="hybrid-request") as pool:
+            search_results = list(pool.map(run_search, searches))
+    else:
+        search_results = [run_search(search) for search in searches]
+    
+    chunk_results_per_query = [results for (tier, *_), results in zip(searches, search_results) if tier == "chunks"]
+    summary_results_per_query = [results for (tier, *_), results in zip(searches, search_results) if tier == "summaries"]
+    
     if len(queries) > 1:
-        # Multi-query: collect results from each variation
-        chunk_results_per_query = []
-        summary_results_per_query = []
-        
-        for q in queries:
-            logger.info(f"Searching with variation: {q}")
-            
-            if search_chunks_enabled:
-                chunks = search_chunks(q, max_results=max_chunk_results, filter_expression=filter_expression)
-                chunk_results_per_query.append(chunks)
-            
-            if search_summaries_enabled:
-                summaries = search_summaries(q, max_results=max_summary_results, filter_expression=filter_expression)
-                summary_results_per_query.append(summaries)
-        
-        # Merge using RRF
+        # Multi-query: merge the results of each variation using RRF
         if chunk_results_per_query:
             all_chunk_results = merge_multi_query_results(queries, chunk_results_per_query)
         if summary_results_per_query:
             all_summary_results = merge_multi_query_results(queries, summary_results_per_query)
     else:
         # Single query: direct search
-        if search_chunks_enabled:
-            all_chunk_results = search_chunks(query, max_results=max_chunk_results, filter_expression=filter_expression)
-        if search_summaries_enabled:
-            all_summary_results = search_summaries(query, max_results=max_summary_results, filter_expression=filter_expression)
+        if chunk_results_per_query:
+            all_chunk_results = chunk_results_per_query[0]
+        if summary_results_per_query:
+            all_summary_results = summary_results_per_query[0]
     
     # Step 7: Deduplication (if enabled)
     if enable_deduplication:
+        dedup_threshold = get_config().retriever.deduplication_threshold
         if all_chunk_results:
-            all_chunk_results = deduplicate_results(all_chunk_results)
+            all_chunk_results = deduplicate_results(all_chunk_results, threshold=dedup_threshold)
         if all_summary_results:
-            all_summary_results = deduplicate_results(all_summary_results)
+            all_summary_results = deduplicate_results(all_summary_results, threshold=dedup_threshold)
     
     # Step 8: Reranking (if enabled)
     if enable_reranking:
-        if all_chunk_results:
-            all_chunk_results = rerank_by_relevance(
-                query, 
-                all_chunk_results, 
-                top_k=rerank_top_k or max_chunk_results
-            )
-        if all_summary_results:
-            all_summary_results = rerank_by_relevance(
-                query, 
-                all_summary_results, 
-                top_k=rerank_top_k or max_summary_results
-            )
+        all_chunk_results, all_summary_results = rerank_two_tier(
+            query,
+            all_chunk_results,
+            all_summary_results,
+            chunk_top_k=rerank_top_k or max_chunk_results,
+            summary_top_k=rerank_top_k or max_summary_results,
+            mode=rerank_mode
+        )
     else:
         # Apply limits without reranking
         if all_chunk_results:
@@ -395,14 +951,19 @@ def search_two_tier_optimized(
         "optimizations_applied": {
             "query_expansion": enable_query_expansion,
             "reranking": enable_reranking,
+            "rerank_mode": rerank_mode if enable_reranking else None,
             "deduplication": enable_deduplication,
             "adaptive_strategy": use_adaptive_strategy,
+            "search_backend": search_backend,
             "metadata_filter": filter_expression is not None,
             "filter_logic": filter_logic if filter_expression else None,
             "filter_expression": filter_expression
         }
     }
     
+    if hybrid_searcher:
+        result["hybrid_retrieval"] = hybrid_searcher.report(all_chunk_results, all_summary_results)
+    
     # Add query characteristics if analyzed
     if query_characteristics:
         result["query_characteristics"] = query_characteristics
@@ -423,8 +984,8 @@ def analyze_query_characteristics(query: str) -> Dict[str, Any]:
         - needs_summaries: bool (whether document summaries are needed)
         - filter_hints: list of metadata filter suggestions
     """
-    query_lower = query.lower()
     word_count = len(query.split())
+    matches = match_query(query)
     
     characteristics = {
         'query_type': 'factual',
@@ -435,122 +996,46 @@ def analyze_query_characteristics(query: str) -> Dict[str, Any]:
         'filter_hints': []
     }
     
-    # Determine query type
-    if any(kw in query_lower for kw in ['what is', 'define', 'definition', 'meaning of']):
-        characteristics['query_type'] = 'factual'
-        characteristics['needs_chunks'] = True
-        characteristics['needs_summaries'] = True  # Search both - data could be in either
-    
-    elif any(kw in query_lower for kw in ['compare', 'difference', 'versus', 'vs', 'contrast']):
-        characteristics['query_type'] = 'comparative'
-        characteristics['needs_chunks'] = True
-        characteristics['needs_summaries'] = True  # Need overview + details
-    
-    elif any(kw in query_lower for kw in ['how to', 'steps', 'process', 'procedure', 'protocol']):
-        characteristics['query_type'] = 'procedural'
-        characteristics['needs_chunks'] = True
-        characteristics['needs_summaries'] = True  # Search both for procedures
-    
-    elif any(kw in query_lower for kw in ['analyze', 'analysis', 'evaluate', 'assess', 'examine']):
-        characteristics['query_type'] = 'analytical'
-        characteristics['needs_chunks'] = True
-        characteristics['needs_summaries'] = True  # Analysis needs both overview and evidence
-    
-    elif any(kw in query_lower for kw in ['overview', 'about', 'tell me about', 'explain', 'describe']):
-        characteristics['query_type'] = 'exploratory'
-        characteristics['needs_chunks'] = True
-        characteristics['needs_summaries'] = True  # Exploration benefits from both
+    # Determine query type (first matching type in the query_patterns.RULES order).
+    # All types currently search both chunks and summaries.
+    query_type = matches.first('query_type')
+    if query_type:
+        characteristics['query_type'] = query_type
     
     # Determine complexity
     if word_count < 5:
         characteristics['complexity'] = 'simple'
-    elif word_count > 15 or any(kw in query_lower for kw in ['comprehensive', 'detailed', 'thorough', 'in-depth']):
+    elif word_count > 15 or matches.has('complexity', 'complex'):
         characteristics['complexity'] = 'complex'
     else:
         characteristics['complexity'] = 'moderate'
     
     # Determine scope
-    if any(kw in query_lower for kw in ['specific', 'particular', 'exact', 'precise']):
-        characteristics['scope'] = 'narrow'
-    elif any(kw in query_lower for kw in ['all', 'every', 'comprehensive', 'complete', 'entire', 'global']):
-        characteristics['scope'] = 'broad'
-    else:
-        characteristics['scope'] = 'medium'
+    characteristics['scope'] = matches.first('scope') or 'medium'
     
     # Extract filter hints from query
-    # Look for organization mentions (case-insensitive partial match)
-    orgs = {
-        'fatf': 'FATF',
-        'financial action task force': 'FATF',
-        'fiu': 'FIU',
-        'financial intelligence unit': 'FIU',
-        'un': 'UN',
-        'united nations': 'UN',
-        'imf': 'IMF',
-        'international monetary fund': 'IMF',
-        'world bank': 'World Bank',
-        'egmont': 'Egmont Group',
-        'egmont group': 'Egmont Group',
-        'wolfsberg': 'Wolfsberg Group',
-        'wolfsberg group': 'Wolfsberg Group',
-        'basel': 'Basel Committee',
-        'basel committee': 'Basel Committee',
-        'oecd': 'OECD'
-    }
-    
-    for org_key, org_value in orgs.items():
-        if org_key in query_lower:
-            characteristics['filter_hints'].append(('organization', org_value))
-            break  # Take first match to avoid duplicates
-    
-    # Look for topic/tag hints based on common AML/CTF terminology
-    # These should match the tags generated by summarize_chunks.py
-    topic_keywords = {
-        # Virtual assets / Crypto
-        ('crypto', 'virtual asset', 'vasp', 'cryptocurrency', 'bitcoin', 'digital currency'): 'virtual_assets',
-        # Sanctions
-        ('sanction', 'sanctions', 'sanctioned', 'embargo'): 'sanctions',
-        # Beneficial ownership
-        ('beneficial ownership', 'beneficial owner', 'bo', 'ubo', 'ultimate beneficial'): 'beneficial_ownership',
-        # Customer due diligence
-        ('cdd', 'customer due diligence', 'kyc', 'know your customer'): 'customer_due_diligence',
-        # Enhanced due diligence
-        ('edd', 'enhanced due diligence'): 'enhanced_due_diligence',
-        # PEPs
-        ('pep', 'peps', 'politically exposed', 'politically exposed person'): 'peps',
-        # Risk assessment
-        ('risk assessment', 'risk based approach', 'rba', 'risk management'): 'risk_assessment',
-        # Transaction monitoring
-        ('transaction monitoring', 'suspicious transaction', 'unusual transaction'): 'transaction_monitoring',
-        # SAR/STR
-        ('sar', 'str', 'suspicious activity report', 'suspicious transaction report'): 'suspicious_activity_reporting',
-        # Wire transfers
-        ('wire transfer', 'funds transfer', 'remittance'): 'wire_transfers',
-        # Trade-based money laundering
-        ('tbml', 'trade based', 'trade finance'): 'trade_based_money_laundering',
-        # Correspondent banking
-        ('correspondent bank', 'correspondent banking', 'nostro', 'vostro'): 'correspondent_banking',
-        # DNFBPs
-        ('dnfbp', 'designated non-financial', 'casino', 'real estate', 'lawyer', 'accountant'): 'dnfbps',
-        # NPOs
-        ('npo', 'non-profit', 'nonprofit', 'charity', 'charitable'): 'non_profit_organizations',
-        # Terrorism financing
-        ('terrorism financing', 'terrorist financing', 'ctf', 'cft', 'counter terrorism'): 'terrorism_financing',
-        # Money laundering
-        ('money laundering', 'aml', 'anti money laundering', 'laundering'): 'money_laundering',
-        # Proliferation financing
-        ('proliferation financing', 'wmd', 'weapons of mass destruction'): 'proliferation_financing'
-    }
+    # Take only the first matching organization and topic to avoid over-filtering
+    organization = matches.first('organization')
+    if organization:
+        characteristics['filter_hints'].append(('organization', organization))
     
-    for keywords, tag_value in topic_keywords.items():
-        if any(kw in query_lower for kw in keywords):
-            characteristics['filter_hints'].append(('topic', tag_value))
-            # Only add first matching topic to avoid over-filtering
-            break
+    topic = matches.first('topic')
+    if topic:
+        characteristics['filter_hints'].append(('topic', topic))
     
     return characteristics
 
 
+# Base (chunks, summaries) limits per query type
+BASE_RESULT_LIMITS = {
+    'factual': (5, 2),        # Fewer but precise chunks
+    'procedural': (12, 3),    # More chunks (step-by-step), fewer summaries
+    'comparative': (8, 6),    # Balanced sources for comparison
+    'analytical': (15, 7),    # Comprehensive evidence
+    'exploratory': (10, 5),   # Balanced approach
+}
+
+
 def adaptive_result_limits(query: str, query_characteristics: Optional[Dict[str, Any]] = None) -> Tuple[int, int]:
     """
     Determine optimal chunk and summary limits based on query characteristics.
@@ -570,30 +1055,7 @@ def adaptive_result_limits(query: str, query_characteristics: Optional[Dict[str,
     scope = query_characteristics['scope']
     
     # Base limits
-    base_chunks = 10
-    base_summaries = 5
-    
-    # Adjust by query type
-    if query_type == 'factual':
-        # Factual: need fewer but precise chunks
-        base_chunks = 5
-        base_summaries = 2
-    elif query_type == 'procedural':
-        # Procedural: need more chunks (step-by-step), fewer summaries
-        base_chunks = 12
-        base_summaries = 3
-    elif query_type == 'comparative':
-        # Comparative: need balanced sources for comparison
-        base_chunks = 8
-        base_summaries = 6
-    elif query_type == 'analytical':
-        # Analytical: need comprehensive evidence
-        base_chunks = 15
-        base_summaries = 7
-    elif query_type == 'exploratory':
-        # Exploratory: balanced approach
-        base_chunks = 10
-        base_summaries = 5
+    base_chunks, base_summaries = BASE_RESULT_LIMITS.get(query_type, (10, 5))
     
     # Adjust by complexity
     if complexity == 'simple':
@@ -4,10 +4,24 @@ Handles querying both chunk and summary datastores.
 """
 import logging
 import os
-from typing import List, Dict, Any, Optional
+import queue
+import random
+import threading
+import time
+from typing import List, Dict, Any, Optional, Sequence
 
+import grpc
 from dotenv import load_dotenv
+from google.api_core import exceptions as core_exceptions
+from google.api_core import gapic_v1
 from google.cloud import discoveryengine_v1beta as discoveryengine
+from google.cloud.discoveryengine_v1beta.services.search_service.transports.base import DEFAULT_CLIENT_INFO
+
+from apps.agent_api.performance_metrics import get_hedged_call_metrics
+from apps.agent_api.search_result import CHUNK_FIELDS, SUMMARY_FIELDS, SearchResult
+from apps.agent_api.document_fetch import fetch_source_chunks, fetch_source_summary
+from shared.manifest import get_manifest_entry
+from shared.telemetry import observe_vertex_search
 
 # Load environment variables first
 load_dotenv()
@@ -25,12 +39,178 @@ DISCOVERY_SERVING_CONFIG = os.getenv("DISCOVERY_SERVING_CONFIG")
 CHUNKS_DATASTORE_ID = os.getenv("CHUNKS_DATASTORE_ID")
 SUMMARIES_DATASTORE_ID = os.getenv("SUMMARIES_DATASTORE_ID")
 
+# Tail-latency protection
+SEARCH_TIMEOUT_S = float(os.getenv("VERTEX_SEARCH_TIMEOUT_S", "10"))  # Deadline per search call
+SEARCH_HEDGING_ENABLED = os.getenv("VERTEX_SEARCH_HEDGING", "true").lower() == "true"
+SEARCH_HEDGE_QUANTILE = float(os.getenv("VERTEX_SEARCH_HEDGE_QUANTILE", "0.95"))  # Hedge once this latency is exceeded
+SEARCH_HEDGE_MIN_SAMPLES = int(os.getenv("VERTEX_SEARCH_HEDGE_MIN_SAMPLES", "20"))  # Samples before hedging starts
+SEARCH_HEDGE_CONTROL_RATE = float(os.getenv("VERTEX_SEARCH_HEDGE_CONTROL_RATE", "0.05"))  # Calls left unhedged as a baseline
+SEARCH_RETRY_ATTEMPTS = int(os.getenv("VERTEX_SEARCH_RETRY_ATTEMPTS", "2"))  # Retries after a transient error
+SEARCH_RETRY_BACKOFF_MS = float(os.getenv("VERTEX_SEARCH_RETRY_BACKOFF_MS", "100"))  # First retry delay, doubled per retry
+
+# Status codes worth retrying (the service was briefly unreachable)
+_TRANSIENT_CODES = (grpc.StatusCode.UNAVAILABLE,)
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_search_client() -> discoveryengine.SearchServiceClient:
+    """Get the shared Discovery Engine search client (created once per process)."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = discoveryengine.SearchServiceClient()
+        return _client
+
+
+def _start_search(request: discoveryengine.SearchRequest, timeout: float):
+    """
+    Start a search RPC without blocking.
+    
+    Calls the raw transport (the GAPIC wrapper only blocks), so the client-info
+    and routing headers it would add are set here; retries live in execute_search.
+    
+    Returns:
+        A grpc future (supports done/result/exception/cancel/add_done_callback)
+    """
+    metadata = [
+        DEFAULT_CLIENT_INFO.to_grpc_metadata(),
+        gapic_v1.routing_header.to_grpc_metadata((("serving_config", request.serving_config),)),
+    ]
+    return get_search_client().transport.search.future(request, timeout=timeout, metadata=metadata)
+
+
+def _is_transient(error: BaseException) -> bool:
+    """Whether a failed attempt is worth retrying."""
+    if isinstance(error, grpc.RpcError):
+        return error.code() in _TRANSIENT_CODES
+    return isinstance(error, core_exceptions.ServiceUnavailable)
+
+
+def execute_search(request: discoveryengine.SearchRequest, operation: str) -> discoveryengine.SearchResponse:
+    """
+    Execute a search with a deadline, hedging slow calls.
+    
+    Once the primary attempt has run longer than the online SEARCH_HEDGE_QUANTILE
+    latency, an identical request is issued; the first successful response wins
+    and the other attempt is cancelled. A SEARCH_HEDGE_CONTROL_RATE sample of calls
+    is never hedged, giving the unhedged baseline. When the last outstanding attempt
+    fails with a transient error (UNAVAILABLE), the request is retried up to
+    SEARCH_RETRY_ATTEMPTS times with exponential backoff, within the same deadline.
+    Latencies and hedge outcomes are recorded in performance_metrics under `operation`.
+    
+    Args:
+        request: Search request
+        operation: Metrics name (e.g. "vertex_search.chunks")
+    
+    Returns:
+        Search response
+    
+    Raises:
+        google.api_core.exceptions.GoogleAPICallError: If every attempt failed or the deadline passed
+    """
+    metrics = get_hedged_call_metrics(operation)
+    start = time.monotonic()
+    deadline = start + SEARCH_TIMEOUT_S
+    completed: "queue.Queue" = queue.Queue()
+    attempts = []
+    
+    def launch(timeout: float):
+        attempt = _start_search(request, timeout)
+        attempts.append(attempt)
+        attempt.add_done_callback(completed.put)
+    
+    launch(SEARCH_TIMEOUT_S)
+    
+    hedge_delay_ms = None
+    if SEARCH_HEDGING_ENABLED and random.random() >= SEARCH_HEDGE_CONTROL_RATE:
+        hedge_delay_ms = metrics.hedge_delay_ms(SEARCH_HEDGE_QUANTILE, SEARCH_HEDGE_MIN_SAMPLES)
+    
+    winner = None
+    error = None
+    received = 0
+    retries = 0
+    primary_ms = None
+    hedge_pending = hedge_delay_ms is not None
+    hedge_attempt = None
+    while winner is None and received < len(attempts):
+        try:
+            if hedge_pending:
+                attempt = completed.get(timeout=max(0.0, start + hedge_delay_ms / 1000 - time.monotonic()))
+            else:
+                # RPC deadlines fire on their own; the margin only guards against a lost callback
+                attempt = completed.get(timeout=max(0.0, deadline - time.monotonic()) + 1.0)
+        except queue.Empty:
+            if hedge_pending:
+                hedge_pending = False
+                logger.info(f"{operation}: no response after {hedge_delay_ms:.0f}ms, sending hedged request")
+                launch(max(0.0, deadline - time.monotonic()))
+                hedge_attempt = attempts[-1]
+                continue
+            break
+        received += 1
+        if attempt is attempts[0]:
+            primary_ms = (time.monotonic() - start) * 1000
+        if attempt.cancelled():
+            continue
+        attempt_error = attempt.exception()
+        if attempt_error is None:
+            winner = attempt
+            continue
+        error = attempt_error
+        backoff_s = SEARCH_RETRY_BACKOFF_MS / 1000 * 2 ** retries
+        if (
+            received == len(attempts)
+            and retries < SEARCH_RETRY_ATTEMPTS
+            and _is_transient(error)
+            and time.monotonic() + backoff_s < deadline
+        ):
+            retries += 1
+            hedge_pending = False  # Retries are not hedged
+            logger.warning(f"{operation}: transient error ({error}), retry {retries} in {backoff_s * 1000:.0f}ms")
+            time.sleep(backoff_s)
+            launch(max(0.0, deadline - time.monotonic()))
+    
+    for attempt in attempts:
+        if attempt is not winner:
+            attempt.cancel()
+    
+    elapsed_ms = (time.monotonic() - start) * 1000
+    timed_out = winner is None and (
+        error is None
+        or (isinstance(error, grpc.RpcError) and error.code() == grpc.StatusCode.DEADLINE_EXCEEDED)
+    )
+    metrics.record(
+        latency_ms=elapsed_ms,
+        primary_ms=primary_ms if primary_ms is not None else elapsed_ms,
+        armed=hedge_delay_ms is not None,
+        hedged=hedge_attempt is not None,
+        hedge_won=winner is not None and winner is hedge_attempt,
+        timed_out=timed_out
+    )
+    observe_vertex_search(
+        operation,
+        "ok" if winner is not None else "timeout" if timed_out else "error",
+        len(attempts),
+        elapsed_ms / 1000
+    )
+    
+    if winner is not None:
+        return winner.result()
+    if error is None:
+        raise core_exceptions.DeadlineExceeded(f"{operation} exceeded {SEARCH_TIMEOUT_S}s deadline")
+    if isinstance(error, grpc.RpcError):
+        raise core_exceptions.from_grpc_error(error)
+    raise error
+
 
 def search_chunks(
     query: str,
     max_results: int = 10,
-    filter_expression: Optional[str] = None
-) -> List[Dict[str, Any]]:
+    filter_expression: Optional[str] = None,
+    fields: Optional[Sequence[str]] = None
+) -> List[SearchResult]:
     """
     Search the chunk datastore using Vertex AI Search.
 
@@ -38,6 +218,7 @@ def search_chunks(
         query: Search query string
         max_results: Maximum number of results to return
         filter_expression: Optional filter (e.g., "source_id: ANY('xyz')")
+        fields: Result fields to project (default CHUNK_FIELDS; add "metadata" for the full record)
 
     Returns:
         List of chunk results with content and metadata
@@ -45,9 +226,6 @@ def search_chunks(
     logger.info(f"Searching chunks with query: {query}")
 
     try:
-        # Initialize Discovery Engine Search client
-        client = discoveryengine.SearchServiceClient()
-
         # Build serving config for chunks datastore
         serving_config = (
             f"projects/{PROJECT_ID}/"
@@ -77,32 +255,18 @@ def search_chunks(
             logger.info(f"Applied filter: {filter_expression}")
 
         # Execute search
-        response = client.search(request=request)
-
-        # Process results
-        results = []
-        for result in response.results:
-            doc = result.document
-
-            # Convert struct_data to regular dict
-            struct_data = dict(doc.struct_data) if doc.struct_data else {}
-            page_number = struct_data.get("page_number")
-            if page_number is None:
-                page_number = struct_data.get("page")
-
-            results.append({
-                "id": doc.id,
-                "content": struct_data.get("content", ""),
-                "page_number": page_number,
-                "page": page_number,  # legacy key for backward compatibility
-                "start_sec": struct_data.get("start_sec"),
-                "end_sec": struct_data.get("end_sec"),
-                "source_id": struct_data.get("source_id"),
-                "filename": struct_data.get("filename"),
-                "title": struct_data.get("title"),
-                "score": getattr(result, 'relevance_score', 0.0),
-                "metadata": struct_data
-            })
+        response = execute_search(request, "vertex_search.chunks")
+
+        # Project only the requested fields out of each document's struct_data
+        results = [
+            SearchResult.project(
+                result.document.struct_data,
+                fields or CHUNK_FIELDS,
+                doc_id=result.document.id,
+                score=getattr(result, 'relevance_score', 0.0)
+            )
+            for result in response.results
+        ]
 
         logger.info(f"Found {len(results)} chunk results from Vertex AI Search")
         return results
@@ -115,8 +279,9 @@ def search_chunks(
 def search_summaries(
     query: str,
     max_results: int = 5,
-    filter_expression: Optional[str] = None
-) -> List[Dict[str, Any]]:
+    filter_expression: Optional[str] = None,
+    fields: Optional[Sequence[str]] = None
+) -> List[SearchResult]:
     """
     Search the summary datastore using Vertex AI Search.
     
@@ -124,6 +289,7 @@ def search_summaries(
         query: Search query string
         max_results: Maximum number of results to return
         filter_expression: Optional filter
+        fields: Result fields to project (default SUMMARY_FIELDS; add "metadata" for the full record)
     
     Returns:
         List of summary results with content and metadata
@@ -131,9 +297,6 @@ def search_summaries(
     logger.info(f"Searching summaries with query: {query}")
     
     try:
-        # Initialize Discovery Engine Search client
-        client = discoveryengine.SearchServiceClient()
-        
         # Build serving config for summaries datastore
         serving_config = (
             f"projects/{PROJECT_ID}/"
@@ -163,30 +326,18 @@ def search_summaries(
             logger.info(f"Applied filter: {filter_expression}")
         
         # Execute search
-        response = client.search(request=request)
+        response = execute_search(request, "vertex_search.summaries")
         
-        # Process results
-        results = []
-        for result in response.results:
-            doc = result.document
-            
-            # Convert struct_data to regular dict
-            struct_data = dict(doc.struct_data) if doc.struct_data else {}
-            
-            results.append({
-                "id": doc.id,
-                "summary_text": struct_data.get("summary_text", ""),
-                "source_id": struct_data.get("source_id"),
-                "filename": struct_data.get("filename"),
-                "title": struct_data.get("title"),
-                "author": struct_data.get("author"),
-                "organization": struct_data.get("organization"),
-                "date": struct_data.get("date"),
-                "publisher": struct_data.get("publisher"),
-                "tags": struct_data.get("tags", []),
-                "score": getattr(result, 'relevance_score', 0.0),
-                "metadata": struct_data
-            })
+        # Project only the requested fields out of each document's struct_data
+        results = [
+            SearchResult.project(
+                result.document.struct_data,
+                fields or SUMMARY_FIELDS,
+                doc_id=result.document.id,
+                score=getattr(result, 'relevance_score', 0.0)
+            )
+            for result in response.results
+        ]
         
         logger.info(f"Found {len(results)} summary results from Vertex AI Search")
         return results
@@ -231,23 +382,24 @@ def retrieve_by_source_id(source_id: str) -> Dict[str, Any]:
     """
     Retrieve all chunks and summary for a specific source_id.
     
+    Reads the source's chunk and summary JSONL files directly (cached by GCS
+    generation) rather than running a capped wildcard search.
+    
     Args:
         source_id: The source_id to retrieve
     
     Returns:
-        All chunks and summary for the document
+        All chunks (in document order) and summary for the document
     """
     logger.info(f"Retrieving all content for source_id={source_id}")
     
-    # Use filter to get only this source
-    filter_expr = f'source_id: ANY("{source_id}")'
-    
-    chunk_results = search_chunks("*", max_results=1000, filter_expression=filter_expr)
-    summary_results = search_summaries("*", max_results=1, filter_expression=filter_expr)
+    entry = get_manifest_entry(source_id)
+    chunk_results = fetch_source_chunks(source_id, entry=entry)
+    summary = fetch_source_summary(source_id, entry=entry)
     
     return {
         "source_id": source_id,
         "chunks": chunk_results,
-        "summary": summary_results[0] if summary_results else None,
+        "summary": summary,
         "total_chunks": len(chunk_results)
     }
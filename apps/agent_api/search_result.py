@@ -0,0 +1,171 @@
+"""
+Compact search result type for CENTEF RAG system.
+
+SearchResult replaces the per-result dicts built by the retrievers. Only the
+fields a caller declares are copied out of the datastore record (the protobuf
+Struct for Vertex AI Search), values live in __slots__ instead of a per-result
+dict, and the full record is only converted if "metadata" is requested and read.
+
+SearchResult is a read/write Mapping, so existing code using result['id'],
+result.get('content') or result['rerank_score'] = ... keeps working, and
+FastAPI/json serialize it through dict(result) / result.to_dict().
+"""
+from collections.abc import Mapping
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+# Default projections: the fields the retriever result dicts have always carried,
+# plus the source URI and page that citations used to read from the full metadata
+CHUNK_FIELDS: Tuple[str, ...] = (
+    "id", "content", "page_number", "page", "start_sec", "end_sec",
+    "source_id", "filename", "title", "source_uri", "simhash", "score",
+)
+SUMMARY_FIELDS: Tuple[str, ...] = (
+    "id", "summary_text", "source_id", "filename", "title", "source_uri", "author",
+    "organization", "date", "publisher", "tags", "simhash", "score",
+)
+
+# Every field that has a slot; anything else (e.g. rerank_score) goes to an overflow dict
+SLOT_FIELDS: Tuple[str, ...] = (
+    "id", "content", "summary_text", "page_number", "page", "start_sec", "end_sec",
+    "source_id", "filename", "title", "source_uri", "mimetype", "chunk_index", "author",
+    "organization", "date", "publisher", "tags", "description", "simhash", "score",
+)
+_SLOT_SET = frozenset(SLOT_FIELDS)
+
+# Record keys a source URI may be stored under (same order as synthesizer.resolve_source_uri)
+_SOURCE_URI_KEYS: Tuple[str, ...] = ("source_uri", "sourceUrl", "source_url", "gcs_uri", "gcsUrl", "url")
+
+# Defaults for missing fields, matching the old result dicts
+_FIELD_DEFAULTS = {"content": "", "summary_text": "", "tags": [], "score": 0.0}
+
+
+def to_plain(value: Any) -> Any:
+    """Convert proto-plus composites (MapComposite, RepeatedComposite) to dicts and lists."""
+    if isinstance(value, (str, bytes, int, float, bool)) or value is None:
+        return value
+    if isinstance(value, Mapping):
+        return {k: to_plain(v) for k, v in value.items()}
+    try:
+        return [to_plain(v) for v in value]
+    except TypeError:
+        return value
+
+
+class SearchResult(Mapping):
+    """A single chunk or summary search result."""
+
+    __slots__ = SLOT_FIELDS + ("_record", "_metadata", "_extra")
+
+    def __init__(self, **values: Any):
+        self._record = None
+        self._metadata = None
+        self._extra = None
+        for key, value in values.items():
+            self[key] = value
+
+    @classmethod
+    def project(
+        cls,
+        record: Mapping,
+        fields: Iterable[str],
+        doc_id: Optional[str] = None,
+        score: float = 0.0
+    ) -> "SearchResult":
+        """
+        Build a result holding only the requested fields of a datastore record.
+
+        Args:
+            record: Record mapping (a Vertex struct_data MapComposite or a plain dict)
+            fields: Field names to copy; "metadata" keeps a reference to the record
+                and converts it on first access
+            doc_id: Document ID (default: record['id'])
+            score: Relevance score
+
+        Returns:
+            SearchResult
+        """
+        result = cls()
+        for field in fields:
+            if field == "id":
+                result.id = doc_id if doc_id is not None else record.get("id")
+            elif field == "score":
+                result.score = score
+            elif field in ("page_number", "page"):
+                page_number = record.get("page_number")
+                if page_number is None:
+                    page_number = record.get("page")
+                result[field] = to_plain(page_number)
+            elif field == "source_uri":
+                result.source_uri = next((record.get(key) for key in _SOURCE_URI_KEYS if record.get(key)), None)
+            elif field == "metadata":
+                result._record = record
+            else:
+                value = record.get(field)
+                if value is None:
+                    value = _FIELD_DEFAULTS.get(field)
+                    result[field] = list(value) if isinstance(value, list) else value
+                else:
+                    result[field] = to_plain(value)
+        return result
+
+    def __getitem__(self, key: str) -> Any:
+        if key in _SLOT_SET:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if key == "metadata" and self._record is not None:
+            if self._metadata is None:
+                self._metadata = to_plain(self._record)
+            return self._metadata
+        if self._extra and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key in _SLOT_SET:
+            setattr(self, key, value)
+        elif key == "metadata":
+            self._record = self._metadata = value
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __iter__(self) -> Iterator[str]:
+        for key in SLOT_FIELDS:
+            if hasattr(self, key):
+                yield key
+        if self._record is not None:
+            yield "metadata"
+        if self._extra:
+            yield from self._extra
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __contains__(self, key: object) -> bool:
+        if key in _SLOT_SET:
+            return hasattr(self, key)
+        if key == "metadata":
+            return self._record is not None
+        return bool(self._extra) and key in self._extra
+
+    def copy(self) -> "SearchResult":
+        """Shallow copy, like dict.copy()."""
+        clone = SearchResult()
+        for key in SLOT_FIELDS:
+            if hasattr(self, key):
+                setattr(clone, key, getattr(self, key))
+        clone._record, clone._metadata = self._record, self._metadata
+        clone._extra = dict(self._extra) if self._extra else None
+        return clone
+
+    __copy__ = copy
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to a plain dictionary."""
+        return {key: self[key] for key in self}
+
+    def __repr__(self) -> str:
+        return f"SearchResult({self.to_dict()!r})"
@@ -6,8 +6,9 @@ import logging
 import os
 import re
 import sys
+from collections.abc import Mapping
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from urllib.parse import quote
 
 from dotenv import load_dotenv
@@ -18,8 +19,17 @@ from vertexai.preview.generative_models import GenerativeModel, GenerationConfig
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 
 from shared.llm_tracker import track_llm_call
+from shared.telemetry import observe_answer_model
 from shared.chat_history import MessageRole
 from shared.manifest import ManifestEntry
+from apps.agent_api.citation_processor import (
+    CITATION_SCANNER,
+    MAX_CITATION_CHARS,
+    process_citations,
+    resolve_placeholder_labels,
+)
+from apps.agent_api.model_health import get_breaker, next_available_model
+from apps.agent_api.prompt_cache import build_split_prompt, get_prompt_prefix_cache, model_for_prompt
 
 # Load environment variables
 load_dotenv()
@@ -57,6 +67,36 @@ if GEMINI_MODEL and GEMINI_MODEL not in FALLBACK_MODELS:
 vertexai.init(project=PROJECT_ID, location=GENERATION_LOCATION)
 
 
+def build_static_synthesis_prefix() -> str:
+    """
+    Build the request-independent start of the synthesis prompt (role, domain
+    context and citation requirements).
+
+    Returns:
+        Prefix text (ends with a newline)
+    """
+    prompt_parts = [
+        "You are an expert assistant for the CENTEF (Center for Research of Terror Financing) knowledge base.",
+        "Your role is to provide accurate, comprehensive answers about terrorism financing, money laundering,",
+        "counter-terrorism finance (CTF), and related topics based on the provided documents.",
+        "",
+        "IMPORTANT CONTEXT:",
+        "- AML = Anti-Money Laundering",
+        "- CTF/CFT = Counter-Terrorism Financing / Combating the Financing of Terrorism",
+        "- FATF = Financial Action Task Force",
+        "",
+        "CITATION REQUIREMENTS:",
+        "1. Use information from the provided sources below",
+        "2. Cite specific sources when making claims using this format: [Document Title, Page X] or [Document Title, Timestamp X:XX] for videos",
+        "3. Place citations immediately after the relevant claim in square brackets",
+        "4. If abbreviations like AML, CTF, CFT appear in the documents, use the full terms in your answer",
+        "5. Synthesize information across multiple sources when relevant",
+        "6. Structure your answer clearly with relevant sections if appropriate",
+        "",
+    ]
+    return "\n".join(prompt_parts) + "\n"
+
+
 def build_synthesis_prompt(
     query: str,
     summary_results: List[Dict[str, Any]],
@@ -65,6 +105,8 @@ def build_synthesis_prompt(
 ) -> str:
     """
     Build a prompt for Gemini that includes query and retrieval results.
+    The static instructions come first (see build_static_synthesis_prefix) so
+    they can be reused across requests.
     
     Args:
         query: User's question
@@ -73,19 +115,9 @@ def build_synthesis_prompt(
         conversation_history: Optional list of previous ChatMessage objects
     
     Returns:
-        Formatted prompt string
+        Formatted prompt string (a SplitPrompt)
     """
-    prompt_parts = [
-        "You are an expert assistant for the CENTEF (Center for Research of Terror Financing) knowledge base.",
-        "Your role is to provide accurate, comprehensive answers about terrorism financing, money laundering,",
-        "counter-terrorism finance (CTF), and related topics based on the provided documents.",
-        "",
-        "IMPORTANT CONTEXT:",
-        "- AML = Anti-Money Laundering",
-        "- CTF/CFT = Counter-Terrorism Financing / Combating the Financing of Terrorism",
-        "- FATF = Financial Action Task Force",
-        "",
-    ]
+    prompt_parts = []
     
     # Add conversation history if available
     if conversation_history and len(conversation_history) > 0:
@@ -106,14 +138,6 @@ def build_synthesis_prompt(
         prompt_parts.append("")
     
     prompt_parts.extend([
-        "CITATION REQUIREMENTS:",
-        "1. Use information from the provided sources below",
-        "2. Cite specific sources when making claims using this format: [Document Title, Page X] or [Document Title, Timestamp X:XX] for videos",
-        "3. Place citations immediately after the relevant claim in square brackets",
-        "4. If abbreviations like AML, CTF, CFT appear in the documents, use the full terms in your answer",
-        "5. Synthesize information across multiple sources when relevant",
-        "6. Structure your answer clearly with relevant sections if appropriate",
-        "",
         f"USER QUESTION: {query}",
         "",
         "=" * 80,
@@ -168,7 +192,7 @@ def build_synthesis_prompt(
     else:
         prompt_parts.append("(No detailed chunks available)")
     
-    return "\n".join(prompt_parts)
+    return build_split_prompt("standard", build_static_synthesis_prefix, "\n".join(prompt_parts))
 
 
 def format_timestamp(seconds: float) -> str:
@@ -283,7 +307,7 @@ def resolve_source_uri(
         return manifest_entry.source_uri
 
     def _extract_candidate(metadata: Optional[Dict[str, Any]]) -> Optional[str]:
-        if not isinstance(metadata, dict):
+        if not isinstance(metadata, Mapping):
             return None
         for key in ("source_uri", "sourceUrl", "source_url", "gcs_uri", "gcsUrl", "url"):
             value = metadata.get(key)
@@ -299,9 +323,9 @@ def resolve_source_uri(
     if manifest_entry and manifest_entry.filename:
         filename = manifest_entry.filename
     else:
-        if isinstance(primary_metadata, dict):
+        if isinstance(primary_metadata, Mapping):
             filename = primary_metadata.get("filename")
-        if not filename and isinstance(secondary_metadata, dict):
+        if not filename and isinstance(secondary_metadata, Mapping):
             filename = secondary_metadata.get("filename")
 
     if filename and SOURCE_BUCKET:
@@ -363,13 +387,7 @@ def replace_inline_placeholder_labels(
     """
     Replace inline [Document N, ...] / [Chunk N, ...] tokens with actual titles.
     """
-    def _sub(match: re.Match) -> str:
-        content = match.group(1)
-        replaced = _replace_label_token(content, DOCUMENT_LABEL_PATTERN, document_label_map)
-        replaced = _replace_label_token(replaced, CHUNK_LABEL_PATTERN, chunk_label_map)
-        return f"[{replaced}]"
-
-    return BRACKET_CONTENT_PATTERN.sub(_sub, text)
+    return resolve_placeholder_labels(text, document_label_map, chunk_label_map)
 
 
 def extract_inline_citations(answer_text: str) -> List[str]:
@@ -384,12 +402,10 @@ def extract_inline_citations(answer_text: str) -> List[str]:
     """
     citations = []
     # Match [Document Title, Page X] or [Document Title, Timestamp X:XX] patterns
-    citation_pattern = re.compile(r'\[([^\]]+)\]')
-    
-    for match in citation_pattern.finditer(answer_text):
+    for match in CITATION_SCANNER.finditer(answer_text):
         citation = match.group(1).strip()
         # Filter out citations that look like they have document content (too long)
-        if citation and len(citation) < 200 and citation not in citations:
+        if citation and len(citation) < MAX_CITATION_CHARS and citation not in citations:
             citations.append(citation)
     
     return citations
@@ -397,167 +413,114 @@ def extract_inline_citations(answer_text: str) -> List[str]:
 
 def post_process_answer_and_sources(
     answer_text: str,
-    all_sources: List[Dict[str, Any]]
+    all_sources: List[Dict[str, Any]],
+    document_label_map: Optional[Dict[str, str]] = None,
+    chunk_label_map: Optional[Dict[str, str]] = None
 ) -> Dict[str, Any]:
     """
     Post-process answer to:
-    1. Extract inline citations
-    2. Match citations to sources
+    1. Resolve [Document N] / [Chunk N] placeholders (if label maps are given)
+    2. Extract inline citations and match them to sources
     3. Number citations consistently
     4. Replace inline citations with numbered references [1], [2], etc.
     5. Return final answer and matched sources list
+
+    All in one pass over the answer (see citation_processor.py).
     
     Args:
         answer_text: Answer with inline citations like [Title, Page X]
         all_sources: All available sources
+        document_label_map: Mapping of document indices to titles
+        chunk_label_map: Mapping of chunk indices to titles
     
     Returns:
         Dict with processed_answer, sources (ordered list), and citation_map
     """
     logger.info("Post-processing answer and sources...")
-    
-    # Extract all inline citations
-    inline_citations = extract_inline_citations(answer_text)
-    logger.info(f"Found {len(inline_citations)} inline citations")
-    
-    # Match each citation to a source
-    citation_to_source = {}
-    matched_sources = []
-    source_to_number = {}
-    
-    for citation in inline_citations:
-        citation_lower = citation.lower()
-        
-        # Try to match with sources
-        matched = False
-        for source in all_sources:
-            source_title = source['title'].lower()
-            source_id = source.get('source_id', '').lower()
-            
-            # Match by title or source_id
-            if source_title in citation_lower or citation_lower in source_title or source_id in citation_lower:
-                # Check if this source is already matched
-                if source['source_id'] not in source_to_number:
-                    # Add to matched sources list
-                    matched_sources.append(source)
-                    source_num = len(matched_sources)
-                    source_to_number[source['source_id']] = source_num
-                    citation_to_source[citation] = source_num
-                else:
-                    # Reuse existing number
-                    citation_to_source[citation] = source_to_number[source['source_id']]
-                
-                matched = True
-                break
-        
-        if not matched:
-            logger.warning(f"Could not match citation to source: {citation[:100]}")
-    
-    # Replace inline citations with numbered references
-    processed_answer = answer_text
-    
-    # Sort citations by length (longest first) to avoid partial replacements
-    sorted_citations = sorted(inline_citations, key=len, reverse=True)
-    
-    for citation in sorted_citations:
-        if citation in citation_to_source:
-            source_num = citation_to_source[citation]
-            # Replace [Full Citation] with [N]
-            processed_answer = processed_answer.replace(f"[{citation}]", f"[{source_num}]")
-    
-    logger.info(f"Matched {len(matched_sources)} sources with numbered citations")
-    
-    return {
-        "processed_answer": processed_answer,
-        "sources": matched_sources,
-        "citation_map": citation_to_source
-    }
+    return process_citations(answer_text, all_sources, document_label_map, chunk_label_map)
 
 
-def synthesize_answer(
-    query: str,
-    summary_results: List[Dict[str, Any]],
-    chunk_results: List[Dict[str, Any]],
-    temperature: float = 0.2,
-    max_output_tokens: int = 2048,
+def extract_usage_metadata(response: Any) -> Optional[Dict[str, int]]:
+    """Token usage from a generate_content response (or the last streamed chunk)."""
+    usage = getattr(response, 'usage_metadata', None)
+    if usage is None:
+        return None
+    usage_metadata = {
+        'prompt_token_count': getattr(usage, 'prompt_token_count', 0),
+        'candidates_token_count': getattr(usage, 'candidates_token_count', 0),
+        'total_token_count': getattr(usage, 'total_token_count', 0),
+    }
+    # Prompt tokens served from a context cache (newer SDKs only)
+    cached_tokens = getattr(usage, 'cached_content_token_count', 0)
+    if isinstance(cached_tokens, int) and cached_tokens:
+        usage_metadata['cached_content_token_count'] = cached_tokens
+    return usage_metadata
+
+
+def generate_with_fallback(
+    prompt: str,
+    generation_config: GenerationConfig,
+    source_function: str,
+    operation: str = "chat_answer",
     user_id: Optional[str] = None,
     session_id: Optional[str] = None,
-    conversation_history: Optional[List[Any]] = None
-) -> Dict[str, Any]:
+    temperature: Optional[float] = None,
+    max_tokens: Optional[int] = None
+) -> Tuple[Optional[str], Optional[str], Optional[Dict[str, int]], Optional[Exception]]:
     """
-    Generate an answer using Gemini based on retrieval results.
+    Generate with the first healthy model in FALLBACK_MODELS.
+
+    Models whose circuit breaker is open (recent 429/quota errors) are skipped
+    without a call; every attempt reports its outcome to the model's breaker.
 
     Args:
-        query: User's question
-        summary_results: Summary search results
-        chunk_results: Chunk search results
-        temperature: Model temperature (0.0 - 1.0)
-        max_output_tokens: Maximum length of generated answer
+        prompt: Prompt text
+        generation_config: Generation parameters
+        source_function: Caller name for LLM call tracking
+        operation: Operation name for LLM call tracking
         user_id: Optional user ID for tracking
         session_id: Optional session ID for tracking
-        conversation_history: Optional list of previous ChatMessage objects for context
+        temperature: Temperature (for tracking)
+        max_tokens: Max output tokens (for tracking)
 
     Returns:
-        Dictionary with answer text and metadata
+        Tuple of (answer_text, model_used, usage_metadata, last_error);
+        answer_text is None if no model produced an answer
     """
-    logger.info(f"Synthesizing answer for query: {query}")
-    logger.info(f"Using {len(summary_results)} summaries and {len(chunk_results)} chunks")
-    if conversation_history:
-        logger.info(f"Including {len(conversation_history)} messages from conversation history")
-
-    # Build prompt with conversation history
-    prompt = build_synthesis_prompt(query, summary_results, chunk_results, conversation_history)
-
-    logger.info(f"Prompt length: {len(prompt)} characters")
-
-    # Configure generation
-    generation_config = GenerationConfig(
-        temperature=temperature,
-        max_output_tokens=max_output_tokens,
-        top_p=0.95,
-    )
-
-    # Try models in order until one succeeds
-    answer_text = None
-    model_used = None
     last_error = None
-    usage_metadata = None  # Track token usage
+    model_name = next_available_model(FALLBACK_MODELS)
 
-    for model_name in FALLBACK_MODELS:
-        # Track this LLM call
+    while model_name is not None:
+        breaker = get_breaker(model_name)
         with track_llm_call(
-            source_function="synthesize_answer",
+            source_function=source_function,
             api_provider="gemini",
             api_type="generative",
             model=model_name,
-            operation="chat_answer",
+            operation=operation,
             user_id=user_id,
             session_id=session_id,
             temperature=temperature,
-            max_tokens=max_output_tokens
+            max_tokens=max_tokens
         ) as call:
             try:
                 logger.info(f"Attempting model: {model_name}")
-                model = GenerativeModel(model_name)
+                # Sends only the suffix when the prompt's static prefix is in a context cache
+                model, contents = model_for_prompt(GenerativeModel, model_name, prompt)
 
                 response = model.generate_content(
-                    prompt,
+                    contents,
                     generation_config=generation_config
                 )
 
                 answer_text = response.text
-                model_used = model_name
+                breaker.record_success()
 
                 # Extract token usage if available
-                if hasattr(response, 'usage_metadata'):
-                    usage_metadata = {
-                        'prompt_token_count': getattr(response.usage_metadata, 'prompt_token_count', 0),
-                        'candidates_token_count': getattr(response.usage_metadata, 'candidates_token_count', 0),
-                        'total_token_count': getattr(response.usage_metadata, 'total_token_count', 0),
-                    }
+                usage_metadata = extract_usage_metadata(response)
+                get_prompt_prefix_cache().record_usage(usage_metadata)
+                if usage_metadata:
                     logger.info(f"Token usage: {usage_metadata}")
-
-                    # Update tracking with token counts
                     call.update_tokens(
                         input_tokens=usage_metadata['prompt_token_count'],
                         output_tokens=usage_metadata['candidates_token_count'],
@@ -565,30 +528,78 @@ def synthesize_answer(
                     )
 
                 logger.info(f"✅ Success with {model_name} - Generated {len(answer_text)} characters")
-                break
+                observe_answer_model(model_name, FALLBACK_MODELS[0])
+                return answer_text, model_name, usage_metadata, None
 
             except Exception as e:
                 error_msg = str(e)
                 logger.warning(f"❌ Model {model_name} failed: {error_msg}")
                 last_error = e
-
-                # Mark call as error in tracking
                 call.set_error(error_msg)
+                breaker.record_failure(e)
 
-                # Check if it's a rate limit error (429)
-                if "429" in error_msg or "Resource exhausted" in error_msg:
-                    logger.info(f"Rate limit hit on {model_name}, trying next fallback...")
-                    continue
+        model_name = next_available_model(FALLBACK_MODELS, after=model_name)
 
-                # Check if it's a quota error
-                if "quota" in error_msg.lower() or "insufficient" in error_msg.lower():
-                    logger.info(f"Quota issue on {model_name}, trying next fallback...")
-                    continue
+    observe_answer_model(None, FALLBACK_MODELS[0])
+    return None, None, None, last_error
+
+
+def synthesize_answer(
+    query: str,
+    summary_results: List[Dict[str, Any]],
+    chunk_results: List[Dict[str, Any]],
+    temperature: float = 0.2,
+    max_output_tokens: int = 2048,
+    user_id: Optional[str] = None,
+    session_id: Optional[str] = None,
+    conversation_history: Optional[List[Any]] = None,
+    include_follow_ups: bool = True
+) -> Dict[str, Any]:
+    """
+    Generate an answer using Gemini based on retrieval results.
+
+    Args:
+        query: User's question
+        summary_results: Summary search results
+        chunk_results: Chunk search results
+        temperature: Model temperature (0.0 - 1.0)
+        max_output_tokens: Maximum length of generated answer
+        user_id: Optional user ID for tracking
+        session_id: Optional session ID for tracking
+        conversation_history: Optional list of previous ChatMessage objects for context
+        include_follow_ups: Whether to generate follow-up questions before returning
+
+    Returns:
+        Dictionary with answer text and metadata
+    """
+    logger.info(f"Synthesizing answer for query: {query}")
+    logger.info(f"Using {len(summary_results)} summaries and {len(chunk_results)} chunks")
+    if conversation_history:
+        logger.info(f"Including {len(conversation_history)} messages from conversation history")
+
+    # Build prompt with conversation history
+    prompt = build_synthesis_prompt(query, summary_results, chunk_results, conversation_history)
+
+    logger.info(f"Prompt length: {len(prompt)} characters")
+
+    # Configure generation
+    generation_config = GenerationConfig(
+        temperature=temperature,
+        max_output_tokens=max_output_tokens,
+        top_p=0.95,
+    )
+
+    # Try models in order (skipping rate-limited ones) until one succeeds
+    answer_text, model_used, usage_metadata, last_error = generate_with_fallback(
+        prompt,
+        generation_config,
+        source_function="synthesize_answer",
+        user_id=user_id,
+        session_id=session_id,
+        temperature=temperature,
+        max_tokens=max_output_tokens
+    )
 
-                # For other errors, try next model but log more details
-                logger.error(f"Unexpected error with {model_name}: {error_msg}")
-                continue
-    
     # If all models failed, use fallback response
     if answer_text is None:
         logger.error(f"All models failed. Last error: {last_error}")
@@ -608,16 +619,15 @@ def synthesize_answer(
     chunk_label_map: Dict[str, str] = {}
     
     # Import manifest to get source_uri
-    from shared.manifest import get_manifest_entry
+    from shared.manifest import get_manifest_entries_by_ids
 
-    manifest_cache: Dict[str, Optional["ManifestEntry"]] = {}
+    # Resolve every cited source in one pass over the shared manifest view
+    manifest_entries: Dict[str, Optional["ManifestEntry"]] = get_manifest_entries_by_ids(
+        r.get('source_id') for r in list(summary_results) + list(chunk_results)
+    )
 
     def fetch_manifest_entry(source_id: Optional[str]):
-        if not source_id:
-            return None
-        if source_id not in manifest_cache:
-            manifest_cache[source_id] = get_manifest_entry(source_id)
-        return manifest_cache[source_id]
+        return manifest_entries.get(source_id) if source_id else None
 
     # Add summaries (no page numbers, represent whole document)
     for idx, summary in enumerate(summary_results, 1):
@@ -649,7 +659,7 @@ def synthesize_answer(
     for idx, chunk in enumerate(chunk_results, 1):
         source_id = chunk.get('source_id')
         manifest_entry = fetch_manifest_entry(source_id)
-        chunk_metadata = chunk.get('metadata') if isinstance(chunk.get('metadata'), dict) else {}
+        chunk_metadata = chunk.get('metadata') if isinstance(chunk.get('metadata'), Mapping) else {}
         chunk_title = (
             chunk.get('title')
             or (manifest_entry.title if manifest_entry else None)
@@ -714,22 +724,20 @@ def synthesize_answer(
         
         all_sources.append(source_info)
     
-    # Replace placeholder labels in answer
-    sanitized_answer = replace_inline_placeholder_labels(
+    # Post-process answer: resolve placeholder labels, match citations to sources and number them
+    post_processed = post_process_answer_and_sources(
         answer_text,
+        all_sources,
         document_label_map,
         chunk_label_map,
     )
-    
-    # Post-process answer: match citations to sources and number them
-    post_processed = post_process_answer_and_sources(sanitized_answer, all_sources)
     final_answer = post_processed["processed_answer"]
     cited_sources = post_processed["sources"]
     
     logger.info(f"Post-processing: {len(all_sources)} sources → {len(cited_sources)} cited sources with numbered references")
     
-    # Generate follow-up questions
-    follow_up_questions = generate_follow_up_questions(query, final_answer, num_questions=3)
+    # Generate follow-up questions (callers running them asynchronously pass include_follow_ups=False)
+    follow_up_questions = generate_follow_up_questions(query, final_answer, num_questions=3) if include_follow_ups else []
     
     result = {
         "query": query,
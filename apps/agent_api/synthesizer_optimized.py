@@ -6,6 +6,8 @@ import logging
 import os
 import re
 import sys
+import time
+from collections.abc import Mapping
 from pathlib import Path
 from typing import List, Dict, Any, Optional, Iterator, Tuple
 from urllib.parse import quote
@@ -18,6 +20,7 @@ from vertexai.preview.generative_models import GenerativeModel, GenerationConfig
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 
 from shared.llm_tracker import track_llm_call
+from shared.telemetry import observe_answer_model
 from shared.chat_history import MessageRole
 
 # Import existing synthesizer functions
@@ -25,15 +28,27 @@ from apps.agent_api.synthesizer import (
     build_synthesis_prompt,
     extract_inline_citations,
     post_process_answer_and_sources,
-    replace_inline_placeholder_labels,
     resolve_source_uri,
     build_authorized_url,
     format_timestamp,
     format_page_range,
     FALLBACK_MODELS,
+    extract_usage_metadata,
+    generate_with_fallback,
     DOCUMENT_LABEL_PATTERN,
     CHUNK_LABEL_PATTERN
 )
+from apps.agent_api.citation_processor import CitationProcessor
+from apps.agent_api.query_patterns import match_query
+from apps.agent_api.model_health import get_breaker, next_available_model
+from apps.agent_api.token_budget import fit_context, get_token_counter
+from apps.agent_api.prompt_cache import SplitPrompt, build_split_prompt, get_prompt_prefix_cache, model_for_prompt
+from apps.agent_api.answer_cache import (
+    ANSWER_CACHE_ENABLED,
+    answer_cache_key,
+    get_answer_cache,
+    record_cache_hit,
+)
 
 load_dotenv()
 
@@ -52,16 +67,16 @@ SOURCE_BUCKET = os.getenv("SOURCE_BUCKET", "centef-rag-bucket")
 
 def estimate_token_count(text: str) -> int:
     """
-    Rough estimation of token count for text.
-    Uses ~4 characters per token heuristic.
+    Token count for text, from the shared token counter (Gemini's tokenizer
+    when available, otherwise a calibrated script-aware estimate).
     
     Args:
         text: Input text
     
     Returns:
-        Estimated token count
+        Token count
     """
-    return len(text) // 4
+    return get_token_counter().count(text)
 
 
 def smart_context_truncation(
@@ -70,12 +85,12 @@ def smart_context_truncation(
     max_tokens: int = 24000
 ) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
     """
-    Intelligently truncate context to fit within token limits while preserving most relevant content.
+    Truncate context to fit within token limits while preserving most relevant content.
     
-    Strategy:
-    1. Keep all summaries (usually small)
-    2. Prioritize top-ranked chunks
-    3. Truncate individual chunk content if needed
+    Strategy (see token_budget.fit_context):
+    1. Summaries get up to SUMMARY_BUDGET_SHARE of the budget, chunks the rest
+    2. Within each tier, budget is allocated by retrieval/rerank score
+    3. Over-budget content is cut on paragraph/sentence boundaries
     
     Args:
         summary_results: List of summary search results
@@ -85,64 +100,118 @@ def smart_context_truncation(
     Returns:
         Tuple of (truncated_summaries, truncated_chunks)
     """
+    summaries, chunks, _ = _fit_context_logged(summary_results, chunk_results, max_tokens)
+    return summaries, chunks
+
+
+def _fit_context_logged(
+    summary_results: List[Dict[str, Any]],
+    chunk_results: List[Dict[str, Any]],
+    max_tokens: int
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], Dict[str, Any]]:
     logger.info(f"Truncating context to fit {max_tokens} tokens")
-    
-    # Reserve tokens for prompt structure (~2000 tokens)
-    available_tokens = max_tokens - 2000
-    
-    # Allocate tokens: 20% for summaries, 80% for chunks
-    summary_budget = int(available_tokens * 0.2)
-    chunk_budget = int(available_tokens * 0.8)
-    
-    # Process summaries
-    truncated_summaries = []
-    used_summary_tokens = 0
-    
-    for summary in summary_results:
-        summary_text = summary.get('summary_text', '')
-        tokens = estimate_token_count(summary_text)
-        
-        if used_summary_tokens + tokens > summary_budget:
-            # Truncate this summary
-            available = summary_budget - used_summary_tokens
-            if available > 100:  # Only include if we can fit meaningful content
-                chars = available * 4
-                summary_copy = summary.copy()
-                summary_copy['summary_text'] = summary_text[:chars] + "..."
-                truncated_summaries.append(summary_copy)
-                used_summary_tokens += available
-            break
-        else:
-            truncated_summaries.append(summary)
-            used_summary_tokens += tokens
-    
-    # Process chunks
-    truncated_chunks = []
-    used_chunk_tokens = 0
-    
-    for chunk in chunk_results:
-        content = chunk.get('content', '')
-        tokens = estimate_token_count(content)
-        
-        if used_chunk_tokens + tokens > chunk_budget:
-            # Try to fit truncated version
-            available = chunk_budget - used_chunk_tokens
-            if available > 200:  # Need meaningful chunk content
-                chars = available * 4
-                chunk_copy = chunk.copy()
-                chunk_copy['content'] = content[:chars] + "..."
-                truncated_chunks.append(chunk_copy)
-                used_chunk_tokens += available
-            break
-        else:
-            truncated_chunks.append(chunk)
-            used_chunk_tokens += tokens
-    
-    logger.info(f"Context truncation: {len(truncated_summaries)}/{len(summary_results)} summaries, "
-                f"{len(truncated_chunks)}/{len(chunk_results)} chunks")
-    logger.info(f"Token usage: ~{used_summary_tokens + used_chunk_tokens}/{available_tokens}")
-    
-    return truncated_summaries, truncated_chunks
+    summaries, chunks, plan = fit_context(summary_results, chunk_results, max_tokens)
+    logger.info(f"Context truncation: {len(summaries)}/{len(summary_results)} summaries, "
+                f"{len(chunks)}/{len(chunk_results)} chunks")
+    logger.info(f"Token usage: {plan['summary_tokens'] + plan['chunk_tokens']}/{plan['budget_tokens']} "
+                f"({plan['counter']}, {plan['dropped_tokens']} tokens left out)")
+    return summaries, chunks, plan
+
+
+DEFAULT_FORMAT_INFO = {
+    'format_type': 'general_answer',
+    'length': 'medium',
+    'structure': 'paragraphs',
+    'temperature': 0.2,
+    'max_tokens': 2048,
+    'style': 'formal'
+}
+
+# Output format profiles, keyed by the output_format labels in query_patterns.RULES.
+# Detection priority follows the RULES order.
+FORMAT_PROFILES = {
+    # Brief/Summary formats (200-500 tokens)
+    'brief_summary': ("Brief Summary", {
+        'format_type': 'brief_summary',
+        'length': 'brief',
+        'structure': 'bullets',
+        'temperature': 0.15,
+        'max_tokens': 500,
+        'style': 'concise'
+    }),
+    # Tweet/Social Media (50-280 characters worth, ~100 tokens)
+    'social_media': ("Social Media Post", {
+        'format_type': 'social_media',
+        'length': 'brief',
+        'structure': 'single_paragraph',
+        'temperature': 0.4,
+        'max_tokens': 150,
+        'style': 'casual_engaging'
+    }),
+    # Blog Post/Article (1000-2000 tokens)
+    'blog_post': ("Blog Post/Article", {
+        'format_type': 'blog_post',
+        'length': 'long',
+        'structure': 'sections',
+        'temperature': 0.5,
+        'max_tokens': 2500,
+        'style': 'engaging_informative'
+    }),
+    # Newsletter (800-1500 tokens)
+    'newsletter': ("Newsletter", {
+        'format_type': 'newsletter',
+        'length': 'medium',
+        'structure': 'sections',
+        'temperature': 0.4,
+        'max_tokens': 1800,
+        'style': 'professional_friendly'
+    }),
+    # Outline/Presentation (500-1000 tokens)
+    'outline': ("Outline/Presentation", {
+        'format_type': 'outline',
+        'length': 'medium',
+        'structure': 'hierarchical_bullets',
+        'temperature': 0.25,
+        'max_tokens': 1200,
+        'style': 'structured'
+    }),
+    # Protocol/Procedure (800-1500 tokens)
+    'protocol': ("Protocol/Procedure", {
+        'format_type': 'protocol',
+        'length': 'long',
+        'structure': 'numbered_steps',
+        'temperature': 0.15,
+        'max_tokens': 1800,
+        'style': 'precise_formal'
+    }),
+    # Comprehensive/In-depth (2000-4000 tokens)
+    'comprehensive_analysis': ("Comprehensive Analysis", {
+        'format_type': 'comprehensive_analysis',
+        'length': 'comprehensive',
+        'structure': 'sections_with_subsections',
+        'temperature': 0.3,
+        'max_tokens': 4000,
+        'style': 'academic_thorough'
+    }),
+    # Report (1200-2000 tokens)
+    'report': ("Report", {
+        'format_type': 'report',
+        'length': 'long',
+        'structure': 'formal_sections',
+        'temperature': 0.2,
+        'max_tokens': 2200,
+        'style': 'formal_professional'
+    }),
+    # Factual questions (400-800 tokens)
+    'factual_answer': ("Factual Answer", {
+        'format_type': 'factual_answer',
+        'length': 'medium',
+        'structure': 'paragraphs',
+        'temperature': 0.15,
+        'max_tokens': 800,
+        'style': 'clear_concise'
+    }),
+}
 
 
 def detect_output_format(query: str) -> Dict[str, Any]:
@@ -171,169 +240,14 @@ def detect_output_format(query: str) -> Dict[str, Any]:
             'style': str (formal/casual/academic/creative)
         }
     """
-    query_lower = query.lower()
-    
     # Initialize defaults
-    format_info = {
-        'format_type': 'general_answer',
-        'length': 'medium',
-        'structure': 'paragraphs',
-        'temperature': 0.2,
-        'max_tokens': 2048,
-        'style': 'formal'
-    }
-    
-    # Brief/Summary formats (200-500 tokens)
-    brief_keywords = [
-        'brief', 'summary', 'summarize', 'briefly', 'quick overview', 
-        'tldr', 'tl;dr', 'in short', 'key points', 'bullet points',
-        'main points', 'highlights'
-    ]
-    if any(keyword in query_lower for keyword in brief_keywords):
-        format_info.update({
-            'format_type': 'brief_summary',
-            'length': 'brief',
-            'structure': 'bullets',
-            'temperature': 0.15,
-            'max_tokens': 500,
-            'style': 'concise'
-        })
-        logger.info("Detected format: Brief Summary")
-        return format_info
+    format_info = dict(DEFAULT_FORMAT_INFO)
     
-    # Tweet/Social Media (50-280 characters worth, ~100 tokens)
-    social_keywords = [
-        'tweet', 'twitter post', 'social media post', 'linkedin post',
-        'facebook post', 'instagram caption', '280 characters'
-    ]
-    if any(keyword in query_lower for keyword in social_keywords):
-        format_info.update({
-            'format_type': 'social_media',
-            'length': 'brief',
-            'structure': 'single_paragraph',
-            'temperature': 0.4,
-            'max_tokens': 150,
-            'style': 'casual_engaging'
-        })
-        logger.info("Detected format: Social Media Post")
-        return format_info
-    
-    # Blog Post/Article (1000-2000 tokens)
-    blog_keywords = [
-        'blog post', 'article', 'write an article', 'blog about',
-        'essay', 'write about', 'detailed article', 'medium post'
-    ]
-    if any(keyword in query_lower for keyword in blog_keywords):
-        format_info.update({
-            'format_type': 'blog_post',
-            'length': 'long',
-            'structure': 'sections',
-            'temperature': 0.5,
-            'max_tokens': 2500,
-            'style': 'engaging_informative'
-        })
-        logger.info("Detected format: Blog Post/Article")
-        return format_info
-    
-    # Newsletter (800-1500 tokens)
-    newsletter_keywords = [
-        'newsletter', 'email newsletter', 'weekly update', 'monthly update',
-        'news brief', 'digest'
-    ]
-    if any(keyword in query_lower for keyword in newsletter_keywords):
-        format_info.update({
-            'format_type': 'newsletter',
-            'length': 'medium',
-            'structure': 'sections',
-            'temperature': 0.4,
-            'max_tokens': 1800,
-            'style': 'professional_friendly'
-        })
-        logger.info("Detected format: Newsletter")
-        return format_info
-    
-    # Outline/Presentation (500-1000 tokens)
-    outline_keywords = [
-        'outline', 'presentation outline', 'talk outline', 'speaking points',
-        'presentation', 'prepare a presentation', 'slide outline',
-        'interview prep', 'talking points', 'key topics'
-    ]
-    if any(keyword in query_lower for keyword in outline_keywords):
-        format_info.update({
-            'format_type': 'outline',
-            'length': 'medium',
-            'structure': 'hierarchical_bullets',
-            'temperature': 0.25,
-            'max_tokens': 1200,
-            'style': 'structured'
-        })
-        logger.info("Detected format: Outline/Presentation")
-        return format_info
-    
-    # Protocol/Procedure (800-1500 tokens)
-    protocol_keywords = [
-        'protocol', 'procedure', 'guidelines', 'step-by-step', 'how to',
-        'instructions', 'best practices', 'framework', 'methodology',
-        'process', 'workflow'
-    ]
-    if any(keyword in query_lower for keyword in protocol_keywords):
-        format_info.update({
-            'format_type': 'protocol',
-            'length': 'long',
-            'structure': 'numbered_steps',
-            'temperature': 0.15,
-            'max_tokens': 1800,
-            'style': 'precise_formal'
-        })
-        logger.info("Detected format: Protocol/Procedure")
-        return format_info
-    
-    # Comprehensive/In-depth (2000-4000 tokens)
-    comprehensive_keywords = [
-        'comprehensive', 'in-depth', 'detailed', 'thorough', 'complete analysis',
-        'full report', 'extensive', 'deep dive', 'exhaustive'
-    ]
-    if any(keyword in query_lower for keyword in comprehensive_keywords):
-        format_info.update({
-            'format_type': 'comprehensive_analysis',
-            'length': 'comprehensive',
-            'structure': 'sections_with_subsections',
-            'temperature': 0.3,
-            'max_tokens': 4000,
-            'style': 'academic_thorough'
-        })
-        logger.info("Detected format: Comprehensive Analysis")
-        return format_info
-    
-    # Report (1200-2000 tokens)
-    report_keywords = [
-        'report', 'write a report', 'formal report', 'research report',
-        'findings', 'assessment report'
-    ]
-    if any(keyword in query_lower for keyword in report_keywords):
-        format_info.update({
-            'format_type': 'report',
-            'length': 'long',
-            'structure': 'formal_sections',
-            'temperature': 0.2,
-            'max_tokens': 2200,
-            'style': 'formal_professional'
-        })
-        logger.info("Detected format: Report")
-        return format_info
-    
-    # Factual questions (400-800 tokens)
-    factual_keywords = ['what is', 'when did', 'who is', 'where is', 'define', 'definition']
-    if any(keyword in query_lower for keyword in factual_keywords):
-        format_info.update({
-            'format_type': 'factual_answer',
-            'length': 'medium',
-            'structure': 'paragraphs',
-            'temperature': 0.15,
-            'max_tokens': 800,
-            'style': 'clear_concise'
-        })
-        logger.info("Detected format: Factual Answer")
+    format_type = match_query(query).first('output_format')
+    if format_type:
+        display_name, profile = FORMAT_PROFILES[format_type]
+        format_info.update(profile)
+        logger.info(f"Detected format: {display_name}")
         return format_info
     
     logger.info("Using default format: General Answer")
@@ -355,6 +269,128 @@ def adaptive_temperature(query: str) -> float:
     return format_info['temperature']
 
 
+FORMAT_INSTRUCTIONS = {
+    'brief_summary': [
+        "- Provide a BRIEF summary with KEY POINTS only",
+        "- Use bullet points for clarity",
+        "- Keep it concise (3-5 main points)",
+        "- Each point should be 1-2 sentences maximum",
+    ],
+    'social_media': [
+        "- Write a compelling SOCIAL MEDIA POST (tweet-length)",
+        "- Keep it under 280 characters if possible",
+        "- Make it engaging and shareable",
+        "- Use clear, accessible language",
+        "- Include 1-2 key hashtags if appropriate",
+    ],
+    'blog_post': [
+        "- Write a comprehensive BLOG POST or ARTICLE",
+        "- Structure with clear sections and headings",
+        "- Include an engaging introduction",
+        "- Develop key points with examples and details",
+        "- Conclude with key takeaways or implications",
+        "- Use a conversational yet informative tone",
+    ],
+    'newsletter': [
+        "- Create a NEWSLETTER-style update",
+        "- Start with a brief intro or context",
+        "- Use clear section headings",
+        "- Keep paragraphs short and scannable",
+        "- End with a call-to-action or next steps",
+        "- Professional but approachable tone",
+    ],
+    'outline': [
+        "- Provide a structured OUTLINE",
+        "- Use hierarchical bullet points (main topics → subtopics → details)",
+        "- Each main point should have 2-4 supporting sub-points",
+        "- Keep it organized and easy to follow",
+        "- Perfect for presentations or talks",
+    ],
+    'protocol': [
+        "- Write a clear PROTOCOL or PROCEDURE",
+        "- Use numbered steps for sequential actions",
+        "- Include any prerequisites or requirements",
+        "- Be precise and unambiguous",
+        "- Add warnings or notes where appropriate",
+        "- Formal, authoritative tone",
+    ],
+    'comprehensive_analysis': [
+        "- Provide a COMPREHENSIVE, IN-DEPTH analysis",
+        "- Structure with main sections and subsections",
+        "- Cover all relevant aspects thoroughly",
+        "- Include context, details, and implications",
+        "- Synthesize information from multiple sources",
+        "- Academic or professional depth",
+    ],
+    'report': [
+        "- Write a formal REPORT",
+        "- Use standard report structure (Executive Summary, Findings, Analysis, Conclusions)",
+        "- Present information objectively",
+        "- Include relevant data and evidence",
+        "- Professional, formal tone",
+    ],
+}
+# general_answer, factual_answer and anything unrecognised
+DEFAULT_FORMAT_INSTRUCTIONS = [
+    "- Provide a clear, well-structured answer",
+    "- Use paragraphs with logical flow",
+    "- Include relevant details and context",
+    "- Be thorough but concise",
+]
+
+
+def build_static_prompt_prefix(format_type: str, prioritize_citations: bool = True) -> str:
+    """
+    Build the request-independent start of the synthesis prompt: role, domain
+    context, output format, citation and answer rules for one output format.
+    
+    Args:
+        format_type: Output format from detect_output_format()
+        prioritize_citations: Whether to emphasize citation requirements
+    
+    Returns:
+        Prefix text (ends with a newline)
+    """
+    prompt_parts = [
+        "You are an expert assistant for the CENTEF (Center for Research of Terror Financing) knowledge base.",
+        "Your role is to provide accurate, comprehensive answers based on the provided documents.",
+        "",
+        "DOMAIN CONTEXT:",
+        "- AML = Anti-Money Laundering",
+        "- CTF/CFT = Counter-Terrorism Financing",
+        "- FATF = Financial Action Task Force",
+        "- PEP = Politically Exposed Person",
+        "- SAR = Suspicious Activity Report",
+        "- KYC = Know Your Customer",
+        "",
+        "OUTPUT FORMAT REQUIREMENTS:",
+    ]
+    prompt_parts.extend(FORMAT_INSTRUCTIONS.get(format_type, DEFAULT_FORMAT_INSTRUCTIONS))
+    prompt_parts.append("")
+    
+    # Citation requirements (adapt based on format and length)
+    if prioritize_citations:
+        prompt_parts.append("CITATION REQUIREMENTS:")
+        prompt_parts.extend([
+            "1. Use information from the provided sources below",
+            "2. Cite specific sources when making claims using format: [Document Title, Page X] or [Document Title, Timestamp X:XX] for videos",
+            "3. Place citations immediately after the relevant claim in square brackets",
+        ])
+        prompt_parts.append("")
+    
+    prompt_parts.extend([
+        "ANSWER GUIDELINES:",
+        "1. Use information from the provided sources below",
+        "2. Expand abbreviations on first use",
+        "3. Be accurate and evidence-based",
+        f"4. Match the requested format and style ({format_type})",
+        "5. Prioritize diversity in sources - cite from multiple different documents",
+        "6. Include video/audio sources when available and relevant",
+        "",
+    ])
+    return "\n".join(prompt_parts) + "\n"
+
+
 def build_optimized_synthesis_prompt(
     query: str,
     summary_results: List[Dict[str, Any]],
@@ -362,11 +398,15 @@ def build_optimized_synthesis_prompt(
     prioritize_citations: bool = True,
     format_info: Optional[Dict[str, Any]] = None,
     conversation_history: Optional[List[Any]] = None
-) -> str:
+) -> SplitPrompt:
     """
     Build an optimized prompt with better structure and citation requirements.
     Adapts prompt based on detected output format.
     
+    The prompt is a SplitPrompt: the static prefix for the format (built once,
+    see prompt_cache.py) followed by the conversation history, request and
+    retrieved content.
+    
     Args:
         query: User's question
         summary_results: List of summary search results
@@ -381,20 +421,9 @@ def build_optimized_synthesis_prompt(
     # Detect format if not provided
     if format_info is None:
         format_info = detect_output_format(query)
+    format_type = format_info.get('format_type', 'general_answer')
     
-    prompt_parts = [
-        "You are an expert assistant for the CENTEF (Center for Research of Terror Financing) knowledge base.",
-        "Your role is to provide accurate, comprehensive answers based on the provided documents.",
-        "",
-        "DOMAIN CONTEXT:",
-        "- AML = Anti-Money Laundering",
-        "- CTF/CFT = Counter-Terrorism Financing",
-        "- FATF = Financial Action Task Force",
-        "- PEP = Politically Exposed Person",
-        "- SAR = Suspicious Activity Report",
-        "- KYC = Know Your Customer",
-        "",
-    ]
+    prompt_parts = []
     
     # Add conversation history if available
     if conversation_history and len(conversation_history) > 0:
@@ -414,117 +443,7 @@ def build_optimized_synthesis_prompt(
         prompt_parts.append("If the current question refers to previous topics, acknowledge that context.")
         prompt_parts.append("")
     
-    # Add format-specific instructions
-    format_type = format_info.get('format_type', 'general_answer')
-    structure = format_info.get('structure', 'paragraphs')
-    style = format_info.get('style', 'formal')
-    
-    prompt_parts.append("OUTPUT FORMAT REQUIREMENTS:")
-    
-    if format_type == 'brief_summary':
-        prompt_parts.extend([
-            "- Provide a BRIEF summary with KEY POINTS only",
-            "- Use bullet points for clarity",
-            "- Keep it concise (3-5 main points)",
-            "- Each point should be 1-2 sentences maximum",
-        ])
-    
-    elif format_type == 'social_media':
-        prompt_parts.extend([
-            "- Write a compelling SOCIAL MEDIA POST (tweet-length)",
-            "- Keep it under 280 characters if possible",
-            "- Make it engaging and shareable",
-            "- Use clear, accessible language",
-            "- Include 1-2 key hashtags if appropriate",
-        ])
-    
-    elif format_type == 'blog_post':
-        prompt_parts.extend([
-            "- Write a comprehensive BLOG POST or ARTICLE",
-            "- Structure with clear sections and headings",
-            "- Include an engaging introduction",
-            "- Develop key points with examples and details",
-            "- Conclude with key takeaways or implications",
-            "- Use a conversational yet informative tone",
-        ])
-    
-    elif format_type == 'newsletter':
-        prompt_parts.extend([
-            "- Create a NEWSLETTER-style update",
-            "- Start with a brief intro or context",
-            "- Use clear section headings",
-            "- Keep paragraphs short and scannable",
-            "- End with a call-to-action or next steps",
-            "- Professional but approachable tone",
-        ])
-    
-    elif format_type == 'outline':
-        prompt_parts.extend([
-            "- Provide a structured OUTLINE",
-            "- Use hierarchical bullet points (main topics → subtopics → details)",
-            "- Each main point should have 2-4 supporting sub-points",
-            "- Keep it organized and easy to follow",
-            "- Perfect for presentations or talks",
-        ])
-    
-    elif format_type == 'protocol':
-        prompt_parts.extend([
-            "- Write a clear PROTOCOL or PROCEDURE",
-            "- Use numbered steps for sequential actions",
-            "- Include any prerequisites or requirements",
-            "- Be precise and unambiguous",
-            "- Add warnings or notes where appropriate",
-            "- Formal, authoritative tone",
-        ])
-    
-    elif format_type == 'comprehensive_analysis':
-        prompt_parts.extend([
-            "- Provide a COMPREHENSIVE, IN-DEPTH analysis",
-            "- Structure with main sections and subsections",
-            "- Cover all relevant aspects thoroughly",
-            "- Include context, details, and implications",
-            "- Synthesize information from multiple sources",
-            "- Academic or professional depth",
-        ])
-    
-    elif format_type == 'report':
-        prompt_parts.extend([
-            "- Write a formal REPORT",
-            "- Use standard report structure (Executive Summary, Findings, Analysis, Conclusions)",
-            "- Present information objectively",
-            "- Include relevant data and evidence",
-            "- Professional, formal tone",
-        ])
-    
-    else:  # general_answer or factual_answer
-        prompt_parts.extend([
-            "- Provide a clear, well-structured answer",
-            "- Use paragraphs with logical flow",
-            "- Include relevant details and context",
-            "- Be thorough but concise",
-        ])
-    
-    prompt_parts.append("")
-    
-    # Citation requirements (adapt based on format and length)
-    if prioritize_citations:
-        prompt_parts.append("CITATION REQUIREMENTS:")
-        prompt_parts.extend([
-            "1. Use information from the provided sources below",
-            "2. Cite specific sources when making claims using format: [Document Title, Page X] or [Document Title, Timestamp X:XX] for videos",
-            "3. Place citations immediately after the relevant claim in square brackets",
-        ])
-        prompt_parts.append("")
-    
     prompt_parts.extend([
-        "ANSWER GUIDELINES:",
-        "1. Use information from the provided sources below",
-        "2. Expand abbreviations on first use",
-        "3. Be accurate and evidence-based",
-        f"4. Match the requested format and style ({format_type})",
-        "5. Prioritize diversity in sources - cite from multiple different documents",
-        "6. Include video/audio sources when available and relevant",
-        "",
         f"USER REQUEST: {query}",
         "",
         "=" * 80,
@@ -582,10 +501,14 @@ def build_optimized_synthesis_prompt(
     else:
         prompt_parts.append("(No detailed chunks available)")
     
-    return "\n".join(prompt_parts)
+    return build_split_prompt(
+        f"optimized:{format_type}:{'citations' if prioritize_citations else 'plain'}",
+        lambda: build_static_prompt_prefix(format_type, prioritize_citations),
+        "\n".join(prompt_parts)
+    )
 
 
-def synthesize_answer_optimized(
+def prepare_optimized_synthesis(
     query: str,
     summary_results: List[Dict[str, Any]],
     chunk_results: List[Dict[str, Any]],
@@ -594,14 +517,12 @@ def synthesize_answer_optimized(
     enable_context_truncation: bool = True,
     enable_adaptive_temperature: bool = True,
     max_context_tokens: int = 24000,
-    user_id: Optional[str] = None,
-    session_id: Optional[str] = None,
     conversation_history: Optional[List[Any]] = None
 ) -> Dict[str, Any]:
     """
-    Generate an optimized answer with context management and adaptive parameters.
-    Automatically detects desired output format from query.
-    
+    Detect the output format, truncate context and build the generation prompt.
+    Shared by synthesize_answer_optimized and stream_answer_optimized.
+
     Args:
         query: User's question
         summary_results: Summary search results
@@ -611,145 +532,116 @@ def synthesize_answer_optimized(
         enable_context_truncation: Whether to truncate context to fit token limits
         enable_adaptive_temperature: Whether to use query-based temperature
         max_context_tokens: Maximum tokens for context (summaries + chunks)
-        user_id: Optional user ID for tracking
-        session_id: Optional session ID for tracking
         conversation_history: Optional list of previous ChatMessage objects for context
-    
+
     Returns:
-        Dictionary with answer text, citations, format_info, and metadata
+        Dictionary with prompt, generation_config, the (truncated) results and
+        the settings that were applied
     """
     logger.info(f"Optimized synthesis for query: {query}")
     logger.info(f"Input: {len(summary_results)} summaries, {len(chunk_results)} chunks")
     if conversation_history:
         logger.info(f"Including {len(conversation_history)} messages from conversation history")
-    
+
     # Detect desired output format
     format_info = detect_output_format(query)
     logger.info(f"Detected format: {format_info['format_type']} (length: {format_info['length']}, structure: {format_info['structure']})")
-    
+
     # Step 1: Context truncation (if enabled)
+    context_plan = None
     if enable_context_truncation:
-        summary_results, chunk_results = smart_context_truncation(
-            summary_results, 
-            chunk_results, 
-            max_tokens=max_context_tokens
+        summary_results, chunk_results, context_plan = _fit_context_logged(
+            summary_results,
+            chunk_results,
+            max_context_tokens
         )
-    
+
     # Step 2: Adaptive temperature (if enabled and not explicitly set)
     if temperature is None and enable_adaptive_temperature:
         temperature = format_info.get('temperature', 0.2)
     elif temperature is None:
         temperature = 0.2
-    
+
     # Step 3: Get format-specific max_output_tokens if not provided
     if max_output_tokens is None:
         max_output_tokens = format_info.get('max_tokens', 2048)
-    
+
     logger.info(f"Using temperature={temperature}, max_tokens={max_output_tokens} for {format_info['format_type']}")
-    
-    # Step 4: Build optimized, format-aware prompt
+
+    # Step 4: Build optimized, format-aware prompt (static prefix + request suffix)
+    build_start = time.perf_counter()
     prompt = build_optimized_synthesis_prompt(
-        query, 
-        summary_results, 
+        query,
+        summary_results,
         chunk_results,
         prioritize_citations=True,
         format_info=format_info,
         conversation_history=conversation_history
     )
-    
-    prompt_tokens = estimate_token_count(prompt)
-    logger.info(f"Prompt tokens: ~{prompt_tokens}, Temperature: {temperature}")
-    
-    # Step 5: Generate answer with fallback models
-    generation_config = GenerationConfig(
-        temperature=temperature,
-        max_output_tokens=max_output_tokens,
-        top_p=0.95,
-    )
-    
-    answer_text = None
-    model_used = None
-    last_error = None
-    usage_metadata = None
-    
-    for model_name in FALLBACK_MODELS:
-        with track_llm_call(
-            source_function="synthesize_answer_optimized",
-            api_provider="gemini",
-            api_type="generative",
-            model=model_name,
-            operation="chat_answer",
-            user_id=user_id,
-            session_id=session_id,
+    prompt_build_ms = round((time.perf_counter() - build_start) * 1000, 2)
+
+    prompt_tokens = prompt.prefix_tokens + estimate_token_count(prompt.suffix)
+    logger.info(f"Planned prompt tokens: {prompt_tokens} ({prompt.prefix_tokens} static prefix), "
+                f"built in {prompt_build_ms}ms, Temperature: {temperature}")
+
+    return {
+        "prompt": prompt,
+        "generation_config": GenerationConfig(
             temperature=temperature,
-            max_tokens=max_output_tokens
-        ) as call:
-            try:
-                logger.info(f"Attempting model: {model_name}")
-                model = GenerativeModel(model_name)
-                
-                response = model.generate_content(
-                    prompt,
-                    generation_config=generation_config
-                )
-                
-                answer_text = response.text
-                model_used = model_name
-                
-                # Extract token usage
-                if hasattr(response, 'usage_metadata'):
-                    usage_metadata = {
-                        'prompt_token_count': getattr(response.usage_metadata, 'prompt_token_count', 0),
-                        'candidates_token_count': getattr(response.usage_metadata, 'candidates_token_count', 0),
-                        'total_token_count': getattr(response.usage_metadata, 'total_token_count', 0),
-                    }
-                    
-                    call.update_tokens(
-                        input_tokens=usage_metadata['prompt_token_count'],
-                        output_tokens=usage_metadata['candidates_token_count'],
-                        total_tokens=usage_metadata['total_token_count']
-                    )
-                
-                logger.info(f"✅ Success with {model_name}")
-                break
-                
-            except Exception as e:
-                error_msg = str(e)
-                logger.warning(f"❌ Model {model_name} failed: {error_msg}")
-                last_error = e
-                call.set_error(error_msg)
-                
-                # Try next fallback for rate limits or quota errors
-                if any(x in error_msg for x in ["429", "Resource exhausted", "quota", "insufficient"]):
-                    continue
-                logger.error(f"Unexpected error: {error_msg}")
-                continue
-    
-    # Fallback response if all models fail
-    if answer_text is None:
-        logger.error(f"All models failed. Last error: {last_error}")
-        answer_text = (
-            f"I apologize, but I'm currently experiencing high demand. "
-            f"However, I found {len(summary_results)} relevant documents with information about: {query}\n\n"
-            f"Please try again in a few moments."
-        )
-        model_used = "fallback-none"
-    
-    # Step 5: Build source map first
-    from shared.manifest import get_manifest_entry
-    
+            max_output_tokens=max_output_tokens,
+            top_p=0.95,
+        ),
+        "summary_results": summary_results,
+        "chunk_results": chunk_results,
+        "temperature": temperature,
+        "max_output_tokens": max_output_tokens,
+        "format_info": format_info,
+        "prompt_tokens": prompt_tokens,
+        "prompt_prefix_tokens": prompt.prefix_tokens,
+        "prompt_build_ms": prompt_build_ms,
+        "context_plan": context_plan,
+        "enable_context_truncation": enable_context_truncation,
+        "enable_adaptive_temperature": enable_adaptive_temperature,
+    }
+
+
+def _unavailable_answer(query: str, num_summaries: int) -> str:
+    return (
+        f"I apologize, but I'm currently experiencing high demand. "
+        f"However, I found {num_summaries} relevant documents with information about: {query}\n\n"
+        f"Please try again in a few moments."
+    )
+
+
+def build_answer_sources(
+    summary_results: List[Dict[str, Any]],
+    chunk_results: List[Dict[str, Any]]
+) -> Tuple[List[Dict[str, Any]], Dict[str, str], Dict[str, str]]:
+    """
+    Build the source list and the placeholder label maps for a set of results.
+    Depends only on retrieval, so streaming callers can send sources before
+    generation finishes.
+
+    Args:
+        summary_results: Summary results used in the prompt
+        chunk_results: Chunk results used in the prompt
+
+    Returns:
+        Tuple of (all_sources, document_label_map, chunk_label_map)
+    """
+    from shared.manifest import get_manifest_entries_by_ids
+
     source_map = {}
     document_label_map = {}
     chunk_label_map = {}
-    manifest_cache = {}
-    
+    # Resolve every cited source in one pass over the shared manifest view
+    manifest_entries = get_manifest_entries_by_ids(
+        r.get('source_id') for r in list(summary_results) + list(chunk_results)
+    )
+
     def fetch_manifest_entry(source_id: Optional[str]):
-        if not source_id:
-            return None
-        if source_id not in manifest_cache:
-            manifest_cache[source_id] = get_manifest_entry(source_id)
-        return manifest_cache[source_id]
-    
+        return manifest_entries.get(source_id) if source_id else None
+
     # Process summaries
     for idx, summary in enumerate(summary_results, 1):
         source_id = summary.get('source_id')
@@ -762,7 +654,7 @@ def synthesize_answer_optimized(
             f"Document {idx}"
         )
         document_label_map[str(idx)] = summary_title
-        
+
         if source_id and source_id not in source_map:
             raw_source_uri = resolve_source_uri(manifest_entry, summary)
             filename_value = summary.get('filename') or (manifest_entry.filename if manifest_entry else source_id)
@@ -775,12 +667,12 @@ def synthesize_answer_optimized(
                 "type": "summary",
                 "pages": []
             }
-    
+
     # Process chunks
     for idx, chunk in enumerate(chunk_results, 1):
         source_id = chunk.get('source_id')
         manifest_entry = fetch_manifest_entry(source_id)
-        chunk_metadata = chunk.get('metadata') if isinstance(chunk.get('metadata'), dict) else {}
+        chunk_metadata = chunk.get('metadata') if isinstance(chunk.get('metadata'), Mapping) else {}
         chunk_title = (
             chunk.get('title') or
             (manifest_entry.title if manifest_entry else None) or
@@ -789,12 +681,12 @@ def synthesize_answer_optimized(
             f"Chunk {idx}"
         )
         chunk_label_map[str(idx)] = chunk_title
-        
+
         if not source_id:
             continue
-        
+
         raw_source_uri = resolve_source_uri(manifest_entry, chunk, chunk_metadata)
-        
+
         if source_id not in source_map:
             filename_value = chunk.get('filename') or (manifest_entry.filename if manifest_entry else source_id)
             source_map[source_id] = {
@@ -811,12 +703,12 @@ def synthesize_answer_optimized(
             if raw_source_uri and not existing.get("authorized_url"):
                 existing["source_uri"] = existing.get("source_uri") or raw_source_uri
                 existing["authorized_url"] = build_authorized_url(raw_source_uri)
-        
+
         # Add page/timestamp info
         page = chunk.get('page_number') or chunk.get('page')
         if page is not None and page not in source_map[source_id]['pages']:
             source_map[source_id]['pages'].append(page)
-        
+
         start_sec = chunk.get('start_sec')
         end_sec = chunk.get('end_sec')
         if start_sec is not None:
@@ -827,7 +719,7 @@ def synthesize_answer_optimized(
             if 'timestamps' not in source_map[source_id]:
                 source_map[source_id]['timestamps'] = []
             source_map[source_id]['timestamps'].append(timestamp)
-    
+
     # Format sources
     all_sources = []
     for source_info in source_map.values():
@@ -835,49 +727,509 @@ def synthesize_answer_optimized(
             source_info['pages'].sort()
             source_info['page_range'] = format_page_range(source_info['pages'])
         all_sources.append(source_info)
-    
-    # Replace placeholder labels in answer
-    sanitized_answer = replace_inline_placeholder_labels(
-        answer_text,
-        document_label_map,
-        chunk_label_map
-    )
-    
-    # Post-process answer: extract citations, match to sources, number them
-    post_processed = post_process_answer_and_sources(sanitized_answer, all_sources)
+
+    return all_sources, document_label_map, chunk_label_map
+
+
+def finalize_optimized_answer(
+    query: str,
+    prepared: Dict[str, Any],
+    answer_text: str,
+    model_used: Optional[str],
+    usage_metadata: Optional[Dict[str, int]] = None,
+    answer_sources: Optional[Tuple[List[Dict[str, Any]], Dict[str, str], Dict[str, str]]] = None,
+    citations: Optional[CitationProcessor] = None
+) -> Dict[str, Any]:
+    """
+    Replace placeholder labels, number citations and assemble the result dictionary.
+    Follow-up questions are left to the caller.
+
+    Args:
+        query: User's question
+        prepared: Output of prepare_optimized_synthesis
+        answer_text: Raw generated answer
+        model_used: Model that produced the answer
+        usage_metadata: Token usage from the model response
+        answer_sources: Output of build_answer_sources, if already computed
+        citations: CitationProcessor that already processed answer_text (streaming), if any
+
+    Returns:
+        Dictionary with answer text, citations, format_info, and metadata
+    """
+    summary_results = prepared["summary_results"]
+    chunk_results = prepared["chunk_results"]
+    format_info = prepared["format_info"]
+
+    if answer_sources is None:
+        answer_sources = build_answer_sources(summary_results, chunk_results)
+    all_sources, document_label_map, chunk_label_map = answer_sources
+
+    # Post-process answer: resolve placeholder labels, match citations to sources, number them
+    if citations is not None:
+        post_processed = citations.result()
+    else:
+        post_processed = post_process_answer_and_sources(
+            answer_text,
+            all_sources,
+            document_label_map,
+            chunk_label_map
+        )
     final_answer = post_processed["processed_answer"]
     cited_sources = post_processed["sources"]
-    
+
     logger.info(f"Post-processing: {len(all_sources)} sources → {len(cited_sources)} cited sources with numbered references")
-    
-    # Generate follow-up questions
-    from .synthesizer import generate_follow_up_questions
-    follow_up_questions = generate_follow_up_questions(query, final_answer, num_questions=3)
-    
+
     result = {
         "query": query,
         "answer": final_answer,
         "full_answer": final_answer,
         "explicit_citations": list(post_processed["citation_map"].keys()),
         "sources": cited_sources,  # Only sources explicitly referenced in answer
-        "follow_up_questions": follow_up_questions,
         "num_summaries_used": len(summary_results),
         "num_chunks_used": len(chunk_results),
         "model_used": model_used or "unknown",
-        "temperature": temperature,
+        "temperature": prepared["temperature"],
         "format_info": format_info,  # Include detected format information
         "optimizations_applied": {
-            "context_truncation": enable_context_truncation,
-            "adaptive_temperature": enable_adaptive_temperature,
-            "estimated_prompt_tokens": prompt_tokens,
+            "context_truncation": prepared["enable_context_truncation"],
+            "adaptive_temperature": prepared["enable_adaptive_temperature"],
+            "estimated_prompt_tokens": prepared["prompt_tokens"],
+            "context_budget": prepared.get("context_plan"),
+            "prompt_prefix_tokens": prepared.get("prompt_prefix_tokens"),
+            "prompt_build_ms": prepared.get("prompt_build_ms"),
             "format_detected": format_info['format_type'],
-            "max_tokens_used": max_output_tokens
+            "max_tokens_used": prepared["max_output_tokens"]
         }
     }
-    
+
     if usage_metadata:
         result["input_tokens"] = usage_metadata.get('prompt_token_count', 0)
         result["output_tokens"] = usage_metadata.get('candidates_token_count', 0)
         result["total_tokens"] = usage_metadata.get('total_token_count', 0)
-    
+
+        # Planned vs actual prompt size; also calibrates the token estimate
+        actual_prompt_tokens = result["input_tokens"]
+        if actual_prompt_tokens:
+            planned = prepared["prompt_tokens"]
+            get_token_counter().record_actual(planned, actual_prompt_tokens)
+            result["optimizations_applied"]["actual_prompt_tokens"] = actual_prompt_tokens
+            result["optimizations_applied"]["prompt_token_error_pct"] = round(
+                (planned - actual_prompt_tokens) / actual_prompt_tokens * 100, 1
+            )
+            logger.info(f"Prompt tokens: planned {planned}, actual {actual_prompt_tokens}")
+        if usage_metadata.get('cached_content_token_count'):
+            result["cached_input_tokens"] = usage_metadata['cached_content_token_count']
+
+    return result
+
+
+def lookup_cached_answer(
+    query: str,
+    prepared: Dict[str, Any],
+    conversation_history: Optional[List[Any]] = None
+) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+    """
+    Look up a cached answer for a prepared synthesis.
+
+    Returns:
+        Tuple of (cache key, cached result or None); the key is None when caching is disabled
+    """
+    if not ANSWER_CACHE_ENABLED:
+        return None, None
+    key = answer_cache_key(
+        query,
+        prepared["summary_results"],
+        prepared["chunk_results"],
+        prepared["format_info"]["format_type"],
+        prepared["temperature"],
+        prepared["max_output_tokens"],
+        conversation_history
+    )
+    cached = get_answer_cache().get(key)
+    if cached is not None:
+        logger.info(f"Answer cache hit ({cached['cache_age_s']}s old)")
+        cached["optimizations_applied"]["answer_cache"] = "hit"
+    return key, cached
+
+
+def store_cached_answer(cache_key: Optional[str], prepared: Dict[str, Any], result: Dict[str, Any]) -> None:
+    """Cache a complete answer under cache_key (unavailable answers are not cached)."""
+    if cache_key is None or result.get("model_used") == "fallback-none":
+        return
+    result["optimizations_applied"]["answer_cache"] = "miss"
+    source_ids = [r.get("source_id") for r in prepared["summary_results"] + prepared["chunk_results"]]
+    get_answer_cache().put(cache_key, result, source_ids)
+
+
+def _cached_follow_ups(query: str, result: Dict[str, Any], include_follow_ups: bool) -> List[str]:
+    if not include_follow_ups:
+        return []
+    if result.get("follow_up_questions"):
+        return result["follow_up_questions"]
+    from .synthesizer import generate_follow_up_questions
+    return generate_follow_up_questions(query, result["answer"], num_questions=3)
+
+
+def synthesize_answer_optimized(
+    query: str,
+    summary_results: List[Dict[str, Any]],
+    chunk_results: List[Dict[str, Any]],
+    temperature: Optional[float] = None,
+    max_output_tokens: Optional[int] = None,
+    enable_context_truncation: bool = True,
+    enable_adaptive_temperature: bool = True,
+    max_context_tokens: int = 24000,
+    user_id: Optional[str] = None,
+    session_id: Optional[str] = None,
+    conversation_history: Optional[List[Any]] = None,
+    include_follow_ups: bool = True
+) -> Dict[str, Any]:
+    """
+    Generate an optimized answer with context management and adaptive parameters.
+    Automatically detects desired output format from query.
+
+    Args:
+        query: User's question
+        summary_results: Summary search results
+        chunk_results: Chunk search results
+        temperature: Model temperature (None = use adaptive/format-based)
+        max_output_tokens: Maximum length of generated answer (None = use format-based)
+        enable_context_truncation: Whether to truncate context to fit token limits
+        enable_adaptive_temperature: Whether to use query-based temperature
+        max_context_tokens: Maximum tokens for context (summaries + chunks)
+        user_id: Optional user ID for tracking
+        session_id: Optional session ID for tracking
+        conversation_history: Optional list of previous ChatMessage objects for context
+        include_follow_ups: Whether to generate follow-up questions before returning
+
+    Returns:
+        Dictionary with answer text, citations, format_info, and metadata
+    """
+    prepared = prepare_optimized_synthesis(
+        query,
+        summary_results,
+        chunk_results,
+        temperature=temperature,
+        max_output_tokens=max_output_tokens,
+        enable_context_truncation=enable_context_truncation,
+        enable_adaptive_temperature=enable_adaptive_temperature,
+        max_context_tokens=max_context_tokens,
+        conversation_history=conversation_history
+    )
+    generated = generate_optimized_answer(
+        query,
+        prepared,
+        user_id=user_id,
+        session_id=session_id,
+        conversation_history=conversation_history
+    )
+    return complete_optimized_answer(query, prepared, generated, include_follow_ups=include_follow_ups)
+
+
+def generate_optimized_answer(
+    query: str,
+    prepared: Dict[str, Any],
+    user_id: Optional[str] = None,
+    session_id: Optional[str] = None,
+    conversation_history: Optional[List[Any]] = None,
+    source_function: str = "synthesize_answer_optimized"
+) -> Dict[str, Any]:
+    """
+    Serve a prepared synthesis from the answer cache, or generate it with fallback models.
+
+    Args:
+        query: User's question
+        prepared: Output of prepare_optimized_synthesis
+        user_id: Optional user ID for tracking
+        session_id: Optional session ID for tracking
+        conversation_history: History window included in the prompt (part of the cache key)
+        source_function: Caller name for the LLM tracker
+
+    Returns:
+        Dict with cache_key, cached (the cached result, or None), and on a miss
+        answer_text, model_used and usage_metadata
+    """
+    # Serve identical questions over identical evidence from the answer cache
+    lookup_start = time.perf_counter()
+    cache_key, cached = lookup_cached_answer(query, prepared, conversation_history)
+    if cached is not None:
+        record_cache_hit(
+            cached, source_function, (time.perf_counter() - lookup_start) * 1000,
+            user_id=user_id, session_id=session_id
+        )
+        return {"cache_key": cache_key, "cached": cached}
+
+    # Generate answer with fallback models (skipping rate-limited ones)
+    answer_text, model_used, usage_metadata, last_error = generate_with_fallback(
+        prepared["prompt"],
+        prepared["generation_config"],
+        source_function=source_function,
+        user_id=user_id,
+        session_id=session_id,
+        temperature=prepared["temperature"],
+        max_tokens=prepared["max_output_tokens"]
+    )
+
+    # Fallback response if all models fail
+    if answer_text is None:
+        logger.error(f"All models failed. Last error: {last_error}")
+        answer_text = _unavailable_answer(query, len(prepared["summary_results"]))
+        model_used = "fallback-none"
+
+    return {
+        "cache_key": cache_key,
+        "cached": None,
+        "answer_text": answer_text,
+        "model_used": model_used,
+        "usage_metadata": usage_metadata,
+    }
+
+
+def complete_optimized_answer(
+    query: str,
+    prepared: Dict[str, Any],
+    generated: Dict[str, Any],
+    include_follow_ups: bool = True
+) -> Dict[str, Any]:
+    """
+    Turn the output of generate_optimized_answer into the final result: number
+    citations, add follow-up questions and cache the answer.
+
+    Args:
+        query: User's question
+        prepared: Output of prepare_optimized_synthesis
+        generated: Output of generate_optimized_answer
+        include_follow_ups: Whether to generate follow-up questions before returning
+
+    Returns:
+        Dictionary with answer text, citations, format_info, and metadata
+    """
+    if generated["cached"] is not None:
+        cached = generated["cached"]
+        cached["follow_up_questions"] = _cached_follow_ups(query, cached, include_follow_ups)
+        return cached
+
+    result = finalize_optimized_answer(
+        query, prepared, generated["answer_text"], generated["model_used"], generated["usage_metadata"]
+    )
+
+    # Generate follow-up questions (callers running them asynchronously pass include_follow_ups=False)
+    result["follow_up_questions"] = []
+    if include_follow_ups:
+        from .synthesizer import generate_follow_up_questions
+        result["follow_up_questions"] = generate_follow_up_questions(query, result["answer"], num_questions=3)
+
+    store_cached_answer(generated["cache_key"], prepared, result)
     return result
+
+
+def stream_answer_optimized(
+    query: str,
+    summary_results: List[Dict[str, Any]],
+    chunk_results: List[Dict[str, Any]],
+    temperature: Optional[float] = None,
+    max_output_tokens: Optional[int] = None,
+    enable_context_truncation: bool = True,
+    enable_adaptive_temperature: bool = True,
+    max_context_tokens: int = 24000,
+    user_id: Optional[str] = None,
+    session_id: Optional[str] = None,
+    conversation_history: Optional[List[Any]] = None,
+    include_follow_ups: bool = True
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Streaming variant of synthesize_answer_optimized.
+
+    Yields (event, data) pairs in this order:
+        "sources"    - candidate sources (from retrieval, before generation starts)
+        "citation"   - {"number": N, "source": ...} when a source is first cited, before
+                       the token that contains [N]
+        "token"      - {"text": ...} for each piece of generated text, as it arrives, with
+                       placeholder labels resolved and citations numbered (text after an
+                       unclosed "[" is held back until the citation closes)
+        "citations"  - processed answer with numbered citations and the cited sources
+        "follow_ups" - follow-up questions (if include_follow_ups)
+        "result"     - the full result dictionary, as synthesize_answer_optimized returns it,
+                       with "time_to_first_token_ms" and "generation_ms" added
+
+    A model that fails before producing any text falls back to the next model.
+    Once text has been streamed it cannot be taken back, so a failure mid-stream
+    ends generation and the answer keeps what was received.
+
+    Args:
+        query: User's question
+        summary_results: Summary search results
+        chunk_results: Chunk search results
+        temperature: Model temperature (None = use adaptive/format-based)
+        max_output_tokens: Maximum length of generated answer (None = use format-based)
+        enable_context_truncation: Whether to truncate context to fit token limits
+        enable_adaptive_temperature: Whether to use query-based temperature
+        max_context_tokens: Maximum tokens for context (summaries + chunks)
+        user_id: Optional user ID for tracking
+        session_id: Optional session ID for tracking
+        conversation_history: Optional list of previous ChatMessage objects for context
+        include_follow_ups: Whether to generate follow-up questions after the answer
+
+    Yields:
+        Tuple of (event name, event data)
+    """
+    start = time.perf_counter()
+    prepared = prepare_optimized_synthesis(
+        query,
+        summary_results,
+        chunk_results,
+        temperature=temperature,
+        max_output_tokens=max_output_tokens,
+        enable_context_truncation=enable_context_truncation,
+        enable_adaptive_temperature=enable_adaptive_temperature,
+        max_context_tokens=max_context_tokens,
+        conversation_history=conversation_history
+    )
+
+    cache_key, cached = lookup_cached_answer(query, prepared, conversation_history)
+    if cached is not None:
+        record_cache_hit(
+            cached, "stream_answer_optimized", (time.perf_counter() - start) * 1000,
+            user_id=user_id, session_id=session_id
+        )
+        cached["time_to_first_token_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        yield "sources", {"sources": cached["sources"]}
+        yield "token", {"text": cached["answer"]}
+        yield "citations", {
+            "answer": cached["answer"],
+            "explicit_citations": cached["explicit_citations"],
+            "sources": cached["sources"]
+        }
+        cached["follow_up_questions"] = _cached_follow_ups(query, cached, include_follow_ups)
+        if include_follow_ups:
+            yield "follow_ups", {"follow_up_questions": cached["follow_up_questions"]}
+        cached["generation_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        yield "result", cached
+        return
+
+    answer_sources = build_answer_sources(prepared["summary_results"], prepared["chunk_results"])
+    yield "sources", {"sources": answer_sources[0]}
+
+    citations = CitationProcessor(*answer_sources)
+    parts: List[str] = []
+    model_used = None
+    last_error = None
+    complete = False
+    usage_metadata = None
+    first_token_at = None
+
+    model_name = next_available_model(FALLBACK_MODELS)
+    while model_name is not None:
+        breaker = get_breaker(model_name)
+        with track_llm_call(
+            source_function="stream_answer_optimized",
+            api_provider="gemini",
+            api_type="generative",
+            model=model_name,
+            operation="chat_answer",
+            user_id=user_id,
+            session_id=session_id,
+            temperature=prepared["temperature"],
+            max_tokens=prepared["max_output_tokens"]
+        ) as call:
+            try:
+                logger.info(f"Attempting streamed generation with model: {model_name}")
+                model, contents = model_for_prompt(GenerativeModel, model_name, prepared["prompt"])
+                responses = model.generate_content(
+                    contents,
+                    generation_config=prepared["generation_config"],
+                    stream=True
+                )
+                for response in responses:
+                    usage_metadata = extract_usage_metadata(response) or usage_metadata
+                    try:
+                        text = response.text
+                    except ValueError:
+                        # Chunks without text (e.g. the final usage-only chunk)
+                        continue
+                    if not text:
+                        continue
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                        model_used = model_name
+                        logger.info(f"First token from {model_name} after {(first_token_at - start) * 1000:.0f}ms")
+                    parts.append(text)
+                    cited = len(citations.sources)
+                    resolved = citations.feed(text)
+                    for number, source in enumerate(citations.sources[cited:], cited + 1):
+                        yield "citation", {"number": number, "source": source}
+                    if resolved:
+                        yield "token", {"text": resolved}
+
+                model_used = model_name
+                complete = True
+                breaker.record_success()
+                get_prompt_prefix_cache().record_usage(usage_metadata)
+                if usage_metadata:
+                    call.update_tokens(
+                        input_tokens=usage_metadata['prompt_token_count'],
+                        output_tokens=usage_metadata['candidates_token_count'],
+                        total_tokens=usage_metadata['total_token_count']
+                    )
+                logger.info(f"✅ Streamed answer with {model_name}")
+                break
+
+            except GeneratorExit:
+                # Client went away mid-answer; the model itself was answering fine
+                breaker.record_success()
+                close = getattr(responses, "close", None)
+                if close:
+                    close()
+                raise
+            except Exception as e:
+                error_msg = str(e)
+                last_error = e
+                call.set_error(error_msg)
+                breaker.record_failure(e)
+                if parts:
+                    logger.error(f"❌ Model {model_name} failed mid-stream, keeping partial answer: {error_msg}")
+                    break
+                logger.warning(f"❌ Model {model_name} failed: {error_msg}")
+
+        model_name = next_available_model(FALLBACK_MODELS, after=model_name)
+
+    observe_answer_model(model_used, FALLBACK_MODELS[0])
+    if not parts:
+        logger.error(f"All models failed. Last error: {last_error}")
+        fallback_text = _unavailable_answer(query, len(prepared["summary_results"]))
+        first_token_at = time.perf_counter()
+        parts.append(fallback_text)
+        model_used = "fallback-none"
+        yield "token", {"text": citations.feed(fallback_text)}
+
+    cited = len(citations.sources)
+    tail = citations.finish()
+    for number, source in enumerate(citations.sources[cited:], cited + 1):
+        yield "citation", {"number": number, "source": source}
+    if tail:
+        yield "token", {"text": tail}
+
+    generation_ms = (time.perf_counter() - start) * 1000
+    result = finalize_optimized_answer(
+        query, prepared, "".join(parts), model_used, usage_metadata,
+        answer_sources=answer_sources, citations=citations
+    )
+    result["time_to_first_token_ms"] = round((first_token_at - start) * 1000, 1)
+    result["generation_ms"] = round(generation_ms, 1)
+    yield "citations", {
+        "answer": result["answer"],
+        "explicit_citations": result["explicit_citations"],
+        "sources": result["sources"]
+    }
+
+    if include_follow_ups:
+        from .synthesizer import generate_follow_up_questions
+        result["follow_up_questions"] = generate_follow_up_questions(query, result["answer"], num_questions=3)
+        yield "follow_ups", {"follow_up_questions": result["follow_up_questions"]}
+    else:
+        result["follow_up_questions"] = []
+
+    if complete:
+        # Answers cut short by a mid-stream failure are not cached
+        store_cached_answer(cache_key, prepared, result)
+    yield "result", result
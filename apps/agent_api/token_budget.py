@@ -0,0 +1,378 @@
+"""
+Token budgeting for the synthesis context in CENTEF RAG system.
+
+The old budget used len(text) // 4 and a fixed 20/80 summary/chunk split, and
+cut content mid-word. Four characters per token is close for English prose but
+badly off for Arabic transcripts (more tokens per character), digit-heavy tables
+(Gemini splits numbers into single digits) and markup, so the prompt was either
+oversized or left context unused.
+
+    TokenCounter    Gemini's local tokenizer when the installed SDK provides one
+                    (vertexai.preview.tokenization), otherwise a script-aware
+                    estimate calibrated against the prompt_token_count Gemini
+                    reports. Counts are cached per result ID; chunk text never
+                    changes once indexed.
+    allocate_budget Splits a token budget across results in proportion to their
+                    retrieval/rerank score; results that need less than their
+                    share give the rest back to the others.
+    truncate_to_tokens
+                    Cuts text on paragraph, then sentence, then word boundaries.
+"""
+import logging
+import math
+import os
+import re
+import statistics
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Environment variables
+TOKEN_COUNT_CACHE_SIZE = int(os.getenv("TOKEN_COUNT_CACHE_SIZE", "50000"))
+TOKEN_BUDGET_CALIBRATION_WINDOW = int(os.getenv("TOKEN_BUDGET_CALIBRATION_WINDOW", "200"))
+TOKEN_BUDGET_MIN_CALIBRATION_SAMPLES = 5
+TOKENIZER_MODEL = os.getenv("TOKENIZER_MODEL", "gemini-1.5-flash-002")
+
+# Summaries may take up to this share of the context; whatever they leave goes to chunks
+SUMMARY_BUDGET_SHARE = float(os.getenv("SUMMARY_BUDGET_SHARE", "0.2"))
+PROMPT_STRUCTURE_TOKENS = 2000  # Instructions, labels and history around the context
+MIN_SUMMARY_TOKENS = 100  # Don't include a summary cut shorter than this
+MIN_CHUNK_TOKENS = 200  # Don't include a chunk cut shorter than this
+TRUNCATION_MARKER = "..."
+
+_TOKEN_PATTERN = re.compile(
+    r"\d"                                                 # Digits are single tokens
+    r"|[A-Za-z\u00C0-\u024F']+"                           # Latin words
+    r"|[\u0590-\u06FF\u0750-\u077F\uFB1D-\uFDFF\uFE70-\uFEFF]+"  # Hebrew/Arabic words
+    r"|[\u3040-\u30FF\u3400-\u4DBF\u4E00-\u9FFF\uAC00-\uD7AF]"  # CJK characters
+    r"|[^\W\d_]+"                                         # Words in other scripts
+    r"|\n+"
+    r"|[^\s\w]"                                           # Punctuation, table pipes, markup
+)
+_CHARS_PER_TOKEN = {"latin": 4.0, "rtl": 2.7, "other": 3.0}
+_PARAGRAPH_SPLIT = re.compile(r"(?<=\n)\s*\n")
+_SENTENCE_END = re.compile(r"(?<=[.!?\u061F\u06D4\u3002])[\"'\u201D)\]]*\s+")
+
+
+def _estimate_tokens(text: str) -> int:
+    """Script-aware token estimate (before calibration)."""
+    count = 0
+    for piece in _TOKEN_PATTERN.findall(text):
+        first = piece[0]
+        if len(piece) == 1 or first.isdigit() or first == "\n":
+            count += 1
+            continue
+        if first < "\u0250" or first == "'":
+            script = "latin"
+        elif "\u0590" <= first <= "\u077F" or "\uFB1D" <= first <= "\uFEFF":
+            script = "rtl"
+        else:
+            script = "other"
+        count += math.ceil(len(piece) / _CHARS_PER_TOKEN[script])
+    return count
+
+
+def _load_local_tokenizer(model: str) -> Optional[Callable[[str], int]]:
+    """Gemini's local tokenizer, if this SDK version ships one."""
+    try:
+        from vertexai.preview.tokenization import get_tokenizer_for_model
+    except ImportError:
+        return None
+    try:
+        tokenizer = get_tokenizer_for_model(model)
+    except Exception as e:
+        logger.warning(f"Local tokenizer for {model} unavailable, using estimates: {e}")
+        return None
+    return lambda text: tokenizer.count_tokens(text).total_tokens
+
+
+class TokenCounter:
+    """
+    Counts prompt tokens, caching counts for search results by ID.
+
+    With the local tokenizer counts are exact. Otherwise the script-aware
+    estimate is scaled by the median actual/planned ratio of recent prompts
+    (see record_actual), so it converges on what Gemini bills.
+    """
+
+    def __init__(
+        self,
+        tokenizer: Optional[Callable[[str], int]] = None,
+        cache_size: int = TOKEN_COUNT_CACHE_SIZE,
+        calibration_window: int = TOKEN_BUDGET_CALIBRATION_WINDOW
+    ):
+        self._tokenizer = tokenizer
+        self.exact = tokenizer is not None
+        self._cache: "OrderedDict[Tuple[str, str], int]" = OrderedDict()
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+        self._ratios: Deque[float] = deque(maxlen=calibration_window)
+        self._errors_pct: Deque[float] = deque(maxlen=calibration_window)
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def calibration(self) -> float:
+        """Multiplier applied to estimates (1.0 with the exact tokenizer or too few samples)."""
+        with self._lock:
+            ratios = list(self._ratios)
+        if self.exact or len(ratios) < TOKEN_BUDGET_MIN_CALIBRATION_SAMPLES:
+            return 1.0
+        return min(2.0, max(0.5, statistics.median(ratios)))
+
+    def _raw_count(self, text: str) -> int:
+        if self._tokenizer is not None:
+            try:
+                return self._tokenizer(text)
+            except Exception as e:
+                logger.warning(f"Tokenizer failed, falling back to estimate: {e}")
+        return _estimate_tokens(text)
+
+    def count(self, text: str) -> int:
+        """Token count for arbitrary text (not cached)."""
+        if not text:
+            return 0
+        return max(1, round(self._raw_count(text) * self.calibration))
+
+    def count_field(self, result: Any, field: str) -> int:
+        """
+        Token count for a search result's text field, cached by result ID.
+
+        Args:
+            result: Summary or chunk result (dict or SearchResult)
+            field: 'summary_text' or 'content'
+
+        Returns:
+            Token count
+        """
+        text = result.get(field) or ""
+        result_id = result.get("id")
+        if not result_id or not text:
+            return self.count(text)
+        key = (str(result_id), field)
+        with self._lock:
+            raw = self._cache.get(key)
+            if raw is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+        if raw is None:
+            raw = self._raw_count(text)
+            with self._lock:
+                self.misses += 1
+                self._cache[key] = raw
+                while len(self._cache) > self._cache_size:
+                    self._cache.popitem(last=False)
+        return max(1, round(raw * self.calibration))
+
+    def record_actual(self, planned: int, actual: int) -> None:
+        """
+        Record the prompt_token_count Gemini reported for a prompt planned at `planned` tokens.
+        """
+        if planned <= 0 or actual <= 0:
+            return
+        calibration = self.calibration
+        with self._lock:
+            self._ratios.append(actual / (planned / calibration))
+            self._errors_pct.append((planned - actual) / actual * 100)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            errors = list(self._errors_pct)
+            cached = len(self._cache)
+        return {
+            "counter": "tokenizer" if self.exact else "estimate",
+            "calibration": round(self.calibration, 3),
+            "cached_counts": cached,
+            "cache_hits": self.hits,
+            "cache_misses": self.misses,
+            "samples": len(errors),
+            "planned_vs_actual_error_pct": {
+                "median": round(statistics.median(errors), 1) if errors else None,
+                "max_abs": round(max(abs(e) for e in errors), 1) if errors else None,
+            },
+        }
+
+
+_counter: Optional[TokenCounter] = None
+_counter_lock = threading.Lock()
+
+
+def get_token_counter() -> TokenCounter:
+    """Get the shared token counter."""
+    global _counter
+    with _counter_lock:
+        if _counter is None:
+            _counter = TokenCounter(_load_local_tokenizer(TOKENIZER_MODEL))
+            logger.info(f"Token counter: {'local tokenizer' if _counter.exact else 'calibrated estimate'}")
+        return _counter
+
+
+def _score_weights(results: Sequence[Any]) -> List[float]:
+    """
+    Relative weights from rerank_score (or the retrieval score), min-max scaled
+    to 0.1-1 so scores on any scale work. Results without distinct scores fall
+    back to their rank.
+    """
+    scores = []
+    for result in results:
+        score = result.get("rerank_score")
+        if score is None:
+            score = result.get("score")
+        scores.append(float(score) if score is not None else None)
+    known = [s for s in scores if s is not None]
+    if len(set(known)) < 2:
+        return [1 / math.sqrt(rank + 1) for rank in range(len(results))]
+    low, high = min(known), max(known)
+    return [0.1 + 0.9 * ((s if s is not None else low) - low) / (high - low) for s in scores]
+
+
+def allocate_budget(
+    needs: Sequence[int],
+    weights: Sequence[float],
+    budget: int,
+    min_tokens: int = 0
+) -> List[int]:
+    """
+    Split a token budget in proportion to weights, capped at each item's need.
+
+    Items needing less than their share keep only what they need and the rest
+    is shared among the others. An item that would get fewer than min_tokens
+    (and can't fit whole) is dropped, lowest weight first, and its share
+    redistributed.
+
+    Args:
+        needs: Full token count of each item
+        weights: Relative weight of each item
+        budget: Tokens to distribute
+        min_tokens: Smallest useful partial allocation
+
+    Returns:
+        Tokens allocated to each item (0 = leave out)
+    """
+    candidates = [i for i, need in enumerate(needs) if need > 0]
+    while True:
+        allocation = [0] * len(needs)
+        remaining = budget
+        active = list(candidates)
+        while active:
+            total_weight = sum(weights[i] for i in active) or 1.0
+            satisfied = [i for i in active if needs[i] <= remaining * weights[i] / total_weight]
+            if not satisfied:
+                for i in active:
+                    allocation[i] = int(remaining * weights[i] / total_weight)
+                break
+            for i in satisfied:
+                allocation[i] = needs[i]
+                remaining -= needs[i]
+            active = [i for i in active if i not in satisfied]
+
+        too_small = [i for i in candidates if allocation[i] < needs[i] and allocation[i] < min_tokens]
+        if not too_small:
+            return allocation
+        candidates.remove(min(too_small, key=lambda i: (weights[i], -i)))
+
+
+def _split_keep(pattern: re.Pattern, text: str) -> List[str]:
+    """Split text after each match, keeping separators attached to the preceding piece."""
+    pieces, start = [], 0
+    for match in pattern.finditer(text):
+        pieces.append(text[start:match.end()])
+        start = match.end()
+    pieces.append(text[start:])
+    return [p for p in pieces if p]
+
+
+def truncate_to_tokens(text: str, max_tokens: int, counter: Optional[TokenCounter] = None) -> str:
+    """
+    Shorten text to at most max_tokens, cutting after the last whole paragraph,
+    else the last whole sentence, else the last whole word that fits.
+
+    Args:
+        text: Text to shorten
+        max_tokens: Token limit (including the truncation marker)
+        counter: Token counter (default: the shared one)
+
+    Returns:
+        text unchanged if it fits, otherwise a prefix ending in TRUNCATION_MARKER
+    """
+    counter = counter or get_token_counter()
+    if counter.count(text) <= max_tokens:
+        return text
+    limit = max_tokens - counter.count(" " + TRUNCATION_MARKER)
+
+    kept = ""
+    for paragraph in _split_keep(_PARAGRAPH_SPLIT, text):
+        if counter.count(kept + paragraph) > limit:
+            for sentence in _split_keep(_SENTENCE_END, paragraph):
+                if counter.count(kept + sentence) > limit:
+                    if not kept.strip():
+                        # Not even one sentence fits: cut between words
+                        for word in _split_keep(re.compile(r"\s+"), sentence):
+                            if counter.count(kept + word) > limit:
+                                break
+                            kept += word
+                    break
+                kept += sentence
+            break
+        kept += paragraph
+    return f"{kept.rstrip()} {TRUNCATION_MARKER}"
+
+
+def fit_context(
+    summary_results: List[Any],
+    chunk_results: List[Any],
+    max_tokens: int,
+    counter: Optional[TokenCounter] = None
+) -> Tuple[List[Any], List[Any], Dict[str, Any]]:
+    """
+    Fit summaries and chunks into a context budget.
+
+    Summaries get up to SUMMARY_BUDGET_SHARE of the budget; chunks get the rest,
+    including anything summaries didn't use. Within each tier the budget is
+    allocated by score and over-budget results are cut on sentence boundaries.
+    Result order is preserved; results that can't get a useful share are dropped.
+
+    Args:
+        summary_results: Summary search results
+        chunk_results: Chunk search results
+        max_tokens: Context budget including prompt structure
+        counter: Token counter (default: the shared one)
+
+    Returns:
+        Tuple of (summaries, chunks, plan) where plan records the budget and
+        the planned token counts
+    """
+    counter = counter or get_token_counter()
+    available = max(0, max_tokens - PROMPT_STRUCTURE_TOKENS)
+
+    def fit(results, field, budget, min_tokens):
+        needs = [counter.count_field(r, field) for r in results]
+        allocation = allocate_budget(needs, _score_weights(results), budget, min_tokens)
+        kept, used = [], 0
+        for result, need, tokens in zip(results, needs, allocation):
+            if tokens <= 0:
+                continue
+            if tokens < need:
+                result = dict(result)
+                result[field] = truncate_to_tokens(result.get(field) or "", tokens, counter)
+                tokens = counter.count(result[field])
+            kept.append(result)
+            used += tokens
+        return kept, used, sum(needs)
+
+    summaries, summary_tokens, summary_need = fit(
+        summary_results, "summary_text", int(available * SUMMARY_BUDGET_SHARE), MIN_SUMMARY_TOKENS
+    )
+    chunks, chunk_tokens, chunk_need = fit(
+        chunk_results, "content", available - summary_tokens, MIN_CHUNK_TOKENS
+    )
+    plan = {
+        "budget_tokens": available,
+        "summary_tokens": summary_tokens,
+        "chunk_tokens": chunk_tokens,
+        "dropped_tokens": summary_need + chunk_need - summary_tokens - chunk_tokens,
+        "counter": "tokenizer" if counter.exact else "estimate",
+    }
+    return summaries, chunks, plan
@@ -0,0 +1,558 @@
+"""
+Local dense vector index for CENTEF RAG system.
+Stores chunk/summary embeddings as one contiguous NumPy matrix that is
+memory-mapped at load time, with a side table of IDs and a JSONL docstore.
+
+Index layout (one directory per tier, "chunks" and "summaries"):
+    meta.json            - embedder name, dimension, dtype, partition info
+    vectors.npy          - (N, dim) float16/float32 matrix, L2-normalized rows
+    ids.npy              - (N,) fixed-width unicode IDs, aligned with vectors
+    doc_offsets.npy      - (N,) uint64 byte offsets into docs.jsonl
+    docs.jsonl           - original records
+    centroids.npy        - (nlist, dim) IVF centroids (IVF indexes only)
+    partition_offsets.npy - (nlist + 1,) row ranges per partition (IVF indexes only)
+
+All .npy files are opened with mmap_mode='r', so every uvicorn worker maps the
+same pages from the page cache instead of holding a private copy.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Iterable, Sequence, Tuple, Union
+
+import numpy as np
+from dotenv import load_dotenv
+
+# Add parent directory to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from shared.schemas import Chunk, Summary
+from apps.agent_api.search_result import SearchResult
+from apps.agent_api.reranker_local import tokenize
+from apps.agent_api.retriever_local import (
+    TIERS,
+    TIER_SOURCE_DIRS,
+    iter_jsonl_records,
+    parse_filter,
+    format_chunk_result,
+    format_summary_result,
+)
+
+load_dotenv()
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Environment variables
+PROJECT_ID = os.getenv("PROJECT_ID")
+GENERATION_LOCATION = os.getenv("GENERATION_LOCATION", "us-central1")
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", "./vector_index")
+VECTOR_EMBEDDER = os.getenv("VECTOR_EMBEDDER", "hashing")  # "hashing" or "vertex"
+VECTOR_EMBEDDING_MODEL = os.getenv("VECTOR_EMBEDDING_MODEL", "text-embedding-004")
+VECTOR_EMBED_BATCH_SIZE = int(os.getenv("VECTOR_EMBED_BATCH_SIZE", "5"))
+VECTOR_INDEX_DTYPE = os.getenv("VECTOR_INDEX_DTYPE", "float16")
+VECTOR_IVF_MIN_SIZE = int(os.getenv("VECTOR_IVF_MIN_SIZE", "50000"))  # Build IVF partitions above this size
+VECTOR_IVF_NPROBE = int(os.getenv("VECTOR_IVF_NPROBE", "8"))
+
+# Rows scored per block in flat search; bounds the float32 working set
+SEARCH_BLOCK_ROWS = 16384
+
+# Initial over-fetch factor for filtered search (widened until enough records match)
+FILTER_OVERFETCH = 4
+
+
+# ============================================================================
+# Embedders
+# ============================================================================
+
+class HashingEmbedder:
+    """
+    Deterministic feature-hashing embedder (no model, no network).
+
+    Unigrams and bigrams are hashed into `dim` signed buckets and the vector is
+    L2-normalized. Useful for tests and as a lexical-semantic fallback.
+    """
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _features(self, text: str) -> List[str]:
+        tokens = tokenize(text)
+        return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+                value = int.from_bytes(digest, "little")
+                vectors[i, value % self.dim] += 1.0 if (value >> 63) & 1 else -1.0
+        return _normalize(vectors)
+
+
+class VertexEmbedder:
+    """Vertex AI text embedding model (e.g. text-embedding-004)."""
+
+    def __init__(self, model_name: str = VECTOR_EMBEDDING_MODEL, batch_size: int = VECTOR_EMBED_BATCH_SIZE):
+        import vertexai
+        from vertexai.language_models import TextEmbeddingModel
+
+        vertexai.init(project=PROJECT_ID, location=GENERATION_LOCATION)
+        self._model = TextEmbeddingModel.from_pretrained(model_name)
+        self.batch_size = batch_size
+        self.name = f"vertex-{model_name}"
+        self.dim = None
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        rows = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = [t or " " for t in texts[start:start + self.batch_size]]
+            rows.extend(e.values for e in self._model.get_embeddings(batch))
+        vectors = np.asarray(rows, dtype=np.float32)
+        self.dim = vectors.shape[1] if len(vectors) else self.dim
+        return _normalize(vectors)
+
+
+Embedder = Union[HashingEmbedder, VertexEmbedder]
+
+
+def get_embedder(name: Optional[str] = None) -> Embedder:
+    """
+    Create the configured embedder.
+
+    Args:
+        name: "hashing", "hashing-<dim>", "vertex" or "vertex-<model>" (None = VECTOR_EMBEDDER)
+
+    Returns:
+        Embedder instance
+    """
+    name = name or VECTOR_EMBEDDER
+    if name.startswith("hashing"):
+        _, _, dim = name.partition("-")
+        return HashingEmbedder(int(dim) if dim else 256)
+    if name.startswith("vertex"):
+        _, _, model = name.partition("-")
+        return VertexEmbedder(model or VECTOR_EMBEDDING_MODEL)
+    raise ValueError(f"Unknown embedder: {name}")
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+# ============================================================================
+# Index building
+# ============================================================================
+
+def _record_text(record: Dict[str, Any]) -> str:
+    title = record.get("title") or ""
+    body = record.get("content") or record.get("summary_text") or ""
+    return f"{title}\n{body}" if title else body
+
+
+def _kmeans(vectors: np.ndarray, nlist: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """Spherical k-means on a sample of the vectors; returns (nlist, dim) centroids."""
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(vectors), nlist * 256)
+    sample = vectors[rng.choice(len(vectors), sample_size, replace=False)].astype(np.float32)
+    centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        for c in range(nlist):
+            members = sample[assignment == c]
+            if len(members):
+                centroids[c] = members.sum(axis=0)
+        centroids = _normalize(centroids)
+    return centroids
+
+
+def build_vector_index(
+    items: Iterable[Union[Chunk, Summary]],
+    out_dir: str,
+    embedder: Optional[Embedder] = None,
+    dtype: str = VECTOR_INDEX_DTYPE,
+    nlist: Optional[int] = None,
+    batch_size: int = 256
+) -> Dict[str, Any]:
+    """
+    Embed chunks or summaries and write a memory-mappable vector index.
+
+    Args:
+        items: Chunk or Summary objects
+        out_dir: Output directory for this tier
+        embedder: Embedder to use (default from VECTOR_EMBEDDER)
+        dtype: "float16" or "float32" storage
+        nlist: Number of IVF partitions (None = automatic above VECTOR_IVF_MIN_SIZE, 0 = flat)
+        batch_size: Records embedded per call
+
+    Returns:
+        Index metadata
+    """
+    embedder = embedder or get_embedder()
+    os.makedirs(out_dir, exist_ok=True)
+
+    records: List[Dict[str, Any]] = []
+    offsets: List[int] = []
+    blocks: List[np.ndarray] = []
+    pending: List[str] = []
+
+    with open(os.path.join(out_dir, "docs.jsonl"), "wb") as docs_file:
+        for item in items:
+            record = item.to_dict()
+            offsets.append(docs_file.tell())
+            docs_file.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+            records.append({"id": record.get("id") or record.get("source_id")})
+            pending.append(_record_text(record))
+            if len(pending) >= batch_size:
+                blocks.append(embedder.embed(pending).astype(dtype))
+                pending = []
+        if pending:
+            blocks.append(embedder.embed(pending).astype(dtype))
+
+    dim = blocks[0].shape[1] if blocks else (embedder.dim or 0)
+    vectors = np.concatenate(blocks) if blocks else np.zeros((0, dim), dtype=dtype)
+    ids = np.array([r["id"] for r in records], dtype=f"<U{max([len(r['id']) for r in records] or [1])}")
+    doc_offsets = np.array(offsets, dtype=np.uint64)
+
+    if nlist is None:
+        nlist = int(np.sqrt(len(vectors))) if len(vectors) >= VECTOR_IVF_MIN_SIZE else 0
+    nlist = min(nlist, len(vectors))
+
+    meta = {
+        "embedder": embedder.name,
+        "dim": int(dim),
+        "dtype": dtype,
+        "num_vectors": int(len(vectors)),
+        "nlist": int(nlist),
+        "built_at": datetime.utcnow().isoformat(),
+    }
+
+    if nlist:
+        # Reorder rows so each IVF partition is a contiguous slice of the matrix
+        centroids = _kmeans(vectors, nlist)
+        assignment = np.concatenate([
+            np.argmax(vectors[i:i + SEARCH_BLOCK_ROWS].astype(np.float32) @ centroids.T, axis=1)
+            for i in range(0, len(vectors), SEARCH_BLOCK_ROWS)
+        ])
+        order = np.argsort(assignment, kind="stable")
+        vectors, ids, doc_offsets = vectors[order], ids[order], doc_offsets[order]
+        counts = np.bincount(assignment, minlength=nlist)
+        partition_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        np.save(os.path.join(out_dir, "centroids.npy"), centroids.astype(np.float32))
+        np.save(os.path.join(out_dir, "partition_offsets.npy"), partition_offsets)
+
+    np.save(os.path.join(out_dir, "vectors.npy"), vectors)
+    np.save(os.path.join(out_dir, "ids.npy"), ids)
+    np.save(os.path.join(out_dir, "doc_offsets.npy"), doc_offsets)
+    with open(os.path.join(out_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+
+    logger.info(f"Built vector index: {meta['num_vectors']} vectors x {dim} ({dtype}), nlist={nlist} -> {out_dir}")
+    return meta
+
+
+def build_vector_index_from_jsonl(
+    source_root: str,
+    index_dir: str = VECTOR_INDEX_DIR,
+    embedder: Optional[Embedder] = None,
+    nlist: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    Build chunk and summary vector indexes from source_root/data and source_root/summaries.
+
+    Args:
+        source_root: Local directory or gs://bucket[/prefix] with data/ and summaries/
+        index_dir: Output index directory
+        embedder: Embedder to use (default from VECTOR_EMBEDDER)
+        nlist: Number of IVF partitions (None = automatic)
+
+    Returns:
+        Metadata for each tier
+    """
+    embedder = embedder or get_embedder()
+    loaders = {"chunks": Chunk.from_dict, "summaries": Summary.from_dict}
+    return {
+        tier: build_vector_index(
+            (loaders[tier](record) for record in iter_jsonl_records(source_root, TIER_SOURCE_DIRS[tier])),
+            os.path.join(index_dir, tier),
+            embedder=embedder,
+            nlist=nlist
+        )
+        for tier in TIERS
+    }
+
+
+# ============================================================================
+# Index loading and search
+# ============================================================================
+
+class VectorIndex:
+    """Read-only, memory-mapped vector index for one tier."""
+
+    def __init__(self, index_dir: str, embedder: Optional[Embedder] = None):
+        self.index_dir = index_dir
+        with open(os.path.join(index_dir, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+
+        self.embedder = embedder or get_embedder(self.meta["embedder"])
+        if self.embedder.name != self.meta["embedder"]:
+            raise ValueError(
+                f"Index at {index_dir} was built with {self.meta['embedder']}, not {self.embedder.name}"
+            )
+
+        self.vectors = np.load(os.path.join(index_dir, "vectors.npy"), mmap_mode="r")
+        self.ids = np.load(os.path.join(index_dir, "ids.npy"), mmap_mode="r")
+        self.doc_offsets = np.load(os.path.join(index_dir, "doc_offsets.npy"), mmap_mode="r")
+        self.nlist = int(self.meta.get("nlist", 0))
+        if self.nlist:
+            self.centroids = np.load(os.path.join(index_dir, "centroids.npy"), mmap_mode="r")
+            self.partition_offsets = np.load(os.path.join(index_dir, "partition_offsets.npy"), mmap_mode="r")
+
+        self._docs_file = open(os.path.join(index_dir, "docs.jsonl"), "rb")
+        self._docs_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+    def get_record(self, row: int) -> Dict[str, Any]:
+        """Read the original record for a matrix row."""
+        with self._docs_lock:
+            self._docs_file.seek(int(self.doc_offsets[row]))
+            line = self._docs_file.readline()
+        return json.loads(line)
+
+    def _top_k_in_rows(self, queries: np.ndarray, start: int, end: int, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Blockwise dot products over rows [start, end); returns (rows, scores) of shape (Q, k')."""
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        best_scores = np.zeros((len(queries), 0), dtype=np.float32)
+        for block_start in range(start, end, SEARCH_BLOCK_ROWS):
+            block_end = min(block_start + SEARCH_BLOCK_ROWS, end)
+            scores = queries @ np.asarray(self.vectors[block_start:block_end], dtype=np.float32).T
+            rows = np.broadcast_to(np.arange(block_start, block_end), scores.shape)
+            all_scores = np.concatenate([best_scores, scores], axis=1)
+            all_rows = np.concatenate([best_rows, rows], axis=1)
+            if all_scores.shape[1] > k:
+                keep = np.argpartition(-all_scores, k - 1, axis=1)[:, :k]
+                all_scores = np.take_along_axis(all_scores, keep, axis=1)
+                all_rows = np.take_along_axis(all_rows, keep, axis=1)
+            best_scores, best_rows = all_scores, all_rows
+        return best_rows, best_scores
+
+    def search_vectors(
+        self,
+        queries: np.ndarray,
+        k: int,
+        nprobe: int = VECTOR_IVF_NPROBE
+    ) -> List[List[Tuple[int, float]]]:
+        """
+        Batched top-k search for normalized query vectors.
+
+        Args:
+            queries: (Q, dim) float32 query matrix
+            k: Results per query
+            nprobe: IVF partitions scanned per query (ignored for flat indexes)
+
+        Returns:
+            Per query, a list of (row, score) pairs sorted by score descending
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if not len(self) or k <= 0:
+            return [[] for _ in queries]
+
+        if not self.nlist:
+            rows, scores = self._top_k_in_rows(queries, 0, len(self), k)
+            per_query = list(zip(rows, scores))
+        else:
+            probes = np.argsort(-(queries @ np.asarray(self.centroids).T), axis=1)[:, :nprobe]
+            candidate_rows: List[List[np.ndarray]] = [[] for _ in queries]
+            candidate_scores: List[List[np.ndarray]] = [[] for _ in queries]
+            # One matrix product per probed partition, for every query probing it
+            for p in np.unique(probes):
+                probing = np.flatnonzero((probes == p).any(axis=1))
+                rows, scores = self._top_k_in_rows(
+                    queries[probing], int(self.partition_offsets[p]), int(self.partition_offsets[p + 1]), k
+                )
+                for i, q in enumerate(probing):
+                    candidate_rows[q].append(rows[i])
+                    candidate_scores[q].append(scores[i])
+            per_query = [
+                (np.concatenate(rows), np.concatenate(scores))
+                for rows, scores in zip(candidate_rows, candidate_scores)
+            ]
+
+        results = []
+        for rows, scores in per_query:
+            order = np.argsort(-scores, kind="stable")[:k]
+            results.append([(int(rows[i]), float(scores[i])) for i in order])
+        return results
+
+    def search(
+        self,
+        query: str,
+        max_results: int,
+        filter_expression: Optional[str] = None
+    ) -> List[Tuple[Dict[str, Any], float]]:
+        """
+        Semantic search for a text query.
+
+        Args:
+            query: Search query
+            max_results: Maximum number of results
+            filter_expression: Optional Vertex AI Search style filter
+
+        Returns:
+            List of (record, score) tuples, best first
+        """
+        predicate = parse_filter(filter_expression)
+        query_vector = self.embedder.embed([query])
+        if not predicate:
+            return [(self.get_record(row), score) for row, score in self.search_vectors(query_vector, max_results)[0]]
+
+        # Filters are applied to the records: over-fetch, and widen the search
+        # (more results, more IVF partitions) until enough records match or
+        # every partition has been scanned
+        k = max_results * FILTER_OVERFETCH
+        nprobe = VECTOR_IVF_NPROBE
+        matched: Dict[int, Optional[Dict[str, Any]]] = {}
+        while True:
+            hits = self.search_vectors(query_vector, k, nprobe)[0]
+            results = []
+            for row, score in hits:
+                if row not in matched:
+                    record = self.get_record(row)
+                    matched[row] = record if predicate(record) else None
+                if matched[row] is not None:
+                    results.append((matched[row], score))
+                    if len(results) >= max_results:
+                        return results
+            all_probed = not self.nlist or nprobe >= self.nlist
+            if all_probed and (len(hits) < k or k >= len(self)):
+                return results
+            if len(hits) >= k:
+                k *= 2
+            if not all_probed:
+                nprobe = min(nprobe * 2, self.nlist)
+
+    def close(self) -> None:
+        self._docs_file.close()
+
+
+_indexes: Dict[str, VectorIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_vector_index(tier: str, index_dir: Optional[str] = None) -> VectorIndex:
+    """Get the memory-mapped vector index for a tier (loaded once per process)."""
+    path = os.path.join(index_dir or VECTOR_INDEX_DIR, tier)
+    with _indexes_lock:
+        if path not in _indexes:
+            if not os.path.exists(os.path.join(path, "meta.json")):
+                raise FileNotFoundError(
+                    f"Vector {tier} index not found at {path}. "
+                    f"Build it with: python -m apps.agent_api.vector_index build --source <dir>"
+                )
+            _indexes[path] = VectorIndex(path)
+            logger.info(f"Loaded vector {tier} index from {path} ({len(_indexes[path])} vectors)")
+        return _indexes[path]
+
+
+def search_chunks(
+    query: str,
+    max_results: int = 10,
+    filter_expression: Optional[str] = None,
+    fields: Optional[Sequence[str]] = None
+) -> List[SearchResult]:
+    """
+    Semantic search over the local chunk vector index.
+
+    Args:
+        query: Search query string
+        max_results: Maximum number of results to return
+        filter_expression: Optional filter
+        fields: Result fields to project (default CHUNK_FIELDS)
+
+    Returns:
+        List of chunk results with content and metadata
+    """
+    logger.info(f"Searching chunk vector index with query: {query}")
+    results = [
+        format_chunk_result(record, score, fields)
+        for record, score in get_vector_index("chunks").search(query, max_results, filter_expression)
+    ]
+    logger.info(f"Found {len(results)} chunk results from vector index")
+    return results
+
+
+def search_summaries(
+    query: str,
+    max_results: int = 5,
+    filter_expression: Optional[str] = None,
+    fields: Optional[Sequence[str]] = None
+) -> List[SearchResult]:
+    """
+    Semantic search over the local summary vector index.
+
+    Args:
+        query: Search query string
+        max_results: Maximum number of results to return
+        filter_expression: Optional filter
+        fields: Result fields to project (default SUMMARY_FIELDS)
+
+    Returns:
+        List of summary results with content and metadata
+    """
+    logger.info(f"Searching summary vector index with query: {query}")
+    results = [
+        format_summary_result(record, score, fields)
+        for record, score in get_vector_index("summaries").search(query, max_results, filter_expression)
+    ]
+    logger.info(f"Found {len(results)} summary results from vector index")
+    return results
+
+
+def main():
+    """CLI entry point for building and querying the vector index."""
+    parser = argparse.ArgumentParser(description="Local dense vector index for chunk/summary JSONL files")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="Build the index")
+    build_parser.add_argument("--source", required=True,
+                              help="Directory or gs://bucket[/prefix] containing data/ and summaries/")
+    build_parser.add_argument("--index-dir", default=VECTOR_INDEX_DIR, help="Output index directory")
+    build_parser.add_argument("--embedder", default=VECTOR_EMBEDDER, help="hashing[-dim] or vertex[-model]")
+    build_parser.add_argument("--nlist", type=int, default=None, help="IVF partitions (0 = flat, default = auto)")
+
+    search_parser = subparsers.add_parser("search", help="Query the index")
+    search_parser.add_argument("query")
+    search_parser.add_argument("--tier", choices=TIERS, default="chunks")
+    search_parser.add_argument("--max-results", type=int, default=5)
+    search_parser.add_argument("--index-dir", default=VECTOR_INDEX_DIR)
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        meta = build_vector_index_from_jsonl(args.source, args.index_dir, get_embedder(args.embedder), args.nlist)
+        print(json.dumps(meta, indent=2))
+        return 0
+
+    index = get_vector_index(args.tier, args.index_dir)
+    for record, score in index.search(args.query, args.max_results):
+        text = (record.get("content") or record.get("summary_text") or "")[:120].replace("\n", " ")
+        print(f"{score:8.3f}  {record.get('id')}  {text}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
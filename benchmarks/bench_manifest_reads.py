@@ -0,0 +1,202 @@
+"""
+Regression benchmark: manifest reads per /chat turn.
+
+Before the shared manifest view, both synthesizers resolved citations with one
+get_manifest_entry() call per distinct source, and each call downloaded and
+parsed the full manifest.jsonl, so a turn citing ten sources made ten full
+downloads. The legacy resolver below reproduces that; the current path
+resolves every source in one pass with get_manifest_entries_by_ids().
+
+Each turn runs synthesize_answer_optimized end to end (source map, answer
+cache revalidation) against an in-memory GCS stand-in and a fake Gemini model,
+so no network is used. The answer cache's source version check goes through
+the same resolver, so it is counted too. Reported per turn: full manifest
+downloads, generation checks (metadata requests) and wall time, with
+--download-ms of simulated latency per download.
+
+Usage:
+    python benchmarks/bench_manifest_reads.py [--sources 10] [--manifest-size 500] [--turns 20] [--download-ms 40]
+"""
+import argparse
+import json
+import logging
+import sys
+import time
+from pathlib import Path
+
+from google.api_core import exceptions as core_exceptions
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import shared.manifest
+from apps.agent_api import synthesizer, synthesizer_optimized
+from apps.agent_api.answer_cache import reset_answer_cache
+from apps.agent_api.model_health import reset_breakers
+
+
+class FakeManifestStorage:
+    """Minimal google.cloud.storage client serving one manifest blob from memory."""
+
+    def __init__(self, content: str, download_ms: float = 0.0):
+        self.content = content
+        self.generation = 1
+        self.download_ms = download_ms
+        self.downloads = 0
+        self.metadata_requests = 0
+
+    def bucket(self, name):
+        return self
+
+    def get_blob(self, path):
+        self.metadata_requests += 1
+        return _FakeBlob(self) if self.content is not None else None
+
+    def blob(self, path):
+        return _FakeBlob(self)
+
+    def rewrite(self, content: str) -> None:
+        """A write by another process (e.g. the ingestion service)."""
+        self.content = content
+        self.generation += 1
+
+
+class _FakeBlob:
+    def __init__(self, storage):
+        self._storage = storage
+        self.generation = storage.generation
+
+    def download_as_text(self, if_generation_match=None):
+        if if_generation_match is not None and if_generation_match != self._storage.generation:
+            raise core_exceptions.PreconditionFailed("generation mismatch")
+        self._storage.downloads += 1
+        time.sleep(self._storage.download_ms / 1000)
+        return self._storage.content
+
+    def upload_from_string(self, content, content_type=None):
+        self._storage.rewrite(content)
+        self.generation = self._storage.generation
+
+
+def make_manifest(size: int) -> str:
+    """A manifest.jsonl with `size` embedded documents (doc0 ... doc{size-1})."""
+    lines = []
+    for i in range(size):
+        lines.append(json.dumps({
+            "source_id": f"doc{i}",
+            "filename": f"doc{i}.pdf",
+            "title": f"Guidance on Transparency and Beneficial Ownership ({i})",
+            "mimetype": "application/pdf",
+            "source_uri": f"gs://centef-rag-bucket/sources/doc{i}.pdf",
+            "status": "embedded",
+            "approved": True,
+            "updated_at": "2024-01-01T00:00:00",
+            "tags": ["beneficial_ownership"],
+        }))
+    return "\n".join(lines) + "\n"
+
+
+def make_results(num_sources: int):
+    """Summaries and chunks citing num_sources distinct documents (two chunks each)."""
+    summaries = [{"id": f"doc{i}_summary", "source_id": f"doc{i}", "summary_text": "Beneficial ownership guidance."}
+                 for i in range(num_sources)]
+    chunks = [{"id": f"doc{i}_page_{page}", "source_id": f"doc{i}", "page": page,
+               "content": "Owners must be disclosed."}
+              for i in range(num_sources) for page in (1, 2)]
+    return summaries, chunks
+
+
+def legacy_entries_by_ids(source_ids):
+    """The pre-view resolution: one full manifest download per distinct source."""
+    return {source_id: shared.manifest.get_manifest_entry(source_id) for source_id in set(source_ids) if source_id}
+
+
+class _Usage:
+    prompt_token_count = 900
+    candidates_token_count = 150
+    total_token_count = 1050
+
+
+class _Response:
+    text = "Owners must be disclosed [Document 1]."
+    usage_metadata = _Usage()
+
+
+class _FakeModel:
+    def __init__(self, name):
+        self.name = name
+
+    def generate_content(self, prompt, generation_config=None, stream=False):
+        return iter([_Response()]) if stream else _Response()
+
+
+def install_fakes(storage: FakeManifestStorage) -> None:
+    shared.manifest._get_storage_client = lambda: storage
+    synthesizer_optimized.GenerativeModel = _FakeModel
+    synthesizer.GenerativeModel = _FakeModel
+    synthesizer.generate_follow_up_questions = lambda query, answer, num_questions=3: []
+    reset_breakers()
+
+
+def run_turns(resolver, storage: FakeManifestStorage, num_sources: int, turns: int):
+    """
+    Run chat turns and count manifest traffic.
+
+    Returns:
+        Dict with downloads, metadata_requests and ms per turn
+    """
+    original = shared.manifest.get_manifest_entries_by_ids
+    shared.manifest.get_manifest_entries_by_ids = resolver
+    shared.manifest.clear_manifest_view()
+    reset_answer_cache()
+    summaries, chunks = make_results(num_sources)
+    downloads, metadata, started = storage.downloads, storage.metadata_requests, time.perf_counter()
+    try:
+        for turn in range(turns):
+            # A different question each turn (and a fresh cache per run) so the answer cache never short-circuits
+            result = synthesizer_optimized.synthesize_answer_optimized(
+                f"Who must disclose beneficial owners? ({turn})", summaries, chunks
+            )
+            assert result["sources"][0]["source_uri"] == "gs://centef-rag-bucket/sources/doc0.pdf"
+    finally:
+        shared.manifest.get_manifest_entries_by_ids = original
+    return {
+        "downloads": (storage.downloads - downloads) / turns,
+        "metadata_requests": (storage.metadata_requests - metadata) / turns,
+        "ms": (time.perf_counter() - started) * 1000 / turns,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Count manifest reads per chat turn")
+    parser.add_argument("--sources", type=int, default=10, help="Distinct sources cited per turn")
+    parser.add_argument("--manifest-size", type=int, default=500, help="Documents in the manifest")
+    parser.add_argument("--turns", type=int, default=20, help="Chat turns to run")
+    parser.add_argument("--download-ms", type=float, default=40.0, help="Simulated latency per manifest download")
+    parser.add_argument("--max-reads", type=float, default=1.0,
+                        help="Fail (exit 1) if the current path averages more downloads per turn")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    storage = FakeManifestStorage(make_manifest(args.manifest_size), args.download_ms)
+    install_fakes(storage)
+    variants = (
+        ("per-source get_manifest_entry", legacy_entries_by_ids),
+        ("get_manifest_entries_by_ids", shared.manifest.get_manifest_entries_by_ids),
+    )
+
+    print(f"{args.sources} sources per turn, {args.manifest_size}-entry manifest, {args.download_ms:.0f} ms per download\n")
+    print(f"{'resolver':<32}{'downloads/turn':>16}{'gen checks/turn':>17}{'ms/turn':>10}")
+    current = None
+    for name, resolver in variants:
+        stats = run_turns(resolver, storage, args.sources, args.turns)
+        print(f"{name:<32}{stats['downloads']:>16.2f}{stats['metadata_requests']:>17.2f}{stats['ms']:>10.1f}")
+        current = stats
+
+    if current["downloads"] > args.max_reads:
+        print(f"\nREGRESSION: {current['downloads']:.2f} manifest downloads per turn (max {args.max_reads})")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
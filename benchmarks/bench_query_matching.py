@@ -0,0 +1,162 @@
+"""
+Micro-benchmark: compiled query matcher vs. the legacy keyword scans.
+
+The legacy functions below reproduce the substring scans that
+analyze_query_characteristics() and detect_output_format() used before the
+rules were moved into apps/agent_api/query_patterns.py (keyword dicts rebuilt
+on every call, one `any(kw in query_lower ...)` scan per category).
+
+Usage:
+    python benchmarks/bench_query_matching.py [--iterations 2000]
+"""
+import argparse
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from apps.agent_api.query_patterns import match_query
+
+SAMPLE_QUERIES = [
+    "What is the FATF definition of beneficial ownership?",
+    "Compare customer due diligence requirements in the EU versus the UK",
+    "How to file a suspicious transaction report for crypto exchanges",
+    "Write a comprehensive analysis of terrorist financing through charities",
+    "Give me a brief summary of the Egmont Group principles",
+    "Prepare a presentation outline on sanctions evasion typologies",
+    "Tell me about trade based money laundering in the Gulf region",
+    "Draft a LinkedIn post about the latest FATF plenary outcomes",
+    "Explain the risk based approach for real estate agents and lawyers",
+    "What are the boundaries of understanding for structured products?",
+]
+
+
+def legacy_match(query: str) -> dict:
+    """Legacy keyword scans (one pass per category, substring semantics)."""
+    query_lower = query.lower()
+    result = {}
+
+    query_types = [
+        ('factual', ['what is', 'define', 'definition', 'meaning of']),
+        ('comparative', ['compare', 'difference', 'versus', 'vs', 'contrast']),
+        ('procedural', ['how to', 'steps', 'process', 'procedure', 'protocol']),
+        ('analytical', ['analyze', 'analysis', 'evaluate', 'assess', 'examine']),
+        ('exploratory', ['overview', 'about', 'tell me about', 'explain', 'describe']),
+    ]
+    for label, keywords in query_types:
+        if any(kw in query_lower for kw in keywords):
+            result['query_type'] = label
+            break
+
+    if any(kw in query_lower for kw in ['comprehensive', 'detailed', 'thorough', 'in-depth']):
+        result['complexity'] = 'complex'
+
+    if any(kw in query_lower for kw in ['specific', 'particular', 'exact', 'precise']):
+        result['scope'] = 'narrow'
+    elif any(kw in query_lower for kw in ['all', 'every', 'comprehensive', 'complete', 'entire', 'global']):
+        result['scope'] = 'broad'
+
+    orgs = {
+        'fatf': 'FATF', 'financial action task force': 'FATF', 'fiu': 'FIU',
+        'financial intelligence unit': 'FIU', 'un': 'UN', 'united nations': 'UN',
+        'imf': 'IMF', 'international monetary fund': 'IMF', 'world bank': 'World Bank',
+        'egmont': 'Egmont Group', 'egmont group': 'Egmont Group', 'wolfsberg': 'Wolfsberg Group',
+        'wolfsberg group': 'Wolfsberg Group', 'basel': 'Basel Committee',
+        'basel committee': 'Basel Committee', 'oecd': 'OECD'
+    }
+    for org_key, org_value in orgs.items():
+        if org_key in query_lower:
+            result['organization'] = org_value
+            break
+
+    topic_keywords = {
+        ('crypto', 'virtual asset', 'vasp', 'cryptocurrency', 'bitcoin', 'digital currency'): 'virtual_assets',
+        ('sanction', 'sanctions', 'sanctioned', 'embargo'): 'sanctions',
+        ('beneficial ownership', 'beneficial owner', 'bo', 'ubo', 'ultimate beneficial'): 'beneficial_ownership',
+        ('cdd', 'customer due diligence', 'kyc', 'know your customer'): 'customer_due_diligence',
+        ('edd', 'enhanced due diligence'): 'enhanced_due_diligence',
+        ('pep', 'peps', 'politically exposed', 'politically exposed person'): 'peps',
+        ('risk assessment', 'risk based approach', 'rba', 'risk management'): 'risk_assessment',
+        ('transaction monitoring', 'suspicious transaction', 'unusual transaction'): 'transaction_monitoring',
+        ('sar', 'str', 'suspicious activity report', 'suspicious transaction report'): 'suspicious_activity_reporting',
+        ('wire transfer', 'funds transfer', 'remittance'): 'wire_transfers',
+        ('tbml', 'trade based', 'trade finance'): 'trade_based_money_laundering',
+        ('correspondent bank', 'correspondent banking', 'nostro', 'vostro'): 'correspondent_banking',
+        ('dnfbp', 'designated non-financial', 'casino', 'real estate', 'lawyer', 'accountant'): 'dnfbps',
+        ('npo', 'non-profit', 'nonprofit', 'charity', 'charitable'): 'non_profit_organizations',
+        ('terrorism financing', 'terrorist financing', 'ctf', 'cft', 'counter terrorism'): 'terrorism_financing',
+        ('money laundering', 'aml', 'anti money laundering', 'laundering'): 'money_laundering',
+        ('proliferation financing', 'wmd', 'weapons of mass destruction'): 'proliferation_financing'
+    }
+    for keywords, tag_value in topic_keywords.items():
+        if any(kw in query_lower for kw in keywords):
+            result['topic'] = tag_value
+            break
+
+    formats = [
+        ('brief_summary', ['brief', 'summary', 'summarize', 'briefly', 'quick overview', 'tldr', 'tl;dr',
+                           'in short', 'key points', 'bullet points', 'main points', 'highlights']),
+        ('social_media', ['tweet', 'twitter post', 'social media post', 'linkedin post', 'facebook post',
+                          'instagram caption', '280 characters']),
+        ('blog_post', ['blog post', 'article', 'write an article', 'blog about', 'essay', 'write about',
+                       'detailed article', 'medium post']),
+        ('newsletter', ['newsletter', 'email newsletter', 'weekly update', 'monthly update', 'news brief', 'digest']),
+        ('outline', ['outline', 'presentation outline', 'talk outline', 'speaking points', 'presentation',
+                     'prepare a presentation', 'slide outline', 'interview prep', 'talking points', 'key topics']),
+        ('protocol', ['protocol', 'procedure', 'guidelines', 'step-by-step', 'how to', 'instructions',
+                      'best practices', 'framework', 'methodology', 'process', 'workflow']),
+        ('comprehensive_analysis', ['comprehensive', 'in-depth', 'detailed', 'thorough', 'complete analysis',
+                                    'full report', 'extensive', 'deep dive', 'exhaustive']),
+        ('report', ['report', 'write a report', 'formal report', 'research report', 'findings', 'assessment report']),
+        ('factual_answer', ['what is', 'when did', 'who is', 'where is', 'define', 'definition']),
+    ]
+    for label, keywords in formats:
+        if any(kw in query_lower for kw in keywords):
+            result['output_format'] = label
+            break
+
+    return result
+
+
+def compiled_match(query: str, cached: bool = False) -> dict:
+    """Same outputs as legacy_match(), from one pass of the compiled matcher."""
+    matches = match_query(query) if cached else match_query.__wrapped__(query)
+    result = {}
+    for group in ('query_type', 'scope', 'organization', 'topic', 'output_format'):
+        label = matches.first(group)
+        if label:
+            result[group] = label
+    if matches.has('complexity', 'complex'):
+        result['complexity'] = 'complex'
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark query keyword matching")
+    parser.add_argument("--iterations", type=int, default=2000, help="Passes over the sample queries")
+    args = parser.parse_args()
+
+    def run(fn):
+        return lambda: [fn(q) for q in SAMPLE_QUERIES]
+
+    n = args.iterations
+    total = n * len(SAMPLE_QUERIES)
+    legacy = timeit.timeit(run(legacy_match), number=n)
+    compiled = timeit.timeit(run(compiled_match), number=n)
+    cached = timeit.timeit(run(lambda q: compiled_match(q, cached=True)), number=n)
+
+    print(f"{'implementation':<22}{'total (s)':>12}{'per query (us)':>18}{'speedup':>10}")
+    for name, elapsed in (("legacy substring", legacy), ("compiled regex", compiled), ("compiled + cache", cached)):
+        print(f"{name:<22}{elapsed:>12.3f}{elapsed / total * 1e6:>18.2f}{legacy / elapsed:>9.1f}x")
+
+    print("\nResults that differ (legacy substring false positives are expected here):")
+    for q in SAMPLE_QUERIES:
+        old, new = legacy_match(q), compiled_match(q)
+        if old != new:
+            print(f"  {q}\n    legacy:   {old}\n    compiled: {new}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
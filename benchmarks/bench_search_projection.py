@@ -0,0 +1,141 @@
+"""
+Micro-benchmark: SearchResult field projection vs. the legacy result dicts.
+
+The legacy function below reproduces how retriever_vertex_search.search_chunks
+built results before SearchResult: dict(doc.struct_data) converted the whole
+protobuf Struct, and the full copy was kept again under "metadata" (so every
+page of content travelled twice through /search and the reranker).
+
+The benchmark builds a real discoveryengine SearchResponse (no network) and
+reports time, allocations, bytes allocated and JSON payload size per query.
+
+Usage:
+    python benchmarks/bench_search_projection.py [--results 10] [--page-chars 3000] [--iterations 300]
+"""
+import argparse
+import json
+import sys
+import timeit
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from google.cloud import discoveryengine_v1beta as discoveryengine
+
+from apps.agent_api.search_result import CHUNK_FIELDS, SearchResult, to_plain
+
+
+def make_response(num_results: int, page_chars: int) -> discoveryengine.SearchResponse:
+    """A chunk search response shaped like the CENTEF chunk datastore."""
+    words = ("beneficial ownership information must be adequate accurate and up to date "
+             "competent authorities should have timely access ").split()
+    content = " ".join(words[i % len(words)] for i in range(page_chars // 6))[:page_chars]
+    results = []
+    for i in range(num_results):
+        struct = {
+            "id": f"doc{i}_page_{i + 1}",
+            "source_id": f"doc{i}",
+            "filename": f"doc{i}.pdf",
+            "title": f"Guidance on Transparency and Beneficial Ownership ({i})",
+            "mimetype": "application/pdf",
+            "content": content,
+            "chunk_index": i,
+            "simhash": "9f3a5c7e11d2b480",
+            "author": "FATF",
+            "organization": "FATF",
+            "date": "2023-03-01",
+            "publisher": "FATF/OECD",
+            "tags": ["beneficial_ownership", "customer_due_diligence", "risk_assessment"],
+            "description": "Guidance on Recommendation 24 and its interpretive note.",
+            "page": i + 1,
+        }
+        results.append(discoveryengine.SearchResponse.SearchResult(
+            id=struct["id"],
+            document=discoveryengine.Document(id=struct["id"], struct_data=struct),
+        ))
+    return discoveryengine.SearchResponse(results=results)
+
+
+def legacy_results(response):
+    """Result dicts as built before SearchResult."""
+    results = []
+    for result in response.results:
+        doc = result.document
+        struct_data = dict(doc.struct_data) if doc.struct_data else {}
+        page_number = struct_data.get("page_number")
+        if page_number is None:
+            page_number = struct_data.get("page")
+        results.append({
+            "id": doc.id,
+            "content": struct_data.get("content", ""),
+            "page_number": page_number,
+            "page": page_number,
+            "start_sec": struct_data.get("start_sec"),
+            "end_sec": struct_data.get("end_sec"),
+            "source_id": struct_data.get("source_id"),
+            "filename": struct_data.get("filename"),
+            "title": struct_data.get("title"),
+            "simhash": struct_data.get("simhash"),
+            "score": getattr(result, 'relevance_score', 0.0),
+            "metadata": struct_data
+        })
+    return results
+
+
+def projected_results(response, fields=CHUNK_FIELDS):
+    """Results as built by retriever_vertex_search.search_chunks now."""
+    return [
+        SearchResult.project(
+            result.document.struct_data, fields,
+            doc_id=result.document.id, score=getattr(result, 'relevance_score', 0.0)
+        )
+        for result in response.results
+    ]
+
+
+def allocations(fn, response):
+    """(allocation count, bytes allocated) for one call, via tracemalloc."""
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    results = fn(response)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    stats = [s for s in after.compare_to(before, "filename") if s.size_diff > 0]
+    del results
+    return sum(s.count_diff for s in stats), sum(s.size_diff for s in stats)
+
+
+def payload_bytes(results) -> int:
+    """
+    Size of the JSON /search would return for these results.
+    (Legacy dicts still hold proto-plus lists, so both sides go through to_plain first.)
+    """
+    return len(json.dumps(to_plain(results)).encode("utf-8"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark search result projection")
+    parser.add_argument("--results", type=int, default=10, help="Results per query")
+    parser.add_argument("--page-chars", type=int, default=3000, help="Characters of content per chunk")
+    parser.add_argument("--iterations", type=int, default=300, help="Queries to time")
+    args = parser.parse_args()
+
+    response = make_response(args.results, args.page_chars)
+    variants = (
+        ("legacy dicts", legacy_results),
+        ("SearchResult", projected_results),
+        ("SearchResult id+score", lambda r: projected_results(r, ("id", "source_id", "score"))),
+    )
+
+    print(f"{args.results} results x {args.page_chars} chars of content per query\n")
+    print(f"{'implementation':<24}{'per query (us)':>16}{'allocs':>10}{'bytes alloc':>14}{'JSON bytes':>13}")
+    for name, fn in variants:
+        elapsed = timeit.timeit(lambda: fn(response), number=args.iterations)
+        count, size = allocations(fn, response)
+        print(f"{name:<24}{elapsed / args.iterations * 1e6:>16.1f}{count:>10}{size:>14}{payload_bytes(fn(response)):>13}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
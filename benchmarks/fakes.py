@@ -0,0 +1,507 @@
+"""
+In-process stand-ins for GCS, Vertex AI Search and Gemini, for benchmarks.
+
+Each fake delays its calls by a LatencyModel (log-normal with a given median
+and p99) and fails a fraction of them with ServiceUnavailable, so load tests
+can run the real request path (auth, pipeline, persistence) without GCP and
+with controlled backend behaviour:
+
+    FakeStorageClient   replaces google.cloud.storage.Client (manifest, chat
+                        history, users, uploads); objects live in memory
+    FakeVertexSearch    replaces retriever_vertex_search._start_search with
+                        futures completed by a timer thread, so hedging and
+                        deadlines behave as with the gRPC client
+    gemini_model_class  a GenerativeModel replacement that answers each of the
+                        app's prompt kinds (answers, query expansion, reranking,
+                        follow-ups) in the format the parser expects
+
+FakeBackends.install() patches all three in and neutralises the upload
+background processors (Document AI, transcription); uninstall() restores them.
+"""
+import heapq
+import itertools
+import json
+import math
+import random
+import re
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, InvalidStateError
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from google.api_core import exceptions as core_exceptions
+from google.cloud import discoveryengine_v1beta as discoveryengine
+
+# z-score of the 99th percentile of a standard normal
+_Z99 = 2.326
+
+
+class LatencyModel:
+    """Log-normal call latency with a median and p99, plus an error rate."""
+
+    def __init__(self, median_ms: float = 0.0, p99_ms: Optional[float] = None, error_rate: float = 0.0,
+                 seed: Optional[int] = None):
+        self.median_ms = median_ms
+        self.p99_ms = p99_ms if p99_ms is not None else median_ms
+        self.error_rate = error_rate
+        self._sigma = math.log(self.p99_ms / median_ms) / _Z99 if median_ms > 0 and self.p99_ms > median_ms else 0.0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def parse(cls, spec: str, seed: Optional[int] = None) -> "LatencyModel":
+        """Parse "median_ms[:p99_ms[:error_rate]]", e.g. "20:120:0.01"."""
+        parts = [float(part) for part in spec.split(":")]
+        if not 1 <= len(parts) <= 3:
+            raise ValueError(f"Invalid latency spec: {spec}. Expected median_ms[:p99_ms[:error_rate]]")
+        median_ms = parts[0]
+        p99_ms = parts[1] if len(parts) > 1 else None
+        error_rate = parts[2] if len(parts) > 2 else 0.0
+        return cls(median_ms, p99_ms, error_rate, seed)
+
+    def sample(self) -> Tuple[float, bool]:
+        """Draw (delay in seconds, whether the call fails)."""
+        with self._lock:
+            delay_ms = self.median_ms * math.exp(self._random.gauss(0.0, self._sigma)) if self.median_ms > 0 else 0.0
+            fails = self.error_rate > 0 and self._random.random() < self.error_rate
+        return delay_ms / 1000, fails
+
+    def wait(self, what: str) -> None:
+        """Sleep for one call's latency; raise ServiceUnavailable if it fails."""
+        delay_s, fails = self.sample()
+        if delay_s:
+            time.sleep(delay_s)
+        if fails:
+            raise core_exceptions.ServiceUnavailable(f"Injected failure: {what}")
+
+    def describe(self) -> Dict[str, float]:
+        return {"median_ms": self.median_ms, "p99_ms": self.p99_ms, "error_rate": self.error_rate}
+
+
+class CallCounter:
+    """Thread-safe call counts by name."""
+
+    def __init__(self):
+        self._counts: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def add(self, name: str) -> None:
+        with self._lock:
+            self._counts[name] += 1
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+
+
+class FakeStorageClient:
+    """google.cloud.storage.Client stand-in keeping objects in memory."""
+
+    def __init__(self, latency: Optional[LatencyModel] = None):
+        self.latency = latency or LatencyModel()
+        self.calls = CallCounter()
+        self._objects: Dict[Tuple[str, str], Tuple[bytes, int, Optional[str]]] = {}
+        self._generations = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def __call__(self, *args: Any, **kwargs: Any) -> "FakeStorageClient":
+        """Lets the instance stand in for the Client class: storage.Client(project=...)."""
+        return self
+
+    def bucket(self, name: str) -> "FakeBucket":
+        return FakeBucket(self, name)
+
+    def _call(self, operation: str) -> None:
+        self.calls.add(operation)
+        self.latency.wait(f"gcs.{operation}")
+
+    def put(self, bucket: str, path: str, data: bytes, content_type: Optional[str] = None,
+            if_generation_match: Optional[int] = None) -> int:
+        """Store an object without latency (seeding); returns its generation."""
+        with self._lock:
+            if if_generation_match is not None:
+                current = self._objects.get((bucket, path))
+                if (current[1] if current else 0) != if_generation_match:
+                    raise core_exceptions.PreconditionFailed(f"gs://{bucket}/{path} generation changed")
+            generation = next(self._generations)
+            self._objects[(bucket, path)] = (data, generation, content_type)
+            return generation
+
+    def get(self, bucket: str, path: str) -> Optional[Tuple[bytes, int, Optional[str]]]:
+        with self._lock:
+            return self._objects.get((bucket, path))
+
+    def delete(self, bucket: str, path: str) -> bool:
+        with self._lock:
+            return self._objects.pop((bucket, path), None) is not None
+
+    def names(self, bucket: str, prefix: str) -> List[str]:
+        with self._lock:
+            return sorted(path for name, path in self._objects if name == bucket and path.startswith(prefix))
+
+
+class FakeBucket:
+    def __init__(self, client: FakeStorageClient, name: str):
+        self.client = client
+        self.name = name
+
+    def blob(self, path: str) -> "FakeBlob":
+        return FakeBlob(self, path)
+
+    def get_blob(self, path: str) -> Optional["FakeBlob"]:
+        self.client._call("metadata")
+        stored = self.client.get(self.name, path)
+        return FakeBlob(self, path, stored[1]) if stored else None
+
+    def list_blobs(self, prefix: str = "") -> List["FakeBlob"]:
+        self.client._call("list")
+        return [FakeBlob(self, path) for path in self.client.names(self.name, prefix)]
+
+
+class FakeBlob:
+    def __init__(self, bucket: FakeBucket, name: str, generation: Optional[int] = None):
+        self.bucket = bucket
+        self.name = name
+        self.generation = generation
+
+    @property
+    def _client(self) -> FakeStorageClient:
+        return self.bucket.client
+
+    def _read(self, if_generation_match: Optional[int]) -> bytes:
+        self._client._call("download")
+        stored = self._client.get(self.bucket.name, self.name)
+        if stored is None:
+            raise core_exceptions.NotFound(f"gs://{self.bucket.name}/{self.name}")
+        if if_generation_match is not None and stored[1] != if_generation_match:
+            raise core_exceptions.PreconditionFailed(f"gs://{self.bucket.name}/{self.name} generation changed")
+        self.generation = stored[1]
+        return stored[0]
+
+    def exists(self) -> bool:
+        self._client._call("metadata")
+        return self._client.get(self.bucket.name, self.name) is not None
+
+    def reload(self) -> None:
+        self._client._call("metadata")
+        stored = self._client.get(self.bucket.name, self.name)
+        if stored is None:
+            raise core_exceptions.NotFound(f"gs://{self.bucket.name}/{self.name}")
+        self.generation = stored[1]
+
+    @property
+    def size(self) -> Optional[int]:
+        stored = self._client.get(self.bucket.name, self.name)
+        return len(stored[0]) if stored else None
+
+    def download_as_bytes(self, if_generation_match: Optional[int] = None, **kwargs: Any) -> bytes:
+        return self._read(if_generation_match)
+
+    def download_as_text(self, if_generation_match: Optional[int] = None, encoding: str = "utf-8", **kwargs: Any) -> str:
+        return self._read(if_generation_match).decode(encoding)
+
+    def upload_from_string(self, data: Any, content_type: Optional[str] = None,
+                           if_generation_match: Optional[int] = None, **kwargs: Any) -> None:
+        self._client._call("upload")
+        data = data.encode("utf-8") if isinstance(data, str) else bytes(data)
+        self.generation = self._client.put(self.bucket.name, self.name, data, content_type, if_generation_match)
+
+    def upload_from_file(self, file_obj: Any, content_type: Optional[str] = None, **kwargs: Any) -> None:
+        self.upload_from_string(file_obj.read(), content_type=content_type)
+
+    def delete(self) -> None:
+        self._client._call("delete")
+        if not self._client.delete(self.bucket.name, self.name):
+            raise core_exceptions.NotFound(f"gs://{self.bucket.name}/{self.name}")
+
+
+class _Timer:
+    """One daemon thread running scheduled callbacks in deadline order."""
+
+    def __init__(self):
+        self._heap: List[Tuple[float, int, Callable[[], None]]] = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        threading.Thread(target=self._run, name="fake-backend-timer", daemon=True).start()
+
+    def call_later(self, delay_s: float, fn: Callable[[], None]) -> None:
+        with self._condition:
+            heapq.heappush(self._heap, (time.monotonic() + delay_s, next(self._sequence), fn))
+            self._condition.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._heap:
+                    self._condition.wait()
+                when = self._heap[0][0]
+                now = time.monotonic()
+                if when > now:
+                    self._condition.wait(when - now)
+                    continue
+                _, _, fn = heapq.heappop(self._heap)
+            fn()
+
+
+def make_corpus(num_sources: int) -> List[Dict[str, Any]]:
+    """Synthetic documents: manifest fields plus a summary and page texts."""
+    topics = ("beneficial ownership", "sanctions screening", "terrorist financing", "virtual assets",
+              "correspondent banking", "politically exposed persons", "trade-based laundering")
+    corpus = []
+    for i in range(num_sources):
+        topic = topics[i % len(topics)]
+        corpus.append({
+            "source_id": f"doc{i}",
+            "filename": f"doc{i}.pdf",
+            "title": f"Guidance on {topic.title()} ({i})",
+            "summary_text": f"Guidance on {topic}: obligations, risk indicators and supervisory expectations. " * 4,
+            "pages": [f"Page {page} on {topic}: institutions must identify, verify and record {topic} risks "
+                      f"and report suspicious activity without delay. " * 6 for page in range(1, 6)],
+        })
+    return corpus
+
+
+def manifest_jsonl(corpus: List[Dict[str, Any]], bucket: str) -> str:
+    """manifest.jsonl content with every corpus document embedded and approved."""
+    return "".join(json.dumps({
+        "source_id": doc["source_id"],
+        "filename": doc["filename"],
+        "title": doc["title"],
+        "mimetype": "application/pdf",
+        "source_uri": f"gs://{bucket}/sources/{doc['filename']}",
+        "status": "embedded",
+        "approved": True,
+        "updated_at": "2024-01-01T00:00:00",
+        "tags": ["benchmark"],
+    }) + "\n" for doc in corpus)
+
+
+class FakeVertexSearch:
+    """
+    _start_search stand-in: returns a future that a timer thread completes
+    after the modelled latency, with chunk or summary results drawn from the
+    corpus (chosen by the query, so repeated queries get the same results).
+    """
+
+    def __init__(self, corpus: List[Dict[str, Any]], summaries_datastore: str, latency: Optional[LatencyModel] = None):
+        self.latency = latency or LatencyModel()
+        self.calls = CallCounter()
+        self.summaries_datastore = summaries_datastore
+        self._timer = _Timer()
+        self._chunks = [
+            discoveryengine.SearchResponse.SearchResult(document=discoveryengine.Document(
+                id=f"{doc['source_id']}_page_{page}",
+                struct_data={"source_id": doc["source_id"], "filename": doc["filename"], "title": doc["title"],
+                             "content": text, "page": page},
+            ))
+            for doc in corpus for page, text in enumerate(doc["pages"], 1)
+        ]
+        self._summaries = [
+            discoveryengine.SearchResponse.SearchResult(document=discoveryengine.Document(
+                id=f"{doc['source_id']}_summary",
+                struct_data={"source_id": doc["source_id"], "filename": doc["filename"], "title": doc["title"],
+                             "summary_text": doc["summary_text"], "organization": "FATF"},
+            ))
+            for doc in corpus
+        ]
+        self._responses: Dict[Tuple[bool, int, int], discoveryengine.SearchResponse] = {}
+        self._lock = threading.Lock()
+
+    def _response(self, summaries: bool, query: str, page_size: int) -> discoveryengine.SearchResponse:
+        pool = self._summaries if summaries else self._chunks
+        offset = sum(query.encode()) % len(pool)
+        key = (summaries, offset, page_size)
+        with self._lock:
+            response = self._responses.get(key)
+            if response is None:
+                picked = [pool[(offset + i) % len(pool)] for i in range(min(page_size or 10, len(pool)))]
+                response = discoveryengine.SearchResponse(results=picked)
+                self._responses[key] = response
+            return response
+
+    def __call__(self, request: discoveryengine.SearchRequest, timeout: float) -> Future:
+        summaries = f"dataStores/{self.summaries_datastore}/" in request.serving_config
+        self.calls.add("summaries" if summaries else "chunks")
+        response = self._response(summaries, request.query, request.page_size)
+        delay_s, fails = self.latency.sample()
+        future: Future = Future()
+
+        def complete():
+            try:
+                if fails:
+                    future.set_exception(core_exceptions.ServiceUnavailable("Injected failure: vertex_search"))
+                else:
+                    future.set_result(response)
+            except InvalidStateError:
+                pass  # Cancelled (e.g. the losing attempt of a hedged call)
+
+        if delay_s >= timeout:
+            self._timer.call_later(timeout, lambda: _fail(future, core_exceptions.DeadlineExceeded("Deadline exceeded")))
+        else:
+            self._timer.call_later(delay_s, complete)
+        return future
+
+
+def _fail(future: Future, error: Exception) -> None:
+    try:
+        future.set_exception(error)
+    except InvalidStateError:
+        pass
+
+
+class _Usage:
+    def __init__(self, prompt_tokens: int, output_tokens: int):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = output_tokens
+        self.total_token_count = prompt_tokens + output_tokens
+
+
+class _Response:
+    def __init__(self, text: str, usage: Optional[_Usage] = None):
+        self.text = text
+        if usage is not None:
+            self.usage_metadata = usage
+
+
+def _reply(prompt: str) -> str:
+    """A response in the format each of the app's prompts asks for."""
+    if "mapping every label to its score" in prompt:
+        labels = re.findall(r"^\[([CS]\d+)\]", prompt, re.MULTILINE)
+        return json.dumps({label: 9 - (i % 10) for i, label in enumerate(labels)})
+    if "Order (indices only" in prompt:
+        return ", ".join(re.findall(r"^\[(\d+)\]", prompt, re.MULTILINE))
+    if "alternative queries" in prompt:
+        match = re.search(r"Original query: (.*)", prompt)
+        query = match.group(1).strip() if match else "the question"
+        return f"{query} regulatory requirements\n{query} FATF recommendations"
+    if "follow-up questions" in prompt:
+        return ("Which supervisors enforce these obligations?\n"
+                "How do the rules apply to trusts and foundations?\n"
+                "What are the penalties for non-compliance?")
+    return ("Institutions must identify and verify beneficial owners [Document 1] and report suspicious "
+            "activity without delay [Document 2]. Supervisors expect a documented risk assessment [Document 1].")
+
+
+def gemini_model_class(latency: LatencyModel, calls: Optional[CallCounter] = None, stream_pieces: int = 8):
+    """
+    A GenerativeModel replacement with a latency model (the class attribute
+    `latency`, which can be swapped while the app runs). Streamed answers
+    are split into stream_pieces chunks spread over the call's latency; a
+    failing call raises before the first chunk, as a quota error does.
+    """
+    counter = calls or CallCounter()
+    initial_latency = latency
+
+    class FakeGenerativeModel:
+        calls = counter
+        latency = initial_latency
+
+        def __init__(self, model_name: str, *args: Any, **kwargs: Any):
+            self.model_name = model_name
+
+        def generate_content(self, contents: Any, generation_config: Any = None, stream: bool = False, **kwargs: Any):
+            prompt = str(contents)
+            self.calls.add(self.model_name)
+            text = _reply(prompt)
+            usage = _Usage(len(prompt) // 4, len(text) // 4)
+            delay_s, fails = self.latency.sample()
+            if not stream:
+                time.sleep(delay_s)
+                if fails:
+                    raise core_exceptions.ServiceUnavailable(f"Injected failure: gemini {self.model_name}")
+                return _Response(text, usage)
+            if fails:
+                time.sleep(delay_s)
+                raise core_exceptions.ServiceUnavailable(f"Injected failure: gemini {self.model_name}")
+            return self._stream(text, usage, delay_s)
+
+        @staticmethod
+        def _stream(text: str, usage: _Usage, delay_s: float):
+            size = max(1, math.ceil(len(text) / stream_pieces))
+            for start in range(0, len(text), size):
+                time.sleep(delay_s / stream_pieces)
+                yield _Response(text[start:start + size])
+            yield _Response("", usage)
+
+    return FakeGenerativeModel
+
+
+class FakeBackends:
+    """The three fakes plus a seeded corpus, installed into the app's modules."""
+
+    def __init__(
+        self,
+        gcs: Optional[LatencyModel] = None,
+        vertex: Optional[LatencyModel] = None,
+        gemini: Optional[LatencyModel] = None,
+        num_sources: int = 50
+    ):
+        self.latency = {"gcs": gcs or LatencyModel(), "vertex": vertex or LatencyModel(), "gemini": gemini or LatencyModel()}
+        self.corpus = make_corpus(num_sources)
+        self.storage = FakeStorageClient()
+        self.search: Optional[FakeVertexSearch] = None
+        self.gemini_calls = CallCounter()
+        self.model_class = gemini_model_class(LatencyModel(), self.gemini_calls)
+        self.background_tasks = CallCounter()
+        self._patched: List[Tuple[Any, str, Any]] = []
+
+    def _patch(self, target: Any, name: str, value: Any) -> None:
+        self._patched.append((target, name, getattr(target, name)))
+        setattr(target, name, value)
+
+    def install(self) -> None:
+        """
+        Patch the fakes in and seed the manifest (no latency or failures
+        until start() is called).
+        """
+        from google.cloud import storage
+
+        import shared.manifest
+        from apps.agent_api import main, retriever_optimized, retriever_vertex_search, synthesizer, synthesizer_optimized
+        from apps.agent_api.answer_cache import reset_answer_cache
+        from apps.agent_api.model_health import reset_breakers
+
+        self._patch(storage, "Client", self.storage)
+        bucket, path = shared.manifest.MANIFEST_PATH[len("gs://"):].split("/", 1)
+        self.storage.put(bucket, path, manifest_jsonl(self.corpus, shared.manifest.SOURCE_BUCKET).encode())
+        shared.manifest.clear_manifest_view()
+
+        self._patch(retriever_vertex_search, "CHUNKS_DATASTORE_ID",
+                    retriever_vertex_search.CHUNKS_DATASTORE_ID or "bench-chunks")
+        self._patch(retriever_vertex_search, "SUMMARIES_DATASTORE_ID",
+                    retriever_vertex_search.SUMMARIES_DATASTORE_ID or "bench-summaries")
+        self.search = FakeVertexSearch(self.corpus, retriever_vertex_search.SUMMARIES_DATASTORE_ID)
+        self._patch(retriever_vertex_search, "_start_search", self.search)
+
+        for module in (synthesizer, synthesizer_optimized, retriever_optimized):
+            self._patch(module, "GenerativeModel", self.model_class)
+
+        for name in ("process_uploaded_document", "process_video_file", "process_audio_file", "process_youtube_video"):
+            self._patch(main, name, lambda *args, _name=name, **kwargs: self.background_tasks.add(_name))
+
+        reset_breakers()
+        reset_answer_cache()
+
+    def uninstall(self) -> None:
+        """Restore everything install() patched."""
+        import shared.manifest
+
+        while self._patched:
+            target, name, original = self._patched.pop()
+            setattr(target, name, original)
+        shared.manifest.clear_manifest_view()
+
+    def start(self) -> None:
+        """Apply the configured latency and error distributions."""
+        self.storage.latency = self.latency["gcs"]
+        self.search.latency = self.latency["vertex"]
+        self.model_class.latency = self.latency["gemini"]
+
+    def calls(self) -> Dict[str, Dict[str, int]]:
+        return {
+            "gcs": self.storage.calls.snapshot(),
+            "vertex_search": self.search.calls.snapshot() if self.search else {},
+            "gemini": self.gemini_calls.snapshot(),
+            "background_tasks": self.background_tasks.snapshot(),
+        }
@@ -0,0 +1,398 @@
+"""
+Offline load test for the agent API.
+
+Runs apps.agent_api.main:app in-process (through its middleware, JWT auth and
+executors) against the stand-ins in benchmarks/fakes.py, so no GCP project is
+needed and backend latency and failures are controlled:
+
+    --gcs-latency / --vertex-latency / --gemini-latency  median_ms[:p99_ms[:error_rate]]
+
+Virtual users issue requests at a fixed concurrency, picking each request from
+the --mix weights:
+
+    chat      POST /chat, continuing a session for --turns-per-session turns
+    manifest  GET /manifest
+    sessions  GET /chat/sessions
+    upload    POST /upload (a small PDF; background processing is skipped)
+
+The report (JSON, --output) has latency percentiles and throughput per
+endpoint, per-stage pipeline latencies from the metrics aggregator, executor
+queue stats and backend call counts, tagged with the git commit. Pass
+--compare with an earlier report to print the differences; the run exits 1
+if an endpoint's p95 latency or throughput regressed by more than
+--max-regression.
+
+Usage:
+    python benchmarks/load_test.py [--requests 200] [--concurrency 8] [--mix chat=6,manifest=2,sessions=1,upload=1]
+        [--gemini-latency 1500:6000:0.01] [--output report.json] [--compare baseline.json]
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+# Keep the LLM tracker's call log out of the working tree
+os.environ.setdefault("LLM_TRACKING_DIR", str(Path(tempfile.gettempdir()) / "centef-load-test"))
+
+from benchmarks.fakes import FakeBackends, LatencyModel
+
+SCENARIOS = ("chat", "manifest", "sessions", "upload")
+DEFAULT_MIX = "chat=6,manifest=2,sessions=1,upload=1"
+
+_TOPICS = ("beneficial ownership", "sanctions screening", "terrorist financing", "virtual asset providers",
+           "correspondent banking", "politically exposed persons", "trade-based money laundering", "NPO abuse")
+_TEMPLATES = ("What are the FATF requirements for {}?", "How should banks assess {} risk?",
+              "Summarize recent guidance on {}.", "Which red flags indicate {} abuse?",
+              "Compare the EU and US approach to {}.")
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    """Parse "chat=6,manifest=2" into scenario weights."""
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise ValueError(f"Unknown scenario: {name}. Must be one of {', '.join(SCENARIOS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def query_pool(size: int) -> List[str]:
+    """Distinct chat questions; a smaller pool means more answer cache hits."""
+    base = [template.format(topic) for template in _TEMPLATES for topic in _TOPICS]
+    return [base[i % len(base)] + (f" (case {i // len(base)})" if i >= len(base) else "") for i in range(size)]
+
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    """Mean and nearest-rank percentiles of latencies in ms."""
+    if not values:
+        return {"mean": None, "p50": None, "p90": None, "p95": None, "p99": None, "max": None}
+    ordered = sorted(values)
+
+    def rank(q: float) -> float:
+        return round(ordered[max(0, math.ceil(q * len(ordered)) - 1)], 2)
+
+    return {"mean": round(sum(ordered) / len(ordered), 2), "p50": rank(0.5), "p90": rank(0.9), "p95": rank(0.95),
+            "p99": rank(0.99), "max": round(ordered[-1], 2)}
+
+
+class ASGIClient:
+    """Calls an ASGI app directly, as an HTTP server would."""
+
+    def __init__(self, app, token: str):
+        self.app = app
+        self.headers = [(b"authorization", f"Bearer {token}".encode())]
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        json_body: Any = None,
+        body: bytes = b"",
+        content_type: Optional[str] = None
+    ) -> Tuple[int, bytes]:
+        """Send one request; returns (status, response body)."""
+        headers = list(self.headers)
+        if json_body is not None:
+            body, content_type = json.dumps(json_body).encode(), "application/json"
+        if content_type:
+            headers.append((b"content-type", content_type.encode()))
+        headers.append((b"content-length", str(len(body)).encode()))
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method, "scheme": "http",
+            "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"", "headers": headers,
+            "server": ("load-test", 80), "client": ("127.0.0.1", 50000),
+        }
+        sent = [False]
+        status = [0]
+        chunks = []
+
+        async def receive():
+            if sent[0]:
+                await asyncio.Event().wait()  # No disconnect until the app is done
+            sent[0] = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        try:
+            await self.app(scope, receive, send)
+        except Exception:
+            # Starlette re-raises after sending its 500 response (for the server to log)
+            if not status[0]:
+                raise
+        return status[0], b"".join(chunks)
+
+
+class VirtualUser:
+    """One concurrent client: keeps its chat session for a few turns."""
+
+    def __init__(self, client: ASGIClient, rng: random.Random, queries: List[str], turns_per_session: int):
+        self.client = client
+        self.rng = rng
+        self.queries = queries
+        self.turns_per_session = turns_per_session
+        self.session_id: Optional[str] = None
+        self.turns = 0
+
+    async def chat(self) -> int:
+        request = {"query": self.rng.choice(self.queries), "session_id": self.session_id}
+        status, body = await self.client.request("POST", "/chat", json_body=request)
+        if status == 200:
+            self.turns += 1
+            self.session_id = json.loads(body)["session_id"] if self.turns < self.turns_per_session else None
+            if self.session_id is None:
+                self.turns = 0
+        return status
+
+    async def manifest(self) -> int:
+        return (await self.client.request("GET", "/manifest"))[0]
+
+    async def sessions(self) -> int:
+        return (await self.client.request("GET", "/chat/sessions"))[0]
+
+    async def upload(self) -> int:
+        boundary = uuid.uuid4().hex
+        filename = f"load_test_{uuid.uuid4().hex[:8]}.pdf"
+        body = (
+            f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{filename}\"\r\n"
+            f"Content-Type: application/pdf\r\n\r\n"
+        ).encode() + b"%PDF-1.4\n" + os.urandom(2048) + f"\r\n--{boundary}--\r\n".encode()
+        return (await self.client.request("POST", "/upload", body=body,
+                                          content_type=f"multipart/form-data; boundary={boundary}"))[0]
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).parent, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+async def run_load(
+    backends: FakeBackends,
+    requests: int = 200,
+    concurrency: int = 8,
+    mix: Optional[Dict[str, float]] = None,
+    query_pool_size: int = 200,
+    turns_per_session: int = 4,
+    seed: int = 0
+) -> Dict[str, Any]:
+    """
+    Drive the app with the fake backends installed and return the report.
+
+    Args:
+        backends: FakeBackends (installed for the run, then uninstalled)
+        requests: Total requests to send
+        concurrency: Virtual users sending requests at the same time
+        mix: Scenario weights (default DEFAULT_MIX)
+        query_pool_size: Distinct chat questions
+        turns_per_session: Chat turns before a user starts a new session
+        seed: Random seed for scenario and query choice
+
+    Returns:
+        Report dict (see module docstring)
+    """
+    from apps.agent_api import follow_ups
+    from apps.agent_api.main import app
+    from apps.agent_api.performance_metrics import get_aggregator
+    from shared.auth import create_access_token
+    from shared.executors import executor_stats
+    from shared.user_management import create_user
+
+    mix = mix or parse_mix(DEFAULT_MIX)
+    backends.install()
+    user = create_user(f"load-test-{uuid.uuid4().hex[:8]}@example.org", "load-test-password", "Load Test")
+    token = create_access_token({"sub": user.user_id, "email": user.email})
+    get_aggregator().reset()
+    backends.start()
+
+    client = ASGIClient(app, token)
+    queries = query_pool(query_pool_size)
+    scenarios, weights = zip(*mix.items())
+    issued = itertools.count()
+    samples: Dict[str, List[float]] = defaultdict(list)
+    statuses: Dict[str, Counter] = defaultdict(Counter)
+
+    async def virtual_user(index: int):
+        rng = random.Random(seed * 1000 + index)
+        vu = VirtualUser(client, rng, queries, turns_per_session)
+        while next(issued) < requests:
+            scenario = rng.choices(scenarios, weights)[0]
+            started = time.perf_counter()
+            try:
+                status = await getattr(vu, scenario)()
+            except Exception as e:
+                logging.getLogger(__name__).warning(f"{scenario} raised: {e}")
+                status = 0
+            samples[scenario].append((time.perf_counter() - started) * 1000)
+            statuses[scenario][status] += 1
+
+    await app.router.startup()
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(virtual_user(i) for i in range(concurrency)))
+    finally:
+        duration_s = time.perf_counter() - started
+        executors = executor_stats()
+        # Background follow-up jobs still running must finish against the fakes
+        await asyncio.get_running_loop().run_in_executor(None, follow_ups.drain_follow_ups, 60)
+        await app.router.shutdown()
+        backends.uninstall()
+
+    endpoints = {}
+    for scenario in scenarios:
+        counts = statuses[scenario]
+        errors = sum(count for status, count in counts.items() if not 200 <= status < 300)
+        endpoints[scenario] = {
+            "requests": len(samples[scenario]),
+            "errors": errors,
+            "status_codes": {str(status): count for status, count in sorted(counts.items())},
+            "throughput_rps": round(len(samples[scenario]) / duration_s, 2),
+            "latency_ms": percentiles(samples[scenario]),
+        }
+    total = sum(len(values) for values in samples.values())
+    total_errors = sum(endpoint["errors"] for endpoint in endpoints.values())
+
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "config": {
+            "requests": requests,
+            "concurrency": concurrency,
+            "mix": mix,
+            "query_pool": query_pool_size,
+            "turns_per_session": turns_per_session,
+            "sources": len(backends.corpus),
+            "seed": seed,
+            "backends": {name: latency.describe() for name, latency in backends.latency.items()},
+        },
+        "summary": {
+            "requests": total,
+            "errors": total_errors,
+            "error_rate": round(total_errors / total, 4) if total else 0.0,
+            "duration_s": round(duration_s, 2),
+            "throughput_rps": round(total / duration_s, 2),
+            "latency_ms": percentiles([value for values in samples.values() for value in values]),
+        },
+        "endpoints": endpoints,
+        "stages_ms": get_aggregator().latency_summary()["latency"],
+        "executors": executors,
+        "backend_calls": backends.calls(),
+    }
+
+
+def compare_reports(
+    current: Dict[str, Any],
+    baseline: Dict[str, Any],
+    max_regression: float = 0.2
+) -> Tuple[List[str], List[str]]:
+    """
+    Compare two reports endpoint by endpoint.
+
+    Returns:
+        Tuple of (table lines, regressions), where a regression is p95 latency
+        up or throughput down by more than max_regression
+    """
+    def change(new, old):
+        return (new - old) / old if new is not None and old else None
+
+    lines = [f"{'endpoint':<10}{'p50 ms':>18}{'p95 ms':>18}{'p99 ms':>18}{'req/s':>16}"]
+    regressions = []
+    for name, endpoint in current["endpoints"].items():
+        old = baseline.get("endpoints", {}).get(name)
+        if not old:
+            continue
+        cells = []
+        for key in ("p50", "p95", "p99"):
+            new_value, old_value = endpoint["latency_ms"][key], old["latency_ms"][key]
+            delta = change(new_value, old_value)
+            cells.append(f"{new_value} ({delta:+.0%})" if delta is not None else str(new_value))
+        p95_change = change(endpoint["latency_ms"]["p95"], old["latency_ms"]["p95"])
+        rps_change = change(endpoint["throughput_rps"], old["throughput_rps"])
+        cells.append(f"{endpoint['throughput_rps']} ({rps_change:+.0%})" if rps_change is not None else "-")
+        lines.append(f"{name:<10}" + "".join(f"{cell:>18}" for cell in cells[:3]) + f"{cells[3]:>16}")
+        if p95_change is not None and p95_change > max_regression:
+            regressions.append(f"{name}: p95 {old['latency_ms']['p95']} -> {endpoint['latency_ms']['p95']} ms")
+        if rps_change is not None and rps_change < -max_regression:
+            regressions.append(f"{name}: throughput {old['throughput_rps']} -> {endpoint['throughput_rps']} req/s")
+    return lines, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test of the agent API with fake GCP backends")
+    parser.add_argument("--requests", type=int, default=200, help="Total requests")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent virtual users")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Scenario weights, e.g. chat=6,manifest=2,sessions=1,upload=1")
+    parser.add_argument("--gcs-latency", default="15:60", help="GCS median_ms[:p99_ms[:error_rate]]")
+    parser.add_argument("--vertex-latency", default="120:600", help="Vertex AI Search median_ms[:p99_ms[:error_rate]]")
+    parser.add_argument("--gemini-latency", default="800:3000", help="Gemini median_ms[:p99_ms[:error_rate]]")
+    parser.add_argument("--sources", type=int, default=50, help="Documents in the fake corpus and manifest")
+    parser.add_argument("--query-pool", type=int, default=200, help="Distinct chat questions")
+    parser.add_argument("--turns-per-session", type=int, default=4, help="Chat turns per session")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("--output", help="Write the JSON report here (default: stdout)")
+    parser.add_argument("--compare", help="Earlier JSON report to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="With --compare, fail (exit 1) if p95 rises or throughput falls by more than this")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    backends = FakeBackends(
+        gcs=LatencyModel.parse(args.gcs_latency, seed=args.seed),
+        vertex=LatencyModel.parse(args.vertex_latency, seed=args.seed + 1),
+        gemini=LatencyModel.parse(args.gemini_latency, seed=args.seed + 2),
+        num_sources=args.sources,
+    )
+    report = asyncio.run(run_load(
+        backends, args.requests, args.concurrency, parse_mix(args.mix), args.query_pool, args.turns_per_session, args.seed
+    ))
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text)
+    else:
+        print(text)
+
+    summary = report["summary"]
+    print(f"\n{summary['requests']} requests in {summary['duration_s']}s: {summary['throughput_rps']} req/s, "
+          f"p95 {summary['latency_ms']['p95']} ms, {summary['errors']} errors", file=sys.stderr)
+    for name, endpoint in report["endpoints"].items():
+        latency = endpoint["latency_ms"]
+        print(f"  {name:<10}{endpoint['requests']:>6} req  p50 {latency['p50']} ms  p95 {latency['p95']} ms  "
+              f"p99 {latency['p99']} ms  errors {endpoint['errors']}", file=sys.stderr)
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())
+        lines, regressions = compare_reports(report, baseline, args.max_regression)
+        print(f"\nvs {args.compare} (commit {baseline.get('commit')}):", file=sys.stderr)
+        print("\n".join(lines), file=sys.stderr)
+        if regressions:
+            print("\nREGRESSION:\n  " + "\n  ".join(regressions), file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,589 @@
+"""
+Retrieval quality and cost evaluation for search_two_tier_optimized.
+
+test_outputs/ only holds one-off reports of what a live search returned, so
+there is no way to tell whether a change to expansion, reranking, dedup or
+the adaptive limits helps or hurts. This harness runs a versioned query set
+(benchmarks/fixtures/retrieval/queries_v1.json, judged relevant source_ids
+with grades) through every combination of search_two_tier_optimized flags:
+
+    expansion  enable_query_expansion      0, 1
+    dedup      enable_deduplication        0, 1
+    rerank     off or a rerank_mode        off, local, llm, joint, hybrid
+    adaptive   use_adaptive_strategy       1, 0
+
+and reports, per combination, recall@k, MRR and nDCG@k of the distinct
+source_ids in the chunk and summary results, next to latency and Vertex AI
+Search / Gemini calls per query. Combinations no other combination beats on
+quality, p50 latency and LLM calls at once are marked as the Pareto front.
+
+Vertex AI Search results and Gemini responses are replayed from a recording
+(benchmarks/fixtures/retrieval/recording_v1.json), keyed by request, so runs
+are offline and repeatable. Recorded latencies are slept, scaled by
+--latency-scale (0 measures only local work). --record runs against the live
+services, serving what is already recorded and adding what is missing; a
+replay that needs an unrecorded call exits 2. With --corpus the missing calls
+go to a local BM25 index over a fixture corpus and the fake Gemini in
+benchmarks/fakes.py instead: the committed recording_v1.json was made that
+way from corpus_v1.json, so it measures the pipeline's ranking and call
+counts, not Vertex AI Search relevance, Gemini's reranking or live latency.
+
+Usage:
+    python benchmarks/retrieval_eval.py --record                  # needs GCP credentials
+    python benchmarks/retrieval_eval.py --record --corpus benchmarks/fixtures/retrieval/corpus_v1.json
+    python benchmarks/retrieval_eval.py [--grid rerank=off,local,llm expansion=0,1] [--k 5,10]
+        [--latency-scale 1.0] [--output report.json] [--candidates candidates.json]
+"""
+import argparse
+import contextlib
+import hashlib
+import itertools
+import json
+import logging
+import math
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from apps.agent_api import retriever_optimized
+from apps.agent_api.optimization_config import get_config
+from apps.agent_api.retriever_local import LocalIndex, build_tier_index, format_chunk_result, format_summary_result
+from apps.agent_api.retriever_optimized import RERANK_MODES, search_two_tier_optimized
+from apps.agent_api.search_result import SearchResult, to_plain
+from benchmarks.fakes import LatencyModel, gemini_model_class
+from benchmarks.load_test import git_commit, percentiles
+from shared.schemas import Chunk, ChunkAnchor, ChunkMetadata, Summary
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures" / "retrieval"
+DEFAULT_QUERY_SET = FIXTURES_DIR / "queries_v1.json"
+DEFAULT_RECORDING = FIXTURES_DIR / "recording_v1.json"
+DEFAULT_CORPUS = FIXTURES_DIR / "corpus_v1.json"
+
+# Flag values evaluated by default; every combination is run
+DEFAULT_GRID: Dict[str, tuple] = {
+    "expansion": (False, True),
+    "dedup": (False, True),
+    "rerank": ("off",) + RERANK_MODES,
+    "adaptive": (True, False),
+}
+TIERS = ("chunks", "summaries")
+
+
+class FixtureMiss(KeyError):
+    """A replayed call that is not in the recording."""
+
+
+class Recording:
+    """Vertex AI Search results and Gemini responses keyed by request, with their latency."""
+
+    def __init__(
+        self,
+        vertex: Optional[Dict[str, Dict[str, Any]]] = None,
+        gemini: Optional[Dict[str, Dict[str, Any]]] = None,
+        meta: Optional[Dict[str, Any]] = None
+    ):
+        self.vertex = vertex if vertex is not None else {}
+        self.gemini = gemini if gemini is not None else {}
+        self.meta = meta if meta is not None else {}
+
+    @classmethod
+    def load(cls, path: Path) -> "Recording":
+        """Load a recording; a missing file gives an empty one."""
+        path = Path(path)
+        if not path.exists():
+            return cls()
+        data = json.loads(path.read_text())
+        return cls(data.get("vertex"), data.get("gemini"), data.get("meta"))
+
+    def save(self, path: Path) -> None:
+        data = {"meta": self.meta, "vertex": self.vertex, "gemini": self.gemini}
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        Path(path).write_text(json.dumps(data, indent=1, sort_keys=True, default=str) + "\n")
+
+    @staticmethod
+    def vertex_key(tier: str, query: str, max_results: int, filter_expression: Optional[str]) -> str:
+        return json.dumps([tier, query, max_results, filter_expression])
+
+    @staticmethod
+    def gemini_key(model_name: str, prompt: Any) -> str:
+        return hashlib.sha256(f"{model_name}\n{prompt}".encode()).hexdigest()
+
+
+class Replayer:
+    """
+    Serves search_two_tier_optimized's Vertex AI Search and Gemini calls from a
+    Recording while active (a context manager patching retriever_optimized).
+
+    With live=True, calls missing from the recording go to the real services
+    and are added to it; otherwise they raise FixtureMiss. Calls are counted in
+    self.calls ("vertex", "gemini", "misses").
+    """
+
+    def __init__(self, recording: Recording, live: bool = False, latency_scale: float = 1.0):
+        self.recording = recording
+        self.live = live
+        self.latency_scale = latency_scale
+        self.calls: Counter = Counter()
+        self._lock = threading.Lock()
+        self._saved: Dict[str, Any] = {}
+        self._saved_backend: Optional[str] = None
+
+    def _wait(self, entry: Dict[str, Any]) -> None:
+        if self.latency_scale > 0 and entry.get("latency_ms"):
+            time.sleep(entry["latency_ms"] * self.latency_scale / 1000)
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.calls[name] += 1
+
+    def _search(self, tier: str, live_search: Callable) -> Callable:
+        def search(query: str, max_results: int = 10, filter_expression: Optional[str] = None, fields=None):
+            self._count("vertex")
+            key = Recording.vertex_key(tier, query, max_results, filter_expression)
+            entry = self.recording.vertex.get(key)
+            if entry is None:
+                if not self.live:
+                    self._count("misses")
+                    raise FixtureMiss(key)
+                start = time.perf_counter()
+                results = live_search(query, max_results=max_results, filter_expression=filter_expression)
+                entry = {
+                    "results": [to_plain(dict(result)) for result in results],
+                    "latency_ms": round((time.perf_counter() - start) * 1000, 1),
+                }
+                with self._lock:
+                    self.recording.vertex[key] = entry
+            else:
+                self._wait(entry)
+            return [SearchResult(**result) for result in entry["results"]]
+        return search
+
+    def _generate(self, model_name: str, contents: Any, kwargs: Dict[str, Any]) -> SimpleNamespace:
+        self._count("gemini")
+        key = Recording.gemini_key(model_name, contents)
+        entry = self.recording.gemini.get(key)
+        if entry is None:
+            if not self.live:
+                self._count("misses")
+                raise FixtureMiss(f"gemini {model_name} {key[:12]}")
+            start = time.perf_counter()
+            response = self._saved["GenerativeModel"](model_name).generate_content(contents, **kwargs)
+            entry = {
+                "model": model_name,
+                "text": response.text,
+                "latency_ms": round((time.perf_counter() - start) * 1000, 1),
+            }
+            with self._lock:
+                self.recording.gemini[key] = entry
+        else:
+            self._wait(entry)
+        return SimpleNamespace(text=entry["text"])
+
+    def _model_class(self) -> type:
+        replayer = self
+
+        class ReplayedModel:
+            def __init__(self, model_name: str, *args, **kwargs):
+                self.model_name = model_name
+
+            def generate_content(self, contents, **kwargs):
+                return replayer._generate(self.model_name, contents, kwargs)
+
+        return ReplayedModel
+
+    def __enter__(self) -> "Replayer":
+        self._saved = {
+            name: getattr(retriever_optimized, name)
+            for name in ("search_chunks", "search_summaries", "GenerativeModel")
+        }
+        retriever_optimized.search_chunks = self._search("chunks", self._saved["search_chunks"])
+        retriever_optimized.search_summaries = self._search("summaries", self._saved["search_summaries"])
+        retriever_optimized.GenerativeModel = self._model_class()
+        # The recording holds Vertex AI Search results, whatever RETRIEVER_BACKEND is
+        config = get_config().retriever
+        self._saved_backend, config.backend = config.backend, "vertex"
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        for name, value in self._saved.items():
+            setattr(retriever_optimized, name, value)
+        get_config().retriever.backend = self._saved_backend
+
+
+def corpus_records(corpus: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+    """Chunk (one per page) and summary records for a fixture corpus, as written by shared.schemas."""
+    records: Dict[str, List[Dict[str, Any]]] = {"chunks": [], "summaries": []}
+    for doc in corpus["documents"]:
+        metadata = {key: doc.get(key) for key in ("title", "organization", "date", "tags")}
+        for page, content in enumerate(doc["pages"], start=1):
+            chunk = Chunk(
+                metadata=ChunkMetadata(
+                    id=f"{doc['source_id']}_page_{page}", source_id=doc["source_id"],
+                    filename=f"{doc['source_id']}.pdf", mimetype="application/pdf", **metadata,
+                ),
+                anchor=ChunkAnchor(page=page),
+                content=content,
+                chunk_index=page - 1,
+            )
+            records["chunks"].append(chunk.to_dict())
+        summary = Summary(
+            source_id=doc["source_id"], filename=f"{doc['source_id']}.pdf",
+            summary_text=doc["summary_text"], **metadata,
+        )
+        records["summaries"].append(summary.to_dict())
+    return records
+
+
+class CorpusServices:
+    """
+    Stands in for the live services while recording without GCP access: a
+    local BM25 index over a fixture corpus (honouring filter expressions)
+    answers the searches and benchmarks.fakes answers Gemini.
+
+    Use it around evaluate(live=True); the Replayer sends misses here.
+    """
+
+    def __init__(self, corpus_path: Path):
+        self.corpus = json.loads(Path(corpus_path).read_text())
+        self._tmp: Optional[tempfile.TemporaryDirectory] = None
+        self._indexes: Dict[str, LocalIndex] = {}
+        self._saved: Dict[str, Any] = {}
+
+    def _search(self, tier: str, shape: Callable) -> Callable:
+        def search(query: str, max_results: int = 10, filter_expression: Optional[str] = None, fields=None):
+            hits = self._indexes[tier].search(query, max_results, filter_expression)
+            return [shape(record, score, fields) for record, score in hits]
+        return search
+
+    def __enter__(self) -> "CorpusServices":
+        self._tmp = tempfile.TemporaryDirectory()
+        for tier, records in corpus_records(self.corpus).items():
+            out_dir = str(Path(self._tmp.name) / tier)
+            build_tier_index(iter(records), tier, out_dir)
+            self._indexes[tier] = LocalIndex(out_dir)
+        self._saved = {
+            name: getattr(retriever_optimized, name)
+            for name in ("search_chunks", "search_summaries", "GenerativeModel")
+        }
+        retriever_optimized.search_chunks = self._search("chunks", format_chunk_result)
+        retriever_optimized.search_summaries = self._search("summaries", format_summary_result)
+        retriever_optimized.GenerativeModel = gemini_model_class(LatencyModel())
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        for name, value in self._saved.items():
+            setattr(retriever_optimized, name, value)
+        self._indexes.clear()
+        self._tmp.cleanup()
+
+
+def ranked_sources(results: Iterable[Dict[str, Any]]) -> List[str]:
+    """Distinct source_ids in result order."""
+    seen = {}
+    for result in results:
+        source_id = result.get("source_id")
+        if source_id and source_id not in seen:
+            seen[source_id] = True
+    return list(seen)
+
+
+def recall_at_k(ranked: Sequence[str], relevant: Dict[str, int], k: int) -> float:
+    return len(set(ranked[:k]) & set(relevant)) / len(relevant)
+
+
+def reciprocal_rank(ranked: Sequence[str], relevant: Dict[str, int]) -> float:
+    return next((1 / rank for rank, source_id in enumerate(ranked, start=1) if source_id in relevant), 0.0)
+
+
+def ndcg_at_k(ranked: Sequence[str], relevant: Dict[str, int], k: int) -> float:
+    """nDCG@k with graded relevance (gain 2^grade - 1)."""
+    def dcg(grades):
+        return sum((2 ** grade - 1) / math.log2(rank + 1) for rank, grade in enumerate(grades, start=1))
+    ideal = dcg(sorted(relevant.values(), reverse=True)[:k])
+    return dcg([relevant.get(source_id, 0) for source_id in ranked[:k]]) / ideal if ideal else 0.0
+
+
+def tier_metrics(ranked: Sequence[str], relevant: Dict[str, int], k_values: Sequence[int]) -> Dict[str, float]:
+    metrics = {"mrr": reciprocal_rank(ranked, relevant)}
+    for k in k_values:
+        metrics[f"recall@{k}"] = recall_at_k(ranked, relevant, k)
+        metrics[f"ndcg@{k}"] = ndcg_at_k(ranked, relevant, k)
+    return metrics
+
+
+def parse_grid(items: Sequence[str]) -> Dict[str, tuple]:
+    """Parse "name=v1,v2" items over DEFAULT_GRID (flags not given keep their default values)."""
+    grid = dict(DEFAULT_GRID)
+    for item in items:
+        name, _, values = item.partition("=")
+        if name not in DEFAULT_GRID or not values:
+            raise ValueError(f"Invalid grid item '{item}'. Expected name=v1,v2 with name in {tuple(DEFAULT_GRID)}")
+        if name == "rerank":
+            parsed = tuple(values.split(","))
+            unknown = set(parsed) - set(DEFAULT_GRID["rerank"])
+            if unknown:
+                raise ValueError(f"Invalid rerank values {sorted(unknown)}. Must be among {DEFAULT_GRID['rerank']}")
+        else:
+            parsed = tuple(value.strip().lower() in ("1", "true", "on") for value in values.split(","))
+        grid[name] = parsed
+    return grid
+
+
+def expand_grid(grid: Dict[str, tuple]) -> List[Dict[str, Any]]:
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def config_name(flags: Dict[str, Any]) -> str:
+    return " ".join(f"{name}={int(value) if isinstance(value, bool) else value}" for name, value in flags.items())
+
+
+def search_kwargs(flags: Dict[str, Any]) -> Dict[str, Any]:
+    """search_two_tier_optimized arguments for a grid combination."""
+    rerank = flags.get("rerank", "off")
+    return {
+        "enable_query_expansion": flags.get("expansion", False),
+        "enable_deduplication": flags.get("dedup", False),
+        "enable_reranking": rerank != "off",
+        "rerank_mode": rerank if rerank != "off" else None,
+        "use_adaptive_strategy": flags.get("adaptive", True),
+    }
+
+
+def _mean(values: List[float]) -> Optional[float]:
+    return round(sum(values) / len(values), 4) if values else None
+
+
+def _objective(config: Dict[str, Any], objective: str) -> Optional[float]:
+    tier, _, metric = objective.partition(".")
+    return config["quality"].get(tier, {}).get(metric)
+
+
+def mark_pareto(configs: List[Dict[str, Any]], objective: str) -> None:
+    """Mark configs no other config matches or beats on objective, p50 latency and LLM calls."""
+    def costs(config):
+        return (-_objective(config, objective), config["latency_ms"]["p50"], config["llm_calls_per_query"])
+
+    scored = [config for config in configs if _objective(config, objective) is not None and config["latency_ms"]["p50"] is not None]
+    for config in configs:
+        config["pareto"] = None
+    for config in scored:
+        mine = costs(config)
+        config["pareto"] = not any(
+            all(a <= b for a, b in zip(costs(other), mine)) and costs(other) != mine
+            for other in scored if other is not config
+        )
+
+
+def evaluate(
+    query_set: Dict[str, Any],
+    recording: Recording,
+    grid: Optional[Dict[str, tuple]] = None,
+    k_values: Sequence[int] = (5, 10),
+    live: bool = False,
+    latency_scale: float = 1.0,
+    objective: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Run every grid combination over the query set and report quality and cost.
+
+    Args:
+        query_set: Loaded query set ({"version", "queries": [{"id", "query", "relevant"}]})
+        recording: Recording to replay (and extend, when live)
+        grid: Flag values to combine (default DEFAULT_GRID)
+        k_values: Cutoffs for recall@k and nDCG@k
+        live: Send calls missing from the recording to the real services
+        latency_scale: Multiplier for the recorded latencies that are slept
+        objective: "<tier>.<metric>" used for the Pareto front (default chunks.ndcg@<largest k>)
+
+    Returns:
+        Report dict with one entry per combination under "configs"
+    """
+    objective = objective or f"chunks.ndcg@{max(k_values)}"
+    queries = query_set["queries"]
+    judged = [query for query in queries if query.get("relevant")]
+    titles: Dict[str, str] = {}
+    configs = []
+
+    with Replayer(recording, live=live, latency_scale=latency_scale) as replayer:
+        for flags in expand_grid(grid or DEFAULT_GRID):
+            per_query = []
+            for query in queries:
+                before = Counter(replayer.calls)
+                start = time.perf_counter()
+                error = None
+                try:
+                    output = search_two_tier_optimized(query["query"], **search_kwargs(flags))
+                except Exception as e:
+                    output, error = {"chunks": [], "summaries": []}, f"{type(e).__name__}: {e}"
+                latency_ms = (time.perf_counter() - start) * 1000
+                calls = replayer.calls - before
+
+                entry = {
+                    "id": query["id"],
+                    "latency_ms": round(latency_ms, 2),
+                    "vertex_calls": calls["vertex"],
+                    "llm_calls": calls["gemini"],
+                    "fixture_misses": calls["misses"],
+                    "error": error,
+                }
+                for tier in TIERS:
+                    for result in output[tier]:
+                        if result.get("source_id"):
+                            titles.setdefault(result["source_id"], result.get("title") or "")
+                    ranked = ranked_sources(output[tier])
+                    entry[f"{tier}_sources"] = ranked[:max(k_values)]
+                    if query.get("relevant"):
+                        entry[f"{tier}_metrics"] = tier_metrics(ranked, query["relevant"], k_values)
+                per_query.append(entry)
+
+            quality = {}
+            for tier in TIERS:
+                scored = [entry[f"{tier}_metrics"] for entry in per_query if f"{tier}_metrics" in entry]
+                if scored:
+                    quality[tier] = {metric: _mean([scores[metric] for scores in scored]) for metric in scored[0]}
+            configs.append({
+                "name": config_name(flags),
+                "flags": flags,
+                "quality": quality,
+                "latency_ms": percentiles([entry["latency_ms"] for entry in per_query]),
+                "llm_calls_per_query": _mean([entry["llm_calls"] for entry in per_query]),
+                "vertex_calls_per_query": _mean([entry["vertex_calls"] for entry in per_query]),
+                "errors": sum(entry["error"] is not None for entry in per_query),
+                "fixture_misses": sum(entry["fixture_misses"] for entry in per_query),
+                "queries": per_query,
+            })
+
+    mark_pareto(configs, objective)
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "query_set": {"version": query_set.get("version"), "queries": len(queries), "judged": len(judged)},
+        "recording": recording.meta,
+        "k": list(k_values),
+        "objective": objective,
+        "latency_scale": latency_scale,
+        "mode": "record" if live else "replay",
+        "configs": configs,
+        "sources": titles,
+    }
+
+
+def judging_candidates(report: Dict[str, Any], query_set: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Every source any combination returned per query, best rank first, with the
+    current grade (if judged), to help fill in the query set's judgments.
+    """
+    candidates = {}
+    for query in query_set["queries"]:
+        best: Dict[str, int] = {}
+        for config in report["configs"]:
+            entry = next(entry for entry in config["queries"] if entry["id"] == query["id"])
+            for tier in TIERS:
+                for rank, source_id in enumerate(entry[f"{tier}_sources"], start=1):
+                    best[source_id] = min(best.get(source_id, rank), rank)
+        candidates[query["id"]] = {
+            "query": query["query"],
+            "sources": [
+                {"source_id": source_id, "title": report["sources"].get(source_id, ""), "best_rank": rank,
+                 "grade": query.get("relevant", {}).get(source_id)}
+                for source_id, rank in sorted(best.items(), key=lambda item: item[1])
+            ],
+        }
+    return candidates
+
+
+def format_table(report: Dict[str, Any]) -> List[str]:
+    """One line per combination, best objective first."""
+    k = max(report["k"])
+    objective = report["objective"]
+    lines = [f"{'combination':<48}{objective:>18}{f'recall@{k}':>11}{'mrr':>7}{'p50 ms':>10}{'llm/q':>7}{'vertex/q':>10}"]
+
+    def sort_key(config):
+        value = _objective(config, objective)
+        return (value is None, -(value or 0), config["latency_ms"]["p50"] or 0)
+
+    for config in sorted(report["configs"], key=sort_key):
+        chunks = config["quality"].get("chunks", {})
+
+        def cell(value):
+            return "-" if value is None else f"{value:.3f}"
+
+        marker = " *" if config["pareto"] else ""
+        lines.append(
+            f"{config['name']:<48}{cell(_objective(config, objective)):>18}{cell(chunks.get(f'recall@{k}')):>11}"
+            f"{cell(chunks.get('mrr')):>7}{config['latency_ms']['p50']:>10}{config['llm_calls_per_query']:>7}"
+            f"{config['vertex_calls_per_query']:>10}{marker}"
+        )
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate retrieval quality and cost for search_two_tier_optimized flags")
+    parser.add_argument("--queries", default=str(DEFAULT_QUERY_SET), help="Query set with judged source_ids")
+    parser.add_argument("--recording", default=str(DEFAULT_RECORDING), help="Recorded Vertex AI Search / Gemini calls")
+    parser.add_argument("--record", action="store_true",
+                        help="Call the live services for requests missing from the recording and save them")
+    parser.add_argument("--corpus", help="With --record, record from a local index over this fixture corpus "
+                                         "and the fake Gemini instead of the live services")
+    parser.add_argument("--grid", nargs="*", default=[],
+                        help="Flag values to combine, e.g. rerank=off,local expansion=0,1 (default: all)")
+    parser.add_argument("--k", default="5,10", help="Cutoffs for recall@k and nDCG@k")
+    parser.add_argument("--objective", help="Quality metric for the Pareto front, <tier>.<metric> (default chunks.ndcg@<max k>)")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="Multiplier for replayed latencies (0 = none)")
+    parser.add_argument("--output", help="Write the JSON report here (default: stdout)")
+    parser.add_argument("--candidates", help="Write the sources each query retrieved here, for judging")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    query_set = json.loads(Path(args.queries).read_text())
+    recording = Recording.load(args.recording)
+    if args.corpus and not args.record:
+        parser.error("--corpus only applies with --record")
+    if args.record:
+        recording.meta.update({
+            "query_set_version": query_set.get("version"),
+            "recorded_at": datetime.utcnow().isoformat(),
+            "commit": git_commit(),
+            "source": f"fixture corpus {Path(args.corpus).name}, local BM25 index, fake Gemini"
+            if args.corpus else "live Vertex AI Search and Gemini",
+        })
+    services = CorpusServices(Path(args.corpus)) if args.corpus else contextlib.nullcontext()
+    with services:
+        report = evaluate(
+            query_set, recording, parse_grid(args.grid), [int(k) for k in args.k.split(",")],
+            live=args.record, latency_scale=args.latency_scale, objective=args.objective,
+        )
+    if args.record:
+        recording.save(args.recording)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text)
+    else:
+        print(text)
+    if args.candidates:
+        Path(args.candidates).write_text(json.dumps(judging_candidates(report, query_set), indent=2))
+
+    info = report["query_set"]
+    print(f"\nQuery set v{info['version']}: {info['queries']} queries, {info['judged']} judged; "
+          f"{len(report['configs'])} combinations ({report['mode']}); * = Pareto front", file=sys.stderr)
+    print("\n".join(format_table(report)), file=sys.stderr)
+
+    misses = sum(config["fixture_misses"] for config in report["configs"])
+    if misses and not args.record:
+        print(f"\n{misses} calls missing from {args.recording}; re-run with --record", file=sys.stderr)
+        return 2
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -12,6 +12,8 @@ from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials, APIKeyHea
 from jose import JWTError, jwt
 from pydantic import BaseModel
 
+from shared.executors import run_blocking
+
 logger = logging.getLogger(__name__)
 
 # Environment variables
@@ -143,7 +145,7 @@ async def get_current_user(
         if token_data:
             # Get user profile from database to retrieve actual roles
             from shared.user_management import get_user_by_id
-            user_profile = get_user_by_id(token_data.user_id)
+            user_profile = await run_blocking("auth", get_user_by_id, token_data.user_id)
             
             if user_profile:
                 return User(
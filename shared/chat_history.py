@@ -7,10 +7,11 @@ import logging
 import os
 import uuid
 from dataclasses import dataclass, field
-from typing import Optional, List, Dict, Any
+from typing import Callable, Optional, List, Dict, Any
 from datetime import datetime
 from enum import Enum
 
+from google.api_core import exceptions as core_exceptions
 from google.cloud import storage
 
 logger = logging.getLogger(__name__)
@@ -19,6 +20,7 @@ logger = logging.getLogger(__name__)
 PROJECT_ID = os.getenv("PROJECT_ID")
 CHAT_HISTORY_BUCKET = os.getenv("CHAT_HISTORY_BUCKET", "centef-rag-bucket")
 CHAT_HISTORY_PATH = os.getenv("CHAT_HISTORY_PATH", "chat_history")
+CHAT_HISTORY_WRITE_ATTEMPTS = int(os.getenv("CHAT_HISTORY_WRITE_ATTEMPTS", "5"))  # Session rewrites racing another write are retried
 
 
 class MessageRole(str, Enum):
@@ -58,6 +60,10 @@ class ChatMessage:
     feedback_note: Optional[str] = None
     feedback_timestamp: Optional[str] = None
 
+    # Follow-up questions (None while they are still being generated)
+    follow_up_questions: Optional[List[str]] = None
+    follow_ups_status: Optional[str] = None  # "ready", "pending", "failed" or "disabled"
+
     def to_dict(self) -> Dict[str, Any]:
         """Convert to dictionary for JSONL serialization."""
         return {
@@ -77,6 +83,8 @@ class ChatMessage:
             "feedback_rating": self.feedback_rating,
             "feedback_note": self.feedback_note,
             "feedback_timestamp": self.feedback_timestamp,
+            "follow_up_questions": self.follow_up_questions,
+            "follow_ups_status": self.follow_ups_status,
         }
     
     @classmethod
@@ -99,6 +107,8 @@ class ChatMessage:
             feedback_rating=data.get("feedback_rating"),
             feedback_note=data.get("feedback_note"),
             feedback_timestamp=data.get("feedback_timestamp"),
+            follow_up_questions=data.get("follow_up_questions"),
+            follow_ups_status=data.get("follow_ups_status"),
         )
 
 
@@ -180,16 +190,28 @@ def save_message(message: ChatMessage) -> None:
         
         # Path: chat_history/{user_id}/{session_id}.jsonl
         blob_path = f"{CHAT_HISTORY_PATH}/{message.user_id}/{message.session_id}.jsonl"
-        blob = bucket.blob(blob_path)
-        
-        # Append to existing file or create new
-        existing_content = ""
-        if blob.exists():
-            existing_content = blob.download_as_text()
-        
-        # Append new message as JSONL
         new_line = json.dumps(message.to_dict()) + "\n"
-        blob.upload_from_string(existing_content + new_line, content_type="application/jsonl")
+        
+        # Append against the generation we read (0: create only), so a concurrent
+        # rewrite such as stored follow-up questions is not overwritten
+        for attempt in range(CHAT_HISTORY_WRITE_ATTEMPTS):
+            blob = bucket.get_blob(blob_path)
+            try:
+                if blob is None:
+                    blob, generation, existing_content = bucket.blob(blob_path), 0, ""
+                else:
+                    generation = blob.generation
+                    existing_content = blob.download_as_text(if_generation_match=generation)
+                blob.upload_from_string(
+                    existing_content + new_line,
+                    content_type="application/jsonl",
+                    if_generation_match=generation
+                )
+                break
+            except core_exceptions.PreconditionFailed:
+                if attempt == CHAT_HISTORY_WRITE_ATTEMPTS - 1:
+                    raise
+                logger.info(f"Session {message.session_id} changed while saving message, retrying")
         
         logger.info(f"Message saved to gs://{CHAT_HISTORY_BUCKET}/{blob_path}")
         
@@ -513,6 +535,60 @@ def update_session_title(user_id: str, session_id: str, title: str) -> Optional[
         raise
 
 
+def _rewrite_message(
+    user_id: str,
+    session_id: str,
+    message_id: str,
+    update: Callable[[ChatMessage], None],
+    action: str
+) -> bool:
+    """
+    Apply update to one message and rewrite the session file.
+
+    The file is rewritten against the generation that was read; if another
+    write (e.g. the next turn, follow-ups or feedback) lands first, the update
+    is re-applied to the new content, up to CHAT_HISTORY_WRITE_ATTEMPTS times.
+
+    Returns:
+        True if updated, False if the session or message does not exist
+        (raises PreconditionFailed once the attempts are used up)
+    """
+    client = _get_storage_client()
+    bucket = client.bucket(CHAT_HISTORY_BUCKET)
+    blob_path = f"{CHAT_HISTORY_PATH}/{user_id}/{session_id}.jsonl"
+
+    for attempt in range(CHAT_HISTORY_WRITE_ATTEMPTS):
+        blob = bucket.get_blob(blob_path)
+        if blob is None:
+            logger.warning(f"Session {session_id} not found")
+            return False
+
+        try:
+            messages = [
+                ChatMessage.from_dict(json.loads(line))
+                for line in blob.download_as_text(if_generation_match=blob.generation).splitlines()
+                if line.strip()
+            ]
+            message = next((msg for msg in messages if msg.message_id == message_id), None)
+            if message is None:
+                logger.warning(f"Message {message_id} not found in session {session_id}")
+                return False
+            update(message)
+
+            new_content = "\n".join(json.dumps(msg.to_dict()) for msg in messages) + "\n"
+            blob.upload_from_string(
+                new_content,
+                content_type="application/jsonl",
+                if_generation_match=blob.generation
+            )
+            return True
+        except core_exceptions.PreconditionFailed:
+            if attempt == CHAT_HISTORY_WRITE_ATTEMPTS - 1:
+                raise
+            logger.info(f"Session {session_id} changed while {action}, retrying")
+    return False
+
+
 def update_message_feedback(
     user_id: str,
     session_id: str,
@@ -523,6 +599,9 @@ def update_message_feedback(
     """
     Update feedback for a specific message.
 
+    Rewrites the session file conditionally (see _rewrite_message), so feedback
+    given while follow-up questions are being stored does not drop them.
+
     Args:
         user_id: User ID
         session_id: Session ID
@@ -535,37 +614,53 @@ def update_message_feedback(
     """
     logger.info(f"Updating feedback for message {message_id} in session {session_id}")
 
+    def apply(message: ChatMessage) -> None:
+        message.feedback_rating = feedback_rating
+        message.feedback_note = feedback_note
+        message.feedback_timestamp = datetime.utcnow().isoformat()
+
     try:
-        # Load all messages
-        messages = get_conversation_history(user_id, session_id)
+        if not _rewrite_message(user_id, session_id, message_id, apply, "updating feedback"):
+            return False
+        logger.info(f"Feedback updated for message {message_id}")
+        return True
 
-        # Find and update the target message
-        message_found = False
-        for msg in messages:
-            if msg.message_id == message_id:
-                msg.feedback_rating = feedback_rating
-                msg.feedback_note = feedback_note
-                msg.feedback_timestamp = datetime.utcnow().isoformat()
-                message_found = True
-                break
+    except Exception as e:
+        logger.error(f"Error updating message feedback: {e}", exc_info=True)
+        return False
 
-        if not message_found:
-            logger.warning(f"Message {message_id} not found in session {session_id}")
-            return False
 
-        # Rewrite the entire JSONL file with updated messages
-        client = _get_storage_client()
-        bucket = client.bucket(CHAT_HISTORY_BUCKET)
-        blob_path = f"{CHAT_HISTORY_PATH}/{user_id}/{session_id}.jsonl"
-        blob = bucket.blob(blob_path)
+def update_message_follow_ups(
+    user_id: str,
+    session_id: str,
+    message_id: str,
+    follow_up_questions: List[str],
+    status: str = "ready"
+) -> bool:
+    """
+    Store follow-up questions generated after a message was saved.
 
-        # Build new JSONL content
-        new_content = "\n".join(json.dumps(msg.to_dict()) for msg in messages) + "\n"
-        blob.upload_from_string(new_content, content_type="application/jsonl")
+    Rewrites the session file conditionally (see _rewrite_message), so the
+    next turn or feedback landing at the same time is not lost.
 
-        logger.info(f"Feedback updated for message {message_id}")
-        return True
+    Args:
+        user_id: User ID
+        session_id: Session ID
+        message_id: Assistant message ID
+        follow_up_questions: Generated questions
+        status: Follow-up status to store ("ready", or "failed" with no questions)
+
+    Returns:
+        True if updated successfully
+    """
+    logger.info(f"Saving {len(follow_up_questions)} follow-up questions for message {message_id} ({status})")
 
+    def apply(message: ChatMessage) -> None:
+        message.follow_up_questions = follow_up_questions
+        message.follow_ups_status = status
+
+    try:
+        return _rewrite_message(user_id, session_id, message_id, apply, "saving follow-up questions")
     except Exception as e:
-        logger.error(f"Error updating message feedback: {e}", exc_info=True)
+        logger.error(f"Error saving follow-up questions: {e}", exc_info=True)
         return False
@@ -0,0 +1,269 @@
+"""
+Per-stage thread pools for blocking work called from async request handlers.
+
+The Google clients used on the request path (Firestore, GCS, Vertex AI Search,
+Gemini) are synchronous. Calling them directly from an `async def` handler
+blocks the event loop, so one slow chat stalls every other request on the
+worker. Handlers instead await run_blocking(stage, fn, ...), which runs the call
+on that stage's pool:
+
+    auth        user lookups and password hashing
+    storage     Firestore/GCS reads and writes (manifest, chat history, uploads)
+    retrieval   Vertex AI Search and the local/vector indexes
+    generation  Gemini calls
+
+Each stage has its own pool and queue, so a burst of slow generations cannot
+starve logins. Pool sizes come from EXECUTOR_<STAGE>_WORKERS. Every stage
+records queue wait and run time; EventLoopLagMonitor logs when the loop
+itself was blocked.
+"""
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Iterator, Optional
+
+from shared.profiling import profiled_call
+
+logger = logging.getLogger(__name__)
+
+# Environment variables
+STAGE_WORKERS = {
+    "auth": int(os.getenv("EXECUTOR_AUTH_WORKERS", "8")),
+    "storage": int(os.getenv("EXECUTOR_STORAGE_WORKERS", "16")),
+    "retrieval": int(os.getenv("EXECUTOR_RETRIEVAL_WORKERS", "16")),
+    "generation": int(os.getenv("EXECUTOR_GENERATION_WORKERS", "16")),
+}
+EXECUTOR_STATS_WINDOW = int(os.getenv("EXECUTOR_STATS_WINDOW", "1000"))
+EVENT_LOOP_LAG_INTERVAL_MS = float(os.getenv("EVENT_LOOP_LAG_INTERVAL_MS", "100"))
+EVENT_LOOP_LAG_WARN_MS = float(os.getenv("EVENT_LOOP_LAG_WARN_MS", "100"))
+
+
+def _percentile(values, q: float) -> Optional[float]:
+    """Nearest-rank percentile (q in 0-1) of a list of values, rounded to 0.01."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 2)
+
+
+class StageExecutor:
+    """A sized thread pool for one stage, with queue depth and timing stats."""
+
+    def __init__(self, stage: str, max_workers: int, window: int = EXECUTOR_STATS_WINDOW):
+        self.stage = stage
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{stage}-stage")
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+        self._max_queued = 0
+        self._wait_ms: Deque[float] = deque(maxlen=window)
+        self._run_ms: Deque[float] = deque(maxlen=window)
+
+    def submit(self, fn: Callable, *args: Any, **kwargs: Any):
+        """Submit fn to the pool; returns a concurrent.futures.Future."""
+        submitted = time.perf_counter()
+        with self._lock:
+            self._queued += 1
+            self._max_queued = max(self._max_queued, self._queued)
+
+        def run():
+            started = time.perf_counter()
+            with self._lock:
+                self._queued -= 1
+                self._running += 1
+                self._wait_ms.append((started - submitted) * 1000)
+            ok = False
+            try:
+                result = fn(*args, **kwargs)
+                ok = True
+                return result
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._completed += 1
+                    self._failed += 0 if ok else 1
+                    self._run_ms.append((time.perf_counter() - started) * 1000)
+
+        return self._pool.submit(run)
+
+    def stats(self) -> Dict[str, Any]:
+        """Current depth and recent queue-wait/run-time percentiles."""
+        with self._lock:
+            wait_ms, run_ms = list(self._wait_ms), list(self._run_ms)
+            return {
+                "workers": self.max_workers,
+                "running": self._running,
+                "queued": self._queued,
+                "max_queued": self._max_queued,
+                "completed": self._completed,
+                "failed": self._failed,
+                "queue_wait_ms": {"p50": _percentile(wait_ms, 0.5), "p99": _percentile(wait_ms, 0.99)},
+                "run_ms": {"p50": _percentile(run_ms, 0.5), "p99": _percentile(run_ms, 0.99)},
+            }
+
+    def shutdown(self, wait: bool = False) -> None:
+        self._pool.shutdown(wait=wait, cancel_futures=True)
+
+
+_executors: Dict[str, StageExecutor] = {}
+_executors_lock = threading.Lock()
+
+
+def get_stage_executor(stage: str) -> StageExecutor:
+    """Get (or create) the executor for a stage."""
+    if stage not in STAGE_WORKERS:
+        raise ValueError(f"Unknown executor stage: {stage}. Must be one of {', '.join(STAGE_WORKERS)}")
+    with _executors_lock:
+        if stage not in _executors:
+            _executors[stage] = StageExecutor(stage, STAGE_WORKERS[stage])
+        return _executors[stage]
+
+
+async def run_blocking(stage: str, fn: Callable, *args: Any, **kwargs: Any) -> Any:
+    """
+    Run a blocking call on a stage's pool and await the result.
+    Context variables (e.g. request-scoped logging context and the request's
+    profile, see shared/profiling.py) are carried over.
+
+    Args:
+        stage: One of STAGE_WORKERS
+        fn: Blocking callable
+        *args, **kwargs: Arguments for fn
+
+    Returns:
+        fn's return value (exceptions propagate)
+    """
+    return await asyncio.wrap_future(_submit(stage, fn, *args, **kwargs))
+
+
+def _submit(stage: str, fn: Callable, *args: Any, **kwargs: Any) -> Future:
+    context = contextvars.copy_context()
+    # Sample the worker thread too while the request is being profiled
+    call = profiled_call(functools.partial(fn, *args, **kwargs))
+    return get_stage_executor(stage).submit(context.run, call)
+
+
+def _close_after(in_flight: Optional[Future], iterator: Iterator[Any]) -> None:
+    if in_flight is not None:
+        wait([in_flight])
+    try:
+        iterator.close()
+    except Exception as e:
+        logger.warning(f"Closing abandoned iterator failed: {e}")
+
+
+async def iterate_blocking(stage: str, iterator: Iterator[Any]) -> AsyncIterator[Any]:
+    """
+    Drive a blocking iterator (e.g. a streaming model response) from async code,
+    fetching each item on the stage's pool.
+
+    If the consumer stops early (the client disconnected and the task was
+    cancelled, or the async generator was closed), the iterator is closed on
+    the stage's pool once any next() still running there returns, so a
+    generator's cleanup runs promptly and never while it is executing.
+    """
+    sentinel = object()
+    in_flight: Optional[Future] = None
+    exhausted = False
+    try:
+        while True:
+            in_flight = _submit(stage, next, iterator, sentinel)
+            item = await asyncio.wrap_future(in_flight)
+            if item is sentinel:
+                exhausted = True
+                return
+            yield item
+    finally:
+        if not exhausted and hasattr(iterator, "close"):
+            if in_flight is not None and in_flight.cancel():
+                in_flight = None
+            closed = get_stage_executor(stage).submit(_close_after, in_flight, iterator)
+            await asyncio.shield(asyncio.wrap_future(closed))
+
+
+def executor_stats() -> Dict[str, Dict[str, Any]]:
+    """Stats for every stage that has been used."""
+    with _executors_lock:
+        executors = dict(_executors)
+    return {stage: executor.stats() for stage, executor in executors.items()}
+
+
+def shutdown_executors() -> None:
+    """Stop all stage pools (queued work is cancelled)."""
+    with _executors_lock:
+        executors = list(_executors.values())
+        _executors.clear()
+    for executor in executors:
+        executor.shutdown()
+
+
+class EventLoopLagMonitor:
+    """
+    Measures how late the event loop wakes up from a fixed-interval sleep.
+    Lag above warn_ms means something ran on the loop for that long without
+    yielding (a blocking call in an async handler); it is logged with the
+    executor queue depths at that moment.
+    """
+
+    def __init__(
+        self,
+        interval_ms: float = EVENT_LOOP_LAG_INTERVAL_MS,
+        warn_ms: float = EVENT_LOOP_LAG_WARN_MS,
+        window: int = EXECUTOR_STATS_WINDOW
+    ):
+        self.interval_ms = interval_ms
+        self.warn_ms = warn_ms
+        self.stalls = 0
+        self.max_lag_ms = 0.0
+        self._lag_ms: Deque[float] = deque(maxlen=window)
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """Start sampling on the running loop."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def record(self, lag_ms: float) -> None:
+        self._lag_ms.append(lag_ms)
+        self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+        if lag_ms > self.warn_ms:
+            self.stalls += 1
+            queued = {stage: stats["queued"] for stage, stats in executor_stats().items()}
+            logger.warning(f"Event loop blocked for {lag_ms:.0f}ms (threshold {self.warn_ms:.0f}ms); executor queues: {queued}")
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        interval = self.interval_ms / 1000
+        while True:
+            scheduled = loop.time()
+            await asyncio.sleep(interval)
+            self.record(max(0.0, (loop.time() - scheduled - interval) * 1000))
+
+    def stats(self) -> Dict[str, Any]:
+        lag_ms = list(self._lag_ms)
+        return {
+            "interval_ms": self.interval_ms,
+            "warn_ms": self.warn_ms,
+            "samples": len(lag_ms),
+            "stalls": self.stalls,
+            "max_lag_ms": round(self.max_lag_ms, 2),
+            "lag_ms": {"p50": _percentile(lag_ms, 0.5), "p99": _percentile(lag_ms, 0.99)},
+        }
@@ -19,6 +19,8 @@ from threading import Lock
 from dataclasses import dataclass, asdict
 import time
 
+from shared.telemetry import observe_llm_call
+
 # Setup logging
 logger = logging.getLogger(__name__)
 
@@ -176,6 +178,15 @@ class LLMTracker:
         Args:
             record: LLMCallRecord to write
         """
+        observe_llm_call(
+            record.api_provider,
+            record.model,
+            record.status,
+            record.input_tokens,
+            record.output_tokens,
+            record.latency_ms / 1000 if record.latency_ms is not None else None
+        )
+
         try:
             json_line = json.dumps(record.to_dict(), ensure_ascii=False) + '\n'
 
@@ -271,7 +282,9 @@ class LLMTracker:
 
         try:
             yield call_tracker
-            record.status = "success"
+            # Keep an error recorded through set_error() by a caller that handled it
+            if record.status == "in_progress":
+                record.status = "success"
         except Exception as e:
             record.status = "error"
             record.error_message = str(e)
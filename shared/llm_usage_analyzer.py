@@ -28,6 +28,12 @@ class UsageStats:
     avg_latency_ms: float = 0.0
     total_cost_estimate: float = 0.0
 
+    # Answer cache (hits are logged as calls with model "answer-cache" and no tokens)
+    answer_cache_hits: int = 0
+    answer_generations: int = 0
+    saved_input_tokens: int = 0
+    saved_output_tokens: int = 0
+
     # Breakdown by model
     by_model: Dict[str, Dict[str, int]] = None
 
@@ -40,6 +46,12 @@ class UsageStats:
         if self.by_operation is None:
             self.by_operation = {}
 
+    @property
+    def answer_cache_hit_rate(self) -> Optional[float]:
+        """Share of chat answers served from the answer cache."""
+        answers = self.answer_cache_hits + self.answer_generations
+        return self.answer_cache_hits / answers if answers else None
+
 
 class LLMUsageAnalyzer:
     """
@@ -198,6 +210,15 @@ class LLMUsageAnalyzer:
             cost = record.get('cost_estimate', 0.0)
             stats.total_cost_estimate += cost
 
+            # Answer cache
+            params = record.get('additional_params') or {}
+            if params.get('answer_cache') == 'hit':
+                stats.answer_cache_hits += 1
+                stats.saved_input_tokens += params.get('saved_input_tokens', 0)
+                stats.saved_output_tokens += params.get('saved_output_tokens', 0)
+            elif record.get('operation') == 'chat_answer' and record.get('status') == 'success':
+                stats.answer_generations += 1
+
             # By model
             model = record.get('model', 'unknown')
             stats.by_model[model]['calls'] += 1
@@ -394,6 +415,13 @@ class LLMUsageAnalyzer:
                 'avg_latency_ms': overall_stats.avg_latency_ms,
                 'total_cost_estimate': overall_stats.total_cost_estimate
             },
+            'answer_cache': {
+                'hits': overall_stats.answer_cache_hits,
+                'generations': overall_stats.answer_generations,
+                'hit_rate': overall_stats.answer_cache_hit_rate,
+                'saved_input_tokens': overall_stats.saved_input_tokens,
+                'saved_output_tokens': overall_stats.saved_output_tokens
+            },
             'unique_counts': {
                 'users': user_count,
                 'sessions': session_count,
@@ -499,6 +527,12 @@ def print_usage_stats(stats: UsageStats, title: str = "Usage Statistics"):
     print(f"Avg Latency:        {stats.avg_latency_ms:.2f} ms")
     print(f"Est. Total Cost:    ${stats.total_cost_estimate:.4f}")
 
+    if stats.answer_cache_hits:
+        print()
+        print(f"Answer Cache:")
+        print(f"  Hits:             {stats.answer_cache_hits:,} ({stats.answer_cache_hit_rate:.1%} of answers)")
+        print(f"  Tokens Saved:     {stats.saved_input_tokens + stats.saved_output_tokens:,}")
+
     if stats.by_model:
         print(f"\nBy Model:")
         for model, model_stats in sorted(stats.by_model.items(),
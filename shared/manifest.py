@@ -1,15 +1,26 @@
 """
 Manifest management for CENTEF RAG system.
 Handles reading, writing, and updating the central manifest.jsonl.
+
+Read-mostly callers (the synthesizers resolving citations) go through a shared
+in-process view of the manifest, indexed by source_id and keyed on the GCS
+object generation. Within MANIFEST_CACHE_REVALIDATE_S the view is served from
+memory; after that a metadata request checks the generation and the manifest
+is downloaded again only if another writer changed it. Writes made through
+this module refresh the view directly. Read-modify-write paths still load the
+manifest fresh.
 """
 import json
 import logging
 import os
+import threading
+import time
 from dataclasses import dataclass, field, asdict
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Iterable, Tuple
 from datetime import datetime
 from enum import Enum
 
+from google.api_core import exceptions as core_exceptions
 from google.cloud import storage
 
 logger = logging.getLogger(__name__)
@@ -19,6 +30,8 @@ PROJECT_ID = os.getenv("PROJECT_ID")
 SOURCE_BUCKET = os.getenv("SOURCE_BUCKET", "centef-rag-bucket")
 TARGET_BUCKET = os.getenv("TARGET_BUCKET", "centef-rag-chunks")
 MANIFEST_PATH = os.getenv("MANIFEST_PATH", "gs://centef-rag-bucket/manifest/manifest.jsonl")
+MANIFEST_CACHE_REVALIDATE_S = float(os.getenv("MANIFEST_CACHE_REVALIDATE_S", "30"))  # Skip generation checks within this window
+MANIFEST_READ_ATTEMPTS = int(os.getenv("MANIFEST_READ_ATTEMPTS", "3"))  # Reads racing a rewrite are retried
 
 
 class DocumentStatus(str, Enum):
@@ -146,6 +159,46 @@ def _parse_gcs_path(gcs_path: str) -> tuple[str, str]:
     return bucket_name, blob_path
 
 
+def _parse_manifest(content: str) -> List[ManifestEntry]:
+    entries = []
+    for line in content.strip().split('\n'):
+        if line.strip():
+            entries.append(ManifestEntry.from_dict(json.loads(line)))
+    return entries
+
+
+def _read_manifest() -> Tuple[List[ManifestEntry], Any]:
+    """
+    Download and parse the manifest.
+
+    Returns:
+        Tuple of (entries, GCS generation); ([], None) if the manifest does not exist
+    """
+    global _manifest_reads
+    client = _get_storage_client()
+    bucket_name, blob_path = _parse_gcs_path(MANIFEST_PATH)
+
+    for attempt in range(MANIFEST_READ_ATTEMPTS):
+        blob = client.bucket(bucket_name).get_blob(blob_path)
+
+        if blob is None:
+            logger.warning(f"Manifest file does not exist, creating empty manifest")
+            return [], None
+
+        # Pin the generation we looked up so a concurrent rewrite cannot mix versions
+        try:
+            content = blob.download_as_text(if_generation_match=blob.generation)
+        except core_exceptions.PreconditionFailed:
+            # Rewritten between the lookup and the download: read the new generation
+            if attempt == MANIFEST_READ_ATTEMPTS - 1:
+                raise
+            logger.info(f"Manifest generation {blob.generation} replaced during read, retrying")
+            continue
+        with _view_lock:
+            _manifest_reads += 1
+        return _parse_manifest(content), blob.generation
+
+
 def _load_manifest_entries() -> List[ManifestEntry]:
     """
     Load all manifest entries from GCS.
@@ -156,24 +209,10 @@ def _load_manifest_entries() -> List[ManifestEntry]:
     logger.info(f"Loading manifest from {MANIFEST_PATH}")
     
     try:
-        client = _get_storage_client()
-        bucket_name, blob_path = _parse_gcs_path(MANIFEST_PATH)
-        bucket = client.bucket(bucket_name)
-        blob = bucket.blob(blob_path)
-        
-        if not blob.exists():
-            logger.warning(f"Manifest file does not exist, creating empty manifest")
-            return []
-        
-        content = blob.download_as_text()
-        entries = []
-        
-        for line in content.strip().split('\n'):
-            if line.strip():
-                data = json.loads(line)
-                entries.append(ManifestEntry.from_dict(data))
-        
+        entries, generation = _read_manifest()
+        _refresh_view(entries, generation)
         logger.info(f"Loaded {len(entries)} manifest entries")
+        # The view keeps its own objects; callers may modify these
         return entries
         
     except Exception as e:
@@ -181,6 +220,99 @@ def _load_manifest_entries() -> List[ManifestEntry]:
         raise
 
 
+class ManifestView:
+    """Snapshot of the manifest indexed by source_id. Entries are shared: do not modify them."""
+
+    __slots__ = ("entries", "generation", "checked_at")
+
+    def __init__(self, entries: Dict[str, ManifestEntry], generation: Any, checked_at: float):
+        self.entries = entries
+        self.generation = generation
+        self.checked_at = checked_at
+
+
+_view: Optional[ManifestView] = None
+_view_lock = threading.Lock()
+_view_refresh_lock = threading.Lock()  # One download at a time when the view goes stale
+_manifest_reads = 0
+
+
+def _refresh_view(entries: List[ManifestEntry], generation: Any) -> ManifestView:
+    global _view
+    view = ManifestView(
+        {e.source_id: ManifestEntry.from_dict(e.to_dict()) for e in entries},
+        generation,
+        time.monotonic(),
+    )
+    with _view_lock:
+        _view = view
+    return view
+
+
+def _current_generation() -> Any:
+    bucket_name, blob_path = _parse_gcs_path(MANIFEST_PATH)
+    blob = _get_storage_client().bucket(bucket_name).get_blob(blob_path)
+    return blob.generation if blob is not None else None
+
+
+def get_manifest_view() -> ManifestView:
+    """
+    Get the shared manifest view, revalidating it against the GCS generation
+    at most every MANIFEST_CACHE_REVALIDATE_S.
+    """
+    with _view_lock:
+        view = _view
+    if view is not None and time.monotonic() - view.checked_at < MANIFEST_CACHE_REVALIDATE_S:
+        return view
+
+    with _view_refresh_lock:
+        with _view_lock:
+            if _view is not view:
+                # Another request refreshed it while we waited
+                return _view
+        if view is not None and _current_generation() == view.generation:
+            view.checked_at = time.monotonic()
+            return view
+        entries, generation = _read_manifest()
+        logger.info(f"Manifest view loaded {len(entries)} entries (generation {generation})")
+        return _refresh_view(entries, generation)
+
+
+def get_manifest_entries_by_ids(source_ids: Iterable[Optional[str]]) -> Dict[str, Optional[ManifestEntry]]:
+    """
+    Resolve many source_ids in one pass over the shared manifest view.
+
+    Args:
+        source_ids: Source IDs to resolve (empty values are skipped)
+
+    Returns:
+        Dict of source_id -> ManifestEntry, or None for IDs not in the manifest.
+        Entries are shared with the view and must not be modified.
+    """
+    wanted = {source_id for source_id in source_ids if source_id}
+    if not wanted:
+        return {}
+    entries = get_manifest_view().entries
+    resolved = {source_id: entries.get(source_id) for source_id in wanted}
+    missing = sorted(source_id for source_id, entry in resolved.items() if entry is None)
+    if missing:
+        logger.warning(f"Manifest entries not found for source_ids={missing}")
+    return resolved
+
+
+def manifest_read_count() -> int:
+    """Number of full manifest downloads made by this process."""
+    with _view_lock:
+        return _manifest_reads
+
+
+def clear_manifest_view() -> None:
+    """Drop the cached manifest view."""
+    global _view
+    with _view_lock:
+        _view = None
+
+
 def _write_manifest_entries(entries: List[ManifestEntry]) -> None:
     """
     Write all manifest entries to GCS.
@@ -212,6 +344,7 @@ def _write_manifest_entries(entries: List[ManifestEntry]) -> None:
 
             # Upload to GCS
             blob.upload_from_string(content, content_type='application/jsonl')
+            _refresh_view(entries, blob.generation)
 
             logger.info(f"Successfully wrote manifest")
             return  # Success, exit the function
@@ -0,0 +1,360 @@
+"""
+Opt-in sampling profiler for slow requests.
+
+Stage timings say that a chat turn took 20 seconds in "generate" or "history",
+but not whether the time went to manifest reloads, history downloads, LLM calls
+or JSON work. ProfilingMiddleware profiles one request in PROFILE_SAMPLE_EVERY,
+and any request carrying an X-Profile-Token header equal to PROFILE_TOKEN, with
+a wall-clock stack sampler:
+
+- One daemon thread samples every PROFILE_INTERVAL_MS while at least one
+  profile is active (sys._current_frames()), and sleeps on an event otherwise.
+- A profile samples the event loop thread, plus any executor thread while it
+  runs work for that request: run_blocking() carries the request's context to
+  the pool, and the current profile travels in a context variable. Loop samples
+  show whatever ran on the loop during the request, including other requests'
+  work that delayed it.
+- Stacks are folded to "root;outer;...;inner count" lines (the collapsed
+  format read by flamegraph.pl and speedscope) and kept with the request's
+  pipeline stage timings in a bounded in-memory store, served from
+  /admin/profiles.
+
+Requests that are not profiled cost a counter increment (plus a header scan
+when PROFILE_TOKEN is set); blocking calls cost one context variable lookup.
+"""
+import contextvars
+import functools
+import hmac
+import itertools
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from datetime import datetime
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# Environment variables
+PROFILE_SAMPLE_EVERY = int(os.getenv("PROFILE_SAMPLE_EVERY", "0"))  # Profile 1 in N requests; 0 = header only
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")  # X-Profile-Token value that forces a profile; unset = disabled
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_MAX_DEPTH = int(os.getenv("PROFILE_MAX_DEPTH", "128"))
+PROFILE_MAX_STORED = int(os.getenv("PROFILE_MAX_STORED", "50"))
+PROFILE_MIN_DURATION_MS = float(os.getenv("PROFILE_MIN_DURATION_MS", "0"))  # Keep sampled profiles at least this slow
+
+PROFILE_HEADER = b"x-profile-token"
+PROFILE_ID_HEADER = b"x-profile-id"
+LOOP_ROOT = "event-loop"
+
+_current_profile: contextvars.ContextVar[Optional["RequestProfile"]] = contextvars.ContextVar(
+    "current_profile", default=None
+)
+
+# Frame labels by code object; bounded by the amount of code loaded
+_labels: Dict[Any, str] = {}
+
+
+def _frame_label(code) -> str:
+    label = _labels.get(code)
+    if label is None:
+        label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ",")
+        _labels[code] = label
+    return label
+
+
+def _fold(frame, root: str, max_depth: int) -> str:
+    """Collapse a thread's stack into "root;outermost;...;innermost"."""
+    labels = []
+    while frame is not None and len(labels) < max_depth:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    labels.append(root)
+    labels.reverse()
+    return ";".join(labels)
+
+
+class RequestProfile:
+    """Stack samples and stage timings for one profiled request."""
+
+    def __init__(self, method: str, path: str, trigger: str, interval_ms: float = PROFILE_INTERVAL_MS):
+        self.profile_id = uuid.uuid4().hex[:12]
+        self.method = method
+        self.path = path
+        self.trigger = trigger
+        self.interval_ms = interval_ms
+        self.started_at = datetime.utcnow().isoformat()
+        self.route: Optional[str] = None
+        self.status: Optional[int] = None
+        self.duration_ms: Optional[float] = None
+        self.samples = 0
+        self.stacks: Counter = Counter()
+        self.annotations: Dict[str, Any] = {}
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self._threads: Dict[int, List] = {}  # thread id -> [root label, active calls]
+
+    def add_thread(self, thread_id: int, root: str) -> None:
+        """Start sampling a thread under the given root label."""
+        with self._lock:
+            entry = self._threads.setdefault(thread_id, [root, 0])
+            entry[1] += 1
+
+    def remove_thread(self, thread_id: int) -> None:
+        with self._lock:
+            entry = self._threads.get(thread_id)
+            if entry is not None:
+                entry[1] -= 1
+                if entry[1] <= 0:
+                    del self._threads[thread_id]
+
+    def run_in_thread(self, fn: Callable[[], Any]) -> Any:
+        """Run fn on the current (executor) thread, sampling it for this request."""
+        thread = threading.current_thread()
+        self.add_thread(thread.ident, thread.name.rsplit("_", 1)[0])
+        try:
+            return fn()
+        finally:
+            self.remove_thread(thread.ident)
+
+    def sample(self, frames: Dict[int, Any], max_depth: int = PROFILE_MAX_DEPTH) -> None:
+        """Record one sample of every thread working for this request."""
+        with self._lock:
+            threads = [(thread_id, entry[0]) for thread_id, entry in self._threads.items()]
+        stacks = [_fold(frames[thread_id], root, max_depth) for thread_id, root in threads if thread_id in frames]
+        with self._lock:
+            self.samples += 1
+            for stack in stacks:
+                self.stacks[stack] += 1
+
+    def finish(self, status: Optional[int], route: Optional[str]) -> None:
+        self.duration_ms = round((time.perf_counter() - self._start) * 1000, 2)
+        self.status = status
+        self.route = route
+
+    def collapsed(self) -> str:
+        """Samples in collapsed-stack format, most frequent first."""
+        with self._lock:
+            stacks = self.stacks.most_common()
+        return "".join(f"{stack} {count}\n" for stack, count in stacks)
+
+    def to_dict(self, include_stacks: bool = True) -> Dict[str, Any]:
+        result = {
+            "profile_id": self.profile_id,
+            "method": self.method,
+            "path": self.path,
+            "route": self.route,
+            "status": self.status,
+            "trigger": self.trigger,
+            "started_at": self.started_at,
+            "duration_ms": self.duration_ms,
+            "interval_ms": self.interval_ms,
+            "samples": self.samples,
+            "stages_ms": self.annotations.get("stages_ms"),
+            "cached_stages": self.annotations.get("cached_stages"),
+        }
+        if include_stacks:
+            result["collapsed"] = self.collapsed()
+        return result
+
+
+class StackSampler:
+    """One daemon thread sampling the active profiles; idle while there are none."""
+
+    def __init__(self, interval_ms: float = PROFILE_INTERVAL_MS):
+        self.interval_s = interval_ms / 1000
+        self._profiles: List[RequestProfile] = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, profile: RequestProfile) -> None:
+        with self._lock:
+            self._profiles.append(profile)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+
+    def remove(self, profile: RequestProfile) -> None:
+        with self._lock:
+            if profile in self._profiles:
+                self._profiles.remove(profile)
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                profiles = list(self._profiles)
+                if not profiles:
+                    self._wakeup.clear()
+            if not profiles:
+                self._wakeup.wait()
+                continue
+            frames = sys._current_frames()
+            for profile in profiles:
+                profile.sample(frames)
+            del frames
+            time.sleep(self.interval_s)
+
+
+class ProfileStore:
+    """The most recent profiles, newest first."""
+
+    def __init__(self, max_profiles: int = PROFILE_MAX_STORED):
+        self._profiles: Deque[RequestProfile] = deque(maxlen=max_profiles)
+        self._lock = threading.Lock()
+
+    def add(self, profile: RequestProfile) -> None:
+        with self._lock:
+            self._profiles.appendleft(profile)
+
+    def list(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            profiles = list(self._profiles)
+        return [profile.to_dict(include_stacks=False) for profile in profiles]
+
+    def get(self, profile_id: str) -> Optional[RequestProfile]:
+        with self._lock:
+            return next((profile for profile in self._profiles if profile.profile_id == profile_id), None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._profiles.clear()
+
+
+_sampler: Optional[StackSampler] = None
+_store: Optional[ProfileStore] = None
+_singleton_lock = threading.Lock()
+
+
+def get_sampler() -> StackSampler:
+    global _sampler
+    with _singleton_lock:
+        if _sampler is None:
+            _sampler = StackSampler()
+        return _sampler
+
+
+def get_profile_store() -> ProfileStore:
+    global _store
+    with _singleton_lock:
+        if _store is None:
+            _store = ProfileStore()
+        return _store
+
+
+def reset_profile_store(max_profiles: int = PROFILE_MAX_STORED) -> ProfileStore:
+    """Replace the store (tests)."""
+    global _store
+    with _singleton_lock:
+        _store = ProfileStore(max_profiles)
+        return _store
+
+
+def current_profile() -> Optional[RequestProfile]:
+    """The profile of the request being handled, if it is being profiled."""
+    return _current_profile.get()
+
+
+def profiled_call(fn: Callable[[], Any]) -> Callable[[], Any]:
+    """
+    Wrap a call about to be sent to an executor thread so that thread is
+    sampled for the current request's profile. Returns fn unchanged when the
+    request is not being profiled.
+    """
+    profile = _current_profile.get()
+    if profile is None:
+        return fn
+    return functools.partial(profile.run_in_thread, fn)
+
+
+def annotate_profile(**fields: Any) -> None:
+    """Attach data (e.g. stage timings) to the current request's profile, if any."""
+    profile = _current_profile.get()
+    if profile is not None:
+        profile.annotations.update(fields)
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware profiling one request in sample_every, and requests whose
+    X-Profile-Token header matches token. The profile covers the request until
+    the last body chunk is sent, its id is returned in X-Profile-Id, and it is
+    stored unless it was sampled and ran faster than min_duration_ms.
+    """
+
+    def __init__(
+        self,
+        app,
+        sample_every: int = PROFILE_SAMPLE_EVERY,
+        token: Optional[str] = PROFILE_TOKEN,
+        min_duration_ms: float = PROFILE_MIN_DURATION_MS,
+        skip_paths: Sequence[str] = ("/metrics", "/admin/profiles"),
+    ):
+        self.app = app
+        self.sample_every = sample_every
+        self.token = token.encode() if token else None
+        self.min_duration_ms = min_duration_ms
+        self.skip_paths = tuple(skip_paths)
+        self._requests = itertools.count(1)
+
+    def _trigger(self, scope) -> Optional[str]:
+        if self.token:
+            for name, value in scope.get("headers", ()):
+                if name == PROFILE_HEADER:
+                    if hmac.compare_digest(value, self.token):
+                        return "header"
+                    break
+        if self.sample_every and next(self._requests) % self.sample_every == 0:
+            return "sampled"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("path", "").startswith(self.skip_paths):
+            await self.app(scope, receive, send)
+            return
+        trigger = self._trigger(scope)
+        if trigger is None:
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope.get("method", ""), scope.get("path", ""), trigger)
+        profile.add_thread(threading.get_ident(), LOOP_ROOT)
+        sampler = get_sampler()
+        status = [500]
+        finished = [False]
+
+        def finish():
+            if finished[0]:
+                return
+            finished[0] = True
+            sampler.remove(profile)
+            profile.finish(status[0], getattr(scope.get("route"), "path", None))
+            if trigger == "header" or profile.duration_ms >= self.min_duration_ms:
+                get_profile_store().add(profile)
+                logger.info(
+                    f"Profiled {profile.method} {profile.path} ({trigger}): {profile.duration_ms}ms, "
+                    f"{profile.samples} samples, id={profile.profile_id}"
+                )
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                message = {
+                    **message,
+                    "headers": list(message.get("headers", [])) + [(PROFILE_ID_HEADER, profile.profile_id.encode())],
+                }
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                finish()
+
+        token = _current_profile.set(profile)
+        sampler.add(profile)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            finish()
+            _current_profile.reset(token)
@@ -11,6 +11,8 @@ from datetime import datetime
 
 from google.cloud import storage
 
+from shared.similarity import simhash
+
 logger = logging.getLogger(__name__)
 
 # Environment variables
@@ -122,6 +124,11 @@ class Chunk:
             "chunk_index": self.chunk_index,
         }
         
+        # Near-duplicate signature used for query-time deduplication
+        signature = simhash(self.content)
+        if signature:
+            result["simhash"] = signature
+        
         # Add optional metadata
         if self.metadata.author:
             result["author"] = self.metadata.author
@@ -217,6 +224,10 @@ class Summary:
             "created_at": self.created_at,
         }
         
+        signature = simhash(self.summary_text)
+        if signature:
+            result["simhash"] = signature
+        
         if self.author:
             result["author"] = self.author
         if self.organization:
@@ -0,0 +1,133 @@
+"""
+Near-duplicate detection for CENTEF RAG system.
+SimHash signatures over word shingles, with LSH banding for fast candidate lookup.
+"""
+import hashlib
+import logging
+import re
+from collections import defaultdict
+from typing import Dict, Hashable, List, Optional, Set, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SIMHASH_BITS = 64
+SHINGLE_SIZE = 3
+
+_TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def _shingles(text: str, size: int = SHINGLE_SIZE) -> List[str]:
+    """Split text into overlapping word n-grams (unigrams for very short texts)."""
+    tokens = _TOKEN_PATTERN.findall(text.lower())
+    if len(tokens) < size:
+        return tokens
+    return [" ".join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)]
+
+
+def simhash(text: Optional[str]) -> Optional[str]:
+    """
+    Compute a 64-bit SimHash signature of text.
+
+    Similar texts produce signatures with a small Hamming distance. The signature
+    is returned as a 16-character hex string so it survives JSON and Vertex AI
+    Search struct data without integer precision loss.
+
+    Args:
+        text: Input text
+
+    Returns:
+        Hex signature, or None for empty text
+    """
+    shingles = _shingles(text or "")
+    if not shingles:
+        return None
+
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big") for s in shingles],
+        dtype=">u8"
+    )
+    # One row of 64 bits per shingle, most significant bit first
+    bits = np.unpackbits(hashes.view(np.uint8).reshape(-1, 8), axis=1)
+    votes = bits.sum(axis=0, dtype=np.int64) * 2 - len(shingles)
+    signature = 0
+    for bit in votes > 0:
+        signature = (signature << 1) | int(bit)
+    return f"{signature:016x}"
+
+
+def hamming_distance(a: str, b: str) -> int:
+    """Number of differing bits between two hex signatures."""
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+
+def simhash_similarity(a: str, b: str) -> float:
+    """Bitwise similarity (0-1) between two hex signatures."""
+    return 1.0 - hamming_distance(a, b) / SIMHASH_BITS
+
+
+def max_distance_for_threshold(threshold: float) -> int:
+    """
+    Convert a similarity threshold (0-1) into a maximum Hamming distance (0-SIMHASH_BITS).
+
+    Raises:
+        ValueError: If threshold is outside 0-1
+    """
+    if not 0.0 <= threshold <= 1.0:
+        raise ValueError(f"Similarity threshold must be between 0 and 1, got {threshold}")
+    return int((1.0 - threshold) * SIMHASH_BITS)
+
+
+class SimHashLSH:
+    """
+    LSH index over SimHash signatures.
+
+    Signatures are split into max_distance + 1 bands. Two signatures within
+    max_distance bits must agree exactly on at least one band (pigeonhole), so
+    bucketing by band finds every near-duplicate without comparing all pairs.
+    That needs at most SIMHASH_BITS bands of at least one bit, so max_distance
+    is at most SIMHASH_BITS - 1; at SIMHASH_BITS every signature matches and
+    all of them share a single bucket.
+    """
+
+    def __init__(self, max_distance: int):
+        if not 0 <= max_distance <= SIMHASH_BITS:
+            raise ValueError(f"max_distance must be between 0 and {SIMHASH_BITS}, got {max_distance}")
+        self.max_distance = max_distance
+        self._bands: List[Tuple[int, int]] = []
+        if max_distance == SIMHASH_BITS:
+            self._bands.append((0, 0))
+        else:
+            width, extra = divmod(SIMHASH_BITS, max_distance + 1)
+            shift = SIMHASH_BITS
+            for i in range(max_distance + 1):
+                band_width = width + (1 if i < extra else 0)
+                shift -= band_width
+                self._bands.append((shift, (1 << band_width) - 1))
+        self._buckets: Dict[Tuple[int, int], List[Hashable]] = defaultdict(list)
+        self._signatures: Dict[Hashable, int] = {}
+
+    def _band_keys(self, signature: int) -> List[Tuple[int, int]]:
+        return [(i, (signature >> shift) & mask) for i, (shift, mask) in enumerate(self._bands)]
+
+    def add(self, key: Hashable, signature: str) -> None:
+        """Index a signature under key."""
+        value = int(signature, 16)
+        self._signatures[key] = value
+        for band_key in self._band_keys(value):
+            self._buckets[band_key].append(key)
+
+    def query(self, signature: str) -> List[Hashable]:
+        """Return keys of indexed signatures within max_distance bits."""
+        value = int(signature, 16)
+        seen: Set[Hashable] = set()
+        matches = []
+        for band_key in self._band_keys(value):
+            for key in self._buckets.get(band_key, ()):
+                if key in seen:
+                    continue
+                seen.add(key)
+                if bin(self._signatures[key] ^ value).count("1") <= self.max_distance:
+                    matches.append(key)
+        return matches
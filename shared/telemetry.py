@@ -0,0 +1,495 @@
+"""
+Prometheus metrics for the CENTEF services.
+
+Operational data used to be visible only in log lines. This module keeps
+counters, gauges and fixed-bucket histograms in process and renders them in the
+Prometheus text exposition format for GET /metrics. prometheus_client is not a
+dependency, so the few metric types needed are implemented here.
+
+Recording is cheap and allocation-free after warm-up: metrics are created once
+at import, each label combination gets its child object (a counter value or a
+bucket-count list) the first time it is seen, and observing is a dict lookup,
+a bisect and a few additions under the metric's lock. Label values must be
+bounded (route templates, model names, stage names), never queries or IDs.
+Values that already live elsewhere (executor queue depths, cache hit ratios)
+are read by collectors at scrape time instead of being copied per request.
+
+Recorded here:
+    centef_http_*             requests and latency per route (PrometheusMiddleware)
+    centef_gcs_*              GCS requests, errors and bytes (instrument_gcs)
+    centef_vertex_search_*    Vertex AI Search requests, errors and latency
+    centef_llm_*              LLM calls, tokens by model, answers by (fallback) model
+    centef_rag_stage_*        per-stage pipeline timings and stage cache hits
+    centef_executor_*         executor queue depths (collector)
+Application collectors (caches, circuit breakers) are registered with
+register_collector by the modules that own the data.
+"""
+import bisect
+import functools
+import hmac
+import logging
+import math
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from shared.executors import executor_stats
+
+logger = logging.getLogger(__name__)
+
+# Environment variables
+TELEMETRY_ENABLED = os.getenv("TELEMETRY_ENABLED", "true").lower() == "true"
+METRICS_BEARER_TOKEN = os.getenv("METRICS_BEARER_TOKEN")  # Bearer token /metrics requires
+METRICS_PUBLIC = os.getenv("METRICS_PUBLIC", "false").lower() == "true"  # Serve /metrics without a token (opt-in)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; covers GCS metadata calls through multi-model Gemini fallbacks
+LATENCY_BUCKETS_S = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# (name, type, help, [(labels, value), ...]) as returned by collectors
+MetricFamily = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class _Metric:
+    """A metric family: one child per label-value combination."""
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def _new_child(self) -> Any:
+        raise NotImplementedError
+
+    def labels(self, *values: Any) -> Any:
+        """The child for these label values (created on first use)."""
+        key = tuple(str(value) for value in values) if values else ()
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.label_names):
+                raise ValueError(f"{self.name} takes labels {self.label_names}, got {key}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._children.clear()
+
+
+class _Value:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self, lock: threading.Lock):
+        self.value = 0.0
+        self._lock = lock
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Counter(_Metric):
+    """Monotonic counter; the name should end in _total."""
+
+    kind = "counter"
+
+    def _new_child(self) -> _Value:
+        return _Value(self._lock)
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            children = list(self._children.items())
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(child.value)}"
+                for key, child in children]
+
+
+class Gauge(Counter):
+    """Value that can go up and down."""
+
+    kind = "gauge"
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+
+class _HistogramChild:
+    __slots__ = ("counts", "sum", "_buckets", "_lock")
+
+    def __init__(self, buckets: Tuple[float, ...], lock: threading.Lock):
+        self._buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot: above the largest bucket
+        self.sum = 0.0
+        self._lock = lock
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+
+class Histogram(_Metric):
+    """Fixed-bucket histogram (cumulative buckets are computed at scrape time)."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS_S
+    ):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self) -> _HistogramChild:
+        return _HistogramChild(self.buckets, self._lock)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def _samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            children = [(key, list(child.counts), child.sum) for key, child in self._children.items()]
+        label_names = self.label_names + ("le",)
+        for key, counts, total in children:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(label_names, key + (_format_value(bound),))} {cumulative}"
+                )
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Metrics and scrape-time collectors rendered together."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], Iterable[MetricFamily]]] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric already registered: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def register_collector(self, collector: Callable[[], Iterable[MetricFamily]]) -> None:
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        blocks = [metric.render() for metric in metrics]
+        for collector in collectors:
+            try:
+                families = list(collector())
+            except Exception as e:
+                logger.warning(f"Metrics collector {getattr(collector, '__name__', collector)} failed: {e}")
+                continue
+            for name, kind, documentation, samples in families:
+                lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+                for labels, value in samples:
+                    if value is None:
+                        continue
+                    lines.append(f"{name}{_format_labels(tuple(labels), tuple(labels.values()))} {_format_value(value)}")
+                blocks.append("\n".join(lines))
+        return "\n".join(blocks) + "\n"
+
+    def reset(self) -> None:
+        """Zero every metric (collectors are kept)."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            metric.clear()
+
+
+REGISTRY = Registry()
+
+
+def metrics_authorized(authorization: Optional[str]) -> bool:
+    """
+    Whether an Authorization header may read /metrics.
+
+    A configured METRICS_BEARER_TOKEN must be sent; without one, /metrics is
+    closed unless METRICS_PUBLIC opts in to serving it openly.
+    """
+    if not METRICS_BEARER_TOKEN:
+        return METRICS_PUBLIC
+    return hmac.compare_digest(authorization or "", f"Bearer {METRICS_BEARER_TOKEN}")
+
+
+def render_metrics() -> str:
+    """The /metrics response body."""
+    return REGISTRY.render()
+
+
+def register_collector(collector: Callable[[], Iterable[MetricFamily]]) -> None:
+    """Add a function returning MetricFamily tuples, called on every scrape."""
+    REGISTRY.register_collector(collector)
+
+
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    "centef_http_requests_total", "HTTP requests by route template and status", ("method", "route", "status")
+))
+HTTP_LATENCY = REGISTRY.register(Histogram(
+    "centef_http_request_duration_seconds",
+    "HTTP request latency until the response body is complete", ("method", "route")
+))
+HTTP_IN_PROGRESS = REGISTRY.register(Gauge("centef_http_requests_in_progress", "HTTP requests being served"))
+
+GCS_REQUESTS = REGISTRY.register(Counter(
+    "centef_gcs_requests_total", "GCS object requests by operation and outcome", ("operation", "status")
+))
+GCS_BYTES = REGISTRY.register(Counter(
+    "centef_gcs_bytes_total", "Bytes downloaded from and uploaded to GCS", ("direction",)
+))
+GCS_LATENCY = REGISTRY.register(Histogram(
+    "centef_gcs_request_duration_seconds", "GCS object request latency", ("operation",)
+))
+
+VERTEX_SEARCH_REQUESTS = REGISTRY.register(Counter(
+    "centef_vertex_search_requests_total", "Vertex AI Search calls (including hedges) by outcome", ("operation", "status")
+))
+VERTEX_SEARCH_LATENCY = REGISTRY.register(Histogram(
+    "centef_vertex_search_duration_seconds", "Vertex AI Search latency seen by the caller", ("operation",)
+))
+
+LLM_REQUESTS = REGISTRY.register(Counter(
+    "centef_llm_requests_total", "LLM calls by provider, model and outcome", ("provider", "model", "status")
+))
+LLM_TOKENS = REGISTRY.register(Counter(
+    "centef_llm_tokens_total", "LLM tokens by model and direction", ("model", "direction")
+))
+LLM_LATENCY = REGISTRY.register(Histogram(
+    "centef_llm_request_duration_seconds", "LLM call latency", ("model",)
+))
+LLM_ANSWERS = REGISTRY.register(Counter(
+    "centef_llm_answers_total",
+    "Answers by the model that produced them (fallback=true: not the primary model; model=none: all failed)",
+    ("model", "fallback")
+))
+
+RAG_STAGE_LATENCY = REGISTRY.register(Histogram(
+    "centef_rag_stage_duration_seconds", "Chat pipeline stage latency", ("stage",)
+))
+RAG_STAGE_CACHE_HITS = REGISTRY.register(Counter(
+    "centef_rag_stage_cache_hits_total", "Chat pipeline stages served from their stage cache", ("stage",)
+))
+
+
+def observe_http_request(method: str, route: str, status: int, duration_s: float) -> None:
+    if TELEMETRY_ENABLED:
+        HTTP_REQUESTS.labels(method, route, status).inc()
+        HTTP_LATENCY.labels(method, route).observe(duration_s)
+
+
+def observe_vertex_search(operation: str, status: str, attempts: int, duration_s: float) -> None:
+    if TELEMETRY_ENABLED:
+        VERTEX_SEARCH_REQUESTS.labels(operation, status).inc(attempts)
+        VERTEX_SEARCH_LATENCY.labels(operation).observe(duration_s)
+
+
+def observe_llm_call(
+    provider: str,
+    model: str,
+    status: str,
+    input_tokens: Optional[int],
+    output_tokens: Optional[int],
+    duration_s: Optional[float]
+) -> None:
+    if not TELEMETRY_ENABLED:
+        return
+    LLM_REQUESTS.labels(provider, model, status).inc()
+    if input_tokens:
+        LLM_TOKENS.labels(model, "input").inc(input_tokens)
+    if output_tokens:
+        LLM_TOKENS.labels(model, "output").inc(output_tokens)
+    if duration_s is not None:
+        LLM_LATENCY.labels(model).observe(duration_s)
+
+
+def observe_answer_model(model: Optional[str], primary_model: str) -> None:
+    """Count an answer by the model that produced it (None: every model failed)."""
+    if TELEMETRY_ENABLED:
+        LLM_ANSWERS.labels(model or "none", "true" if model != primary_model else "false").inc()
+
+
+def observe_stage(stage: str, duration_s: float, cached: bool) -> None:
+    if TELEMETRY_ENABLED:
+        RAG_STAGE_LATENCY.labels(stage).observe(duration_s)
+        if cached:
+            RAG_STAGE_CACHE_HITS.labels(stage).inc()
+
+
+class PrometheusMiddleware:
+    """
+    ASGI middleware counting requests and timing them until the last body chunk
+    is sent (so streamed responses are timed to completion). Routes are labelled
+    by their template (e.g. /chat/history/{session_id}); unmatched paths share
+    one label.
+    """
+
+    def __init__(self, app, skip_paths: Sequence[str] = ("/metrics",)):
+        self.app = app
+        self.skip_paths = frozenset(skip_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not TELEMETRY_ENABLED or scope.get("path") in self.skip_paths:
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = [500]
+        recorded = [False]
+        HTTP_IN_PROGRESS.labels().inc()
+
+        def record():
+            if recorded[0]:
+                return
+            recorded[0] = True
+            HTTP_IN_PROGRESS.labels().inc(-1)
+            route = scope.get("route")
+            observe_http_request(
+                scope.get("method", ""), getattr(route, "path", "unmatched"), status[0], time.perf_counter() - start
+            )
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                record()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            record()
+
+
+_gcs_instrumented = False
+
+
+def _gcs_status(error: BaseException) -> str:
+    return "not_found" if getattr(error, "code", None) == 404 else "error"
+
+
+def _instrument(cls, method_name: str, operation: str, count_bytes: Optional[Callable] = None) -> None:
+    original = getattr(cls, method_name)
+
+    @functools.wraps(original)
+    def wrapper(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = original(self, *args, **kwargs)
+        except Exception as e:
+            GCS_REQUESTS.labels(operation, _gcs_status(e)).inc()
+            GCS_LATENCY.labels(operation).observe(time.perf_counter() - start)
+            raise
+        GCS_REQUESTS.labels(operation, "ok").inc()
+        GCS_LATENCY.labels(operation).observe(time.perf_counter() - start)
+        if count_bytes is not None:
+            size = count_bytes(self, result, args, kwargs)
+            if size:
+                GCS_BYTES.labels("download" if operation == "download" else "upload").inc(size)
+        return result
+
+    wrapper._centef_instrumented = True
+    setattr(cls, method_name, wrapper)
+
+
+def instrument_gcs() -> bool:
+    """
+    Count GCS object requests, errors and bytes for every storage client in the
+    process by wrapping the google-cloud-storage Blob methods the other
+    download/upload helpers are built on (download_as_text -> download_as_bytes,
+    upload_from_string -> upload_from_file, get_blob -> reload). Idempotent.
+
+    Returns:
+        Whether instrumentation is active
+    """
+    global _gcs_instrumented
+    if _gcs_instrumented or not TELEMETRY_ENABLED:
+        return _gcs_instrumented
+    try:
+        from google.cloud.storage import Blob
+    except ImportError:
+        logger.info("google-cloud-storage not installed; GCS metrics disabled")
+        return False
+
+    def upload_size(blob, result, args, kwargs):
+        return kwargs.get("size") if "size" in kwargs else (args[2] if len(args) > 2 else None)
+
+    _instrument(Blob, "download_as_bytes", "download", lambda blob, result, args, kwargs: len(result))
+    _instrument(Blob, "download_to_file", "download", lambda blob, result, args, kwargs: blob.size)
+    _instrument(Blob, "upload_from_file", "upload", upload_size)
+    _instrument(Blob, "reload", "metadata")
+    _instrument(Blob, "delete", "delete")
+    _gcs_instrumented = True
+    return True
+
+
+def _collect_executors() -> List[MetricFamily]:
+    stats = executor_stats()
+    families = []
+    for name, key, kind, documentation in (
+        ("centef_executor_queued", "queued", "gauge", "Calls waiting for a worker, by executor stage"),
+        ("centef_executor_running", "running", "gauge", "Calls running, by executor stage"),
+        ("centef_executor_workers", "workers", "gauge", "Pool size, by executor stage"),
+        ("centef_executor_completed_total", "completed", "counter", "Calls completed, by executor stage"),
+        ("centef_executor_failed_total", "failed", "counter", "Calls that raised, by executor stage"),
+    ):
+        families.append((name, kind, documentation, [({"stage": stage}, s[key]) for stage, s in stats.items()]))
+    return families
+
+
+register_collector(_collect_executors)
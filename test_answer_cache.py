@@ -0,0 +1,137 @@
+"""
+Test the synthesis answer cache (keys, TTL, source invalidation, cache hits in the synthesizer).
+Runs offline: the Gemini model, manifest versions and LLM tracker are replaced by fakes.
+"""
+import sys
+from pathlib import Path
+
+# Add app directories to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import shared.manifest
+from apps.agent_api import answer_cache, synthesizer, synthesizer_optimized
+from apps.agent_api.answer_cache import AnswerCache, answer_cache_key, invalidate_source, reset_answer_cache
+from apps.agent_api.model_health import reset_breakers
+from apps.agent_api.synthesizer_optimized import stream_answer_optimized, synthesize_answer_optimized
+from shared.chat_history import ChatMessage, MessageRole
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class _Usage:
+    prompt_token_count = 900
+    candidates_token_count = 150
+    total_token_count = 1050
+
+
+class _Response:
+    text = "Owners must be disclosed [Document 1]."
+    usage_metadata = _Usage()
+
+
+class _FakeModel:
+    calls = 0
+
+    def __init__(self, name):
+        self.name = name
+
+    def generate_content(self, prompt, generation_config=None, stream=False):
+        _FakeModel.calls += 1
+        return iter([_Response()]) if stream else _Response()
+
+
+SUMMARIES = [{"id": "fatf_summary", "source_id": "fatf", "title": "FATF Guidance", "filename": "fatf.pdf",
+              "summary_text": "Beneficial ownership guidance."}]
+CHUNKS = [{"id": "fatf_chunk_4", "source_id": "fatf", "title": "FATF Guidance", "filename": "fatf.pdf",
+           "page": 4, "content": "Owners must be disclosed."}]
+
+
+def _key(query="Who must disclose owners?", chunks=CHUNKS, history=None):
+    return answer_cache_key(query, SUMMARIES, chunks, "general_answer", 0.2, 2048, history)
+
+
+def test_key():
+    """Query wording is normalized; evidence order, format and history change the key"""
+    assert _key() == _key("  who must DISCLOSE owners ")
+    reordered = [dict(CHUNKS[0], id="other")] + CHUNKS
+    assert _key(chunks=reordered) != _key(chunks=list(reversed(reordered)))
+    assert answer_cache_key("q", SUMMARIES, CHUNKS, "table", 0.2, 2048) != answer_cache_key("q", SUMMARIES, CHUNKS, "list", 0.2, 2048)
+    history = [ChatMessage(message_id="m1", session_id="s1", user_id="u1", role=MessageRole.USER,
+                           content="Tell me about trusts", timestamp="2024-01-01T00:00:00")]
+    assert _key(history=history) != _key()
+    print("✓ cache key covers query, evidence, format and history")
+
+
+def test_ttl_and_invalidation():
+    """Entries expire, and a re-indexed or deleted source drops them"""
+    clock = _Clock()
+    versions = {"fatf": "2024-01-01"}
+    cache = AnswerCache(ttl_s=100, revalidate_s=10, clock=clock,
+                        version_lookup=lambda ids: {i: versions.get(i) for i in ids})
+    result = {"answer": "a", "input_tokens": 900, "output_tokens": 150}
+
+    assert cache.put("k", result, ["fatf"])
+    assert cache.get("k")["answer"] == "a"
+    clock.now += 101
+    assert cache.get("k") is None
+
+    cache.put("k", result, ["fatf"])
+    versions["fatf"] = "2024-02-01"  # Re-indexed by the ingestion service
+    assert cache.get("k") is not None  # Within the revalidation window
+    clock.now += 11
+    assert cache.get("k") is None
+
+    cache.put("k", result, ["fatf"])
+    assert cache.invalidate_source("fatf") == 1 and cache.get("k") is None
+
+    del versions["fatf"]  # Deleted
+    assert not cache.put("k", result, ["fatf"])
+
+    stats = cache.stats()
+    assert stats["hits"] == 2 and stats["saved_input_tokens"] == 1800 and stats["invalidations"] == 3
+    print(f"✓ TTL and invalidation: {stats}")
+
+
+def test_synthesizer_serves_hits():
+    """A repeated question skips generation, logs the saved tokens, and is dropped on invalidation"""
+    _FakeModel.calls = 0
+    synthesizer_optimized.GenerativeModel = _FakeModel
+    synthesizer.GenerativeModel = _FakeModel
+    shared.manifest.get_manifest_entries_by_ids = lambda source_ids: {}
+    synthesizer.generate_follow_up_questions = lambda query, answer, num_questions=3: ["What about trusts?"]
+    reset_breakers()
+    reset_answer_cache(version_lookup=lambda source_ids: {source_id: "v1" for source_id in source_ids})
+    logged = []
+    answer_cache.get_tracker = lambda: type("_Tracker", (), {"log_call": lambda self, **kw: logged.append(kw)})()
+
+    first = synthesize_answer_optimized("Who must disclose owners?", SUMMARIES, CHUNKS)
+    second = synthesize_answer_optimized("who must disclose owners", SUMMARIES, CHUNKS)
+    assert _FakeModel.calls == 1
+    assert second["answer"] == first["answer"] and second["sources"] == first["sources"]
+    assert second["follow_up_questions"] == ["What about trusts?"]
+    assert first["optimizations_applied"]["answer_cache"] == "miss"
+    assert second["optimizations_applied"]["answer_cache"] == "hit"
+    assert logged[0]["additional_params"]["saved_input_tokens"] == 900
+
+    events = list(stream_answer_optimized("Who must disclose owners?", SUMMARIES, CHUNKS, include_follow_ups=False))
+    assert [name for name, _ in events] == ["sources", "token", "citations", "result"]
+    assert events[1][1]["text"] == first["answer"] and _FakeModel.calls == 1
+
+    invalidate_source("fatf")
+    synthesize_answer_optimized("Who must disclose owners?", SUMMARIES, CHUNKS)
+    assert _FakeModel.calls == 2
+    print("✓ cache hits served without generation (blocking and streamed)")
+
+
+if __name__ == "__main__":
+    print("Testing answer cache...\n")
+    test_key()
+    test_ttl_and_invalidation()
+    test_synthesizer_serves_hits()
+    print("\n✅ All answer cache tests passed")
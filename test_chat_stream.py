@@ -0,0 +1,255 @@
+"""
+Test the streamed answer pipeline behind /chat/stream (event order, fallback,
+time-to-first-token and persistence after streaming).
+Runs offline: the Gemini model, manifest lookups and follow-up generation are replaced by fakes.
+"""
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+# Add app directories to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import shared.manifest
+from apps.agent_api import follow_ups, main, synthesizer, synthesizer_optimized
+from apps.agent_api.answer_cache import get_answer_cache, reset_answer_cache
+from apps.agent_api.model_health import reset_breakers
+from apps.agent_api.synthesizer_optimized import stream_answer_optimized, synthesize_answer_optimized
+
+# Attributes the tests replace, restored for test files run later in the same process
+_ORIGINALS = [(target, name, getattr(target, name)) for target, name in (
+    (shared.manifest, "get_manifest_entries_by_ids"),
+    (synthesizer, "generate_follow_up_questions"),
+    (synthesizer, "GenerativeModel"),
+    (synthesizer_optimized, "GenerativeModel"),
+    (main, "_retrieve_for_chat"),
+    (main, "_chat_history"),
+    (main, "_save_assistant_turn"),
+    (follow_ups, "update_message_follow_ups"),
+)]
+
+
+def teardown_module(module):
+    for target, name, value in _ORIGINALS:
+        setattr(target, name, value)
+
+
+class _Response:
+    def __init__(self, text, usage=None):
+        self._text = text
+        if usage:
+            self.usage_metadata = usage
+
+    @property
+    def text(self):
+        if self._text is None:
+            raise ValueError("no text in this chunk")
+        return self._text
+
+
+class _Usage:
+    prompt_token_count = 120
+    candidates_token_count = 12
+    total_token_count = 132
+
+
+class _FakeModel:
+    """Streams the answer in pieces; names in `failing` raise before the first piece."""
+    failing = set()
+    calls = []
+    streams = []
+
+    def __init__(self, name):
+        self.name = name
+
+    def generate_content(self, prompt, generation_config=None, stream=False):
+        _FakeModel.calls.append((self.name, stream))
+        if self.name in _FakeModel.failing:
+            raise RuntimeError("429 Resource exhausted")
+        pieces = ["Owners must be ", "disclosed [Document 1]", "."]
+        if not stream:
+            return _Response("".join(pieces), _Usage())
+        return self._stream([_Response(p) for p in pieces] + [_Response(None, _Usage())])
+
+    @staticmethod
+    def _stream(responses):
+        finished = False
+        try:
+            yield from responses
+            finished = True
+        finally:
+            _FakeModel.streams.append("finished" if finished else "closed")
+
+
+def _install_fakes():
+    _FakeModel.failing = set()
+    _FakeModel.calls = []
+    _FakeModel.streams = []
+    synthesizer_optimized.GenerativeModel = _FakeModel
+    synthesizer.GenerativeModel = _FakeModel
+    reset_breakers()
+    reset_answer_cache(version_lookup=lambda source_ids: {source_id: "v1" for source_id in source_ids})
+    shared.manifest.get_manifest_entries_by_ids = lambda source_ids: {}
+    synthesizer.generate_follow_up_questions = lambda query, answer, num_questions=3: ["What about trusts?"]
+
+
+SUMMARIES = [{"source_id": "fatf", "title": "FATF Guidance", "filename": "fatf.pdf",
+              "summary_text": "Beneficial ownership guidance."}]
+CHUNKS = [{"source_id": "fatf", "title": "FATF Guidance", "filename": "fatf.pdf", "page": 4,
+           "content": "Owners must be disclosed."}]
+
+
+async def _retrieve(request, context):
+    return {"summaries": SUMMARIES, "chunks": CHUNKS}
+
+
+def test_event_order_and_result():
+    """Sources come before tokens; each source is announced when first cited; citations, follow-ups and the result come after"""
+    _install_fakes()
+    events = list(stream_answer_optimized("Who must disclose owners?", SUMMARIES, CHUNKS))
+    names = [name for name, _ in events]
+
+    assert names[0] == "sources"
+    assert names[1:5] == ["token", "citation", "token", "token"]
+    assert names[5:] == ["citations", "follow_ups", "result"]
+    # Tokens arrive with citations already resolved and numbered
+    assert "".join(data["text"] for name, data in events if name == "token") == "Owners must be disclosed [1]."
+    assert events[2][1]["number"] == 1 and events[2][1]["source"]["source_id"] == "fatf"
+
+    result = events[-1][1]
+    assert result["model_used"] == _FakeModel.calls[0][0]
+    assert _FakeModel.calls[0][1] is True
+    assert result["follow_up_questions"] == ["What about trusts?"]
+    assert result["input_tokens"] == 120 and result["total_tokens"] == 132
+    assert result["time_to_first_token_ms"] <= result["generation_ms"]
+    assert events[5][1]["answer"] == result["answer"]
+    json.dumps([data for _, data in events])
+    print(f"✓ {len(events)} events, first token after {result['time_to_first_token_ms']}ms")
+
+
+def test_matches_non_streaming_answer():
+    """The streamed result carries the same answer and citations as synthesize_answer_optimized"""
+    _install_fakes()
+    streamed = list(stream_answer_optimized("Who must disclose owners?", SUMMARIES, CHUNKS))[-1][1]
+    get_answer_cache().clear()
+    blocking = synthesize_answer_optimized("Who must disclose owners?", SUMMARIES, CHUNKS)
+
+    assert streamed["answer"] == blocking["answer"]
+    assert streamed["explicit_citations"] == blocking["explicit_citations"]
+    assert streamed["sources"] == blocking["sources"]
+    print("✓ streamed and blocking answers match")
+
+
+def test_fallback_before_first_token():
+    """A model failing before any text falls through to the next fallback model"""
+    _install_fakes()
+    first = synthesizer_optimized.FALLBACK_MODELS[0]
+    _FakeModel.failing = {first}
+    result = list(stream_answer_optimized("Who must disclose owners?", SUMMARIES, CHUNKS))[-1][1]
+
+    assert result["model_used"] == synthesizer_optimized.FALLBACK_MODELS[1]
+    assert "disclosed" in result["answer"]
+
+    _FakeModel.failing = set(synthesizer_optimized.FALLBACK_MODELS)
+    get_answer_cache().clear()
+    events = list(stream_answer_optimized("Who must disclose owners?", SUMMARIES, CHUNKS, include_follow_ups=False))
+    assert [name for name, _ in events] == ["sources", "token", "citations", "result"]
+    assert events[-1][1]["model_used"] == "fallback-none"
+    print("✓ fallback models and unavailable answer")
+
+
+def test_chat_event_stream_persists_after_streaming():
+    """The SSE body saves the assistant message only after follow-ups, then sends done"""
+    _install_fakes()
+    from apps.agent_api.main import ChatRequest
+
+    order = []
+    main._retrieve_for_chat = _retrieve
+    main._chat_history = lambda user_id, session_id, user_message_id: []
+
+    def save(request, user, session_id, result, follow_up_mode, message_id=None):
+        order.append("saved")
+        return message_id
+    main._save_assistant_turn = save
+
+    class _User:
+        user_id = "u1"
+
+    body = []
+
+    async def collect():
+        async for message in main._chat_event_stream(ChatRequest(query="Who must disclose owners?"), _User(), "s1", "m0", "inline"):
+            event = message.split("\n", 1)[0][len("event: "):]
+            order.append(event)
+            body.append((event, json.loads(message.split("data: ", 1)[1])))
+
+    asyncio.run(collect())
+
+    assert order[0] == "retrieval" and order[1] == "sources"
+    assert order[-3:] == ["follow_ups", "saved", "done"]
+    done = body[-1][1]
+    assert done["session_id"] == "s1" and done["message_id"]
+    assert done["timings_ms"]["time_to_first_token"] >= done["timings_ms"]["retrieval"]
+    print(f"✓ SSE events: {', '.join(dict.fromkeys(order))}")
+
+
+def test_async_follow_ups_arrive_after_done():
+    """In async mode the answer is saved and done is sent before follow-ups are generated"""
+    _install_fakes()
+    from apps.agent_api.main import ChatRequest
+
+    order = []
+    main._retrieve_for_chat = _retrieve
+    main._chat_history = lambda user_id, session_id, user_message_id: []
+    main._save_assistant_turn = lambda *args, **kwargs: order.append("saved")
+    follow_ups.update_message_follow_ups = lambda *args: order.append("stored") or True
+
+    class _User:
+        user_id = "u1"
+
+    async def collect():
+        async for message in main._chat_event_stream(ChatRequest(query="Who must disclose owners?"), _User(), "s1", "m0", "async"):
+            order.append(message.split("\n", 1)[0][len("event: "):])
+
+    asyncio.run(collect())
+    assert order.index("saved") < order.index("done") < order.index("follow_ups")
+    assert order.count("follow_ups") == 1 and "stored" in order
+    print("✓ async follow-ups streamed after done")
+
+
+def test_disconnect_closes_model_stream():
+    """A client that goes away mid-answer closes the model stream right away and nothing is saved"""
+    _install_fakes()
+    from apps.agent_api.main import ChatRequest
+
+    saved = []
+    main._retrieve_for_chat = _retrieve
+    main._chat_history = lambda user_id, session_id, user_message_id: []
+    main._save_assistant_turn = lambda *args, **kwargs: saved.append(args)
+
+    class _User:
+        user_id = "u1"
+
+    async def disconnect_after_first_token():
+        stream = main._chat_event_stream(ChatRequest(query="Who must disclose owners?"), _User(), "s1", "m0", "off")
+        async for message in stream:
+            if message.startswith("event: token"):
+                break
+        await stream.aclose()
+        return list(_FakeModel.streams)
+
+    assert asyncio.run(disconnect_after_first_token()) == ["closed"]
+    assert not saved
+    print("✓ disconnect closed the model stream")
+
+
+if __name__ == "__main__":
+    print("Testing streamed chat answers...\n")
+    test_event_order_and_result()
+    test_matches_non_streaming_answer()
+    test_fallback_before_first_token()
+    test_chat_event_stream_persists_after_streaming()
+    test_async_follow_ups_arrive_after_done()
+    test_disconnect_closes_model_stream()
+    print("\n✅ All streaming tests passed")
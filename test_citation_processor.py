@@ -0,0 +1,81 @@
+"""
+Test single-pass citation processing (whole answers and streamed text).
+Runs offline: pure string processing.
+"""
+import sys
+from pathlib import Path
+
+# Add app directories to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from apps.agent_api.citation_processor import CitationProcessor, process_citations
+
+SOURCES = [
+    {"source_id": "fatf_bo", "title": "FATF Beneficial Ownership Guidance"},
+    {"source_id": "egmont_tf", "title": "Egmont Terrorist Financing Indicators"},
+    {"source_id": "un_1373", "title": "UNSC Resolution 1373"},
+]
+DOCUMENT_LABELS = {"1": "FATF Beneficial Ownership Guidance", "2": "UNSC Resolution 1373"}
+CHUNK_LABELS = {"1": "Egmont Terrorist Financing Indicators"}
+
+ANSWER = (
+    "Owners must be disclosed [Document 1, Page 4]. Red flags include structuring "
+    "[chunk 1]. States must criminalize financing [Document 2] and keep registers "
+    "[FATF Beneficial Ownership Guidance, Page 9]. Again [Document 1, Page 4]. "
+    "Unmatched [Some Other Report]; an array [] and a [Document 7] label stay as written."
+)
+
+
+def test_process_whole_answer():
+    """Labels resolve, sources are numbered by first citation, repeats reuse their number"""
+    result = process_citations(ANSWER, SOURCES, DOCUMENT_LABELS, CHUNK_LABELS)
+
+    assert result["processed_answer"] == (
+        "Owners must be disclosed [1]. Red flags include structuring "
+        "[2]. States must criminalize financing [3] and keep registers "
+        "[1]. Again [1]. "
+        "Unmatched [Some Other Report]; an array [] and a [Document 7] label stay as written."
+    )
+    assert [s["source_id"] for s in result["sources"]] == ["fatf_bo", "egmont_tf", "un_1373"]
+    assert result["citation_map"] == {
+        "FATF Beneficial Ownership Guidance, Page 4": 1,
+        "Egmont Terrorist Financing Indicators": 2,
+        "UNSC Resolution 1373": 3,
+        "FATF Beneficial Ownership Guidance, Page 9": 1,
+    }
+    print("✓ one pass resolves, matches and numbers citations")
+
+
+def test_streamed_matches_whole_answer():
+    """Feeding the answer in small pieces gives the same text and sources as one call"""
+    whole = process_citations(ANSWER, SOURCES, DOCUMENT_LABELS, CHUNK_LABELS)
+    for size in (1, 3, 7, 16):
+        processor = CitationProcessor(SOURCES, DOCUMENT_LABELS, CHUNK_LABELS)
+        emitted = [processor.feed(ANSWER[i:i + size]) for i in range(0, len(ANSWER), size)]
+        emitted.append(processor.finish())
+        assert "".join(emitted) == whole["processed_answer"]
+        assert processor.result()["sources"] == whole["sources"]
+        # No placeholder ever leaks out half-resolved
+        assert not any("Document 1" in piece for piece in emitted)
+    print("✓ streamed processing matches the whole-answer result")
+
+
+def test_open_bracket_held_then_released():
+    """An unclosed "[" is held back, but quoted text that never closes is released"""
+    processor = CitationProcessor(SOURCES, DOCUMENT_LABELS, CHUNK_LABELS)
+    assert processor.feed("See [Docu") == "See "
+    assert processor.feed("ment 2]") == "[1]"
+
+    long_quote = "[" + "x" * 250
+    assert processor.feed(long_quote) == long_quote
+    assert processor.feed("] done [unclosed") == "] done "
+    assert processor.finish() == "[unclosed"
+    print("✓ open citations held back, long brackets released")
+
+
+if __name__ == "__main__":
+    print("Testing citation processor...\n")
+    test_process_whole_answer()
+    test_streamed_matches_whole_answer()
+    test_open_bracket_held_then_released()
+    print("\n✅ All citation processor tests passed")
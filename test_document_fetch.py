@@ -0,0 +1,134 @@
+"""
+Test direct per-source chunk fetch (page/time ranges and the generation-keyed cache).
+Runs offline against local JSONL files.
+"""
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Add app directories to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from google.api_core import exceptions as core_exceptions
+
+from shared.manifest import ManifestEntry
+from shared.schemas import Chunk, ChunkMetadata, ChunkAnchor, Summary, write_chunks_to_jsonl, write_summary_to_jsonl
+from apps.agent_api import document_fetch
+from apps.agent_api.document_fetch import fetch_source_chunks, fetch_source_summary, clear_document_cache
+
+
+def _chunks(source_id, anchors):
+    metadata = lambda i: ChunkMetadata(id=f"{source_id}_{i}", source_id=source_id, filename=f"{source_id}.pdf",
+                                       title="Doc", mimetype="application/pdf")
+    return [Chunk(metadata=metadata(i), anchor=anchor, content=f"part {i}", chunk_index=i)
+            for i, anchor in enumerate(anchors)]
+
+
+def _entry(tmp, source_id):
+    return ManifestEntry(source_id=source_id, filename=f"{source_id}.pdf", title="Doc", mimetype="application/pdf",
+                         source_uri="", data_path=str(Path(tmp, f"{source_id}.jsonl")),
+                         summary_path=str(Path(tmp, f"{source_id}_summary.jsonl")))
+
+
+def test_page_and_time_ranges():
+    """Chunks come back in document order and can be limited to pages or a time window"""
+    clear_document_cache()
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf = _entry(tmp, "pdf")
+        # Written out of order on purpose
+        write_chunks_to_jsonl(_chunks("pdf", [ChunkAnchor(page=p) for p in (3, 1, 2, 5, 4)]), pdf.data_path)
+        write_summary_to_jsonl(Summary(source_id="pdf", filename="pdf.pdf", title="Doc", summary_text="About pdf"),
+                               pdf.summary_path)
+
+        chunks = fetch_source_chunks("pdf", entry=pdf)
+        assert [c["page"] for c in chunks] == [1, 2, 3, 4, 5]
+        assert [c["page"] for c in fetch_source_chunks("pdf", page_start=2, page_end=4, entry=pdf)] == [2, 3, 4]
+        assert [c["page"] for c in fetch_source_chunks("pdf", page_start=5, entry=pdf)] == [5]
+        assert fetch_source_summary("pdf", entry=pdf)["summary_text"] == "About pdf"
+
+        video = _entry(tmp, "video")
+        write_chunks_to_jsonl(_chunks("video", [ChunkAnchor(start_sec=s, end_sec=s + 30) for s in (0, 30, 60, 90)]),
+                              video.data_path)
+        window = fetch_source_chunks("video", start_sec=45, end_sec=70, entry=video)
+        assert [c["start_sec"] for c in window] == [30, 60]
+
+        missing = _entry(tmp, "missing")
+        assert fetch_source_chunks("missing", entry=missing) == []
+        assert fetch_source_summary("missing", entry=missing) is None
+    print("✓ page and time ranges")
+
+
+def test_cache_follows_generation():
+    """Cached files are reused until the file's generation changes"""
+    clear_document_cache()
+    original = document_fetch.DOCUMENT_CACHE_REVALIDATE_S
+    with tempfile.TemporaryDirectory() as tmp:
+        entry = _entry(tmp, "doc")
+        write_chunks_to_jsonl(_chunks("doc", [ChunkAnchor(page=1)]), entry.data_path)
+        first = document_fetch.load_document_file(entry.data_path)
+        assert document_fetch.load_document_file(entry.data_path) is first
+
+        write_chunks_to_jsonl(_chunks("doc", [ChunkAnchor(page=1), ChunkAnchor(page=2)]), entry.data_path)
+        os.utime(entry.data_path, ns=(time.time_ns(), time.time_ns() + 10**9))
+        # Within the revalidation window the cached copy is served without a stat
+        assert len(fetch_source_chunks("doc", entry=entry)) == 1
+
+        document_fetch.DOCUMENT_CACHE_REVALIDATE_S = 0
+        try:
+            assert len(fetch_source_chunks("doc", entry=entry)) == 2
+            second = document_fetch.load_document_file(entry.data_path)
+            assert second is not first and document_fetch.load_document_file(entry.data_path) is second
+        finally:
+            document_fetch.DOCUMENT_CACHE_REVALIDATE_S = original
+    print("✓ cache follows generation")
+
+
+class _Blob:
+    def __init__(self, generation, content):
+        self.generation = generation
+        self.content = content
+
+    def download_as_text(self, if_generation_match=None):
+        if self.content is None:
+            raise core_exceptions.PreconditionFailed(f"generation {self.generation} was replaced")
+        return self.content
+
+
+class _RacingBucket:
+    """GCS stand-in whose object is rewritten between the first lookup and its download."""
+
+    def __init__(self, blobs):
+        self.blobs = blobs
+        self.lookups = 0
+
+    def bucket(self, name):
+        return self
+
+    def get_blob(self, blob_path):
+        self.lookups += 1
+        return self.blobs[min(self.lookups, len(self.blobs)) - 1]
+
+
+def test_gcs_read_racing_rewrite():
+    """A download whose pinned generation was replaced is retried at the new generation"""
+    clear_document_cache()
+    racing = _RacingBucket([_Blob(1, None), _Blob(2, '{"id": "new", "source_id": "doc", "page": 1}')])
+    original = document_fetch._get_storage_client
+    document_fetch._get_storage_client = lambda: racing
+    try:
+        document = document_fetch.load_document_file("gs://bucket/data/doc.jsonl")
+    finally:
+        document_fetch._get_storage_client = original
+        clear_document_cache()
+    assert document.generation == 2 and [r["id"] for r in document.records] == ["new"]
+    assert racing.lookups == 2
+    print("✓ GCS read racing a rewrite")
+
+
+if __name__ == "__main__":
+    test_page_and_time_ranges()
+    test_cache_follows_generation()
+    test_gcs_read_racing_rewrite()
+    print("\nAll document fetch tests passed")
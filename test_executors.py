@@ -0,0 +1,156 @@
+"""
+Test the per-stage executors and the event loop lag monitor.
+Runs offline.
+"""
+import asyncio
+import sys
+import threading
+import time
+from pathlib import Path
+
+# Add app directories to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from shared.executors import (
+    EventLoopLagMonitor,
+    StageExecutor,
+    executor_stats,
+    get_stage_executor,
+    iterate_blocking,
+    run_blocking,
+)
+
+
+def test_blocking_calls_leave_loop_free():
+    """While a stage runs a slow blocking call, the loop keeps serving other coroutines"""
+    async def scenario():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        result = await run_blocking("storage", lambda x: time.sleep(0.2) or x * 2, 21)
+        task.cancel()
+        return result, ticks
+
+    result, ticks = asyncio.run(scenario())
+    assert result == 42
+    assert ticks >= 10, ticks
+    print(f"✓ loop ticked {ticks} times during a 200ms blocking call")
+
+
+def test_stage_queues_and_stats():
+    """Each stage has its own pool; queue depth and wait times are recorded"""
+    executor = StageExecutor("test", max_workers=1)
+    release = threading.Event()
+    first = executor.submit(release.wait)
+    second = executor.submit(lambda: "done")
+    time.sleep(0.05)
+    stats = executor.stats()
+    assert stats["running"] == 1 and stats["queued"] == 1
+    release.set()
+    assert second.result(timeout=1) == "done" and first.result(timeout=1)
+
+    failing = executor.submit(lambda: 1 / 0)
+    try:
+        failing.result(timeout=1)
+        assert False, "exception should propagate"
+    except ZeroDivisionError:
+        pass
+    stats = executor.stats()
+    assert stats["completed"] == 3 and stats["failed"] == 1 and stats["max_queued"] >= 1
+    assert stats["queue_wait_ms"]["p99"] >= 40
+    executor.shutdown()
+
+    assert get_stage_executor("auth") is get_stage_executor("auth")
+    assert get_stage_executor("auth") is not get_stage_executor("generation")
+    try:
+        get_stage_executor("nope")
+        assert False, "unknown stage should raise"
+    except ValueError:
+        pass
+    assert "auth" in executor_stats()
+    print("✓ per-stage pools with queue/run stats")
+
+
+def test_iterate_blocking():
+    """A blocking generator is drained from async code item by item"""
+    def numbers():
+        for i in range(3):
+            time.sleep(0.01)
+            yield i
+
+    async def drain():
+        return [item async for item in iterate_blocking("generation", numbers())]
+
+    assert asyncio.run(drain()) == [0, 1, 2]
+    print("✓ blocking iterator drained asynchronously")
+
+
+def test_iterate_blocking_closed_on_disconnect():
+    """A cancelled consumer closes the iterator on the pool, after the next() in flight returns"""
+    release = threading.Event()
+    closed = []
+
+    def answer():
+        try:
+            yield "first"
+            release.wait(timeout=2)
+            yield "second"
+        finally:
+            closed.append((release.is_set(), threading.current_thread().name))
+
+    async def scenario():
+        received = []
+
+        async def consume():
+            async for item in iterate_blocking("generation", answer()):
+                received.append(item)
+
+        task = asyncio.create_task(consume())
+        while not received:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.02)  # The second next() is now blocked on the pool
+        task.cancel()
+        asyncio.get_running_loop().call_later(0.05, release.set)
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        return received
+
+    assert asyncio.run(scenario()) == ["first"]
+    assert len(closed) == 1 and closed[0][0], closed
+    assert closed[0][1].startswith("generation-stage"), closed
+    print("✓ abandoned iterator closed on its pool")
+
+
+def test_loop_lag_monitor_detects_blocking():
+    """A time.sleep on the loop shows up as lag above the threshold"""
+    async def scenario():
+        monitor = EventLoopLagMonitor(interval_ms=10, warn_ms=50)
+        monitor.start()
+        await asyncio.sleep(0.05)
+        time.sleep(0.15)  # Deliberately block the loop
+        await asyncio.sleep(0.05)
+        await monitor.stop()
+        return monitor.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["stalls"] >= 1
+    assert stats["max_lag_ms"] >= 100
+    print(f"✓ loop lag monitor caught a {stats['max_lag_ms']:.0f}ms stall")
+
+
+if __name__ == "__main__":
+    print("Testing executors...\n")
+    test_blocking_calls_leave_loop_free()
+    test_stage_queues_and_stats()
+    test_iterate_blocking()
+    test_iterate_blocking_closed_on_disconnect()
+    test_loop_lag_monitor_detects_blocking()
+    print("\n✅ All executor tests passed")
@@ -0,0 +1,201 @@
+"""
+Test asynchronous follow-up question generation (modes, background jobs, stored status
+and conditional session writes).
+Runs offline: question generation is faked and chat history is stored in the in-memory GCS
+stand-in from benchmarks/fakes.py.
+"""
+import asyncio
+import sys
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# Add app directories to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from shared import chat_history
+from shared.chat_history import (
+    ChatMessage,
+    get_conversation_history,
+    save_message,
+    update_message_feedback,
+    update_message_follow_ups,
+)
+from apps.agent_api import follow_ups, synthesizer
+from apps.agent_api.follow_ups import follow_up_state, get_follow_ups, resolve_follow_up_mode, schedule_follow_ups
+from benchmarks.fakes import FakeBucket, FakeStorageClient
+
+RELEASE = threading.Event()
+_ORIGINALS = [
+    (chat_history, "_get_storage_client"),
+    (synthesizer, "generate_follow_up_questions"),
+    (follow_ups, "FOLLOW_UP_POLL_INTERVAL_S"),
+]
+_SAVED = [(module, name, getattr(module, name)) for module, name in _ORIGINALS]
+
+
+class _RacingBucket(FakeBucket):
+    """Runs a scripted concurrent write right after a session file is looked up."""
+
+    def get_blob(self, path):
+        blob = super().get_blob(path)
+        race = self.client.races.pop(path, None)
+        if race:
+            race()
+        return blob
+
+
+class _RacingStorage(FakeStorageClient):
+    def __init__(self):
+        super().__init__()
+        self.races = {}
+
+    def bucket(self, name):
+        return _RacingBucket(self, name)
+
+
+def teardown_module(module=None):
+    for target, name, value in _SAVED:
+        setattr(target, name, value)
+
+
+def _install_fakes(fail=False):
+    RELEASE.clear()
+    storage = _RacingStorage()
+
+    def generate(query, answer, num_questions=3):
+        RELEASE.wait(timeout=5)
+        if fail:
+            raise RuntimeError("generation crashed")
+        return [f"More about {query}?"]
+
+    chat_history._get_storage_client = lambda: storage
+    synthesizer.generate_follow_up_questions = generate
+    follow_ups.FOLLOW_UP_POLL_INTERVAL_S = 0.01
+    return storage
+
+
+def _message(message_id, role="assistant", status="pending", **kwargs):
+    return ChatMessage(message_id, "s1", "u1", role, "x", follow_ups_status=status if role == "assistant" else None,
+                       **kwargs)
+
+
+def _session_path():
+    return f"{chat_history.CHAT_HISTORY_PATH}/u1/s1.jsonl"
+
+
+def test_resolve_mode():
+    """Request mode wins over the default; unknown modes are rejected"""
+    assert resolve_follow_up_mode("off") == "off"
+    assert resolve_follow_up_mode(None) == follow_ups.CHAT_FOLLOW_UP_MODE
+    try:
+        resolve_follow_up_mode("later")
+        assert False, "invalid mode should raise"
+    except ValueError:
+        pass
+    print("✓ follow-up modes resolved")
+
+
+def test_background_job_and_lookup():
+    """A scheduled job is pending until generation finishes, then ready and stored on the message"""
+    _install_fakes()
+    save_message(_message("m1"))
+
+    async def scenario():
+        job = schedule_follow_ups("u1", "s1", "m1", "trusts", "Answer")
+        pending = await get_follow_ups("u1", "s1", "m1")
+        waited = await get_follow_ups("u1", "s1", "m1", wait_s=0.05)
+        RELEASE.set()
+        ready = await get_follow_ups("u1", "s1", "m1", wait_s=2)
+        return job, pending, waited, ready
+
+    job, pending, waited, ready = asyncio.run(scenario())
+    assert pending["status"] == "pending" and waited["status"] == "pending"
+    assert ready == {"status": "ready", "follow_up_questions": ["More about trusts?"]}
+    assert job.result(timeout=2) == ["More about trusts?"] and follow_ups.drain_follow_ups(2)
+    stored = get_conversation_history("u1", "s1")[0]
+    assert stored.follow_up_questions == ["More about trusts?"] and stored.follow_ups_status == "ready"
+    assert asyncio.run(get_follow_ups("u1", "s1", "missing")) is None
+    print("✓ pending → ready, read back from the saved message")
+
+
+def test_writes_racing_the_next_turn():
+    """Storing follow-ups and appending the next turn retry on a 412 instead of losing either write"""
+    storage = _install_fakes()
+    save_message(_message("m1"))
+
+    # The next turn is appended between the follow-up read and its conditional write
+    storage.races[_session_path()] = lambda: save_message(_message("m2", role="user"))
+    assert update_message_follow_ups("u1", "s1", "m1", ["Q?"])
+    assert [(m.message_id, m.follow_up_questions) for m in get_conversation_history("u1", "s1")] == [
+        ("m1", ["Q?"]), ("m2", None)]
+
+    # Follow-ups are stored between an append's read and its conditional write
+    storage.races[_session_path()] = lambda: update_message_follow_ups("u1", "s1", "m1", ["Q2?"])
+    save_message(_message("m3"))
+    messages = get_conversation_history("u1", "s1")
+    assert [m.message_id for m in messages] == ["m1", "m2", "m3"] and messages[0].follow_up_questions == ["Q2?"]
+    print("✓ concurrent session writes retried")
+
+
+def test_feedback_racing_follow_ups():
+    """Feedback and follow-ups written to the same message at once both survive"""
+    storage = _install_fakes()
+    save_message(_message("m1"))
+
+    # Feedback lands between the follow-up store's read and its conditional write
+    storage.races[_session_path()] = lambda: update_message_feedback("u1", "s1", "m1", "thumbs_up")
+    assert update_message_follow_ups("u1", "s1", "m1", ["Q?"])
+    stored = get_conversation_history("u1", "s1")[0]
+    assert stored.feedback_rating == "thumbs_up" and stored.follow_up_questions == ["Q?"]
+
+    # Follow-ups land between the feedback write's read and its conditional write
+    storage.races[_session_path()] = lambda: update_message_follow_ups("u1", "s1", "m1", ["Q2?"])
+    assert update_message_feedback("u1", "s1", "m1", "thumbs_down", "too vague")
+    stored = get_conversation_history("u1", "s1")[0]
+    assert (stored.feedback_rating, stored.feedback_note) == ("thumbs_down", "too vague")
+    assert stored.follow_up_questions == ["Q2?"] and stored.follow_ups_status == "ready"
+    assert not update_message_feedback("u1", "s1", "missing", "thumbs_up")
+    print("✓ feedback and follow-up writes retried")
+
+
+def test_failed_and_stale_status():
+    """Failed generation is stored as failed; jobs that never stored anything become failed once stale"""
+    _install_fakes(fail=True)
+    save_message(_message("m1"))
+    RELEASE.set()
+    assert schedule_follow_ups("u1", "s1", "m1", "trusts", "Answer").result(timeout=2) == []
+    assert get_conversation_history("u1", "s1")[0].follow_ups_status == "failed"
+    assert asyncio.run(get_follow_ups("u1", "s1", "m1", wait_s=1)) == {"status": "failed", "follow_up_questions": []}
+
+    old = (datetime.utcnow() - timedelta(seconds=follow_ups.FOLLOW_UP_STALE_S + 1)).isoformat()
+    assert follow_up_state(_message("lost", timestamp=old))["status"] == "failed"
+    assert follow_up_state(_message("recent"))["status"] == "pending"
+    print("✓ failed and stale follow-ups")
+
+
+def test_state_of_legacy_messages():
+    """Messages saved without a status fall back to their questions and mode"""
+    legacy = [
+        ChatMessage("a", "s1", "u1", "assistant", "x", follow_up_questions=["Q?"], query_metadata={"follow_ups": "async"}),
+        ChatMessage("b", "s1", "u1", "assistant", "x", query_metadata={"follow_ups": "off"}),
+        ChatMessage("c", "s1", "u1", "assistant", "x", query_metadata={"follow_ups": "async"}),
+        ChatMessage("d", "s1", "u1", "assistant", "x"),
+    ]
+    assert [follow_up_state(m)["status"] for m in legacy] == ["ready", "disabled", "pending", "unavailable"]
+    assert follow_up_state(legacy[0])["follow_up_questions"] == ["Q?"]
+    print("✓ legacy message states")
+
+
+if __name__ == "__main__":
+    print("Testing follow-up questions...\n")
+    try:
+        test_resolve_mode()
+        test_background_job_and_lookup()
+        test_writes_racing_the_next_turn()
+        test_feedback_racing_follow_ups()
+        test_failed_and_stale_status()
+        test_state_of_legacy_messages()
+    finally:
+        teardown_module()
+    print("\n✅ All follow-up tests passed")
@@ -0,0 +1,178 @@
+"""
+Test hedged Vertex AI Search calls and their latency metrics.
+Runs offline: the RPC is replaced with futures that complete after scripted delays.
+"""
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+
+# Add app directories to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from google.api_core import exceptions as core_exceptions
+
+from apps.agent_api import retriever_vertex_search
+from apps.agent_api.performance_metrics import HedgedCallMetrics, get_hedged_call_metrics
+
+
+class _CancellableFuture(Future):
+    """Future whose cancel() works while running, like a grpc call future."""
+
+    def cancel(self):
+        with self._condition:
+            if self._state == "FINISHED":
+                return False
+            self._state = "CANCELLED"
+            self._condition.notify_all()
+        self._invoke_callbacks()
+        return True
+
+
+class _ScriptedRPC:
+    """Stand-in for _start_search: attempt i answers after delays[i] seconds."""
+
+    def __init__(self, delays, errors=None):
+        self.delays = delays
+        self.errors = errors or {}
+        self.futures = []
+
+    def __call__(self, request, timeout):
+        index = len(self.futures)
+        future = _CancellableFuture()
+        self.futures.append(future)
+        future.set_running_or_notify_cancel()
+
+        def complete():
+            if future.done():
+                return
+            if index in self.errors:
+                future.set_exception(self.errors[index])
+            else:
+                future.set_result(f"response-{index}")
+
+        threading.Timer(self.delays[index], complete).start()
+        return future
+
+
+def _run(operation, rpc):
+    original = retriever_vertex_search._start_search, retriever_vertex_search.SEARCH_HEDGE_CONTROL_RATE
+    retriever_vertex_search._start_search = rpc
+    retriever_vertex_search.SEARCH_HEDGE_CONTROL_RATE = 0.0
+    try:
+        return retriever_vertex_search.execute_search(object(), operation)
+    finally:
+        retriever_vertex_search._start_search, retriever_vertex_search.SEARCH_HEDGE_CONTROL_RATE = original
+
+
+def _warm_up(operation, latency_ms, samples=20):
+    metrics = get_hedged_call_metrics(operation)
+    for _ in range(samples):
+        metrics.record(latency_ms=latency_ms, primary_ms=latency_ms, armed=False)
+    return metrics
+
+
+def test_no_hedge_before_warm_up():
+    """Without enough samples the primary is awaited and no hedge is sent"""
+    rpc = _ScriptedRPC([0.05, 0.0])
+    assert _run("test.cold", rpc) == "response-0"
+    assert len(rpc.futures) == 1
+    assert get_hedged_call_metrics("test.cold").summary()["hedges"] == 0
+    print("✓ no hedge before warm-up")
+
+
+def test_hedge_wins_and_loser_cancelled():
+    """A slow primary is hedged after the p95 delay and cancelled when the hedge answers"""
+    metrics = _warm_up("test.slow", latency_ms=20)
+    rpc = _ScriptedRPC([1.0, 0.01])
+    start = time.monotonic()
+    assert _run("test.slow", rpc) == "response-1"
+    elapsed = time.monotonic() - start
+    assert elapsed < 0.5, elapsed
+    assert rpc.futures[0].cancelled()
+
+    summary = metrics.summary()
+    assert summary["hedges"] == 1 and summary["hedge_wins"] == 1
+    assert summary["hedge_rate"] == 1.0
+    assert summary["hedged_latency_ms"]["p50"] < 500
+    assert summary["unhedged_latency_ms"]["p50"] == 20
+    print("✓ hedge wins and loser cancelled")
+
+
+def test_primary_error_and_deadline():
+    """Fast primary errors are raised unhedged; a missed deadline raises DeadlineExceeded"""
+    rpc = _ScriptedRPC([0.0], errors={0: RuntimeError("boom")})
+    try:
+        _run("test.error", rpc)
+        assert False, "expected error"
+    except RuntimeError:
+        pass
+
+    original_timeout = retriever_vertex_search.SEARCH_TIMEOUT_S
+    retriever_vertex_search.SEARCH_TIMEOUT_S = 0.05
+    try:
+        rpc = _ScriptedRPC([5.0])
+        try:
+            _run("test.deadline", rpc)
+            assert False, "expected deadline"
+        except core_exceptions.DeadlineExceeded:
+            pass
+    finally:
+        retriever_vertex_search.SEARCH_TIMEOUT_S = original_timeout
+    assert get_hedged_call_metrics("test.deadline").summary()["timeouts"] == 1
+    print("✓ primary error and deadline")
+
+
+def test_transient_error_retried():
+    """UNAVAILABLE attempts are retried with backoff until SEARCH_RETRY_ATTEMPTS is used up"""
+    original_backoff = retriever_vertex_search.SEARCH_RETRY_BACKOFF_MS
+    retriever_vertex_search.SEARCH_RETRY_BACKOFF_MS = 1
+    try:
+        rpc = _ScriptedRPC([0.0, 0.0], errors={0: core_exceptions.ServiceUnavailable("blip")})
+        assert _run("test.retry", rpc) == "response-1"
+        assert len(rpc.futures) == 2
+        assert get_hedged_call_metrics("test.retry").summary()["hedges"] == 0
+
+        unavailable = core_exceptions.ServiceUnavailable("down")
+        rpc = _ScriptedRPC([0.0] * 4, errors={i: unavailable for i in range(4)})
+        try:
+            _run("test.retry_exhausted", rpc)
+            assert False, "expected error"
+        except core_exceptions.ServiceUnavailable:
+            pass
+        assert len(rpc.futures) == 1 + retriever_vertex_search.SEARCH_RETRY_ATTEMPTS
+    finally:
+        retriever_vertex_search.SEARCH_RETRY_BACKOFF_MS = original_backoff
+    print("✓ transient errors retried")
+
+
+def test_metrics_summary():
+    """Percentiles and hedge delay come from the windowed histograms (values within ~1%)"""
+    now = [0.0]
+    metrics = HedgedCallMetrics("test.summary", clock=lambda: now[0])
+    assert metrics.hedge_delay_ms() is None
+    for latency in range(1, 101):
+        metrics.record(latency_ms=latency, primary_ms=latency, armed=latency % 2 == 0, hedged=latency > 95)
+    assert abs(metrics.hedge_delay_ms(0.95) - 95) <= 1
+    summary = metrics.summary()
+    assert abs(summary["unhedged_latency_ms"]["p50"] - 49) <= 0.5
+    assert summary["hedged_latency_ms"]["p99"] == 100
+    assert summary["hedge_rate"] == 5 / 50
+
+    # The delay is reused until the refresh interval passes, then re-read from the window
+    for _ in range(1000):
+        metrics.record(latency_ms=500, primary_ms=500, armed=True)
+    assert abs(metrics.hedge_delay_ms(0.95) - 95) <= 1
+    now[0] += 2
+    assert abs(metrics.hedge_delay_ms(0.95) - 500) <= 5
+    print("✓ metrics summary")
+
+
+if __name__ == "__main__":
+    test_no_hedge_before_warm_up()
+    test_hedge_wins_and_loser_cancelled()
+    test_primary_error_and_deadline()
+    test_transient_error_retried()
+    test_metrics_summary()
+    print("\nAll hedged search tests passed")
@@ -0,0 +1,197 @@
+"""
+Test hybrid retrieval: concurrent sources, weighted RRF fusion and the latency budget.
+Runs offline with stand-in search functions.
+"""
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# Add app directories to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from apps.agent_api import retriever_optimized
+from apps.agent_api.retriever_optimized import (
+    HybridSearcher,
+    merge_multi_query_results,
+    search_two_tier_optimized,
+    weighted_rrf_fusion,
+)
+from apps.agent_api.optimization_config import get_config
+
+
+def _source(ids, delay=0.0, fail=False):
+    def search(query, max_results=10, filter_expression=None):
+        time.sleep(delay)
+        if fail:
+            raise RuntimeError("backend unavailable")
+        return [{"id": i, "source_id": i.split("_")[0], "content": f"text {i}"} for i in ids[:max_results]]
+    return search
+
+
+def _with_sources(sources, fn):
+    original = HybridSearcher.SOURCES
+    HybridSearcher.SOURCES = sources
+    try:
+        return fn()
+    finally:
+        HybridSearcher.SOURCES = original
+
+
+def test_weighted_rrf():
+    """Weights shift the fused order; unit weights keep multi-query merge behaviour"""
+    a = [{"id": "x"}, {"id": "y"}]
+    b = [{"id": "y"}, {"id": "z"}]
+    fused, found_in = weighted_rrf_fusion([("a", a), ("b", b)], {"a": 1.0, "b": 1.0})
+    assert [r["id"] for r in fused] == ["y", "x", "z"]
+    assert found_in["y"] == ["a", "b"]
+
+    fused, _ = weighted_rrf_fusion([("a", [{"id": "x"}]), ("b", [{"id": "z"}])], {"a": 1.0, "b": 2.0})
+    assert [r["id"] for r in fused] == ["z", "x"]
+
+    assert [r["id"] for r in merge_multi_query_results(["q1", "q2"], [a, b])] == ["y", "x", "z"]
+    print("✓ weighted RRF")
+
+
+def test_budget_and_failures():
+    """Slow sources are dropped at the budget, failing ones are skipped"""
+    sources = {
+        "vertex": (_source(["v_1", "s_1"], delay=0.5), _source(["v"], delay=0.5)),
+        "local": (_source(["s_1", "l_1"]), _source(["s"])),
+        "vector": (_source([], fail=True), _source(["s", "w"])),
+    }
+
+    def run():
+        searcher = HybridSearcher({"vertex": 1.0, "local": 0.7, "vector": 0.7}, budget_ms=100)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(2) as pool:
+            chunks = pool.submit(searcher.search_chunks, "q", max_results=5)
+            summaries = pool.submit(searcher.search_summaries, "q", max_results=5)
+            chunks, summaries = chunks.result(), summaries.result()
+        return searcher, chunks, summaries, time.perf_counter() - start
+
+    searcher, chunks, summaries, elapsed = _with_sources(sources, run)
+    assert elapsed < 0.4, elapsed
+    assert [r["id"] for r in chunks] == ["s_1", "l_1"]
+    assert [r["source_id"] for r in summaries] == ["s", "w"]
+
+    report = searcher.report(chunks, summaries)
+    assert report["sources"]["vertex"]["chunks"]["timeouts"] == 1
+    assert report["sources"]["vector"]["chunks"]["errors"] == 1
+    assert report["sources"]["local"]["chunks"]["ok"] == 1
+    assert report["contribution"]["chunks"] == {"vertex": 0, "local": 2, "vector": 0}
+    assert report["contribution"]["summaries"] == {"vertex": 0, "local": 1, "vector": 2}
+    print("✓ budget and failures")
+
+
+def test_waits_when_nothing_arrived():
+    """With every fast source failing, the slow one is awaited past the budget"""
+    sources = {
+        "vertex": (_source(["v_1"], delay=0.2), _source(["v"], delay=0.2)),
+        "local": (_source([], fail=True), _source([], fail=True)),
+    }
+    searcher = HybridSearcher({"vertex": 1.0, "local": 1.0}, budget_ms=20)
+    chunks = _with_sources(sources, lambda: searcher.search_chunks("q"))
+    assert [r["id"] for r in chunks] == ["v_1"]
+    print("✓ waits when nothing arrived")
+
+
+def test_budget_is_per_request():
+    """Searches made after the request's budget has expired take the first source that answers"""
+    sources = {
+        "vertex": (_source(["v_1"], delay=0.5), _source(["v"], delay=0.5)),
+        "local": (_source(["l_1"]), _source(["l"])),
+    }
+
+    def run():
+        searcher = HybridSearcher({"vertex": 1.0, "local": 1.0}, budget_ms=100)
+        start = time.perf_counter()
+        results = [searcher.search_chunks("q") for _ in range(4)]
+        return results, time.perf_counter() - start
+
+    results, elapsed = _with_sources(sources, run)
+    assert elapsed < 0.3, elapsed  # Not 4 x 100ms
+    assert all([r["id"] for r in chunks] == ["l_1"] for chunks in results)
+    print(f"✓ budget per request ({elapsed * 1000:.0f}ms for 4 searches)")
+
+
+def test_fallback_wait_is_capped():
+    """With every fast source failing, a hung source is awaited only up to the Vertex deadline"""
+    sources = {
+        "vertex": (_source(["v_1"], delay=0.5), _source(["v"], delay=0.5)),
+        "local": (_source([], fail=True), _source([], fail=True)),
+    }
+    original = retriever_optimized.SEARCH_TIMEOUT_S
+    retriever_optimized.SEARCH_TIMEOUT_S = 0.1
+    try:
+        searcher = HybridSearcher({"vertex": 1.0, "local": 1.0}, budget_ms=20)
+        start = time.perf_counter()
+        chunks = _with_sources(sources, lambda: searcher.search_chunks("q"))
+        elapsed = time.perf_counter() - start
+    finally:
+        retriever_optimized.SEARCH_TIMEOUT_S = original
+    assert chunks == [] and elapsed < 0.3, elapsed
+    assert searcher.stats["vertex"]["chunks"]["timeouts"] == 1
+    print("✓ fallback wait capped")
+
+
+def test_slow_vertex_does_not_starve_local():
+    """Abandoned Vertex calls keep their own workers busy, not the local tier's"""
+    sources = {
+        "vertex": (_source(["v_1"], delay=2.0), _source(["v"], delay=2.0)),
+        "local": (_source(["l_1"], delay=0.01), _source(["l"], delay=0.01)),
+    }
+    searchers = [HybridSearcher({"vertex": 1.0, "local": 0.7}, budget_ms=300) for _ in range(24)]
+
+    def one(searcher):
+        start = time.perf_counter()
+        chunks = searcher.search_chunks("q")
+        return chunks, time.perf_counter() - start
+
+    def run():
+        # About four chat turns of three query variations and two tiers each
+        with ThreadPoolExecutor(len(searchers)) as pool:
+            return list(pool.map(one, searchers))
+
+    outcomes = _with_sources(sources, run)
+    slowest = max(elapsed for _, elapsed in outcomes)
+    assert slowest < 1.0, slowest
+    assert all([r["id"] for r in chunks] == ["l_1"] for chunks, _ in outcomes)
+    assert all(s.stats["local"]["chunks"]["ok"] == 1 and s.stats["vertex"]["chunks"]["timeouts"] == 1
+               for s in searchers)
+    print(f"✓ 24 concurrent searches with a 2s Vertex call, slowest {slowest * 1000:.0f}ms")
+
+
+def test_two_tier_metadata():
+    """search_two_tier_optimized reports hybrid latency and contribution"""
+    sources = {
+        "vertex": (_source(["a_1", "b_1"]), _source(["a"])),
+        "local": (_source(["b_1", "c_1"]), _source(["a", "c"])),
+    }
+    config = get_config().retriever
+    original = (config.backend, config.hybrid_weights, config.enable_deduplication)
+    config.backend, config.hybrid_weights = "hybrid", {"vertex": 1.0, "local": 1.0}
+    try:
+        result = _with_sources(sources, lambda: search_two_tier_optimized(
+            "query", max_chunk_results=3, max_summary_results=2,
+            enable_query_expansion=False, enable_reranking=False, use_adaptive_strategy=False
+        ))
+    finally:
+        config.backend, config.hybrid_weights, config.enable_deduplication = original
+    assert result["optimizations_applied"]["search_backend"] == "hybrid"
+    assert [r["id"] for r in result["chunks"]] == ["b_1", "a_1", "c_1"]
+    hybrid = result["hybrid_retrieval"]
+    assert hybrid["contribution"]["chunks"] == {"vertex": 2, "local": 2}
+    assert set(hybrid["sources"]) == {"vertex", "local"}
+    print("✓ two-tier metadata")
+
+
+if __name__ == "__main__":
+    test_weighted_rrf()
+    test_budget_and_failures()
+    test_waits_when_nothing_arrived()
+    test_budget_is_per_request()
+    test_fallback_wait_is_capped()
+    test_slow_vertex_does_not_starve_local()
+    test_two_tier_metadata()
+    print("\nAll hybrid retrieval tests passed")
@@ -0,0 +1,102 @@
+"""
+Test the fixed-memory latency histograms behind /admin/metrics/latency.
+Runs offline: pure in-process metrics.
+"""
+import math
+import random
+import sys
+from pathlib import Path
+
+# Add app directories to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from apps.agent_api.performance_metrics import (
+    LatencyHistogram,
+    MetricsAggregator,
+    RAGPipelineMetrics,
+    WindowedHistogram,
+)
+
+
+def _exact(values, q):
+    ordered = sorted(values)
+    return ordered[max(1, math.ceil(q * len(ordered))) - 1]
+
+
+def test_quantiles_within_one_percent():
+    """p50/p95/p99 from the histogram stay within ~1% of the exact values"""
+    rng = random.Random(7)
+    values = [rng.lognormvariate(5, 1.2) for _ in range(50_000)]
+    histogram = LatencyHistogram()
+    for value in values:
+        histogram.record(value)
+
+    for q in (0.5, 0.95, 0.99):
+        estimate, exact = histogram.quantile(q), _exact(values, q)
+        assert abs(estimate - exact) / exact < 0.011, (q, estimate, exact)
+    assert histogram.count == len(values) and len(histogram.buckets) < 1000
+    assert histogram.summary()["max_ms"] == round(max(values), 2)
+    print(f"✓ quantiles within 1% using {len(histogram.buckets)} buckets for {len(values)} samples")
+
+
+def test_merge_and_extremes():
+    """Merging equals recording everything in one; out-of-range values are clamped"""
+    a, b, both = LatencyHistogram(), LatencyHistogram(), LatencyHistogram()
+    for i in range(1, 1001):
+        (a if i % 2 else b).record(float(i))
+        both.record(float(i))
+    a.merge(b)
+    assert a.buckets == both.buckets and a.summary() == both.summary()
+
+    extremes = LatencyHistogram()
+    extremes.record(0.0)
+    extremes.record(10 ** 9)
+    assert extremes.quantile(0.0) == 0.01 and extremes.summary()["max_ms"] == 3_600_000.0
+    assert LatencyHistogram().quantile(0.5) is None
+    print("✓ merge and range clamping")
+
+
+def test_window_slides():
+    """Samples older than the window stop counting; the lifetime count keeps them"""
+    now = [0.0]
+    histogram = WindowedHistogram(window_s=60, intervals=6, clock=lambda: now[0])
+    for _ in range(100):
+        histogram.record(1000.0)
+    now[0] = 30
+    histogram.record(10.0)
+    assert histogram.snapshot().count == 101
+
+    now[0] = 75  # First samples are now more than one window (plus one interval) old
+    assert histogram.snapshot().count == 1 and histogram.snapshot().quantile(0.99) == 10.0
+    assert histogram.total_count == 101
+    print("✓ sliding window")
+
+
+def test_aggregator_records_stages():
+    """Each pipeline record feeds the request and per-stage histograms"""
+    aggregator = MetricsAggregator(window=10)
+    for i in range(50):
+        aggregator.add_pipeline(RAGPipelineMetrics(
+            query="q", timestamp="t", total_duration_ms=100.0 + i,
+            stage_timings_ms={"retrieve": 40.0 + i, "generate": 50.0}, cached_stages=["expand"] if i % 2 else []
+        ))
+
+    summary = aggregator.latency_summary()
+    assert set(summary["latency"]) == {"pipeline", "stage.retrieve", "stage.generate"}
+    assert summary["latency"]["pipeline"]["count"] == 50  # Histograms are not limited to the record window
+    assert abs(summary["latency"]["stage.retrieve"]["p95_ms"] - 87) < 1
+    assert len(aggregator.pipeline_metrics) == 10
+    assert aggregator.get_summary()["pipeline"]["stages"]["generate"]["p95_ms"] == 50.0
+
+    aggregator.reset()
+    assert aggregator.latency_summary()["latency"] == {}
+    print("✓ aggregator latency summary")
+
+
+if __name__ == "__main__":
+    print("Testing latency histograms...\n")
+    test_quantiles_within_one_percent()
+    test_merge_and_extremes()
+    test_window_slides()
+    test_aggregator_records_stages()
+    print("\n✅ All latency histogram tests passed")
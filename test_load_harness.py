@@ -0,0 +1,78 @@
+"""
+Test the offline load-test harness (benchmarks/load_test.py) and its fake
+GCS, Vertex AI Search and Gemini backends (benchmarks/fakes.py).
+Runs offline: the app is driven in-process against the fakes.
+"""
+import asyncio
+import copy
+import json
+import sys
+from pathlib import Path
+
+# Add app directories to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from benchmarks.fakes import FakeBackends, LatencyModel
+from benchmarks.load_test import compare_reports, parse_mix, percentiles, run_load
+
+
+def test_latency_model_distribution():
+    """Sampled latencies follow the configured median and p99; failures the error rate"""
+    model = LatencyModel.parse("20:100:0.1", seed=7)
+    samples = [model.sample() for _ in range(20000)]
+    latency = percentiles([delay * 1000 for delay, _ in samples])
+    failures = sum(fails for _, fails in samples) / len(samples)
+
+    assert 18 < latency["p50"] < 22
+    assert 85 < latency["p99"] < 115
+    assert 0.09 < failures < 0.11
+    assert LatencyModel.parse("0").sample() == (0.0, False)
+    print(f"✓ p50 {latency['p50']}ms, p99 {latency['p99']}ms, {failures:.1%} failures")
+
+
+def test_load_run_report():
+    """A mixed run drives every endpoint through the real app and reports per endpoint and stage"""
+    backends = FakeBackends(num_sources=12)
+    report = asyncio.run(run_load(backends, requests=24, concurrency=4,
+                                  mix=parse_mix("chat=3,manifest=1,sessions=1,upload=1"), seed=3))
+
+    assert report["summary"]["requests"] == 24 and report["summary"]["errors"] == 0
+    assert set(report["endpoints"]) == {"chat", "manifest", "sessions", "upload"}
+    assert sum(endpoint["requests"] for endpoint in report["endpoints"].values()) == 24
+    assert all(set(endpoint["status_codes"]) == {"200"} for endpoint in report["endpoints"].values())
+    assert report["stages_ms"]["stage.retrieve"]["count"] == report["endpoints"]["chat"]["requests"]
+    assert report["backend_calls"]["vertex_search"]["chunks"] > 0 and report["backend_calls"]["gemini"]
+    assert report["backend_calls"]["background_tasks"].get("process_uploaded_document", 0) == \
+        report["endpoints"]["upload"]["requests"]
+    json.dumps(report)
+
+    # The fakes are removed again after the run
+    from google.cloud import storage
+    assert storage.Client is not backends.storage
+    print(f"✓ {report['summary']['throughput_rps']} req/s across {len(report['endpoints'])} endpoints")
+
+
+def test_injected_failures_and_comparison():
+    """Backend failures surface as errors; comparing reports flags p95 and throughput regressions"""
+    backends = FakeBackends(vertex=LatencyModel(error_rate=1.0), num_sources=12)
+    report = asyncio.run(run_load(backends, requests=6, concurrency=2, mix=parse_mix("chat=1")))
+    assert report["endpoints"]["chat"]["errors"] == 6
+    assert report["endpoints"]["chat"]["status_codes"] == {"500": 6}
+
+    lines, regressions = compare_reports(report, report)
+    assert regressions == [] and lines[1].startswith("chat")
+
+    slower = copy.deepcopy(report)
+    slower["endpoints"]["chat"]["latency_ms"]["p95"] *= 2
+    slower["endpoints"]["chat"]["throughput_rps"] /= 2
+    _, regressions = compare_reports(slower, report, max_regression=0.2)
+    assert len(regressions) == 2
+    print("✓ injected failures counted, regressions flagged")
+
+
+if __name__ == "__main__":
+    print("Testing load-test harness...\n")
+    test_latency_model_distribution()
+    test_load_run_report()
+    test_injected_failures_and_comparison()
+    print("\n✅ All load-test harness tests passed")
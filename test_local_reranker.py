@@ -0,0 +1,168 @@
+"""
+Test the local BM25/proximity reranker and the joint/hybrid rerank modes.
+Runs offline: LLM calls are replaced with recording stand-ins.
+"""
+import sys
+import tempfile
+from pathlib import Path
+
+# Add app directories to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from apps.agent_api.reranker_local import IDFTable, rerank_local, tokenize
+from apps.agent_api import retriever_optimized
+
+
+CANDIDATES = [
+    {"id": "c1", "content": "Annual report on regional trade statistics and tariffs."},
+    {"id": "c2", "content": "Hawala networks move money informally; terrorist financing through hawala is hard to trace."},
+    {"id": "c3", "content": "Terrorist groups rely on several funding channels, including charities."},
+    {"id": "c4", "content": "Financing of infrastructure projects in the region grew last year."},
+]
+
+
+def test_tokenize():
+    """Tokenizer lowercases and drops stopwords"""
+    assert tokenize("What is the Hawala system?") == ["hawala", "system"]
+    assert tokenize("") == []
+    print("✓ tokenize")
+
+
+def test_local_rerank_order():
+    """Documents containing the query terms close together rank first"""
+    results = [dict(c) for c in CANDIDATES]
+    reranked = rerank_local("terrorist financing hawala", results)
+
+    assert reranked[0]["id"] == "c2", [r["id"] for r in reranked]
+    assert reranked[-1]["id"] == "c1"
+    assert all("rerank_score" in r for r in reranked)
+    scores = [r["rerank_score"] for r in reranked]
+    assert scores == sorted(scores, reverse=True)
+
+    top2 = rerank_local("terrorist financing hawala", [dict(c) for c in CANDIDATES], top_k=2)
+    assert len(top2) == 2
+    print(f"✓ local rerank order: {[r['id'] for r in reranked]}")
+
+
+def test_idf_table_roundtrip():
+    """IDF table built from a corpus directory can be saved and reloaded"""
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = Path(tmp, "data")
+        data_dir.mkdir()
+        with open(data_dir / "doc.jsonl", "w", encoding="utf-8") as f:
+            for c in CANDIDATES:
+                f.write('{"content": "%s"}\n' % c["content"])
+
+        table = IDFTable.from_jsonl_dir(tmp)
+        assert table.num_docs == len(CANDIDATES)
+        # Rare terms get a higher weight than common ones
+        assert table.idf["hawala"] > table.idf["financing"]
+
+        path = str(Path(tmp, "idf.json"))
+        table.save(path)
+        loaded = IDFTable.load(path)
+        assert loaded.idf == table.idf
+
+        reranked = rerank_local("hawala", [dict(c) for c in CANDIDATES], idf_table=loaded)
+        assert reranked[0]["id"] == "c2"
+    print("✓ IDF table roundtrip")
+
+
+def test_hybrid_sends_only_ambiguous():
+    """Hybrid mode sends only the results around the top-k cutoff to the LLM, in one call"""
+    calls = []
+
+    def fake_joint_scores(query, chunk_results, summary_results):
+        calls.append(([r["id"] for r in chunk_results], [r["id"] for r in summary_results]))
+        # Prefer later items so the LLM visibly changes the local order
+        n = len(chunk_results)
+        return [i / max(n, 1) for i in range(n)], [0.5] * len(summary_results)
+
+    original = retriever_optimized.score_results_jointly
+    retriever_optimized.score_results_jointly = fake_joint_scores
+    try:
+        # Clear winner: no LLM call needed
+        chunks, _ = retriever_optimized.rerank_two_tier(
+            "hawala", [dict(c) for c in CANDIDATES], [], chunk_top_k=1, mode="hybrid"
+        )
+        assert chunks[0]["id"] == "c2"
+        assert calls == []
+
+        # Two near-identical documents straddle the cutoff: LLM decides between them
+        tied = [
+            {"id": "a", "content": "hawala transfers"},
+            {"id": "b", "content": "hawala transfers"},
+            {"id": "c", "content": "unrelated text"},
+        ]
+        chunks, _ = retriever_optimized.rerank_two_tier("hawala transfers", tied, [], chunk_top_k=1, mode="hybrid")
+        assert calls == [(["a", "b"], [])], calls
+        assert [r["id"] for r in chunks] == ["b"]
+
+        # Local and LLM scores share one 0-1 scale, in rank order
+        chunks, _ = retriever_optimized.rerank_two_tier(
+            "hawala transfers", [dict(r) for r in tied], [], chunk_top_k=2, mode="hybrid"
+        )
+        scores = [r["rerank_score"] for r in chunks]
+        assert [r["id"] for r in chunks] == ["b", "a"]
+        assert all(0.0 <= s <= 1.0 for s in scores) and scores == sorted(scores, reverse=True), scores
+    finally:
+        retriever_optimized.score_results_jointly = original
+    print("✓ hybrid rerank limits LLM calls to ambiguous results")
+
+
+class _FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class _FakeModel:
+    """Stand-in for GenerativeModel that returns a canned response and counts calls."""
+    calls = 0
+    response_text = ""
+
+    def __init__(self, name):
+        self.name = name
+
+    def generate_content(self, prompt, generation_config=None):
+        _FakeModel.calls += 1
+        return _FakeResponse(_FakeModel.response_text)
+
+
+def test_joint_rerank_single_call():
+    """Joint mode scores both tiers in one call and attaches per-item scores"""
+    chunks = [{"id": "c0", "content": "first"}, {"id": "c1", "content": "second"}]
+    summaries = [{"id": "s0", "summary_text": "one"}, {"id": "s1", "summary_text": "two"}]
+
+    original = retriever_optimized.GenerativeModel
+    retriever_optimized.GenerativeModel = _FakeModel
+    try:
+        _FakeModel.calls = 0
+        _FakeModel.response_text = '```json\n{"C0": 2, "C1": 9, "S0": 4, "S1": "n/a"}\n```'
+        ranked_chunks, ranked_summaries = retriever_optimized.rerank_two_tier(
+            "query", chunks, summaries, chunk_top_k=2, summary_top_k=2, mode="joint"
+        )
+        assert _FakeModel.calls == 1
+        assert [r["id"] for r in ranked_chunks] == ["c1", "c0"]
+        assert ranked_chunks[0]["rerank_score"] == 0.9
+        # Unscored items keep their relative order after scored ones
+        assert [r["id"] for r in ranked_summaries] == ["s0", "s1"]
+        assert "rerank_score" not in ranked_summaries[1]
+
+        # Unparseable output falls back to local reranking without raising
+        _FakeModel.response_text = "I cannot rank these."
+        ranked_chunks, _ = retriever_optimized.rerank_two_tier(
+            "second", [dict(c) for c in chunks], [], mode="joint"
+        )
+        assert ranked_chunks[0]["id"] == "c1"
+    finally:
+        retriever_optimized.GenerativeModel = original
+    print("✓ joint rerank uses one LLM call for both tiers")
+
+
+if __name__ == "__main__":
+    test_tokenize()
+    test_local_rerank_order()
+    test_idf_table_roundtrip()
+    test_hybrid_sends_only_ambiguous()
+    test_joint_rerank_single_call()
+    print("\nAll local reranker tests passed")
@@ -0,0 +1,130 @@
+"""
+Test the local BM25 inverted-index retriever.
+Runs offline: builds a small index from chunk/summary JSONL files in a temp directory.
+"""
+import sys
+import tempfile
+from pathlib import Path
+
+# Add app directories to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from shared.schemas import Chunk, ChunkMetadata, ChunkAnchor, Summary, write_chunks_to_jsonl, write_summary_to_jsonl
+from apps.agent_api import retriever_local
+from apps.agent_api.retriever_local import build_index, get_local_index, parse_filter
+from apps.agent_api.retriever_optimized import build_metadata_filter, search_two_tier_optimized
+from apps.agent_api.optimization_config import get_config
+
+
+def _chunk(source_id, index, page, content, organization=None, tags=None):
+    metadata = ChunkMetadata(
+        id=f"{source_id}_{index}",
+        source_id=source_id,
+        filename=f"{source_id}.pdf",
+        title=f"Document {source_id}",
+        mimetype="application/pdf",
+        organization=organization,
+        tags=tags or []
+    )
+    return Chunk(metadata=metadata, anchor=ChunkAnchor(page=page), content=content, chunk_index=index)
+
+
+def _build_corpus(root: Path) -> None:
+    (root / "data").mkdir()
+    (root / "summaries").mkdir()
+    write_chunks_to_jsonl([
+        _chunk("fatf-va", 0, 1, "Virtual asset service providers must apply the travel rule to transfers.",
+               organization="FATF", tags=["virtual_assets"]),
+        _chunk("fatf-va", 1, 2, "Supervisors should license or register virtual asset service providers.",
+               organization="FATF", tags=["virtual_assets"]),
+    ], str(root / "data" / "fatf-va.jsonl"))
+    write_chunks_to_jsonl([
+        _chunk("egmont-fiu", 0, 4, "Financial intelligence units exchange information through secure channels.",
+               organization="Egmont Group", tags=["transaction_monitoring"]),
+    ], str(root / "data" / "egmont-fiu.jsonl"))
+    for source_id, text, org in (
+        ("fatf-va", "Guidance on a risk-based approach to virtual assets.", "FATF"),
+        ("egmont-fiu", "Principles for information exchange between financial intelligence units.", "Egmont Group"),
+    ):
+        summary = Summary(source_id=source_id, filename=f"{source_id}.pdf", title=f"Document {source_id}",
+                          summary_text=text, organization=org)
+        write_summary_to_jsonl(summary, str(root / "summaries" / f"{source_id}.jsonl"))
+
+
+def test_parse_filter():
+    """Filter syntax emitted by build_metadata_filter is understood"""
+    record = {"organization": "FATF", "tags": ["virtual_assets", "sanctions"], "page": 3, "source_id": "a"}
+    assert parse_filter('organization: "FATF"')(record)
+    assert parse_filter('tags: ANY("sanctions")')(record)
+    assert not parse_filter('tags: ANY("peps", "cdd")')(record)
+    assert parse_filter('(organization: "FIU") OR (tags: ANY("sanctions"))')(record)
+    assert not parse_filter('(organization: "FATF") AND (tags: ANY("peps"))')(record)
+    assert parse_filter('page_number >= 3 AND NOT source_id: "b"')(record)
+    assert parse_filter(None) is None
+
+    characteristics = {"filter_hints": [("organization", "FATF"), ("topic", "virtual_assets")]}
+    expression = build_metadata_filter("", characteristics, filter_logic="AND")
+    assert parse_filter(expression)(record)
+    print("✓ filter parsing")
+
+
+def test_local_search():
+    """BM25 search, filters and match-all queries over a built index"""
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp, "corpus")
+        root.mkdir()
+        _build_corpus(root)
+        index_dir = str(Path(tmp, "index"))
+        meta = build_index(str(root), index_dir)
+        assert meta["chunks"]["num_docs"] == 3
+        assert meta["summaries"]["num_docs"] == 2
+
+        chunks = get_local_index("chunks", index_dir)
+        hits = chunks.search("virtual asset providers", 10)
+        assert {r["id"] for r, _ in hits[:2]} == {"fatf-va_0", "fatf-va_1"}
+        assert all(score > 0 for _, score in hits)
+
+        # The lexicon is a memory-mapped term table, looked up by binary search
+        assert not Path(index_dir, "chunks", "lexicon.json").exists()
+        assert chunks.num_terms == meta["chunks"]["num_terms"]
+        assert chunks.lookup("virtual") == (chunks.lookup("virtual")[0], 2)
+        assert chunks.lookup("zzz-not-a-term") is None and chunks.lookup("") is None
+
+        hits = chunks.search("information", 10, 'organization: "FATF"')
+        assert hits == []
+
+        hits = chunks.search("*", 1000, 'source_id: ANY("fatf-va")')
+        assert [r["chunk_index"] for r, _ in hits] == [0, 1]
+
+        original_dir = retriever_local.LOCAL_INDEX_DIR
+        retriever_local.LOCAL_INDEX_DIR = index_dir
+        config = get_config().retriever
+        original_backend = config.backend
+        config.backend = "local"
+        try:
+            results = retriever_local.search_summaries("financial intelligence units", max_results=1)
+            assert results[0]["source_id"] == "egmont-fiu"
+            assert results[0]["organization"] == "Egmont Group"
+
+            combined = search_two_tier_optimized(
+                "travel rule for virtual asset transfers",
+                max_chunk_results=2,
+                max_summary_results=1,
+                enable_query_expansion=False,
+                enable_reranking=False,
+                use_adaptive_strategy=False
+            )
+            assert combined["chunks"][0]["id"] == "fatf-va_0"
+            assert combined["chunks"][0]["page_number"] == 1
+            assert combined["summaries"][0]["source_id"] == "fatf-va"
+            assert combined["optimizations_applied"]["search_backend"] == "local"
+        finally:
+            config.backend = original_backend
+            retriever_local.LOCAL_INDEX_DIR = original_dir
+    print("✓ local search")
+
+
+if __name__ == "__main__":
+    test_parse_filter()
+    test_local_search()
+    print("\nAll local retriever tests passed")
@@ -0,0 +1,116 @@
+"""
+Test the shared manifest view and batch source resolution.
+Runs offline: GCS is replaced by the in-memory stand-in from benchmarks/bench_manifest_reads.py.
+"""
+import sys
+from pathlib import Path
+
+# Add app directories to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from fastapi import HTTPException
+
+import shared.manifest
+from apps.agent_api import main
+from benchmarks.bench_manifest_reads import FakeManifestStorage, install_fakes, make_manifest, run_turns
+from shared.manifest import get_manifest_entries_by_ids, update_manifest_entry
+
+
+class _RacingStorage(FakeManifestStorage):
+    """Another process rewrites the manifest right after the first generation lookup."""
+
+    def get_blob(self, path):
+        blob = super().get_blob(path)
+        if self.metadata_requests == 1:
+            self.rewrite(self.content.replace("(1)", "(1, revised)"))
+        return blob
+
+
+def _storage(size=50):
+    storage = FakeManifestStorage(make_manifest(size))
+    install_fakes(storage)
+    shared.manifest.clear_manifest_view()
+    return storage
+
+
+def test_batch_resolution():
+    """Many sources resolve with one manifest download, shared across calls"""
+    storage = _storage()
+    entries = get_manifest_entries_by_ids([f"doc{i}" for i in range(10)] + ["missing", None, "doc3"])
+    assert storage.downloads == 1
+    assert entries["doc3"].title.endswith("(3)") and entries["missing"] is None
+    assert None not in entries and len(entries) == 11
+
+    get_manifest_entries_by_ids(["doc20", "doc21"])
+    assert storage.downloads == 1 and get_manifest_entries_by_ids([]) == {}
+    print("✓ one download for a batch of sources")
+
+
+def test_revalidation_and_writes():
+    """Stale views are checked by generation; writes through this module refresh the view"""
+    storage = _storage()
+    original = shared.manifest.MANIFEST_CACHE_REVALIDATE_S
+    shared.manifest.MANIFEST_CACHE_REVALIDATE_S = 0
+    try:
+        get_manifest_entries_by_ids(["doc1"])
+        get_manifest_entries_by_ids(["doc1"])
+        assert storage.downloads == 1 and storage.metadata_requests == 2  # Load, then a generation check
+
+        # Rewritten by another process
+        storage.rewrite(make_manifest(50).replace("(1)", "(1, revised)"))
+        assert get_manifest_entries_by_ids(["doc1"])["doc1"].title.endswith("(1, revised)")
+        assert storage.downloads == 2
+
+        # Written through this module: the read-modify-write loads it, the write refreshes the view
+        update_manifest_entry("doc1", {"title": "Updated"})
+        assert storage.downloads == 3
+        assert get_manifest_entries_by_ids(["doc1"])["doc1"].title == "Updated"
+        assert storage.downloads == 3
+    finally:
+        shared.manifest.MANIFEST_CACHE_REVALIDATE_S = original
+    print("✓ generation revalidation and write-through")
+
+
+def test_read_racing_rewrite():
+    """A generation-pinned read that loses a race with a rewrite is retried at the new generation"""
+    storage = _RacingStorage(make_manifest(50))
+    install_fakes(storage)
+    shared.manifest.clear_manifest_view()
+    assert get_manifest_entries_by_ids(["doc1"])["doc1"].title.endswith("(1, revised)")
+    assert storage.metadata_requests == 2 and storage.downloads == 1
+    print("✓ read racing a rewrite retried")
+
+
+def test_manifest_endpoint_errors():
+    """GET /manifest takes ?status= and still reports a failed read as a 500"""
+    route = next(r for r in main.app.routes if getattr(r, "path", None) == "/manifest")
+    assert [p.alias for p in route.dependant.query_params] == ["status"]
+
+    original = main.get_manifest_entries
+    main.get_manifest_entries = lambda status=None: 1 / 0
+    try:
+        main.list_manifest_entries(status_filter="embedded")
+        assert False, "expected HTTPException"
+    except HTTPException as e:
+        assert e.status_code == 500
+    finally:
+        main.get_manifest_entries = original
+    print("✓ /manifest error path")
+
+
+def test_reads_per_chat_turn():
+    """Regression: a chat turn citing ten sources makes at most one manifest download"""
+    storage = _storage(200)
+    stats = run_turns(get_manifest_entries_by_ids, storage, num_sources=10, turns=5)
+    assert stats["downloads"] <= 1 / 5
+    print(f"✓ manifest reads per turn: {stats}")
+
+
+if __name__ == "__main__":
+    print("Testing manifest view...\n")
+    test_batch_resolution()
+    test_revalidation_and_writes()
+    test_read_racing_rewrite()
+    test_manifest_endpoint_errors()
+    test_reads_per_chat_turn()
+    print("\n✅ All manifest view tests passed")
@@ -0,0 +1,134 @@
+"""
+Test the per-model circuit breakers used for Gemini fallback.
+Runs offline with a fake clock and a fake GenerativeModel.
+"""
+import sys
+from pathlib import Path
+
+# Add app directories to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from apps.agent_api import synthesizer
+from apps.agent_api.model_health import (
+    ModelCircuitBreaker,
+    breaker_states,
+    get_breaker,
+    is_rate_limit_error,
+    next_available_model,
+    reset_breakers,
+)
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_rate_limit_detection():
+    """429 and quota errors open breakers; other errors do not"""
+    assert is_rate_limit_error(RuntimeError("429 Resource exhausted"))
+    assert is_rate_limit_error(RuntimeError("Quota exceeded for aiplatform"))
+    assert not is_rate_limit_error(ValueError("Response was blocked by safety filters"))
+    print("✓ rate-limit errors recognised")
+
+
+def test_breaker_lifecycle():
+    """closed → open on 429, half-open after cooldown with one probe, closed on success"""
+    clock = _Clock()
+    breaker = ModelCircuitBreaker("m", failure_threshold=1, cooldown_s=30, max_cooldown_s=100, clock=clock)
+
+    assert breaker.allow_request()
+    breaker.record_failure(ValueError("bad request"))
+    assert breaker.state == "closed"
+    breaker.record_failure(RuntimeError("429 Resource exhausted"))
+    assert breaker.state == "open"
+    assert not breaker.allow_request()
+
+    clock.now += 31
+    assert breaker.allow_request()          # The probe
+    assert not breaker.allow_request()      # Everyone else still waits
+    breaker.record_failure(RuntimeError("429"))
+    assert breaker.state == "open" and breaker.cooldown_s == 60
+
+    clock.now += 61
+    assert breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.cooldown_s == 30
+    assert breaker.allow_request()
+
+    snapshot = breaker.snapshot()
+    assert snapshot["transitions"] == {"closed->open": 1, "open->half_open": 2, "half_open->open": 1,
+                                       "half_open->closed": 1}
+    assert snapshot["short_circuited"] == 2
+    print(f"✓ breaker transitions: {snapshot['transitions']}")
+
+
+def test_non_rate_limit_probe_failure_releases_probe():
+    """A probe failing for another reason lets the next request probe"""
+    clock = _Clock()
+    breaker = ModelCircuitBreaker("m", cooldown_s=10, clock=clock)
+    breaker.record_failure(RuntimeError("429"))
+    clock.now += 11
+    assert breaker.allow_request()
+    breaker.record_failure(ValueError("safety"))
+    assert breaker.state == "half_open"
+    assert breaker.allow_request()
+    print("✓ probe released after a non-rate-limit failure")
+
+
+class _FakeModel:
+    limited = set()
+    calls = []
+
+    def __init__(self, name):
+        self.name = name
+
+    def generate_content(self, prompt, generation_config=None):
+        _FakeModel.calls.append(self.name)
+        if self.name in _FakeModel.limited:
+            raise RuntimeError("429 Resource exhausted")
+
+        class _Response:
+            text = f"answer from {self.name}"
+        return _Response()
+
+
+def test_fallback_skips_open_breaker():
+    """After the primary is rate-limited once, later requests go straight to the next model"""
+    reset_breakers()
+    synthesizer.GenerativeModel = _FakeModel
+    primary, secondary = synthesizer.FALLBACK_MODELS[:2]
+    _FakeModel.limited = {primary}
+    _FakeModel.calls = []
+
+    first = synthesizer.generate_with_fallback("q", None, source_function="test")
+    second = synthesizer.generate_with_fallback("q", None, source_function="test")
+
+    assert first[:2] == (f"answer from {secondary}", secondary)
+    assert second[1] == secondary
+    assert _FakeModel.calls == [primary, secondary, secondary]
+    assert breaker_states()[primary]["state"] == "open"
+    assert next_available_model(synthesizer.FALLBACK_MODELS) == secondary
+
+    # Every model limited: no answer, and the open breakers are not called again
+    _FakeModel.limited = set(synthesizer.FALLBACK_MODELS)
+    _FakeModel.calls = []
+    text, model, usage, error = synthesizer.generate_with_fallback("q", None, source_function="test")
+    assert text is None and error is not None
+    assert primary not in _FakeModel.calls
+    assert synthesizer.generate_with_fallback("q", None, source_function="test")[0] is None
+    assert all(get_breaker(m).state == "open" for m in synthesizer.FALLBACK_MODELS)
+    reset_breakers()
+    print("✓ fallback routes around open breakers")
+
+
+if __name__ == "__main__":
+    print("Testing model circuit breakers...\n")
+    test_rate_limit_detection()
+    test_breaker_lifecycle()
+    test_non_rate_limit_probe_failure_releases_probe()
+    test_fallback_skips_open_breaker()
+    print("\n✅ All model health tests passed")
@@ -0,0 +1,96 @@
+"""
+Test SimHash near-duplicate detection and its use in deduplicate_results.
+Runs offline.
+"""
+import sys
+from pathlib import Path
+
+# Add app directories to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from shared.similarity import SimHashLSH, hamming_distance, max_distance_for_threshold, simhash
+from apps.agent_api.retriever_optimized import deduplicate_results
+
+
+BASE_TEXT = (
+    "Financial intelligence units receive suspicious transaction reports from banks and "
+    "money service businesses. Analysts correlate these reports with customs declarations, "
+    "cross-border wire transfers and cash courier seizures to identify networks that move "
+    "funds on behalf of designated organizations. Informal value transfer systems such as "
+    "hawala leave few records, so investigators rely on ledgers recovered during searches, "
+    "telecommunication data and the testimony of cooperating brokers. International "
+    "cooperation through the Egmont Group allows units to exchange information quickly "
+    "when transactions span several jurisdictions."
+)
+# Same passage with a small edit, as produced by a re-uploaded revision of a document
+EDITED_TEXT = BASE_TEXT.replace("few records", "very few records")
+OTHER_TEXT = (
+    "The conference agenda covered renewable energy subsidies, grid storage and the "
+    "regulatory changes expected in the coming decade for electricity markets."
+)
+
+
+def test_simhash_signatures():
+    """Near-identical texts have close signatures, unrelated texts do not"""
+    a, b, c = simhash(BASE_TEXT), simhash(EDITED_TEXT), simhash(OTHER_TEXT)
+    assert len(a) == 16
+    assert simhash("") is None
+    assert hamming_distance(a, b) <= max_distance_for_threshold(0.85), hamming_distance(a, b)
+    assert hamming_distance(a, c) > max_distance_for_threshold(0.85), hamming_distance(a, c)
+    print(f"✓ simhash distances: edited={hamming_distance(a, b)}, unrelated={hamming_distance(a, c)}")
+
+
+def test_lsh_finds_all_within_distance():
+    """LSH banding returns every indexed signature within the distance bound"""
+    lsh = SimHashLSH(max_distance=4)
+    base = int("f0f0f0f0f0f0f0f0", 16)
+    lsh.add("base", f"{base:016x}")
+    near = base ^ 0b1011 ^ (1 << 40)  # 4 bits flipped
+    far = base ^ 0b11111  # 5 bits flipped
+    assert lsh.query(f"{near:016x}") == ["base"]
+    assert lsh.query(f"{far:016x}") == []
+
+    # Band count never exceeds the signature width; threshold 0 matches everything
+    assert max_distance_for_threshold(0.0) == 64 and max_distance_for_threshold(1.0) == 0
+    assert len(SimHashLSH(63)._bands) == 64 and all(mask for _, mask in SimHashLSH(63)._bands)
+    everything = SimHashLSH(max_distance_for_threshold(0.0))
+    everything.add("base", f"{base:016x}")
+    assert everything.query(f"{base ^ (2 ** 64 - 1):016x}") == ["base"]
+    for bad in (lambda: max_distance_for_threshold(1.5), lambda: SimHashLSH(65)):
+        try:
+            bad()
+            assert False, "expected ValueError"
+        except ValueError:
+            pass
+    print("✓ LSH candidate lookup")
+
+
+def test_deduplicate_near_duplicates():
+    """deduplicate_results drops near-duplicates and honours the threshold"""
+    results = [
+        {"id": "a", "source_id": "doc-1", "page_number": 3, "content": BASE_TEXT},
+        {"id": "b", "source_id": "doc-1-reupload", "page_number": 3, "content": EDITED_TEXT},
+        {"id": "c", "source_id": "doc-2", "page_number": 1, "content": OTHER_TEXT},
+        {"id": "d", "source_id": "doc-1", "page_number": 3, "content": BASE_TEXT},
+    ]
+
+    deduped = deduplicate_results([dict(r) for r in results], threshold=0.85)
+    assert [r["id"] for r in deduped] == ["a", "c"], [r["id"] for r in deduped]
+
+    # Threshold 1.0 only removes exact location duplicates
+    deduped = deduplicate_results([dict(r) for r in results], threshold=1.0)
+    assert [r["id"] for r in deduped] == ["a", "b", "c"]
+
+    # Precomputed signatures from ingestion are used when present
+    stored = [dict(r, simhash=simhash(BASE_TEXT)) for r in results[:2]]
+    stored[1]["content"] = "different text, but ingestion says it duplicates the first chunk"
+    deduped = deduplicate_results(stored, threshold=0.85)
+    assert [r["id"] for r in deduped] == ["a"]
+    print("✓ near-duplicate deduplication")
+
+
+if __name__ == "__main__":
+    test_simhash_signatures()
+    test_lsh_finds_all_within_distance()
+    test_deduplicate_near_duplicates()
+    print("\nAll near-duplicate tests passed")
@@ -0,0 +1,128 @@
+"""
+Test the sampling request profiler behind /admin/profiles (triggers, loop and
+executor thread samples, stage timings, and the cost of unprofiled requests).
+Runs offline against a local ASGI app.
+"""
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+# Add app directories to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from fastapi import FastAPI
+
+from shared.executors import run_blocking
+from shared.profiling import (
+    ProfilingMiddleware,
+    annotate_profile,
+    current_profile,
+    get_sampler,
+    profiled_call,
+    reset_profile_store,
+)
+
+
+def _busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def _slow_search():
+    _busy(0.08)
+    return ["chunk"]
+
+
+def _app(**options):
+    app = FastAPI()
+
+    @app.get("/chat/{session_id}")
+    async def chat(session_id: str):
+        chunks = await run_blocking("retrieval", _slow_search)
+        _busy(0.05)  # JSON-style work on the event loop
+        annotate_profile(stages_ms={"retrieve": 80.0}, cached_stages=[])
+        return {"chunks": chunks, "profiled": current_profile() is not None}
+
+    return ProfilingMiddleware(app, **options)
+
+
+async def _get(app, path, headers=()):
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": path, "raw_path": path.encode(), "root_path": "",
+             "query_string": b"", "headers": list(headers), "scheme": "http", "server": ("test", 80),
+             "client": ("test", 1), "http_version": "1.1"}
+    await app(scope, receive, send)
+    return dict(messages[0]["headers"]), messages[1]["body"]
+
+
+def test_header_profile_samples_loop_and_executor():
+    """A token-carrying request is profiled on the loop and on the worker thread it used"""
+    store = reset_profile_store()
+    app = _app(sample_every=0, token="secret")
+    headers, body = asyncio.run(_get(app, "/chat/s1", [(b"x-profile-token", b"secret")]))
+
+    assert b'"profiled":true' in body
+    profile = store.get(headers[b"x-profile-id"].decode())
+    assert profile is not None and profile.trigger == "header"
+    assert profile.route == "/chat/{session_id}" and profile.status == 200
+    assert profile.to_dict()["stages_ms"] == {"retrieve": 80.0}
+    assert profile.samples >= 10
+
+    collapsed = profile.collapsed()
+    lines = collapsed.splitlines()
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+    assert any(line.startswith("retrieval-stage;") and "_slow_search (test_profiling.py" in line for line in lines)
+    assert any(line.startswith("event-loop;") and "chat (test_profiling.py" in line for line in lines)
+    print(f"✓ {profile.samples} samples, {len(lines)} distinct stacks in {profile.duration_ms}ms")
+
+
+def test_sampling_and_triggers():
+    """1 in N requests is sampled; a wrong token does not force a profile; fast samples are dropped"""
+    store = reset_profile_store()
+    app = _app(sample_every=3, token="secret")
+
+    async def run(count, headers=()):
+        return [await _get(app, "/chat/s1", headers) for _ in range(count)]
+
+    responses = asyncio.run(run(6, [(b"x-profile-token", b"wrong")]))
+    assert sum(b"x-profile-id" in headers for headers, _ in responses) == 2
+    assert len(store.list()) == 2 and {p["trigger"] for p in store.list()} == {"sampled"}
+
+    store = reset_profile_store()
+    slow_only = _app(sample_every=1, min_duration_ms=60_000)
+    asyncio.run(_get(slow_only, "/chat/s1"))
+    assert store.list() == []
+    print("✓ 1-in-N sampling, token check and minimum duration")
+
+
+def test_unprofiled_requests_add_nothing():
+    """Without a profile, blocking calls are passed through and no profile is recorded"""
+    store = reset_profile_store()
+    app = _app(sample_every=0, token=None)
+    headers, body = asyncio.run(_get(app, "/chat/s1", [(b"x-profile-token", b"secret")]))
+
+    assert b'"profiled":false' in body and b"x-profile-id" not in headers
+    assert store.list() == []
+    call = lambda: None
+    assert profiled_call(call) is call
+    # The sampler thread is parked once no profile is active
+    time.sleep(0.05)
+    assert get_sampler()._profiles == [] and not get_sampler()._wakeup.is_set()
+    print("✓ unprofiled requests are passed through")
+
+
+if __name__ == "__main__":
+    print("Testing request profiler...\n")
+    test_header_profile_samples_loop_and_executor()
+    test_sampling_and_triggers()
+    test_unprofiled_requests_add_nothing()
+    print("\n✅ All profiler tests passed")
@@ -0,0 +1,136 @@
+"""
+Test the static prompt prefix and context caching for synthesis prompts.
+Runs offline: the Vertex caching module and GenerativeModel are replaced by fakes.
+"""
+import sys
+from pathlib import Path
+
+# Add app directories to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from apps.agent_api import prompt_cache
+from apps.agent_api.prompt_cache import PromptPrefixCache, SplitPrompt, model_for_prompt
+from apps.agent_api.synthesizer import build_synthesis_prompt
+from apps.agent_api.synthesizer_optimized import (
+    build_optimized_synthesis_prompt,
+    detect_output_format,
+    finalize_optimized_answer,
+)
+
+SUMMARIES = [{"title": "FATF Guidance", "summary_text": "Beneficial ownership guidance."}]
+CHUNKS = [{"title": "FATF Guidance", "filename": "fatf.pdf", "page_number": 4, "content": "Owners must be disclosed."}]
+
+
+class _FakeCaching:
+    """Stands in for vertexai.preview.caching."""
+    created = []
+
+    class CachedContent:
+        @staticmethod
+        def create(model_name, contents, ttl):
+            _FakeCaching.created.append((model_name, contents[0]))
+            return f"cache-{len(_FakeCaching.created)}"
+
+
+class _FakeModel:
+    def __init__(self, name, cached_content=None):
+        self.name = name
+        self.cached_content = cached_content
+
+    @classmethod
+    def from_cached_content(cls, cached_content):
+        return cls("cached", cached_content)
+
+
+def test_prefix_is_static_per_format():
+    """Requests with the same format share one prefix; the question and evidence only appear in the suffix"""
+    prompt_cache._prefix_cache = PromptPrefixCache(enabled=False)
+    brief = detect_output_format("Summarize the key points of FATF guidance")
+    first = build_optimized_synthesis_prompt("Summarize the key points of FATF guidance", SUMMARIES, CHUNKS, format_info=brief)
+    second = build_optimized_synthesis_prompt("Summarize the key points on PEPs", [], [], format_info=brief)
+    other = build_optimized_synthesis_prompt("Who must disclose owners?", SUMMARIES, CHUNKS)
+
+    assert isinstance(first, SplitPrompt) and first == first.prefix + first.suffix
+    assert first.prefix is second.prefix and first.prefix_key == second.prefix_key
+    assert other.prefix_key != first.prefix_key
+    assert "FATF guidance" not in first.prefix and "Owners must be disclosed." in first.suffix
+    assert "CITATION REQUIREMENTS" in first.prefix and first.suffix.startswith("USER REQUEST:")
+
+    standard = build_synthesis_prompt("Who must disclose owners?", SUMMARIES, CHUNKS)
+    assert standard.prefix_key == "standard" and "USER QUESTION: Who must disclose owners?" in standard.suffix
+
+    stats = prompt_cache.get_prompt_prefix_cache().stats()
+    assert stats["mode"] == "local" and stats["builds"] == 3 and stats["requests"] == 4
+    assert stats["reused_prefix_tokens"] == first.prefix_tokens > 0
+    print(f"✓ static prefixes: {stats}")
+
+
+def test_context_cache_sends_suffix_only():
+    """With context caching available, the prefix is cached once per model and only the suffix is sent"""
+    _FakeCaching.created = []
+    prompt_cache._prefix_cache = PromptPrefixCache(enabled=True, min_tokens=10, caching_module=_FakeCaching)
+    prompt = build_optimized_synthesis_prompt("Who must disclose owners?", SUMMARIES, CHUNKS)
+
+    model, contents = model_for_prompt(_FakeModel, "gemini-1.5-flash-002", prompt)
+    assert model.cached_content == "cache-1" and contents == prompt.suffix
+    model_for_prompt(_FakeModel, "gemini-1.5-flash-002", prompt)
+    model_for_prompt(_FakeModel, "gemini-1.5-pro-002", prompt)
+    assert [name for name, _ in _FakeCaching.created] == ["gemini-1.5-flash-002", "gemini-1.5-pro-002"]
+    assert _FakeCaching.created[0][1] == prompt.prefix
+
+    prompt_cache.get_prompt_prefix_cache().record_usage({"prompt_token_count": 900, "cached_content_token_count": 400})
+    stats = prompt_cache.get_prompt_prefix_cache().stats()
+    assert stats["remote_caches_created"] == 2 and stats["remote_cached_requests"] == 3
+    assert stats["cached_tokens_billed"] == 400
+
+    # Prefixes below the Vertex minimum, and plain strings, go out in full
+    prompt_cache._prefix_cache = PromptPrefixCache(enabled=True, min_tokens=10**6, caching_module=_FakeCaching)
+    model, contents = model_for_prompt(_FakeModel, "gemini-1.5-flash-002", build_synthesis_prompt("q", [], []))
+    assert model.cached_content is None and contents.startswith("You are an expert")
+    model, contents = model_for_prompt(_FakeModel, "gemini-1.5-flash-002", "plain prompt")
+    assert model.name == "gemini-1.5-flash-002" and contents == "plain prompt"
+    print("✓ context cache used for long prefixes only")
+
+
+def test_failed_cache_creation_not_retried():
+    """A model that rejects context caching falls back to the full prompt without retrying every request"""
+    attempts = []
+
+    class _Rejecting:
+        class CachedContent:
+            @staticmethod
+            def create(model_name, contents, ttl):
+                attempts.append(model_name)
+                raise RuntimeError("400 model does not support cached content")
+
+    prompt_cache._prefix_cache = PromptPrefixCache(enabled=True, min_tokens=10, caching_module=_Rejecting)
+    prompt = build_optimized_synthesis_prompt("Who must disclose owners?", SUMMARIES, CHUNKS)
+    for _ in range(3):
+        model, contents = model_for_prompt(_FakeModel, "gemini-2.0-flash-exp", prompt)
+        assert contents == prompt
+    assert attempts == ["gemini-2.0-flash-exp"]
+    prompt_cache._prefix_cache = None
+    print("✓ rejected context caching is not retried")
+
+
+def test_cached_tokens_reported():
+    """Cached input tokens are reported whether or not the prompt token count came back"""
+    prepared = {"summary_results": SUMMARIES, "chunk_results": CHUNKS, "prompt_tokens": 100,
+                "format_info": detect_output_format("Who must disclose owners?"), "max_output_tokens": 1024,
+                "temperature": 0.2, "enable_context_truncation": True, "enable_adaptive_temperature": True}
+    for usage, actual in (({"prompt_token_count": 120, "cached_content_token_count": 80}, 120),
+                          ({"cached_content_token_count": 80}, None)):
+        result = finalize_optimized_answer("Who must disclose owners?", prepared, "Owners [1].", "gemini",
+                                           usage_metadata=usage, answer_sources=([], {}, {}))
+        assert result["cached_input_tokens"] == 80
+        assert result["optimizations_applied"].get("actual_prompt_tokens") == actual
+    print("✓ cached input tokens reported")
+
+
+if __name__ == "__main__":
+    print("Testing prompt prefix caching...\n")
+    test_prefix_is_static_per_format()
+    test_context_cache_sends_suffix_only()
+    test_failed_cache_creation_not_retried()
+    test_cached_tokens_reported()
+    print("\n✅ All prompt cache tests passed")
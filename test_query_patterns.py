@@ -0,0 +1,72 @@
+"""
+Test the compiled keyword matcher used by query analysis and format detection.
+Runs offline.
+"""
+import sys
+from pathlib import Path
+
+# Add app directories to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from apps.agent_api.query_patterns import match_query
+from apps.agent_api.retriever_optimized import analyze_query_characteristics, adaptive_result_limits
+from apps.agent_api.synthesizer_optimized import detect_output_format
+
+
+def test_word_boundaries():
+    """Short keywords no longer match inside longer words"""
+    matches = match_query("What are the boundaries of understanding for structured products?")
+    assert not matches.has('organization'), matches.hits
+    assert not matches.has('topic'), matches.hits
+
+    matches = match_query("UN sanctions and BO registers")
+    assert matches.first('organization') == 'UN'
+    assert matches.labels('topic') == ['sanctions', 'beneficial_ownership']
+    print("✓ word boundaries")
+
+
+def test_all_hits_in_one_pass():
+    """Overlapping keywords across groups are all reported"""
+    matches = match_query("Write a comprehensive report on suspicious transaction reports by the Egmont Group")
+    assert matches.has('complexity', 'complex')
+    assert matches.first('scope') == 'broad'
+    assert matches.first('organization') == 'Egmont Group'
+    # "suspicious transaction report" also contains the transaction monitoring keyword
+    assert matches.labels('topic') == ['transaction_monitoring', 'suspicious_activity_reporting']
+    # Priority follows the RULES order, as the old if/elif chain did
+    assert matches.first('output_format') == 'comprehensive_analysis'
+    assert matches.labels('output_format') == ['comprehensive_analysis', 'report']
+    print("✓ all hits in one pass")
+
+
+def test_separator_variants():
+    """Spaces and hyphens are interchangeable in multi-word keywords"""
+    assert match_query("a risk-based approach").first('topic') == 'risk_assessment'
+    assert match_query("an in depth review").has('complexity', 'complex')
+    assert match_query("step by step").first('output_format') == 'protocol'
+    assert match_query("tl;dr please").first('output_format') == 'brief_summary'
+    print("✓ separator variants")
+
+
+def test_callers_keep_behaviour():
+    """analyze_query_characteristics and detect_output_format keep their outputs"""
+    c = analyze_query_characteristics("Compare FATF and FIU guidance on crypto exchanges")
+    assert c['query_type'] == 'comparative'
+    assert c['filter_hints'] == [('organization', 'FATF'), ('topic', 'virtual_assets')]
+    assert adaptive_result_limits("", c) == (8, 6)
+
+    c = analyze_query_characteristics("Define KYC")
+    assert (c['query_type'], c['complexity'], c['scope']) == ('factual', 'simple', 'medium')
+
+    assert detect_output_format("Give me a brief summary of sanctions")['max_tokens'] == 500
+    assert detect_output_format("Draft a tweet about AML")['format_type'] == 'social_media'
+    assert detect_output_format("Where do I start?")['format_type'] == 'general_answer'
+    print("✓ callers keep behaviour")
+
+
+if __name__ == "__main__":
+    test_word_boundaries()
+    test_all_hits_in_one_pass()
+    test_separator_variants()
+    test_callers_keep_behaviour()
+    print("\nAll query pattern tests passed")
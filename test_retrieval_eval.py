@@ -0,0 +1,190 @@
+"""
+Test the retrieval evaluation harness (benchmarks/retrieval_eval.py): ranking
+metrics, recording and replaying Vertex AI Search / Gemini calls, and the
+per-combination quality and cost report.
+Runs offline: a fake search index and fake Gemini stand in for the live services.
+"""
+import json
+import sys
+import tempfile
+from pathlib import Path
+
+# Add app directories to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from apps.agent_api import retriever_optimized
+from apps.agent_api.search_result import SearchResult
+from apps.agent_api.reranker_local import tokenize
+from benchmarks.fakes import LatencyModel, gemini_model_class
+from benchmarks.retrieval_eval import (
+    DEFAULT_CORPUS,
+    DEFAULT_QUERY_SET,
+    DEFAULT_RECORDING,
+    CorpusServices,
+    Recording,
+    evaluate,
+    judging_candidates,
+    ndcg_at_k,
+    parse_grid,
+    ranked_sources,
+    recall_at_k,
+    reciprocal_rank,
+)
+
+DOCUMENTS = {
+    "src-pep": "Politically exposed persons PEP screening requires enhanced due diligence on senior officials",
+    "src-cdd": "Customer due diligence requirements: identify the customer and verify beneficial owners",
+    "src-ubo": "Beneficial ownership registers help identify the ultimate beneficial owner of legal persons",
+    "src-tbml": "Trade-based money laundering uses over-invoicing and false descriptions of goods",
+    "src-va": "FATF guidance on virtual assets and virtual asset service providers travel rule",
+    "src-misc": "Annual report of the organisation with general news and events",
+}
+
+QUERY_SET = {
+    "version": 1,
+    "queries": [
+        {"id": "pep", "query": "PEP screening and enhanced due diligence", "relevant": {"src-pep": 3, "src-cdd": 1}},
+        {"id": "ubo", "query": "Ultimate beneficial owner identification requirements",
+         "relevant": {"src-ubo": 3, "src-cdd": 2}},
+        {"id": "unjudged", "query": "Trade-based money laundering red flags", "relevant": {}},
+    ],
+}
+
+
+def _fake_search(tier):
+    def search(query, max_results=10, filter_expression=None):
+        terms = set(tokenize(query))
+        scored = sorted(
+            ((len(terms & set(tokenize(text))), source_id, text) for source_id, text in DOCUMENTS.items()),
+            reverse=True,
+        )
+        results = []
+        for rank, (score, source_id, text) in enumerate(scored[:max_results]):
+            field = "content" if tier == "chunks" else "summary_text"
+            results.append(SearchResult(**{
+                "id": f"{source_id}-{tier}", field: text, "source_id": source_id,
+                "title": source_id.upper(), "score": float(score),
+            }))
+        return results
+    return search
+
+
+class _LiveServices:
+    """Installs the fakes where the live Vertex AI Search / Gemini clients would be called."""
+
+    def __enter__(self):
+        self.saved = (retriever_optimized.search_chunks, retriever_optimized.search_summaries,
+                      retriever_optimized.GenerativeModel)
+        retriever_optimized.search_chunks = _fake_search("chunks")
+        retriever_optimized.search_summaries = _fake_search("summaries")
+        retriever_optimized.GenerativeModel = gemini_model_class(LatencyModel())
+        return self
+
+    def __exit__(self, *exc_info):
+        (retriever_optimized.search_chunks, retriever_optimized.search_summaries,
+         retriever_optimized.GenerativeModel) = self.saved
+
+
+def test_ranking_metrics():
+    """recall@k, MRR and graded nDCG@k over distinct source_ids"""
+    ranked = ranked_sources([{"source_id": s} for s in ("a", "x", "a", "b", "y")])
+    relevant = {"a": 3, "b": 1, "c": 2}
+
+    assert ranked == ["a", "x", "b", "y"]
+    assert recall_at_k(ranked, relevant, 2) == 1 / 3
+    assert recall_at_k(ranked, relevant, 4) == 2 / 3
+    assert reciprocal_rank(ranked, relevant) == 1.0
+    assert reciprocal_rank(["x", "b"], relevant) == 0.5
+    assert abs(ndcg_at_k(ranked, relevant, 3) - 7.5 / (7 + 3 / 1.584962500721156 + 0.5)) < 1e-9
+    assert ndcg_at_k(["a", "c", "b"], relevant, 3) == 1.0
+    print("✓ recall@k, MRR and nDCG@k")
+
+
+def test_record_then_replay():
+    """A recorded run replays offline with identical results, call counts and no misses"""
+    grid = parse_grid(["expansion=0,1", "dedup=1", "rerank=off,local,llm", "adaptive=0"])
+    path = Path(tempfile.mkdtemp()) / "recording.json"
+
+    with _LiveServices():
+        recording = Recording()
+        recorded = evaluate(QUERY_SET, recording, grid, k_values=(3,), live=True, latency_scale=0)
+    recording.save(path)
+
+    replayed = evaluate(QUERY_SET, Recording.load(path), grid, k_values=(3,), latency_scale=0)
+    assert len(replayed["configs"]) == 6 and replayed["query_set"]["judged"] == 2
+    for before, after in zip(recorded["configs"], replayed["configs"]):
+        assert after["fixture_misses"] == 0 and after["errors"] == 0
+        assert after["quality"] == before["quality"]
+        assert [q["chunks_sources"] for q in after["queries"]] == [q["chunks_sources"] for q in before["queries"]]
+        assert after["llm_calls_per_query"] == before["llm_calls_per_query"]
+
+    configs = {config["name"]: config for config in replayed["configs"]}
+    baseline = configs["expansion=0 dedup=1 rerank=off adaptive=0"]
+    assert baseline["llm_calls_per_query"] == 0 and baseline["vertex_calls_per_query"] == 2
+    assert configs["expansion=0 dedup=1 rerank=local adaptive=0"]["llm_calls_per_query"] == 0
+    assert configs["expansion=1 dedup=1 rerank=llm adaptive=0"]["llm_calls_per_query"] == 3
+    assert baseline["quality"]["chunks"]["recall@3"] == 1.0 and baseline["quality"]["chunks"]["mrr"] == 1.0
+    # Latencies are measured, so which zero-LLM combination is fastest varies; one of them is on the front
+    assert any(config["pareto"] and config["llm_calls_per_query"] == 0 for config in replayed["configs"])
+    json.dumps(replayed)
+
+    candidates = judging_candidates(replayed, QUERY_SET)
+    assert candidates["pep"]["sources"][0] == {"source_id": "src-pep", "title": "SRC-PEP", "best_rank": 1, "grade": 3}
+    assert candidates["unjudged"]["sources"][0]["grade"] is None
+    print(f"✓ {len(replayed['configs'])} combinations replayed offline")
+
+
+def test_replayed_latency_and_misses():
+    """Recorded latencies are slept (scaled); calls missing from the recording are reported"""
+    grid = parse_grid(["expansion=0", "dedup=0", "rerank=off", "adaptive=0"])
+    one_query = {"version": 1, "queries": QUERY_SET["queries"][:1]}
+    with _LiveServices():
+        recording = Recording()
+        evaluate(one_query, recording, grid, live=True, latency_scale=0)
+    for entry in recording.vertex.values():
+        entry["latency_ms"] = 40.0
+
+    report = evaluate(one_query, recording, grid, latency_scale=0.5)
+    assert report["configs"][0]["latency_ms"]["p50"] >= 40  # Two searches of 20ms each
+
+    missing = evaluate(one_query, Recording(), grid, latency_scale=0)
+    assert missing["configs"][0]["fixture_misses"] == 1 and missing["configs"][0]["errors"] == 1
+    assert retriever_optimized.GenerativeModel.__name__ != "ReplayedModel"
+    print(f"✓ replayed latency {report['configs'][0]['latency_ms']['p50']}ms, misses reported")
+
+
+def test_committed_fixtures_replay():
+    """The committed query set is judged and replays from the committed recording without misses"""
+    query_set = json.loads(DEFAULT_QUERY_SET.read_text())
+    recording = Recording.load(DEFAULT_RECORDING)
+    corpus = {doc["source_id"] for doc in json.loads(DEFAULT_CORPUS.read_text())["documents"]}
+    assert all(query["relevant"] and set(query["relevant"]) <= corpus for query in query_set["queries"])
+    assert recording.meta["query_set_version"] == query_set["version"]
+
+    report = evaluate(query_set, recording, latency_scale=0)
+    assert report["query_set"]["judged"] == len(query_set["queries"])
+    assert all(config["fixture_misses"] == 0 and config["errors"] == 0 for config in report["configs"])
+    print(f"✓ {len(report['configs'])} combinations replayed from {DEFAULT_RECORDING.name}")
+
+
+def test_record_from_corpus():
+    """Recording from the fixture corpus reproduces the committed recording's results"""
+    query_set = json.loads(DEFAULT_QUERY_SET.read_text())
+    grid = parse_grid(["expansion=1", "dedup=1", "rerank=llm", "adaptive=1"])
+    live_search = retriever_optimized.search_chunks
+    with CorpusServices(DEFAULT_CORPUS):
+        recorded = evaluate(query_set, Recording(), grid, live=True, latency_scale=0)
+    replayed = evaluate(query_set, Recording.load(DEFAULT_RECORDING), grid, latency_scale=0)
+    assert recorded["configs"][0]["quality"] == replayed["configs"][0]["quality"]
+    assert retriever_optimized.search_chunks is live_search
+    print("✓ corpus recording matches the committed recording")
+
+
+if __name__ == "__main__":
+    print("Testing retrieval evaluation harness...\n")
+    test_ranking_metrics()
+    test_record_then_replay()
+    test_replayed_latency_and_misses()
+    test_committed_fixtures_replay()
+    test_record_from_corpus()
+    print("\n✅ All retrieval evaluation tests passed")
@@ -0,0 +1,78 @@
+"""
+Test the slotted SearchResult projection used by the retrievers.
+Runs offline against a locally built discoveryengine Document.
+"""
+import sys
+from pathlib import Path
+
+# Add app directories to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from fastapi.encoders import jsonable_encoder
+from google.cloud import discoveryengine_v1beta as discoveryengine
+
+from apps.agent_api.search_result import CHUNK_FIELDS, SUMMARY_FIELDS, SearchResult
+from apps.agent_api.synthesizer import resolve_source_uri
+
+
+def _document():
+    return discoveryengine.Document(id="doc1_page_3", struct_data={
+        "source_id": "doc1",
+        "filename": "doc1.pdf",
+        "title": "Guidance",
+        "content": "Page three text",
+        "page": 3,
+        "tags": ["sanctions", "peps"],
+        "organization": "FATF",
+    })
+
+
+def test_projection_matches_legacy_keys():
+    """Default projections carry the old result dict keys plus source_uri, minus metadata"""
+    doc = _document()
+    chunk = SearchResult.project(doc.struct_data, CHUNK_FIELDS, doc_id=doc.id, score=0.7)
+    assert list(chunk) == ["id", "content", "page_number", "page", "start_sec", "end_sec",
+                           "source_id", "filename", "title", "source_uri", "simhash", "score"]
+    assert chunk["page_number"] == chunk["page"] == 3
+    assert chunk["start_sec"] is None and chunk.get("metadata") is None
+    assert "metadata" not in chunk
+    assert chunk["source_uri"] is None and resolve_source_uri(None, chunk).endswith("doc1.pdf")
+
+    # Citations get the stored URI without the full record, whichever key it was stored under
+    doc.struct_data["gcs_uri"] = "gs://bucket/sources/doc1.pdf"
+    chunk = SearchResult.project(doc.struct_data, CHUNK_FIELDS, doc_id=doc.id)
+    assert chunk["source_uri"] == "gs://bucket/sources/doc1.pdf"
+    assert resolve_source_uri(None, chunk) == "gs://bucket/sources/doc1.pdf"
+
+    summary = SearchResult.project(doc.struct_data, SUMMARY_FIELDS, doc_id=doc.id)
+    assert summary["tags"] == ["sanctions", "peps"] and isinstance(summary["tags"], list)
+    assert summary["summary_text"] == "" and summary["author"] is None
+    print("✓ projection matches legacy keys")
+
+
+def test_mapping_behaviour():
+    """Results behave like the dicts they replace"""
+    doc = _document()
+    result = SearchResult.project(doc.struct_data, ("id", "content", "source_id", "metadata"), doc_id=doc.id)
+    assert not hasattr(result, "__dict__")
+
+    # Full record is converted lazily, only because "metadata" was requested
+    assert result._metadata is None
+    assert result["metadata"]["organization"] == "FATF"
+    assert result["metadata"]["tags"] == ["sanctions", "peps"]
+
+    result["rerank_score"] = 0.9
+    copy = result.copy()
+    copy["content"] = "truncated..."
+    assert result["content"] == "Page three text" and copy["rerank_score"] == 0.9
+
+    encoded = jsonable_encoder({"chunks": [result]})["chunks"][0]
+    assert encoded["rerank_score"] == 0.9 and encoded["metadata"]["page"] == 3
+    assert resolve_source_uri(None, result, result["metadata"]).endswith("doc1.pdf")
+    print("✓ mapping behaviour")
+
+
+if __name__ == "__main__":
+    test_projection_matches_legacy_keys()
+    test_mapping_behaviour()
+    print("\nAll search result tests passed")
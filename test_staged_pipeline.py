@@ -0,0 +1,181 @@
+"""
+Test the staged RAG pipeline (concurrency, stage caching, swapping stages, metrics).
+Runs offline: search, the Gemini model, manifest lookups and follow-up generation are replaced by fakes.
+"""
+import asyncio
+import sys
+import threading
+import time
+from pathlib import Path
+
+# Add app directories to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import shared.manifest
+from apps.agent_api import synthesizer, synthesizer_optimized
+from apps.agent_api.answer_cache import reset_answer_cache
+from apps.agent_api.model_health import reset_breakers
+from apps.agent_api.performance_metrics import get_aggregator
+from apps.agent_api.rag_pipeline import (
+    RETRIEVAL_STAGES,
+    PipelineContext,
+    RAGPipeline,
+    Stage,
+    build_chat_pipeline,
+    build_standard_pipeline,
+    pipeline_metadata,
+)
+
+
+def _sleeper(name, seconds, log):
+    def run(context):
+        log.append(("start", name))
+        time.sleep(seconds)
+        log.append(("end", name))
+        return {name: threading.current_thread().name}
+    return run
+
+
+def test_independent_stages_overlap():
+    """Stages without a dependency between them run at the same time; dependents wait"""
+    log = []
+    pipeline = RAGPipeline([
+        Stage("search", _sleeper("search", 0.2, log), executor="retrieval"),
+        Stage("history", _sleeper("history", 0.2, log), executor="storage"),
+        Stage("answer", _sleeper("answer", 0.0, log), after=("search", "history")),
+    ])
+    context = PipelineContext("q")
+    started = time.perf_counter()
+    asyncio.run(pipeline.run(context, record_metrics=False))
+    elapsed = time.perf_counter() - started
+
+    assert elapsed < 0.35, elapsed
+    assert log.index(("start", "answer")) > max(log.index(("end", "search")), log.index(("end", "history")))
+    assert context.state["search"].startswith("retrieval") and context.state["history"].startswith("storage")
+    assert set(context.timings_ms) == {"search", "history", "answer"}
+    print(f"✓ independent stages overlap ({elapsed * 1000:.0f} ms for two 200 ms stages)")
+
+
+def test_stage_cache():
+    """A cacheable stage runs once per key; cached runs are reported"""
+    calls = []
+    expand = Stage(
+        "expand",
+        lambda context: calls.append(context.query) or {"queries": [context.query, context.query + "?"]},
+        cache_key=lambda context: context.query,
+        cache_enabled=True
+    )
+    pipeline = RAGPipeline([expand])
+
+    first = asyncio.run(pipeline.run(PipelineContext("beneficial owners"), record_metrics=False))
+    first.state["queries"].append("mutated by a later stage")
+    second = asyncio.run(pipeline.run(PipelineContext("beneficial owners"), record_metrics=False))
+    asyncio.run(pipeline.run(PipelineContext("trusts"), record_metrics=False))
+
+    assert calls == ["beneficial owners", "trusts"]
+    assert second.cached_stages == ["expand"] and second.state["queries"] == ["beneficial owners", "beneficial owners?"]
+    assert expand.cache.stats() == {"entries": 2, "hits": 1, "misses": 2}
+    print("✓ stage outputs cached per key")
+
+
+def test_replace_subset_and_validation():
+    """Stages can be swapped or selected; unknown dependencies and cycles are rejected"""
+    pipeline = build_chat_pipeline()
+    assert pipeline.names == [
+        "analyze", "expand", "retrieve", "dedup", "rerank", "history", "budget", "generate", "postprocess", "persist"
+    ]
+    assert build_standard_pipeline().names == pipeline.names
+
+    retrieval = pipeline.subset(RETRIEVAL_STAGES)
+    assert retrieval.names == list(RETRIEVAL_STAGES)
+    assert retrieval.stages["history"].after == () and pipeline.stages["budget"].after == ("rerank", "history")
+
+    swapped = pipeline.replace("retrieve", Stage("retrieve", lambda context: {}, after=("expand",)))
+    assert swapped.stages["retrieve"] is not pipeline.stages["retrieve"]
+    assert swapped.stages["dedup"] is pipeline.stages["dedup"]
+
+    for stages in (
+        [Stage("a", lambda context: {}, after=("missing",))],
+        [Stage("a", lambda context: {}, after=("b",)), Stage("b", lambda context: {}, after=("a",))],
+    ):
+        try:
+            RAGPipeline(stages)
+            raise AssertionError("invalid pipeline accepted")
+        except ValueError:
+            pass
+    print("✓ replace, subset and dependency validation")
+
+
+class _Usage:
+    prompt_token_count = 120
+    candidates_token_count = 12
+    total_token_count = 132
+
+
+class _Response:
+    text = "Owners must be disclosed [Document 1]."
+    usage_metadata = _Usage()
+
+
+class _FakeModel:
+    def __init__(self, name):
+        self.name = name
+
+    def generate_content(self, prompt, generation_config=None, stream=False):
+        return iter([_Response()]) if stream else _Response()
+
+
+SUMMARIES = [{"id": "fatf_summary", "source_id": "fatf", "title": "FATF Guidance", "filename": "fatf.pdf",
+              "summary_text": "Beneficial ownership guidance."}]
+CHUNKS = [{"id": "fatf_page_4", "source_id": "fatf", "title": "FATF Guidance", "filename": "fatf.pdf", "page": 4,
+           "content": "Owners must be disclosed."}]
+
+
+def test_chat_pipeline_end_to_end():
+    """A full run answers, persists once, and adds one metrics record with every stage timed"""
+    synthesizer_optimized.GenerativeModel = _FakeModel
+    synthesizer.GenerativeModel = _FakeModel
+    synthesizer.generate_follow_up_questions = lambda query, answer, num_questions=3: ["What about trusts?"]
+    shared.manifest.get_manifest_entries_by_ids = lambda source_ids: {}
+    reset_breakers()
+    reset_answer_cache(version_lookup=lambda source_ids: {source_id: "v1" for source_id in source_ids})
+    get_aggregator().reset()
+
+    async def retrieve(context):
+        return {"chunks": CHUNKS, "summaries": SUMMARIES, "num_retrieved": (1, 1), "hybrid_searcher": None}
+
+    saved = []
+    pipeline = build_chat_pipeline().replace("retrieve", Stage("retrieve", retrieve, after=("expand",)))
+    context = PipelineContext(
+        "Who must disclose beneficial owners?",
+        options={"enable_query_expansion": False, "enable_reranking": False, "include_follow_ups": True},
+        user_id="u1",
+        session_id="s1",
+        history_loader=lambda: [],
+        persist=lambda result: saved.append(result) or "m1"
+    )
+    asyncio.run(pipeline.run(context))
+
+    result = context.state["result"]
+    assert result["answer"].startswith("Owners must be disclosed [1]")
+    assert result["follow_up_questions"] == ["What about trusts?"]
+    assert saved == [result] and context.state["assistant_message_id"] == "m1"
+    assert set(context.timings_ms) == set(pipeline.names)
+
+    metadata = pipeline_metadata(context)
+    assert metadata["search_optimizations"]["query_expansion"] is False
+    assert set(metadata["pipeline"]["stages_ms"]) == set(pipeline.names)
+
+    records = list(get_aggregator().pipeline_metrics)
+    assert len(records) == 1 and records[0].synthesis.citations_count == 1
+    assert set(get_aggregator().get_summary()["pipeline"]["stages"]) == set(pipeline.names)
+    print(f"✓ end-to-end run: {context.timings_ms}")
+
+
+if __name__ == "__main__":
+    print("Testing staged RAG pipeline...\n")
+    test_independent_stages_overlap()
+    test_stage_cache()
+    test_replace_subset_and_validation()
+    test_chat_pipeline_end_to_end()
+    print("\n✅ All staged pipeline tests passed")
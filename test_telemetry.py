@@ -0,0 +1,195 @@
+"""
+Test the Prometheus metrics behind /metrics (exposition format, route
+middleware, GCS instrumentation, LLM fallback counting and scrape auth).
+Runs offline: a local ASGI app, a stand-in blob class and a fake Gemini model.
+"""
+import asyncio
+import sys
+from pathlib import Path
+
+# Add app directories to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from fastapi import FastAPI
+
+import shared.telemetry as telemetry
+from apps.agent_api import synthesizer
+from apps.agent_api.model_health import reset_breakers
+from shared.telemetry import Counter, Histogram, PrometheusMiddleware, Registry, metrics_authorized, render_metrics
+
+
+def _sample(text, line_start):
+    """Value of the first exposition line starting with line_start."""
+    for line in text.splitlines():
+        if line.startswith(line_start):
+            return float(line.rsplit(" ", 1)[1])
+    return None
+
+
+def test_exposition_format():
+    """Counters and cumulative histogram buckets render in the text format"""
+    registry = Registry()
+    requests = registry.register(Counter("demo_requests_total", "Requests", ("route",)))
+    latency = registry.register(Histogram("demo_seconds", "Latency", ("route",), buckets=(0.1, 1.0)))
+    requests.labels('/a"b').inc()
+    requests.labels('/a"b').inc(2)
+    for value in (0.05, 0.1, 0.5, 3.0):
+        latency.labels("/x").observe(value)
+    registry.register_collector(lambda: [("demo_ratio", "gauge", "Ratio", [({"cache": "answer"}, 0.25), ({}, None)])])
+
+    text = registry.render()
+    assert '# TYPE demo_requests_total counter' in text
+    assert 'demo_requests_total{route="/a\\"b"} 3' in text
+    assert 'demo_seconds_bucket{route="/x",le="0.1"} 2' in text
+    assert 'demo_seconds_bucket{route="/x",le="1"} 3' in text
+    assert 'demo_seconds_bucket{route="/x",le="+Inf"} 4' in text
+    assert 'demo_seconds_count{route="/x"} 4' in text and 'demo_seconds_sum{route="/x"} 3.65' in text
+    assert 'demo_ratio{cache="answer"} 0.25' in text and text.count("demo_ratio") == 3
+    print("✓ Prometheus text exposition")
+
+
+def test_route_middleware():
+    """Requests are labelled by route template and timed until the body is sent"""
+    app = FastAPI()
+
+    @app.get("/items/{item_id}")
+    async def item(item_id: str):
+        return {"id": item_id}
+
+    wrapped = PrometheusMiddleware(app)
+
+    async def call(path):
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {"type": "http", "method": "GET", "path": path, "raw_path": path.encode(), "root_path": "",
+                 "query_string": b"", "headers": [], "scheme": "http", "server": ("test", 80),
+                 "client": ("test", 1), "http_version": "1.1"}
+        await wrapped(scope, receive, send)
+        return messages[0]["status"]
+
+    telemetry.REGISTRY.reset()
+    assert asyncio.run(call("/items/1")) == 200
+    asyncio.run(call("/items/2"))
+    assert asyncio.run(call("/nowhere")) == 404
+
+    text = render_metrics()
+    assert _sample(text, 'centef_http_requests_total{method="GET",route="/items/{item_id}",status="200"}') == 2
+    assert _sample(text, 'centef_http_requests_total{method="GET",route="unmatched",status="404"}') == 1
+    assert _sample(text, 'centef_http_request_duration_seconds_count{method="GET",route="/items/{item_id}"}') == 2
+    assert _sample(text, "centef_http_requests_in_progress") == 0
+    print("✓ per-route request counts and latency")
+
+
+class _NotFound(Exception):
+    code = 404
+
+
+class _Blob:
+    size = 7
+
+    def download_as_bytes(self, start=None, end=None):
+        return b"x" * 1024
+
+    def upload_from_file(self, file_obj, rewind=False, size=None):
+        return None
+
+    def reload(self, fail=False):
+        if fail:
+            raise _NotFound("missing")
+
+
+def test_gcs_instrumentation():
+    """Wrapped blob methods count requests by outcome and bytes by direction"""
+    telemetry.REGISTRY.reset()
+    for method, operation, count_bytes in (
+        ("download_as_bytes", "download", lambda blob, result, args, kwargs: len(result)),
+        ("upload_from_file", "upload", lambda blob, result, args, kwargs: kwargs.get("size")),
+        ("reload", "metadata", None),
+    ):
+        telemetry._instrument(_Blob, method, operation, count_bytes)
+
+    blob = _Blob()
+    blob.download_as_bytes()
+    blob.upload_from_file(None, size=300)
+    blob.reload()
+    try:
+        blob.reload(fail=True)
+    except _NotFound:
+        pass
+
+    text = render_metrics()
+    assert _sample(text, 'centef_gcs_requests_total{operation="download",status="ok"}') == 1
+    assert _sample(text, 'centef_gcs_requests_total{operation="metadata",status="not_found"}') == 1
+    assert _sample(text, 'centef_gcs_bytes_total{direction="download"}') == 1024
+    assert _sample(text, 'centef_gcs_bytes_total{direction="upload"}') == 300
+    print("✓ GCS requests, errors and bytes")
+
+
+class _Usage:
+    prompt_token_count = 100
+    candidates_token_count = 20
+    total_token_count = 120
+
+
+class _Response:
+    text = "Owners must be disclosed."
+    usage_metadata = _Usage()
+
+
+class _FakeModel:
+    def __init__(self, name):
+        self.name = name
+
+    def generate_content(self, prompt, generation_config=None, stream=False):
+        if self.name == synthesizer.FALLBACK_MODELS[0]:
+            raise RuntimeError("429 Resource exhausted")
+        return _Response()
+
+
+def test_llm_tokens_and_fallbacks():
+    """Tokens are counted per model and answers from a fallback model are flagged"""
+    telemetry.REGISTRY.reset()
+    reset_breakers()
+    synthesizer.GenerativeModel = _FakeModel
+    answer, model_used, _, _ = synthesizer.generate_with_fallback("prompt", None, source_function="test")
+    assert model_used == synthesizer.FALLBACK_MODELS[1]
+
+    text = render_metrics()
+    primary, fallback = synthesizer.FALLBACK_MODELS[:2]
+    assert _sample(text, f'centef_llm_requests_total{{provider="gemini",model="{primary}",status="error"}}') == 1
+    assert _sample(text, f'centef_llm_tokens_total{{model="{fallback}",direction="input"}}') == 100
+    assert _sample(text, f'centef_llm_answers_total{{model="{fallback}",fallback="true"}}') == 1
+    print("✓ LLM tokens by model and fallback answers")
+
+
+def test_metrics_auth():
+    """/metrics needs the bearer token; without one configured it is closed unless made public"""
+    original = telemetry.METRICS_BEARER_TOKEN, telemetry.METRICS_PUBLIC
+    try:
+        telemetry.METRICS_BEARER_TOKEN, telemetry.METRICS_PUBLIC = None, False
+        assert not metrics_authorized(None) and not metrics_authorized("Bearer anything")
+        telemetry.METRICS_PUBLIC = True
+        assert metrics_authorized(None)
+
+        telemetry.METRICS_BEARER_TOKEN = "s3cret"
+        assert metrics_authorized("Bearer s3cret")
+        assert not metrics_authorized(None) and not metrics_authorized("Bearer wrong")
+    finally:
+        telemetry.METRICS_BEARER_TOKEN, telemetry.METRICS_PUBLIC = original
+    print("✓ metrics scrape auth")
+
+
+if __name__ == "__main__":
+    print("Testing telemetry...\n")
+    test_exposition_format()
+    test_route_middleware()
+    test_gcs_instrumentation()
+    test_llm_tokens_and_fallbacks()
+    test_metrics_auth()
+    print("\n✅ All telemetry tests passed")
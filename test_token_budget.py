@@ -0,0 +1,125 @@
+"""
+Test token-budgeted context fitting for the optimized synthesizer.
+Runs offline (uses the script-aware estimate; no tokenizer download or API calls).
+"""
+import sys
+from pathlib import Path
+
+# Add app directories to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from apps.agent_api.token_budget import (
+    TokenCounter,
+    allocate_budget,
+    fit_context,
+    truncate_to_tokens,
+)
+
+
+def test_estimate_by_script():
+    """Arabic and digit-heavy text count more tokens per character than English"""
+    counter = TokenCounter()
+    english = "Financial institutions must identify the beneficial owner of every account."
+    arabic = "يجب على المؤسسات المالية تحديد المستفيد الحقيقي من كل حساب مصرفي."
+    table = "| 2019 | 1,250,000 | 3.75% |\n| 2020 | 1,310,500 | 4.10% |"
+
+    def per_char(text):
+        return counter.count(text) / len(text)
+
+    assert per_char(arabic) > per_char(english)
+    assert per_char(table) > 2 * per_char(english)
+    assert counter.count("") == 0
+    print(f"✓ tokens/char: english {per_char(english):.2f}, arabic {per_char(arabic):.2f}, table {per_char(table):.2f}")
+
+
+def test_counts_cached_by_id_and_calibrated():
+    """Counts are cached per result ID and scaled toward reported prompt sizes"""
+    calls = []
+
+    def tokenizer(text):
+        calls.append(text)
+        return len(text.split())
+
+    counter = TokenCounter(tokenizer=tokenizer)
+    chunk = {"id": "c1", "content": "one two three four"}
+    assert counter.count_field(chunk, "content") == 4
+    assert counter.count_field(chunk, "content") == 4
+    assert len(calls) == 1 and counter.hits == 1
+
+    estimate = TokenCounter()
+    planned = estimate.count("word " * 400)
+    for _ in range(5):
+        estimate.record_actual(planned, planned * 2)
+    assert estimate.calibration == 2.0
+    assert estimate.count("word " * 400) == planned * 2
+    stats = estimate.stats()
+    assert stats["samples"] == 5 and stats["planned_vs_actual_error_pct"]["median"] == -50.0
+    print("✓ per-ID cache and planned-vs-actual calibration")
+
+
+def test_allocate_by_score():
+    """Higher-scored items get more budget; small needs are met in full and leftovers shared"""
+    allocation = allocate_budget([1000, 1000, 50], [1.0, 0.25, 0.1], budget=900)
+    assert allocation[2] == 50
+    assert allocation[0] > allocation[1] > 0
+    assert sum(allocation) <= 900
+
+    # An item whose share is below min_tokens is dropped and its share redistributed
+    allocation = allocate_budget([1000, 1000], [1.0, 0.05], budget=600, min_tokens=200)
+    assert allocation == [600, 0]
+    print("✓ score-weighted allocation")
+
+
+def test_truncate_on_sentence_boundaries():
+    """Text is cut after a whole paragraph or sentence, never mid-word"""
+    counter = TokenCounter()
+    text = ("Customer due diligence applies to all accounts. Enhanced measures apply to PEPs.\n\n"
+            "Records must be kept for five years after the relationship ends.")
+    assert truncate_to_tokens(text, 1000, counter) == text
+
+    first_paragraph = "Customer due diligence applies to all accounts. Enhanced measures apply to PEPs. ..."
+    limit = counter.count(first_paragraph) + 5
+    cut = truncate_to_tokens(text, limit, counter)
+    assert cut == first_paragraph and counter.count(cut) <= limit
+
+    first_sentence = "Customer due diligence applies to all accounts. ..."
+    cut = truncate_to_tokens(text, counter.count(first_sentence) + 2, counter)
+    assert cut == first_sentence
+
+    long_sentence = "word " * 50
+    cut = truncate_to_tokens(long_sentence, 10, counter)
+    assert cut.endswith("word ...") and counter.count(cut) <= 10
+    print("✓ truncation on paragraph/sentence/word boundaries")
+
+
+def test_fit_context():
+    """Chunks share the budget by score, keep their order, and unused summary budget goes to chunks"""
+    counter = TokenCounter()
+    sentence = "The reporting entity must file a suspicious transaction report promptly. "
+    summaries = [{"id": "s1", "summary_text": "Short summary.", "score": 0.9}]
+    chunks = [
+        {"id": f"c{i}", "content": sentence * 60, "score": score}
+        for i, score in enumerate([0.9, 0.2, 0.6])
+    ]
+    max_tokens = 2000 + 1200
+    fitted_summaries, fitted_chunks, plan = fit_context(summaries, chunks, max_tokens, counter)
+
+    assert fitted_summaries == summaries
+    assert [c["id"] for c in fitted_chunks] == ["c0", "c2"]
+    tokens = {c["id"]: counter.count(c["content"]) for c in fitted_chunks}
+    assert tokens["c0"] > tokens["c2"]
+    assert all(c["content"].endswith(". ...") for c in fitted_chunks)
+    assert plan["summary_tokens"] + plan["chunk_tokens"] <= plan["budget_tokens"] == 1200
+    assert plan["chunk_tokens"] > 1200 * 0.8  # More than the old fixed 80% share
+    assert chunks[0]["content"] == sentence * 60  # Inputs are not modified
+    print(f"✓ fitted context: {plan}")
+
+
+if __name__ == "__main__":
+    print("Testing token budgeting...\n")
+    test_estimate_by_script()
+    test_counts_cached_by_id_and_calibrated()
+    test_allocate_by_score()
+    test_truncate_on_sentence_boundaries()
+    test_fit_context()
+    print("\n✅ All token budget tests passed")
@@ -0,0 +1,101 @@
+"""
+Test the memory-mapped dense vector index.
+Runs offline with the hashing embedder; reuses the corpus from test_local_retriever.py.
+"""
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+# Add app directories to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from apps.agent_api import vector_index
+from apps.agent_api.vector_index import (
+    HashingEmbedder,
+    VectorIndex,
+    build_vector_index,
+    build_vector_index_from_jsonl,
+)
+from shared.schemas import Summary
+from test_local_retriever import _build_corpus
+
+
+def test_vector_search():
+    """Build from JSONL, search with filters, and read through the module search functions"""
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp, "corpus")
+        root.mkdir()
+        _build_corpus(root)
+        index_dir = str(Path(tmp, "vectors"))
+        meta = build_vector_index_from_jsonl(str(root), index_dir, HashingEmbedder(128), nlist=0)
+        assert meta["chunks"]["num_vectors"] == 3
+        assert meta["summaries"]["dim"] == 128
+
+        chunks = VectorIndex(str(Path(index_dir, "chunks")))
+        assert isinstance(chunks.vectors, np.memmap)
+        assert chunks.vectors.dtype == np.float16
+
+        hits = chunks.search("virtual asset service providers", 2)
+        assert {r["id"] for r, _ in hits} == {"fatf-va_0", "fatf-va_1"}
+        assert hits[0][1] >= hits[1][1]
+
+        hits = chunks.search("virtual asset service providers", 5, 'organization: "Egmont Group"')
+        assert [r["id"] for r, _ in hits] == ["egmont-fiu_0"]
+        chunks.close()
+
+        original_dir = vector_index.VECTOR_INDEX_DIR
+        vector_index.VECTOR_INDEX_DIR = index_dir
+        try:
+            results = vector_index.search_summaries("financial intelligence units information exchange", max_results=1)
+            assert results[0]["source_id"] == "egmont-fiu"
+            assert results[0]["organization"] == "Egmont Group"
+        finally:
+            vector_index.VECTOR_INDEX_DIR = original_dir
+    print("✓ vector search")
+
+
+def test_ivf_matches_flat():
+    """IVF partitions with full probing return the same neighbours as flat search"""
+    topics = ["sanctions screening", "virtual assets", "beneficial ownership", "wire transfers", "casino risk"]
+    summaries = [
+        Summary(source_id=f"doc-{i}", filename=f"doc-{i}.pdf", title=f"Doc {i}",
+                summary_text=f"{topics[i % len(topics)]} guidance number {i} for reporting entities")
+        for i in range(60)
+    ]
+    embedder = HashingEmbedder(64)
+    with tempfile.TemporaryDirectory() as tmp:
+        build_vector_index(summaries, str(Path(tmp, "flat")), embedder, dtype="float32", nlist=0)
+        meta = build_vector_index(summaries, str(Path(tmp, "ivf")), embedder, dtype="float32", nlist=4)
+        assert meta["nlist"] == 4
+
+        flat = VectorIndex(str(Path(tmp, "flat")), embedder)
+        ivf = VectorIndex(str(Path(tmp, "ivf")), embedder)
+        queries = embedder.embed(["sanctions screening guidance", "wire transfers"])
+        for flat_hits, ivf_hits in zip(flat.search_vectors(queries, 5), ivf.search_vectors(queries, 5, nprobe=4)):
+            assert np.allclose([s for _, s in flat_hits], [s for _, s in ivf_hits], atol=1e-5)
+
+        # Batched IVF search gives each query the same hits as searching it alone
+        batched = ivf.search_vectors(queries, 5, nprobe=2)
+        assert batched == [ivf.search_vectors(queries[i:i + 1], 5, nprobe=2)[0] for i in range(len(queries))]
+
+        # A selective filter widens the probe until every match is found
+        original_nprobe = vector_index.VECTOR_IVF_NPROBE
+        vector_index.VECTOR_IVF_NPROBE = 1
+        try:
+            wanted = ("doc-3", "doc-29", "doc-56")
+            hits = ivf.search("sanctions screening guidance", 3, f'source_id: ANY("{wanted[0]}", "{wanted[1]}", "{wanted[2]}")')
+            assert sorted(record["source_id"] for record, _ in hits) == sorted(wanted)
+            assert len(ivf.search("wire transfers", 5, 'source_id: ANY("doc-1")')) == 1
+        finally:
+            vector_index.VECTOR_IVF_NPROBE = original_nprobe
+        flat.close()
+        ivf.close()
+    print("✓ IVF matches flat")
+
+
+if __name__ == "__main__":
+    test_vector_search()
+    test_ivf_matches_flat()
+    print("\nAll vector index tests passed")